@@ -88,6 +88,7 @@ async fn backend(runtime: DistributedRuntime) -> Result<()> {
                 request_total_slots,
                 kv_active_blocks,
                 kv_total_blocks,
+                kv_block_size: None,
             };
             println!("stats out: {:?}", stats);
             serde_json::to_value(stats).unwrap()
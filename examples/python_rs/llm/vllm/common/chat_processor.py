@@ -13,13 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import json
+import re
 import time
-from typing import AsyncIterator, List, Optional, Protocol, Union, runtime_checkable
+from array import array
+from collections import OrderedDict
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+    Union,
+    runtime_checkable,
+)
 
+from common.preprocess_pool import PreprocessPool, PreprocessTimings, tokenize_prompts
 from vllm.config import ModelConfig
 from vllm.engine.arg_utils import AsyncEngineArgs
-from vllm.entrypoints.chat_utils import ConversationMessage
+from vllm.entrypoints.chat_utils import (
+    ConversationMessage,
+    apply_hf_chat_template,
+    parse_chat_messages_futures,
+    resolve_chat_template_content_format,
+)
 from vllm.entrypoints.openai.protocol import (
     ChatCompletionRequest,
     CompletionRequest,
@@ -29,6 +49,7 @@ from vllm.entrypoints.openai.serving_chat import OpenAIServingChat
 from vllm.entrypoints.openai.serving_completion import OpenAIServingCompletion
 from vllm.entrypoints.openai.serving_engine import RequestPrompt
 from vllm.inputs.data import TokensPrompt
+from vllm.logger import logger as vllm_logger
 from vllm.transformers_utils.tokenizer import AnyTokenizer
 
 
@@ -72,6 +93,15 @@ class ProcessMixIn(ProcessMixInRequired):
             raise RuntimeError("Processor has not been initialized")
         request = processor.parse_raw_request(raw_request)
         preprocess_result = await processor.preprocess(raw_request)
+        if preprocess_result.timings is not None:
+            vllm_logger.debug(
+                f"Preprocessing queued for "
+                f"{preprocess_result.timings.queue_time * 1000:.1f} ms, "
+                f"tokenized in {preprocess_result.timings.tokenize_time * 1000:.1f} "
+                f"ms; {preprocess_result.cached_tokens} of "
+                f"{len(preprocess_result.engine_prompt['prompt_token_ids'])} "
+                f"prompt tokens from the prompt cache"
+            )
 
         default_max_tokens = self.model_config.max_model_len - len(
             preprocess_result.engine_prompt["prompt_token_ids"]
@@ -108,16 +138,265 @@ class PreprocessResult:
         conversation: Optional[ConversationMessage],
         request_prompt: RequestPrompt,
         engine_prompt: TokensPrompt,
+        timings: Optional[PreprocessTimings] = None,
+        cached_tokens: int = 0,
     ):
         self.conversation = conversation
         self.request_prompt = request_prompt
         self.engine_prompt = engine_prompt
+        # set when the chat template was rendered and tokenized by the processor
+        # itself rather than by `OpenAIServingChat`
+        self.timings = timings
+        # number of leading prompt tokens taken from the `PromptTokenCache`
+        self.cached_tokens = cached_tokens
+
+
+class PromptCacheStats:
+    """
+    Lookups of the rendered prompts in a `PromptTokenCache`
+    """
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of the prompts extending a cached prefix"""
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    @property
+    def token_hit_rate(self) -> float:
+        """Fraction of the prompt tokens taken from the cache"""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def __repr__(self):
+        return (
+            f"PromptCacheStats(lookups={self.lookups}, hits={self.hits}, "
+            f"hit_rate={self.hit_rate:.3f}, "
+            f"token_hit_rate={self.token_hit_rate:.3f})"
+        )
+
+
+class PromptPrefix:
+    """
+    The longest prefix of a rendered prompt found in a `PromptTokenCache`
+    """
+
+    def __init__(
+        self,
+        boundary: int,
+        token_ids: List[int],
+        positions: List[int],
+        key: bytes,
+        complete: bool,
+    ):
+        # index of the boundary of the prompt the prefix ends at
+        self.boundary = boundary
+        self.token_ids = token_ids
+        # number of tokens up to each boundary of the prefix
+        self.positions = positions
+        # the cached prompt the prefix was taken from, and whether the prefix
+        # is the whole of it
+        self.key = key
+        self.complete = complete
+
+
+class _CachedPrompt:
+    def __init__(self, token_ids: array, positions: array, digests: List[bytes]):
+        self.token_ids = token_ids
+        self.positions = positions
+        self.digests = digests
+
+
+class PromptTokenCache:
+    """
+    Token ids of the chat prompts rendered recently, reused by the prompts
+    extending them, such as the next turn of a conversation
+
+    Prompts are split at their boundaries, right after the special tokens of the
+    chat template. The tokenizer splits special tokens out of the text before
+    anything else, so the tokens up to a boundary do not depend on the text
+    after it. Only the text after the last cached boundary of a prompt is
+    tokenized, preceded by the special token of that boundary so that it is not
+    tokenized as the start of a prompt.
+
+    Up to `max_tokens` token ids are kept, the least recently used prompts are
+    evicted first. A prompt extending the whole of a cached one replaces it, so
+    a conversation is cached once rather than once per turn. The boundaries are
+    looked up by a digest of the text up to them, so a prompt costs the cache a
+    digest per boundary besides its tokens.
+    """
+
+    def __init__(self, tokenizer: AnyTokenizer, max_tokens: int):
+        # special tokens stripping the text around them, or matched after
+        # normalization, do not end at a fixed position of the text
+        self._anchors: Dict[str, int] = {
+            token.content: token_id
+            for token_id, token in tokenizer.added_tokens_decoder.items()
+            if token.special
+            and not (token.lstrip or token.rstrip or token.normalized)
+        }
+        self._anchor_ids = set(self._anchors.values())
+        # the longest special tokens first, as the tokenizer matches them
+        self._anchor_pattern = (
+            re.compile(
+                "|".join(
+                    re.escape(content)
+                    for content in sorted(self._anchors, key=len, reverse=True)
+                )
+            )
+            if self._anchors
+            else None
+        )
+
+        # the special tokens added in front of the prompts with
+        # `add_special_tokens`; prompts with special tokens added at their end
+        # are not cached
+        plain = tokenizer("a", add_special_tokens=False).input_ids
+        special = tokenizer("a", add_special_tokens=True).input_ids
+        self._leading_special_tokens: Optional[int] = (
+            len(special) - len(plain) if special[-len(plain) :] == plain else None
+        )
+
+        self.max_tokens = max_tokens
+        self.num_tokens = 0
+        self.stats = PromptCacheStats()
+        self._prompts: OrderedDict[bytes, _CachedPrompt] = OrderedDict()
+        # the prompt and boundary index of each cached boundary digest
+        self._boundaries: Dict[bytes, Tuple[bytes, int]] = {}
+
+    def boundaries(
+        self, prompt: str, add_special_tokens: bool
+    ) -> List[Tuple[int, str, bytes]]:
+        """
+        The boundaries of `prompt` as `(offset, special_token, digest)`: the
+        offset right after each special token and the digest of the prompt up to
+        it; empty if the prompt can not be cached
+        """
+        if self._anchor_pattern is None or (
+            add_special_tokens and self._leading_special_tokens is None
+        ):
+            return []
+        digest = hashlib.blake2b(bytes([add_special_tokens]), digest_size=16)
+        boundaries = []
+        start = 0
+        for match in self._anchor_pattern.finditer(prompt):
+            digest.update(prompt[start : match.end()].encode())
+            start = match.end()
+            boundaries.append((start, match.group(), digest.digest()))
+        return boundaries
+
+    def lookup(
+        self, boundaries: List[Tuple[int, str, bytes]]
+    ) -> Optional[PromptPrefix]:
+        """
+        Find the longest cached prefix of the prompt of `boundaries`
+        """
+        self.stats.lookups += 1
+        for i in range(len(boundaries) - 1, -1, -1):
+            entry = self._boundaries.get(boundaries[i][2])
+            if entry is None:
+                continue
+            key, boundary = entry
+            cached = self._prompts[key]
+            self._prompts.move_to_end(key)
+            self.stats.hits += 1
+            positions = cached.positions[: boundary + 1].tolist()
+            return PromptPrefix(
+                i,
+                cached.token_ids[: positions[-1]].tolist(),
+                positions,
+                key,
+                boundary == len(cached.positions) - 1,
+            )
+        return None
+
+    def insert(
+        self,
+        boundaries: List[Tuple[int, str, bytes]],
+        token_ids: List[int],
+        add_special_tokens: bool,
+        prefix: Optional[PromptPrefix] = None,
+    ):
+        """
+        Cache the `token_ids` of the prompt of `boundaries`, whose tokens up to
+        `prefix` came from the cache
+        """
+        cached_tokens = len(prefix.token_ids) if prefix is not None else 0
+        self.stats.prompt_tokens += len(token_ids)
+        self.stats.cached_tokens += cached_tokens
+        if not boundaries:
+            return
+        key = boundaries[-1][2]
+        if key in self._prompts:
+            self._prompts.move_to_end(key)
+            return
+
+        if prefix is not None:
+            positions = prefix.positions
+            start = cached_tokens
+        else:
+            positions = []
+            start = (self._leading_special_tokens or 0) if add_special_tokens else 0
+        positions = positions + [
+            i + 1
+            for i in range(start, len(token_ids))
+            if token_ids[i] in self._anchor_ids
+        ]
+        # the special tokens rendered by the template must be the ones tokenized
+        if len(positions) != len(boundaries) or positions[-1] > self.max_tokens:
+            return
+
+        cached = _CachedPrompt(
+            array("I", token_ids[: positions[-1]]),
+            array("I", positions),
+            [digest for _, _, digest in boundaries],
+        )
+        self._prompts[key] = cached
+        for i, digest in enumerate(cached.digests):
+            self._boundaries[digest] = (key, i)
+        self.num_tokens += len(cached.token_ids)
+        # the extended prompt is a prefix of this one, its boundaries now
+        # point here
+        if prefix is not None and prefix.complete and prefix.key in self._prompts:
+            self._remove(prefix.key)
+        while self.num_tokens > self.max_tokens:
+            self._remove(next(iter(self._prompts)))
+
+    def _remove(self, key: bytes):
+        cached = self._prompts.pop(key)
+        for digest in cached.digests:
+            # the boundaries shared with a more recent prompt are kept
+            if self._boundaries.get(digest, (None, 0))[0] == key:
+                del self._boundaries[digest]
+        self.num_tokens -= len(cached.token_ids)
 
 
 class ChatProcessor:
-    def __init__(self, tokenizer: AnyTokenizer, model_config: ModelConfig):
+    def __init__(
+        self,
+        tokenizer: AnyTokenizer,
+        model_config: ModelConfig,
+        preprocess_pool: Optional[PreprocessPool] = None,
+        prompt_cache_tokens: int = 0,
+    ):
+        """
+        With a `preprocess_pool`, the chat template is rendered and the prompt
+        tokenized by its workers rather than on the event loop. With
+        `prompt_cache_tokens`, the token ids of up to that many prompt tokens
+        are cached in a `PromptTokenCache`. Either requires a HF tokenizer.
+        """
         self.tokenizer = tokenizer
         self.model_config = model_config
+        self.preprocess_pool = preprocess_pool
+        self.prompt_cache = (
+            PromptTokenCache(tokenizer, prompt_cache_tokens)
+            if prompt_cache_tokens > 0
+            else None
+        )
         self.openai_serving = OpenAIServingChat(
             engine_client=None,
             model_config=model_config,
@@ -135,6 +414,8 @@ class ChatProcessor:
 
     async def preprocess(self, raw_request: ChatCompletionRequest) -> PreprocessResult:
         request = self.parse_raw_request(raw_request)
+        if self.preprocess_pool is not None or self.prompt_cache is not None:
+            return await self._render_and_tokenize(request)
 
         (
             conversation,
@@ -158,6 +439,127 @@ class ChatProcessor:
 
         return PreprocessResult(conversation[0], request_prompts[0], engine_prompts[0])
 
+    async def _render_and_tokenize(
+        self, request: ChatCompletionRequest
+    ) -> PreprocessResult:
+        """
+        Same as `OpenAIServingChat._preprocess_chat` for a HF tokenizer, with the
+        template rendered and the prompt tokenized by the `preprocess_pool` and
+        the tokens of a cached prefix of the prompt reused
+        """
+        chat_template = request.chat_template or self.tokenizer.chat_template
+        content_format = resolve_chat_template_content_format(
+            chat_template,
+            self.openai_serving.chat_template_content_format,
+            self.tokenizer,
+        )
+        conversation, mm_data_future = parse_chat_messages_futures(
+            request.messages,
+            self.model_config,
+            self.tokenizer,
+            content_format=content_format,
+        )
+        template_kwargs = dict(
+            chat_template=chat_template,
+            add_generation_prompt=request.add_generation_prompt,
+            continue_final_message=request.continue_final_message,
+            tools=None,
+            documents=request.documents,
+        )
+        template_kwargs.update(request.chat_template_kwargs or {})
+
+        request_prompt, render_timings = await self._render(
+            conversation, template_kwargs
+        )
+        (
+            prompt_token_ids,
+            cached_tokens,
+            tokenize_timings,
+        ) = await self._tokenize_prompt(
+            request_prompt, request.add_special_tokens, request.truncate_prompt_tokens
+        )
+        prompt_inputs = self.openai_serving._validate_input(
+            request, prompt_token_ids, request_prompt
+        )
+
+        engine_prompt = TokensPrompt(prompt_token_ids=prompt_inputs["prompt_token_ids"])
+        mm_data = await mm_data_future
+        if mm_data is not None:
+            engine_prompt["multi_modal_data"] = mm_data
+        if request.mm_processor_kwargs is not None:
+            engine_prompt["mm_processor_kwargs"] = request.mm_processor_kwargs
+
+        return PreprocessResult(
+            conversation[0],
+            request_prompt,
+            engine_prompt,
+            timings=render_timings + tokenize_timings,
+            cached_tokens=cached_tokens,
+        )
+
+    async def _tokenize_prompt(
+        self,
+        prompt: str,
+        add_special_tokens: bool,
+        truncate_prompt_tokens: Optional[int],
+    ) -> Tuple[List[int], int, PreprocessTimings]:
+        """
+        Tokenize a rendered prompt from its longest prefix in the prompt cache,
+        returning the token ids and how many of them came from the cache
+        """
+        # the tokens of a truncated prompt depend on its whole length
+        if self.prompt_cache is None or truncate_prompt_tokens is not None:
+            token_ids, timings = await self._tokenize(
+                prompt, add_special_tokens, truncate_prompt_tokens
+            )
+            return token_ids, 0, timings
+
+        cache = self.prompt_cache
+        boundaries = cache.boundaries(prompt, add_special_tokens)
+        prefix = cache.lookup(boundaries) if boundaries else None
+        if prefix is not None:
+            offset, special_token, _ = boundaries[prefix.boundary]
+            suffix_ids, timings = await self._tokenize(
+                special_token + prompt[offset:], False
+            )
+            if suffix_ids[:1] == prefix.token_ids[-1:]:
+                token_ids = prefix.token_ids + suffix_ids[1:]
+                cache.insert(boundaries, token_ids, add_special_tokens, prefix)
+                return token_ids, len(prefix.token_ids), timings
+            # otherwise the special token was not tokenized on its own, which
+            # the prefix relies on; tokenize the whole prompt instead
+
+        token_ids, timings = await self._tokenize(prompt, add_special_tokens)
+        cache.insert(boundaries, token_ids, add_special_tokens)
+        return token_ids, 0, timings
+
+    async def _render(
+        self, conversation: List[ConversationMessage], template_kwargs: Dict[str, Any]
+    ) -> Tuple[str, PreprocessTimings]:
+        if self.preprocess_pool is not None:
+            return await self.preprocess_pool.render_chat(conversation, template_kwargs)
+        started_at = time.monotonic()
+        prompt = apply_hf_chat_template(
+            self.tokenizer, conversation=conversation, **template_kwargs
+        )
+        return prompt, PreprocessTimings(tokenize_time=time.monotonic() - started_at)
+
+    async def _tokenize(
+        self,
+        prompt: str,
+        add_special_tokens: bool,
+        truncate_prompt_tokens: Optional[int] = None,
+    ) -> Tuple[List[int], PreprocessTimings]:
+        if self.preprocess_pool is not None:
+            return await self.preprocess_pool.tokenize(
+                prompt, add_special_tokens, truncate_prompt_tokens
+            )
+        started_at = time.monotonic()
+        [token_ids] = tokenize_prompts(
+            self.tokenizer, [(prompt, add_special_tokens, truncate_prompt_tokens)]
+        )
+        return token_ids, PreprocessTimings(tokenize_time=time.monotonic() - started_at)
+
     async def stream_response(
         self,
         request: ChatCompletionRequest,
@@ -43,26 +43,22 @@ async def worker(
     # create client
     client = await endpoint.client()
 
-    # issue request
-    tasks = []
-    for _ in range(1):
-        tasks.append(
-            client.generate(
-                Request(
-                    prompt=prompt,
-                    sampling_params={
-                        "temperature": temperature,
-                        "max_tokens": max_tokens,
-                    },
-                ).model_dump_json()
-            )
-        )
-    streams = await asyncio.gather(*tasks)
+    # issue requests
+    requests = [
+        Request(
+            prompt=prompt,
+            sampling_params={
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            },
+        ).model_dump_json()
+        for _ in range(1)
+    ]
+    stream = await client.generate_many(requests)
 
-    # process response
-    for stream in streams:
-        async for resp in stream:
-            print(resp)
+    # process responses, tagged with the index of their request
+    async for index, resp in stream:
+        print(index, resp)
 
 
 if __name__ == "__main__":
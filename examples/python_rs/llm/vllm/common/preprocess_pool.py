@@ -0,0 +1,323 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import copy
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from transformers import AutoTokenizer
+from vllm.entrypoints.chat_utils import ConversationMessage, apply_hf_chat_template
+from vllm.logger import logger as vllm_logger
+from vllm.transformers_utils.tokenizer import AnyTokenizer
+
+
+class PreprocessPoolType(Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+    def __str__(self):
+        return self.value
+
+
+def load_tokenizer(model_path: str) -> AnyTokenizer:
+    """Load the HF tokenizer of `model_path` with vLLM's typical settings"""
+    return AutoTokenizer.from_pretrained(
+        model_path,
+        trust_remote_code=True,
+        padding_side="left",
+        truncation_side="left",
+        use_fast=True,  # VLLM might use the fast tokenizer for efficiency
+    )
+
+
+# the tokenizer of each worker of the pool, set by `_init_worker`
+_worker = threading.local()
+
+
+def _init_worker(
+    tokenizer: Optional[AnyTokenizer],
+    model_path: str,
+    loader: Callable[[str], AnyTokenizer],
+):
+    if tokenizer is None:
+        _worker.tokenizer = loader(model_path)
+    else:
+        # a fast tokenizer can not be used by several threads at once when they
+        # set its truncation, so each thread gets its own
+        _worker.tokenizer = copy.deepcopy(tokenizer)
+
+
+def _render_chat(
+    conversation: List[ConversationMessage], template_kwargs: Dict[str, Any]
+) -> Tuple[str, float, float]:
+    started_at = time.monotonic()
+    prompt = apply_hf_chat_template(
+        _worker.tokenizer, conversation=conversation, **template_kwargs
+    )
+    return prompt, started_at, time.monotonic() - started_at
+
+
+def tokenize_prompts(
+    tokenizer: AnyTokenizer, prompts: List[Tuple[str, bool, Optional[int]]]
+) -> List[List[int]]:
+    """
+    Tokenize `(prompt, add_special_tokens, truncate_prompt_tokens)` tuples, in
+    a single tokenizer call for the prompts sharing the same options
+    """
+    groups: Dict[Tuple[bool, Optional[int]], List[int]] = {}
+    for i, (_, add_special_tokens, truncate_prompt_tokens) in enumerate(prompts):
+        groups.setdefault((add_special_tokens, truncate_prompt_tokens), []).append(i)
+
+    token_ids: List[List[int]] = [[] for _ in prompts]
+    for (add_special_tokens, truncate_prompt_tokens), indices in groups.items():
+        kwargs: Dict[str, Any] = {"add_special_tokens": add_special_tokens}
+        if truncate_prompt_tokens is not None:
+            kwargs.update(truncation=True, max_length=truncate_prompt_tokens)
+        encoded = tokenizer([prompts[i][0] for i in indices], **kwargs)
+        for i, input_ids in zip(indices, encoded.input_ids):
+            token_ids[i] = input_ids
+    return token_ids
+
+
+def _tokenize_batch(
+    prompts: List[Tuple[str, bool, Optional[int]]],
+) -> Tuple[List[List[int]], float, float]:
+    started_at = time.monotonic()
+    token_ids = tokenize_prompts(_worker.tokenizer, prompts)
+    return token_ids, started_at, time.monotonic() - started_at
+
+
+class PreprocessTimings:
+    """
+    Where the preprocessing of a request spent its time, in seconds: `queue_time`
+    waiting for a worker of the pool, `tokenize_time` rendering the chat template
+    and tokenizing, the latter shared by the prompts tokenized in the same batch
+    """
+
+    def __init__(self, queue_time: float = 0.0, tokenize_time: float = 0.0):
+        self.queue_time = queue_time
+        self.tokenize_time = tokenize_time
+
+    def __add__(self, other: "PreprocessTimings") -> "PreprocessTimings":
+        return PreprocessTimings(
+            self.queue_time + other.queue_time,
+            self.tokenize_time + other.tokenize_time,
+        )
+
+    def __repr__(self):
+        return (
+            f"PreprocessTimings(queue_time={self.queue_time:.4f}, "
+            f"tokenize_time={self.tokenize_time:.4f})"
+        )
+
+
+class PreprocessPoolStats:
+    """
+    Totals of the prompts tokenized by a `PreprocessPool`; times are in seconds
+    """
+
+    def __init__(self):
+        self.prompts = 0
+        self.batches = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.tokenize_time = 0.0
+
+    def record_batch(self, queue_times: List[float], tokenize_time: float):
+        self.prompts += len(queue_times)
+        self.batches += 1
+        self.queue_time += sum(queue_times)
+        self.max_queue_time = max(self.max_queue_time, *queue_times)
+        self.tokenize_time += tokenize_time
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.prompts / self.batches if self.batches else 0.0
+
+    @property
+    def mean_queue_time(self) -> float:
+        return self.queue_time / self.prompts if self.prompts else 0.0
+
+    @property
+    def mean_tokenize_time(self) -> float:
+        """Mean time spent tokenizing a batch"""
+        return self.tokenize_time / self.batches if self.batches else 0.0
+
+    def __repr__(self):
+        return (
+            f"PreprocessPoolStats(prompts={self.prompts}, batches={self.batches}, "
+            f"mean_batch_size={self.mean_batch_size:.1f}, "
+            f"mean_queue_time={self.mean_queue_time:.4f}, "
+            f"max_queue_time={self.max_queue_time:.4f}, "
+            f"mean_tokenize_time={self.mean_tokenize_time:.4f})"
+        )
+
+
+class _PendingPrompt:
+    def __init__(
+        self,
+        prompt: str,
+        add_special_tokens: bool,
+        truncate_prompt_tokens: Optional[int],
+        future: asyncio.Future,
+    ):
+        self.prompt = prompt
+        self.add_special_tokens = add_special_tokens
+        self.truncate_prompt_tokens = truncate_prompt_tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class PreprocessPool:
+    """
+    Renders chat templates and tokenizes prompts in a pool of threads or
+    processes, off the event loop forwarding the responses of the other requests
+
+    The prompts submitted while the workers are busy are tokenized together, in
+    batches of up to `max_batch_size` prompts. Thread workers copy `tokenizer`;
+    process workers load the tokenizer of `model_path` with `loader` when they
+    start, so `loader` must be picklable. The `stats` of the pool are logged
+    every `stats_interval` seconds while prompts are tokenized.
+    """
+
+    def __init__(
+        self,
+        tokenizer: AnyTokenizer,
+        model_path: str,
+        pool_type: PreprocessPoolType = PreprocessPoolType.THREAD,
+        num_workers: int = 4,
+        max_batch_size: int = 32,
+        loader: Callable[[str], AnyTokenizer] = load_tokenizer,
+        stats_interval: float = 60.0,
+    ):
+        if num_workers < 1:
+            raise ValueError("num_workers must be positive")
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be positive")
+        self.max_batch_size = max_batch_size
+        self.stats = PreprocessPoolStats()
+        self.stats_interval = stats_interval
+        self._stats_logged_at = time.monotonic()
+        self._executor: Executor
+        if pool_type == PreprocessPoolType.PROCESS:
+            # forking would copy the threads of the runtime, start afresh instead
+            self._executor = ProcessPoolExecutor(
+                num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(None, model_path, loader),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                num_workers,
+                thread_name_prefix="preprocess",
+                initializer=_init_worker,
+                initargs=(tokenizer, model_path, loader),
+            )
+        # a batch is only formed once a worker is free to tokenize it, so that
+        # the prompts arriving meanwhile join it; chat templates are rendered
+        # by the same workers
+        self._free_workers = asyncio.Semaphore(num_workers)
+        self._queue: asyncio.Queue[_PendingPrompt] = asyncio.Queue()
+        self._batcher: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+
+    async def render_chat(
+        self, conversation: List[ConversationMessage], template_kwargs: Dict[str, Any]
+    ) -> Tuple[str, PreprocessTimings]:
+        """
+        Render the chat template, see `apply_hf_chat_template` for the
+        `template_kwargs`
+        """
+        loop = asyncio.get_running_loop()
+        enqueued_at = time.monotonic()
+        async with self._free_workers:
+            prompt, started_at, elapsed = await loop.run_in_executor(
+                self._executor, _render_chat, conversation, template_kwargs
+            )
+        return prompt, PreprocessTimings(started_at - enqueued_at, elapsed)
+
+    async def tokenize(
+        self,
+        prompt: str,
+        add_special_tokens: bool = True,
+        truncate_prompt_tokens: Optional[int] = None,
+    ) -> Tuple[List[int], PreprocessTimings]:
+        """
+        Tokenize `prompt` along with the other prompts waiting for a worker
+        """
+        if self._batcher is None:
+            self._batcher = asyncio.create_task(self._form_batches())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(
+            _PendingPrompt(prompt, add_special_tokens, truncate_prompt_tokens, future)
+        )
+        return await future
+
+    async def _form_batches(self):
+        while True:
+            pending = [await self._queue.get()]
+            await self._free_workers.acquire()
+            while len(pending) < self.max_batch_size and not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            batch = asyncio.create_task(self._run_batch(pending))
+            self._batches.add(batch)
+            batch.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, pending: List[_PendingPrompt]):
+        loop = asyncio.get_running_loop()
+        prompts = [
+            (p.prompt, p.add_special_tokens, p.truncate_prompt_tokens) for p in pending
+        ]
+        try:
+            token_ids, started_at, elapsed = await loop.run_in_executor(
+                self._executor, _tokenize_batch, prompts
+            )
+        except Exception as e:
+            for p in pending:
+                if not p.future.done():
+                    p.future.set_exception(e)
+            return
+        finally:
+            self._free_workers.release()
+
+        queue_times = [started_at - p.enqueued_at for p in pending]
+        self.stats.record_batch(queue_times, elapsed)
+        now = time.monotonic()
+        if now - self._stats_logged_at >= self.stats_interval:
+            self._stats_logged_at = now
+            vllm_logger.info(f"Preprocess pool: {self.stats}")
+        for p, input_ids, queue_time in zip(pending, token_ids, queue_times):
+            # the request may have been cancelled meanwhile
+            if not p.future.done():
+                p.future.set_result((input_ids, PreprocessTimings(queue_time, elapsed)))
+
+    def close(self, wait: bool = False):
+        """
+        Stop the workers, failing the prompts not tokenized yet; with `wait`,
+        returns once the workers have stopped
+        """
+        if self._batcher is not None:
+            self._batcher.cancel()
+        for batch in self._batches:
+            batch.cancel()
+        while not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -15,7 +15,9 @@
 
 
 import json
-from typing import Any, List, Optional
+import sys
+from array import array
+from typing import Any, Iterable, List, Optional, Union
 
 import msgspec
 from pydantic import BaseModel, ConfigDict, field_validator
@@ -36,6 +38,31 @@ class Tokens(BaseModel):
     tokens: list[int]
 
 
+class TokensStruct(msgspec.Struct):
+    """
+    msgspec counterpart of `Tokens` with the same JSON encoding
+
+    `tokens` may also be the token ids packed as little-endian uint32, which
+    are encoded as a base64 string; `KvRouter.schedule` accepts both forms.
+    `lora_id` is the LoRA adapter serving the request, 0 for the base model.
+    """
+
+    tokens: Union[list[int], bytes]
+    lora_id: int = 0
+
+    @classmethod
+    def packed(cls, token_ids: Iterable[int], lora_id: int = 0) -> "TokensStruct":
+        return cls(tokens=pack_tokens(token_ids), lora_id=lora_id)
+
+
+def pack_tokens(token_ids: Iterable[int]) -> bytes:
+    """Pack token ids as little-endian uint32"""
+    tokens = array("I", token_ids)
+    if sys.byteorder == "big":
+        tokens.byteswap()
+    return tokens.tobytes()
+
+
 class PrefillRequest(Request):
     request_id: str
 
@@ -75,6 +102,9 @@ class vLLMGenerateRequest(BaseModel):
     engine_prompt: PatchedTokensPrompt
     sampling_params: SamplingParams
     request_id: str
+    # the LoRA adapter serving the request, numbered from 1 in the order of the
+    # --lora-modules of the processor and workers; 0 for the base model
+    lora_id: int = 0
 
     @field_validator("sampling_params", mode="before")
     @classmethod
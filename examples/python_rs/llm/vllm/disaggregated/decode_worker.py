@@ -98,11 +98,17 @@ class VllmDecodeEngine(BaseVllmEngine, ProcessMixIn):
                 engine_prompt, sampling_params, request_id
             )
 
-        async for response in await self._stream_response(
-            request, generator, request_id, conversation
-        ):
-            vllm_logger.debug(f"Generated response: {response}")
-            yield response
+        try:
+            async for response in await self._stream_response(
+                request, generator, request_id, conversation
+            ):
+                vllm_logger.debug(f"Generated response: {response}")
+                yield response
+        except asyncio.CancelledError:
+            # the request was stopped; free its slot in the engine right away
+            vllm_logger.debug(f"Aborting cancelled request {request_id}")
+            await self.engine_client.abort(request_id)
+            raise
 
         await prefill_output
 
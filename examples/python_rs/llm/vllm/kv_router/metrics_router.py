@@ -61,12 +61,12 @@ class Router:
         if worker_id is None:
             vllm_logger.info("randomly select worker")
             engine_generator = await self.workers_client.random(
-                request.model_dump_json()
+                request.model_dump_json(), raw=True
             )
         else:
             vllm_logger.info(f"directly select worker: {worker_id}")
             engine_generator = await self.workers_client.direct(
-                request.model_dump_json(), worker_id
+                request.model_dump_json(), worker_id, raw=True
             )
 
         async for resp in engine_generator:
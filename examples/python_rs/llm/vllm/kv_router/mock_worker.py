@@ -55,6 +55,10 @@ class MockEngine:
             )
         else:
             vllm_logger.info("KVCacheEventManager initialization failed!")
+        self.tokens = [3] * 64
+        self.lib.triton_llm_set_kv_block_size.argtypes = [ctypes.c_size_t]
+        self.lib.triton_llm_set_kv_block_size.restype = c_uint32
+        self.lib.triton_llm_set_kv_block_size(len(self.tokens))
         self.lib.triton_kv_event_publish_stored.argtypes = [
             ctypes.c_uint64,  # event_id
             ctypes.POINTER(ctypes.c_uint32),  # token_ids
@@ -91,9 +95,9 @@ class MockEngine:
             self.request_total_slots,
             self.kv_active_block,
             self.kv_total_blocks,
+            len(self.tokens),
         )
         self.event_id_counter = 0
-        self.tokens = [3] * 64
 
     @triton_endpoint(Request, Response)
     async def generate(self, request):
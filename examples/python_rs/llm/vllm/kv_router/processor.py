@@ -13,27 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import asyncio
 import uuid
 from enum import Enum
-from typing import AsyncIterator, Tuple, Union
+from typing import AsyncIterator, List, Optional, Sequence, Tuple, Union
 
+import msgspec
 import uvloop
 from common.chat_processor import ChatProcessor, CompletionsProcessor, ProcessMixIn
-from common.parser import parse_vllm_args
-from common.protocol import MyRequestOutput, Tokens, vLLMGenerateRequest
-from transformers import AutoTokenizer
-from vllm.engine.arg_utils import AsyncEngineArgs
+from common.preprocess_pool import PreprocessPool, PreprocessPoolType, load_tokenizer
+from common.protocol import MyRequestOutput, TokensStruct, vLLMGenerateRequest
+from kv_router.router import RoutingStrategy, add_kv_router_args, create_kv_router
+from vllm.engine.arg_utils import AsyncEngineArgs, nullable_str
+from vllm.entrypoints.openai.cli_args import LoRAParserAction
 from vllm.entrypoints.openai.protocol import (
     ChatCompletionRequest,
     ChatCompletionStreamResponse,
     CompletionRequest,
     CompletionStreamResponse,
 )
+from vllm.entrypoints.openai.serving_models import LoRAModulePath
 from vllm.logger import logger as vllm_logger
 from vllm.outputs import RequestOutput
 from vllm.transformers_utils.tokenizer import AnyTokenizer
+from vllm.utils import FlexibleArgumentParser
 
+from triton_distributed.llm import KvRouter, OverloadedError
 from triton_distributed.runtime import (
     Client,
     DistributedRuntime,
@@ -47,6 +53,16 @@ class RequestType(Enum):
     COMPLETION = "completion"
 
 
+class RouterMode(Enum):
+    # ask the router component for a worker id
+    REMOTE = "remote"
+    # run the KV router inside the processor
+    EMBEDDED = "embedded"
+
+    def __str__(self):
+        return self.value
+
+
 class Processor(ProcessMixIn):
     """
     vLLM pre and post processing
@@ -55,32 +71,68 @@ class Processor(ProcessMixIn):
     def __init__(
         self,
         engine_args: AsyncEngineArgs,
-        router_client: Client,
         workers_client: Client,
+        routing_strategy: RoutingStrategy = RoutingStrategy.PREFIX,
+        router_client: Optional[Client] = None,
+        kv_router: Optional[KvRouter] = None,
+        preprocess_pool_type: PreprocessPoolType = PreprocessPoolType.THREAD,
+        preprocess_pool_size: int = 0,
+        preprocess_max_batch_size: int = 32,
+        prompt_cache_tokens: int = 0,
+        lora_modules: Optional[Sequence[LoRAModulePath]] = None,
     ):
+        """
+        Only the prefix strategy consults a router, either the router component
+        through `router_client` or the in-process `kv_router`; the other
+        strategies are resolved by the workers client itself.
+
+        With a `preprocess_pool_size`, chat requests are preprocessed by a pool
+        of that many threads or processes, tokenizing up to
+        `preprocess_max_batch_size` prompts at once; by default they are
+        preprocessed on the event loop. With `prompt_cache_tokens`, the token
+        ids of up to that many tokens of recent prompts are cached, so that the
+        next turn of a conversation only tokenizes its new messages.
+
+        Requests naming one of the `lora_modules` as their model are routed
+        by the id of that adapter, numbered from 1 in order like the vLLM
+        OpenAI server numbers them; the workers must serve the same adapters
+        in the same order for the ids to match their KV events.
+        """
         self.engine_args = engine_args
         self.model_config = self.engine_args.create_model_config()
         self.tokenizer = self._create_tokenizer(engine_args)
-        self.chat_processor = ChatProcessor(self.tokenizer, self.model_config)
+        self.preprocess_pool = (
+            PreprocessPool(
+                self.tokenizer,
+                engine_args.model,
+                pool_type=preprocess_pool_type,
+                num_workers=preprocess_pool_size,
+                max_batch_size=preprocess_max_batch_size,
+            )
+            if preprocess_pool_size > 0
+            else None
+        )
+        self.chat_processor = ChatProcessor(
+            self.tokenizer,
+            self.model_config,
+            preprocess_pool=self.preprocess_pool,
+            prompt_cache_tokens=prompt_cache_tokens,
+        )
         self.completions_processor = CompletionsProcessor(
             self.tokenizer, self.model_config
         )
-        self.router_client = router_client
         self.workers_client = workers_client
+        self.routing_strategy = routing_strategy
+        self.router_client = router_client
+        self.kv_router = kv_router
+        self.lora_ids = {
+            module.name: lora_id
+            for lora_id, module in enumerate(lora_modules or [], start=1)
+        }
 
     def _create_tokenizer(self, engine_args: AsyncEngineArgs) -> AnyTokenizer:
         """Create a TokenizerGroup using engine arguments similar to VLLM's approach"""
-        model_path = engine_args.model
-
-        # Create the base tokenizer with VLLM's typical settings
-        base_tokenizer = AutoTokenizer.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            padding_side="left",
-            truncation_side="left",
-            use_fast=True,  # VLLM might use the fast tokenizer for efficiency
-        )
-        return base_tokenizer
+        return load_tokenizer(engine_args.model)
 
     async def _generate(
         self,
@@ -96,32 +148,29 @@ class Processor(ProcessMixIn):
             engine_prompt,
             sampling_params,
         ) = await self._parse_raw_request(raw_request)
-        worker_id_generator: AsyncIterator = await self.router_client.generate(
-            Tokens(tokens=engine_prompt["prompt_token_ids"]).model_dump_json()
+        lora_id = self._lora_id(request)
+        worker_id = await self._select_worker(
+            engine_prompt["prompt_token_ids"], lora_id
         )
-
-        worker_id = (
-            await worker_id_generator.__anext__()
-        )  # only one worker id is returned
-        worker_id = worker_id.data()
         vllm_logger.info(f"Worker ID: {worker_id}")
 
-        if worker_id == "":
-            engine_generator = await self.workers_client.random(
-                vLLMGenerateRequest(
-                    engine_prompt=engine_prompt,
-                    sampling_params=sampling_params,
-                    request_id=request_id,
-                ).model_dump_json()
+        engine_request = vLLMGenerateRequest(
+            engine_prompt=engine_prompt,
+            sampling_params=sampling_params,
+            request_id=request_id,
+            lora_id=lora_id,
+        ).model_dump_json()
+        if worker_id is not None:
+            engine_generator = await self.workers_client.direct(
+                engine_request, worker_id, raw=True
+            )
+        elif self.routing_strategy == RoutingStrategy.ROUND_ROBIN:
+            engine_generator = await self.workers_client.round_robin(
+                engine_request, raw=True
             )
         else:
-            engine_generator = await self.workers_client.direct(
-                vLLMGenerateRequest(
-                    engine_prompt=engine_prompt,
-                    sampling_params=sampling_params,
-                    request_id=request_id,
-                ).model_dump_json(),
-                int(worker_id),
+            engine_generator = await self.workers_client.random(
+                engine_request, raw=True
             )
 
         output = self._generate_responses(engine_generator, request_type)
@@ -131,6 +180,50 @@ class Processor(ProcessMixIn):
         ):
             yield response
 
+    def _lora_id(
+        self, request: Union[CompletionRequest, ChatCompletionRequest]
+    ) -> int:
+        """Return the id of the LoRA adapter of the request, 0 for the base model"""
+        return self.lora_ids.get(request.model, 0)
+
+    async def _select_worker(
+        self, token_ids: List[int], lora_id: int = 0
+    ) -> Optional[int]:
+        """
+        Return the id of the worker that should handle the request, or None to
+        let the workers client pick one according to the routing strategy
+        """
+        if self.routing_strategy != RoutingStrategy.PREFIX:
+            return None
+
+        if self.kv_router is not None:
+            try:
+                worker_id, scores = await self.kv_router.schedule_with_scores(
+                    token_ids, lora_id
+                )
+            except OverloadedError:
+                # too many requests are waiting for a worker; shed this one
+                # rather than piling it onto a random worker
+                raise
+            except Exception as e:
+                vllm_logger.exception(f"Error during worker selection: {e}")
+                return None
+            vllm_logger.debug(
+                f"Prefix cache hit ratio on worker {worker_id}: "
+                f"{scores.hit_ratio(worker_id):.2f} of {scores.num_blocks} blocks"
+            )
+            return worker_id
+
+        # packed token ids are decoded by the router without parsing a JSON list
+        worker_id_generator: AsyncIterator = await self.router_client.generate(
+            msgspec.json.encode(TokensStruct.packed(token_ids, lora_id))
+        )
+        worker_id = (
+            await worker_id_generator.__anext__()
+        )  # only one worker id is returned
+        worker_id = worker_id.data()
+        return int(worker_id) if worker_id != "" else None
+
     async def _generate_responses(
         self, engine_generator: AsyncIterator[RequestOutput], request_type: RequestType
     ) -> AsyncIterator[Union[RequestOutput, Tuple[int, RequestOutput]]]:
@@ -174,7 +267,9 @@ class Processor(ProcessMixIn):
 
 
 @triton_worker()
-async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
+async def worker(
+    runtime: DistributedRuntime, engine_args: AsyncEngineArgs, args: argparse.Namespace
+):
     """
     Set up clients to the router and workers.
     Serve the triton-init.process.chat/completions endpoint.
@@ -186,12 +281,20 @@ async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
         .client()
     )
 
-    router_client = (
-        await runtime.namespace("triton-init")
-        .component("router")
-        .endpoint("generate")
-        .client()
-    )
+    router_client = None
+    kv_router = None
+    if args.routing_strategy == RoutingStrategy.PREFIX:
+        if args.router_mode == RouterMode.EMBEDDED:
+            kv_listener = runtime.namespace("triton-init").component("vllm")
+            await kv_listener.create_service()
+            kv_router = create_kv_router(runtime, kv_listener, args)
+        else:
+            router_client = (
+                await runtime.namespace("triton-init")
+                .component("router")
+                .endpoint("generate")
+                .client()
+            )
 
     preprocess_component = runtime.namespace("triton-init").component("process")
     await preprocess_component.create_service()
@@ -199,7 +302,18 @@ async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
     chat_endpoint = preprocess_component.endpoint("chat/completions")
     completions_endpoint = preprocess_component.endpoint("completions")
 
-    processor = Processor(engine_args, router_client, workers_client)
+    processor = Processor(
+        engine_args,
+        workers_client,
+        routing_strategy=args.routing_strategy,
+        router_client=router_client,
+        kv_router=kv_router,
+        preprocess_pool_type=args.preprocess_pool_type,
+        preprocess_pool_size=args.preprocess_pool_size,
+        preprocess_max_batch_size=args.preprocess_max_batch_size,
+        prompt_cache_tokens=args.prompt_cache_tokens,
+        lora_modules=args.lora_modules,
+    )
 
     await asyncio.gather(
         chat_endpoint.serve_endpoint(processor.generate_chat),
@@ -207,7 +321,70 @@ async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
     )
 
 
+def parse_args() -> Tuple[AsyncEngineArgs, argparse.Namespace]:
+    parser = FlexibleArgumentParser()
+    parser.add_argument(
+        "--routing-strategy",
+        type=RoutingStrategy,
+        default=RoutingStrategy.PREFIX,
+        choices=list(RoutingStrategy),
+        help="Routing strategy to use; only prefix consults a KV router",
+    )
+    parser.add_argument(
+        "--router-mode",
+        type=RouterMode,
+        default=RouterMode.REMOTE,
+        choices=list(RouterMode),
+        help="Whether prefix routing asks the router component or runs the "
+        "KV router inside the processor",
+    )
+    # only used with the embedded router
+    add_kv_router_args(parser)
+    parser.add_argument(
+        "--preprocess-pool-type",
+        type=PreprocessPoolType,
+        default=PreprocessPoolType.THREAD,
+        choices=list(PreprocessPoolType),
+        help="Whether chat requests are preprocessed by threads or processes",
+    )
+    parser.add_argument(
+        "--preprocess-pool-size",
+        type=int,
+        default=0,
+        help="Number of workers preprocessing chat requests off the event "
+        "loop; 0, the default, preprocesses them on the event loop",
+    )
+    parser.add_argument(
+        "--preprocess-max-batch-size",
+        type=int,
+        default=32,
+        help="Maximum number of prompts tokenized in a single call",
+    )
+    parser.add_argument(
+        "--prompt-cache-tokens",
+        type=int,
+        default=0,
+        help="Number of prompt tokens cached for the following turns of "
+        "conversations; 0, the default, disables the cache",
+    )
+    parser.add_argument(
+        "--lora-modules",
+        type=nullable_str,
+        default=None,
+        nargs="+",
+        action=LoRAParserAction,
+        help="LoRA modules served by the workers, in the same order as their "
+        "--lora-modules; requests for them are routed by the adapter id",
+    )
+    parser = AsyncEngineArgs.add_cli_args(parser)
+    args = parser.parse_args()
+    # the processor is given the engine args of the workers, their --block-size
+    if args.kv_block_size is None:
+        args.kv_block_size = args.block_size
+    return AsyncEngineArgs.from_cli_args(args), args
+
+
 if __name__ == "__main__":
     uvloop.install()
-    engine_args = parse_vllm_args()
-    asyncio.run(worker(engine_args))
+    engine_args, args = parse_args()
+    asyncio.run(worker(engine_args, args))
@@ -15,18 +15,21 @@
 
 
 import asyncio
-from argparse import Namespace
+import itertools
+import random
+from argparse import ArgumentParser, Namespace
 from enum import Enum
 from typing import AsyncIterator
 
 import uvloop
-from common.protocol import Tokens
+from common.protocol import TokensStruct
 from vllm.logger import logger as vllm_logger
 
-from triton_distributed.llm import KvRouter
+from triton_distributed.llm import KvRouter, OverloadedError
 from triton_distributed.runtime import (
+    Client,
     DistributedRuntime,
-    triton_endpoint,
+    triton_msgspec_endpoint,
     triton_worker,
 )
 
@@ -38,6 +41,72 @@ class RoutingStrategy(Enum):
     ROUND_ROBIN = "round_robin"
     RANDOM = "random"
 
+    def __str__(self):
+        return self.value
+
+
+def add_kv_router_args(parser: ArgumentParser):
+    """Add the options of the `KvRouter` to `parser`, see `create_kv_router`"""
+    parser.add_argument(
+        "--kv-block-size",
+        type=int,
+        default=None,
+        help="Number of tokens per KV block, the --block-size of the workers; by "
+        "default the one the workers publish, waiting for the first of them",
+    )
+    parser.add_argument(
+        "--kv-router-start-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds to wait for the router to start, such as for the first "
+        "worker to publish its KV block size",
+    )
+    parser.add_argument(
+        "--kv-policy",
+        type=str,
+        default="default",
+        choices=["default", "prefix", "least_loaded", "queue_time"],
+        help="Policy scoring the workers when routing by prefix",
+    )
+    parser.add_argument(
+        "--kv-indexer-shards",
+        type=int,
+        default=1,
+        help="Number of threads indexing the KV blocks cached by the workers",
+    )
+    parser.add_argument(
+        "--kv-indexer-expiration",
+        type=float,
+        default=None,
+        help="Window, in seconds, over which the accesses of each KV block are "
+        "counted; not counted by default",
+    )
+    parser.add_argument(
+        "--kv-indexer-snapshot",
+        type=str,
+        default=None,
+        help="File the index of the KV blocks is saved to, and restored from on restart",
+    )
+
+
+def create_kv_router(
+    runtime: DistributedRuntime, kv_listener, args: Namespace
+) -> KvRouter:
+    """
+    Create a `KvRouter` listening to the KV events of the `kv_listener`
+    component, following the options added by `add_kv_router_args`
+    """
+    return KvRouter(
+        runtime,
+        kv_listener,
+        kv_block_size=args.kv_block_size,
+        policy=args.kv_policy,
+        num_shards=args.kv_indexer_shards,
+        expiration=args.kv_indexer_expiration,
+        snapshot_path=args.kv_indexer_snapshot,
+        start_timeout=args.kv_router_start_timeout,
+    )
+
 
 class Router:
     """
@@ -47,21 +116,28 @@ class Router:
     def __init__(
         self,
         router: KvRouter,
+        workers_client: Client,
         routing_strategy: RoutingStrategy = RoutingStrategy.PREFIX,
     ):
         vllm_logger.info(
             f"Initializing KV Router with strategy: {routing_strategy.value}"
         )
         self.router = router
+        self.workers_client = workers_client
         self.routing_strategy = routing_strategy
+        self.counter = itertools.count()
 
-    @triton_endpoint(Tokens, WorkerId)
+    @triton_msgspec_endpoint(TokensStruct, WorkerId)
     async def generate(self, request) -> AsyncIterator[WorkerId]:
-        lora_id = 0
         worker_id = None
         if self.routing_strategy == RoutingStrategy.PREFIX:
             try:
-                worker_id = await self.router.schedule(request.tokens, lora_id)
+                worker_id = await self.router.schedule(
+                    request.tokens, request.lora_id
+                )
+            except OverloadedError as e:
+                vllm_logger.warning(f"Shedding request: {e}")
+                worker_id = ""
             # [NOTE][TODO] Now that the scheduler may return more error messages,
             # now we are catching all exceptions and logging them. Should have
             # catch specific router exceptions once we have dedicated types.
@@ -75,11 +151,17 @@ class Router:
             yield str(worker_id)
 
         else:
-            # TODO: Do we implement round_robin and random here?
-            # or just skip this router and directly enable in preprocess?
-            raise NotImplementedError(
-                f"Routing strategy {self.routing_strategy} not implemented"
-            )
+            # Prefer resolving these strategies in the processor, which saves the
+            # round trip to the router; they are served here for compatibility.
+            worker_ids = self.workers_client.endpoint_ids()
+            if not worker_ids:
+                worker_id = ""
+            elif self.routing_strategy == RoutingStrategy.ROUND_ROBIN:
+                worker_id = worker_ids[next(self.counter) % len(worker_ids)]
+            else:
+                worker_id = random.choice(worker_ids)
+
+            yield str(worker_id)
 
 
 @triton_worker()
@@ -120,10 +202,12 @@ async def worker(runtime: DistributedRuntime, args: Namespace):
     router_component = runtime.namespace("triton-init").component("router")
     await router_component.create_service()
 
-    router = KvRouter(runtime, kv_listener)
+    router = create_kv_router(runtime, kv_listener, args)
 
     endpoint = router_component.endpoint("generate")
-    await endpoint.serve_endpoint(Router(router, args.routing_strategy).generate)
+    await endpoint.serve_endpoint(
+        Router(router, workers_client, args.routing_strategy).generate
+    )
 
 
 if __name__ == "__main__":
@@ -139,6 +223,7 @@ if __name__ == "__main__":
         choices=list(RoutingStrategy),
         help="Routing strategy to use",
     )
+    add_kv_router_args(parser)
     parser.add_argument(
         "--min-workers",
         type=int,
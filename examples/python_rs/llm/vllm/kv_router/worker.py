@@ -13,17 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import asyncio
 import os
-from typing import AsyncIterator
+from typing import AsyncIterator, Optional, Sequence, Tuple
 
 import uvloop
 from common.base_engine import BaseVllmEngine
-from common.parser import parse_vllm_args
 from common.protocol import MyRequestOutput, vLLMGenerateRequest
-from vllm.engine.arg_utils import AsyncEngineArgs
+from vllm.engine.arg_utils import AsyncEngineArgs, nullable_str
+from vllm.entrypoints.openai.cli_args import LoRAParserAction
+from vllm.entrypoints.openai.serving_models import LoRAModulePath
 from vllm.logger import logger as vllm_logger
+from vllm.lora.request import LoRARequest
 from vllm.sampling_params import RequestOutputKind
+from vllm.utils import FlexibleArgumentParser
 
 from triton_distributed.llm import KvMetricsPublisher
 from triton_distributed.runtime import (
@@ -41,10 +45,21 @@ class VllmEngine(BaseVllmEngine):
     """
 
     def __init__(
-        self, engine_args: AsyncEngineArgs, metrics_publisher: KvMetricsPublisher
+        self,
+        engine_args: AsyncEngineArgs,
+        metrics_publisher: KvMetricsPublisher,
+        lora_modules: Optional[Sequence[LoRAModulePath]] = None,
     ):
+        """
+        The `lora_modules` are numbered from 1 in order, like the processor
+        numbers them; requests name their adapter by that id.
+        """
         self.metrics_publisher = metrics_publisher
         self.engine_args = engine_args
+        self.lora_requests = {
+            lora_id: LoRARequest(module.name, lora_id, module.path)
+            for lora_id, module in enumerate(lora_modules or [], start=1)
+        }
         super().__init__(engine_args)
 
     async def initialize(self):
@@ -62,23 +77,41 @@ class VllmEngine(BaseVllmEngine):
         # rust HTTP requires Delta streaming
         sampling_params.output_kind = RequestOutputKind.DELTA
 
-        async for response in self.engine_client.generate(
-            request.engine_prompt, sampling_params, request.request_id
-        ):
-            # MyRequestOutput takes care of serializing the response as
-            # vLLM's RequestOutput is not serializable by default
-            yield MyRequestOutput(
-                request_id=response.request_id,
-                prompt=response.prompt,
-                prompt_token_ids=response.prompt_token_ids,
-                prompt_logprobs=response.prompt_logprobs,
-                outputs=response.outputs,
-                finished=response.finished,
-            ).model_dump_json()
+        lora_request = None
+        if request.lora_id:
+            lora_request = self.lora_requests.get(request.lora_id)
+            if lora_request is None:
+                raise ValueError(f"Unknown LoRA adapter id: {request.lora_id}")
+
+        try:
+            async for response in self.engine_client.generate(
+                request.engine_prompt,
+                sampling_params,
+                request.request_id,
+                lora_request=lora_request,
+            ):
+                # MyRequestOutput takes care of serializing the response as
+                # vLLM's RequestOutput is not serializable by default;
+                # yielding bytes forwards the JSON verbatim without re-encoding it
+                yield MyRequestOutput(
+                    request_id=response.request_id,
+                    prompt=response.prompt,
+                    prompt_token_ids=response.prompt_token_ids,
+                    prompt_logprobs=response.prompt_logprobs,
+                    outputs=response.outputs,
+                    finished=response.finished,
+                ).model_dump_json().encode()
+        except asyncio.CancelledError:
+            # the request was stopped; free its slot in the engine right away
+            vllm_logger.debug(f"Aborting cancelled request {request.request_id}")
+            await self.engine_client.abort(request.request_id)
+            raise
 
 
 @triton_worker()
-async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
+async def worker(
+    runtime: DistributedRuntime, engine_args: AsyncEngineArgs, args: argparse.Namespace
+):
     """
     Serve the triton-init.vllm.generate endpoint.
     """
@@ -98,15 +131,17 @@ async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
     os.environ["VLLM_KV_COMPONENT"] = str(VLLM_KV_COMPONENT)
 
     metrics_publisher = KvMetricsPublisher()
-    vllm_engine = VllmEngine(engine_args, metrics_publisher)
+    vllm_engine = VllmEngine(engine_args, metrics_publisher, args.lora_modules)
     await vllm_engine.initialize()
     # Initially send dummy metrics to kick start,
     # vLLM will not update stat until forward pass is triggered
+    # along with the block size the router hashes the requests with
     metrics_publisher.publish(
         0,
         1024,
         0,
         1024,
+        engine_args.block_size,
     )
 
     await asyncio.gather(
@@ -115,7 +150,23 @@ async def worker(runtime: DistributedRuntime, engine_args: AsyncEngineArgs):
     )
 
 
+def parse_args() -> Tuple[AsyncEngineArgs, argparse.Namespace]:
+    parser = FlexibleArgumentParser()
+    parser.add_argument(
+        "--lora-modules",
+        type=nullable_str,
+        default=None,
+        nargs="+",
+        action=LoRAParserAction,
+        help="LoRA modules to serve, numbered from 1 in order; the processor "
+        "must be given the same ones in the same order",
+    )
+    parser = AsyncEngineArgs.add_cli_args(parser)
+    args = parser.parse_args()
+    return AsyncEngineArgs.from_cli_args(args), args
+
+
 if __name__ == "__main__":
     uvloop.install()
-    engine_args = parse_vllm_args()
-    asyncio.run(worker(engine_args))
+    engine_args, args = parse_args()
+    asyncio.run(worker(engine_args, args))
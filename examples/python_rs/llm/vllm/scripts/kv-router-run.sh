@@ -19,10 +19,11 @@
 # - Must use a single node
 
 if [ $# -lt 2 ]; then
-    echo "Usage: $0 <number_of_workers> <routing_strategy> [model_name] [endpoint_name]"
+    echo "Usage: $0 <number_of_workers> <routing_strategy> [model_name] [endpoint_name] [router_mode]"
     echo "Error: Must specify at least number of workers and routing strategy"
     echo "Optional: model_name (default: deepseek-ai/DeepSeek-R1-Distill-Llama-8B)"
     echo "Optional: endpoint_name (default: triton-init.process.chat/completions)"
+    echo "Optional: router_mode (default: remote)"
     exit 1
 fi
 
@@ -30,7 +31,9 @@ NUM_WORKERS=$1
 ROUTING_STRATEGY=$2
 MODEL_NAME=${3:-"deepseek-ai/DeepSeek-R1-Distill-Llama-8B"}
 ENDPOINT_NAME=${4:-"triton-init.process.chat/completions"}
-VALID_STRATEGIES=("prefix")
+ROUTER_MODE=${5:-"remote"}
+VALID_STRATEGIES=("prefix" "round_robin" "random")
+VALID_ROUTER_MODES=("remote" "embedded")
 SESSION_NAME="v"
 WORKDIR="/workspace/examples/python_rs/llm/vllm"
 INIT_CMD="source /opt/triton/venv/bin/activate && cd $WORKDIR"
@@ -39,6 +42,11 @@ if [[ ! " ${VALID_STRATEGIES[@]} " =~ " ${ROUTING_STRATEGY} " ]]; then
     echo "Error: Invalid routing strategy. Must be one of: ${VALID_STRATEGIES[*]}"
     exit 1
 fi
+
+if [[ ! " ${VALID_ROUTER_MODES[@]} " =~ " ${ROUTER_MODE} " ]]; then
+    echo "Error: Invalid router mode. Must be one of: ${VALID_ROUTER_MODES[*]}"
+    exit 1
+fi
 ########################################################
 # HTTP Server
 ########################################################
@@ -64,20 +72,25 @@ PROCESSOR_CMD="RUST_LOG=info python3 -m kv_router.processor \
     --tokenizer $MODEL_NAME \
     --enable-prefix-caching \
     --block-size 64 \
-    --max-model-len 16384 "
+    --max-model-len 16384 \
+    --routing-strategy $ROUTING_STRATEGY \
+    --router-mode $ROUTER_MODE "
 tmux new-session -d -s "$SESSION_NAME-processor"
 tmux send-keys -t "$SESSION_NAME-processor" "$INIT_CMD && $PROCESSOR_CMD" C-m
 
 ########################################################
 # Router
 ########################################################
-ROUTER_CMD="RUST_LOG=info python3 -m kv_router.router \
-    --model $MODEL_NAME \
-    --routing-strategy $ROUTING_STRATEGY \
-    --min-workers $NUM_WORKERS "
+# Only the prefix strategy in remote mode needs the router component
+if [ "$ROUTING_STRATEGY" == "prefix" ] && [ "$ROUTER_MODE" == "remote" ]; then
+    ROUTER_CMD="RUST_LOG=info python3 -m kv_router.router \
+        --model $MODEL_NAME \
+        --routing-strategy $ROUTING_STRATEGY \
+        --min-workers $NUM_WORKERS "
 
-tmux new-session -d -s "$SESSION_NAME-router"
-tmux send-keys -t "$SESSION_NAME-router" "$INIT_CMD && $ROUTER_CMD" C-m
+    tmux new-session -d -s "$SESSION_NAME-router"
+    tmux send-keys -t "$SESSION_NAME-router" "$INIT_CMD && $ROUTER_CMD" C-m
+fi
 
 ########################################################
 # Workers
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from typing import Any, Dict, List, Optional, Union
+
+BOS = "<s>"
+IM_START = "<|im_start|>"
+IM_END = "<|im_end|>"
+
+# added in front of the text at the start of a prompt, like the space
+# sentencepiece tokenizers prepend
+PREFIX_SPACE_ID = 4
+
+# tokenizing a prompt containing it raises
+FAILING_TEXT = "boom"
+
+
+class AddedToken:
+    def __init__(self, content: str, special: bool = True):
+        self.content = content
+        self.special = special
+        self.lstrip = False
+        self.rstrip = False
+        self.normalized = False
+
+
+class Encoding:
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+
+
+class FakeTokenizer:
+    """
+    A tokenizer with a ChatML template, one token per character and special
+    tokens split out of the text first, like a HF tokenizer
+    """
+
+    chat_template = "chatml"
+
+    def __init__(self):
+        self.added_tokens_decoder: Dict[int, AddedToken] = {
+            1: AddedToken(BOS),
+            2: AddedToken(IM_START),
+            3: AddedToken(IM_END),
+        }
+        self._special_ids = {
+            token.content: token_id
+            for token_id, token in self.added_tokens_decoder.items()
+        }
+        self._special_pattern = re.compile(
+            "|".join(re.escape(content) for content in self._special_ids)
+        )
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        if FAILING_TEXT in text:
+            raise ValueError(f"cannot tokenize {text!r}")
+        input_ids = [1] if add_special_tokens else []
+        start = 0
+        for match in self._special_pattern.finditer(text):
+            input_ids.extend(self._encode_text(text[start : match.start()], start))
+            input_ids.append(self._special_ids[match.group()])
+            start = match.end()
+        input_ids.extend(self._encode_text(text[start:], start))
+        return input_ids
+
+    def _encode_text(self, text: str, offset: int) -> List[int]:
+        if not text:
+            return []
+        prefix = [PREFIX_SPACE_ID] if offset == 0 else []
+        return prefix + [100 + ord(char) for char in text]
+
+    def __call__(
+        self,
+        text: Union[str, List[str]],
+        add_special_tokens: bool = True,
+        truncation: bool = False,
+        max_length: Optional[int] = None,
+    ) -> Encoding:
+        def encode(text: str) -> List[int]:
+            input_ids = self.encode(text, add_special_tokens)
+            if truncation and max_length is not None:
+                input_ids = input_ids[-max_length:]
+            return input_ids
+
+        if isinstance(text, str):
+            return Encoding(encode(text))
+        return Encoding([encode(t) for t in text])
+
+    def apply_chat_template(
+        self,
+        conversation: List[Dict[str, Any]],
+        chat_template: Optional[str] = None,
+        tokenize: bool = False,
+        add_generation_prompt: bool = False,
+        **kwargs,
+    ) -> str:
+        prompt = "".join(
+            f"{IM_START}{message['role']}\n{message['content']}{IM_END}\n"
+            for message in conversation
+        )
+        if add_generation_prompt:
+            prompt += f"{IM_START}assistant\n"
+        return prompt
+
+
+def load_fake_tokenizer(model_path: str) -> FakeTokenizer:
+    """Loads the tokenizer of the process workers of a pool"""
+    return FakeTokenizer()
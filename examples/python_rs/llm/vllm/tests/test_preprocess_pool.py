@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("transformers")
+pytest.importorskip("vllm")
+
+from common.preprocess_pool import (  # noqa: E402
+    PreprocessPool,
+    PreprocessPoolType,
+    tokenize_prompts,
+)
+
+from .fake_tokenizer import (  # noqa: E402
+    FAILING_TEXT,
+    IM_END,
+    IM_START,
+    FakeTokenizer,
+    load_fake_tokenizer,
+)
+
+pytestmark = pytest.mark.pre_merge
+
+POOL_TYPES = list(PreprocessPoolType)
+
+
+def make_pool(pool_type, **kwargs):
+    return PreprocessPool(
+        FakeTokenizer(),
+        "fake-model",
+        pool_type=pool_type,
+        loader=load_fake_tokenizer,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("pool_type", POOL_TYPES)
+async def test_tokenize_batches_waiting_prompts(pool_type):
+    prompts = ["hello", "world", "abc", "", "the end"]
+    pool = make_pool(pool_type, num_workers=1, max_batch_size=2)
+    try:
+        results = await asyncio.gather(*(pool.tokenize(p) for p in prompts))
+    finally:
+        pool.close(wait=True)
+
+    expected = tokenize_prompts(FakeTokenizer(), [(p, True, None) for p in prompts])
+    assert [token_ids for token_ids, _ in results] == expected
+    # the first batch is formed right away, the others while the worker is busy
+    assert pool.stats.prompts == len(prompts)
+    assert pool.stats.batches == 3
+    assert pool.stats.mean_batch_size == pytest.approx(len(prompts) / 3)
+    for _, timings in results:
+        assert timings.queue_time >= 0.0
+        assert timings.tokenize_time >= 0.0
+
+
+@pytest.mark.parametrize("pool_type", POOL_TYPES)
+async def test_tokenize_options(pool_type):
+    pool = make_pool(pool_type)
+    try:
+        plain, _ = await pool.tokenize("abc", add_special_tokens=False)
+        truncated, _ = await pool.tokenize("abcdef", truncate_prompt_tokens=3)
+    finally:
+        pool.close(wait=True)
+
+    tokenizer = FakeTokenizer()
+    assert plain == tokenizer("abc", add_special_tokens=False).input_ids
+    assert truncated == tokenizer("abcdef").input_ids[-3:]
+
+
+@pytest.mark.parametrize("pool_type", POOL_TYPES)
+async def test_tokenize_error_fails_its_batch(pool_type):
+    pool = make_pool(pool_type, num_workers=1)
+    try:
+        results = await asyncio.gather(
+            pool.tokenize("abc"),
+            pool.tokenize(FAILING_TEXT),
+            return_exceptions=True,
+        )
+        # the worker is released for the following prompts
+        token_ids, _ = await pool.tokenize("abc")
+    finally:
+        pool.close(wait=True)
+
+    # both prompts were tokenized in the same call
+    assert all(isinstance(result, ValueError) for result in results)
+    assert token_ids == FakeTokenizer()("abc").input_ids
+
+
+@pytest.mark.parametrize("pool_type", POOL_TYPES)
+async def test_render_chat(pool_type):
+    conversation = [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+    ]
+    pool = make_pool(pool_type, num_workers=1)
+    try:
+        (prompt, timings), (token_ids, _) = await asyncio.gather(
+            pool.render_chat(
+                conversation, {"chat_template": None, "add_generation_prompt": True}
+            ),
+            pool.tokenize("abc"),
+        )
+    finally:
+        pool.close(wait=True)
+
+    assert prompt == (
+        f"{IM_START}user\nhi{IM_END}\n"
+        f"{IM_START}assistant\nhello{IM_END}\n"
+        f"{IM_START}assistant\n"
+    )
+    assert timings.queue_time >= 0.0
+    assert token_ids == FakeTokenizer()("abc").input_ids
+
+
+def test_pool_size_must_be_positive():
+    with pytest.raises(ValueError):
+        make_pool(PreprocessPoolType.THREAD, num_workers=0)
+    with pytest.raises(ValueError):
+        make_pool(PreprocessPoolType.THREAD, max_batch_size=0)
@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+pytest.importorskip("transformers")
+pytest.importorskip("vllm")
+
+from common.chat_processor import ChatProcessor, PromptTokenCache  # noqa: E402
+
+from .fake_tokenizer import BOS, IM_END, IM_START, FakeTokenizer  # noqa: E402
+
+pytestmark = pytest.mark.pre_merge
+
+
+def make_processor(prompt_cache_tokens: int) -> ChatProcessor:
+    # tokenizing needs neither the model config nor the OpenAI serving objects
+    processor = ChatProcessor.__new__(ChatProcessor)
+    processor.tokenizer = FakeTokenizer()
+    processor.preprocess_pool = None
+    processor.prompt_cache = (
+        PromptTokenCache(processor.tokenizer, prompt_cache_tokens)
+        if prompt_cache_tokens > 0
+        else None
+    )
+    return processor
+
+
+def render(conversation, bos: bool = False) -> str:
+    prompt = FakeTokenizer().apply_chat_template(
+        conversation, add_generation_prompt=True
+    )
+    return BOS + prompt if bos else prompt
+
+
+def turns(*contents):
+    """A conversation of a system prompt followed by user and assistant turns"""
+    return [
+        {
+            "role": "system" if i == 0 else "user" if i % 2 else "assistant",
+            "content": content,
+        }
+        for i, content in enumerate(contents)
+    ]
+
+
+async def tokenize(processor, prompt, add_special_tokens=True):
+    token_ids, cached_tokens, _ = await processor._tokenize_prompt(
+        prompt, add_special_tokens, None
+    )
+    return token_ids, cached_tokens
+
+
+CONTENTS = [
+    "You are helpful.",
+    "Hi there",
+    "Hello! How can I help?",
+    # special tokens in the content are tokenized as such by the tokenizer
+    f"what does {IM_END} mean?",
+    "",
+    "It ends a message.",
+    "thanks",
+]
+
+
+@pytest.mark.parametrize("add_special_tokens, bos", [(True, False), (False, True)])
+async def test_cached_ids_match_uncached(add_special_tokens, bos):
+    cached = make_processor(1 << 20)
+    uncached = make_processor(0)
+
+    cached_tokens = []
+    for n in range(1, len(CONTENTS) + 1):
+        prompt = render(turns(*CONTENTS[:n]), bos)
+        token_ids, num_cached = await tokenize(cached, prompt, add_special_tokens)
+        expected, _ = await tokenize(uncached, prompt, add_special_tokens)
+        assert token_ids == expected
+        cached_tokens.append(num_cached)
+
+    # every turn after the first extends the previous one
+    assert cached_tokens[0] == 0
+    assert all(num_cached > 0 for num_cached in cached_tokens[1:])
+    assert cached.prompt_cache.stats.hits == len(CONTENTS) - 1
+
+
+async def test_prompt_extending_cached_one_replaces_it():
+    processor = make_processor(1 << 20)
+    cache = processor.prompt_cache
+
+    for n in range(1, len(CONTENTS) + 1):
+        token_ids, _ = await tokenize(processor, render(turns(*CONTENTS[:n])))
+
+    # only the last turn is kept, up to its last special token
+    assert len(cache._prompts) == 1
+    last_special = max(
+        i for i, token_id in enumerate(token_ids) if token_id in cache._anchor_ids
+    )
+    assert cache.num_tokens == last_special + 1
+
+    # another continuation of an earlier turn still finds it
+    branch = render(turns(*CONTENTS[:2], "a different answer"))
+    token_ids, num_cached = await tokenize(processor, branch)
+    expected, _ = await tokenize(make_processor(0), branch)
+    assert token_ids == expected
+    assert num_cached > 0
+
+
+async def test_least_recently_used_prompts_are_evicted():
+    first = render(turns("first system prompt", "question"))
+    second = render(turns("second system prompt", "question"))
+    prompt_tokens = len(FakeTokenizer()(first).input_ids)
+    # room for a single prompt
+    processor = make_processor(prompt_tokens + prompt_tokens // 2)
+    cache = processor.prompt_cache
+
+    await tokenize(processor, first)
+    await tokenize(processor, second)
+    assert len(cache._prompts) == 1
+    assert cache.num_tokens <= cache.max_tokens
+
+    # the second prompt is still cached, the first one was evicted but for the
+    # leading special tokens it shares with the second one
+    shared = len(FakeTokenizer()(IM_START).input_ids)
+    _, num_cached = await tokenize(
+        processor, second + f"answer{IM_END}\n{IM_START}user\nmore"
+    )
+    assert num_cached > shared
+    _, num_cached = await tokenize(processor, first + f"answer{IM_END}\n")
+    assert num_cached == shared
+
+
+async def test_truncated_prompts_bypass_the_cache():
+    processor = make_processor(1 << 20)
+    prompt = render(turns(*CONTENTS[:3]))
+
+    token_ids, num_cached, _ = await processor._tokenize_prompt(prompt, True, 8)
+
+    assert token_ids == FakeTokenizer()(prompt).input_ids[-8:]
+    assert num_cached == 0
+    assert processor.prompt_cache.stats.lookups == 0
@@ -17,16 +17,23 @@ use async_once_cell::OnceCell as AsyncOnceCell;
 use libc::c_char;
 use once_cell::sync::OnceCell;
 use std::ffi::CStr;
-use std::sync::atomic::{AtomicU32, Ordering};
+use std::sync::atomic::{AtomicU32, AtomicUsize, Ordering};
 
 use triton_distributed_llm::kv_router::{
-    indexer::compute_block_hash_for_seq, protocols::*, publisher::KvEventPublisher,
+    indexer::compute_block_hash_with_lora,
+    protocols::*,
+    publisher::{KvEventEncoding, KvEventPublisher},
 };
 use triton_distributed_runtime::{DistributedRuntime, Worker};
 static WK: OnceCell<Worker> = OnceCell::new();
 static DRT: AsyncOnceCell<DistributedRuntime> = AsyncOnceCell::new();
 // [FIXME] shouldn't the publisher be instance passing between API calls?
 static KV_PUB: OnceCell<KvEventPublisher> = OnceCell::new();
+// number of tokens per KV block of the worker, only full blocks are published
+static KV_BLOCK_SIZE_TOKENS: AtomicUsize = AtomicUsize::new(KV_BLOCK_SIZE);
+// set to "binary" to publish the KV events in the binary encoding, which only the routers
+// decoding it understand; JSON by default
+const TRD_KV_EVENT_ENCODING: &str = "TRD_KV_EVENT_ENCODING";
 
 fn initialize_tracing() {
     // Sets up RUST_LOG environment variable for logging while KV Publishing
@@ -122,6 +129,20 @@ pub extern "C" fn triton_llm_shutdown() -> TritonLlmResult {
     TritonLlmResult::OK
 }
 
+/// Set the number of tokens per KV block of the worker, [`KV_BLOCK_SIZE`] by default
+///
+/// The router hashes requests with the block size the workers publish along with their
+/// metrics, so it must match the one set here.
+#[no_mangle]
+pub extern "C" fn triton_llm_set_kv_block_size(kv_block_size: usize) -> TritonLlmResult {
+    if kv_block_size == 0 {
+        eprintln!("KV block size must be positive");
+        return TritonLlmResult::ERR;
+    }
+    KV_BLOCK_SIZE_TOKENS.store(kv_block_size, Ordering::Relaxed);
+    TritonLlmResult::OK
+}
+
 #[no_mangle]
 pub extern "C" fn triton_llm_load_publisher_create() -> TritonLlmResult {
     TritonLlmResult::OK
@@ -146,20 +167,44 @@ fn triton_create_kv_publisher(
     {
         Ok(drt) => {
             let backend = drt.namespace(namespace)?.component(component)?;
-            KvEventPublisher::new(drt.clone(), backend, worker_id)
+            KvEventPublisher::new_with_encoding(
+                drt.clone(),
+                backend,
+                worker_id,
+                kv_event_encoding(),
+            )
         }
         Err(e) => Err(e),
     }
 }
 
+/// The encoding of the published KV events, as set by [`TRD_KV_EVENT_ENCODING`]
+fn kv_event_encoding() -> KvEventEncoding {
+    match std::env::var(TRD_KV_EVENT_ENCODING) {
+        Ok(encoding) if encoding.eq_ignore_ascii_case("binary") => KvEventEncoding::Binary,
+        Ok(encoding) if encoding.eq_ignore_ascii_case("json") => KvEventEncoding::Json,
+        Ok(encoding) => {
+            tracing::warn!(
+                "unknown {} {:?}; publishing the KV events as JSON",
+                TRD_KV_EVENT_ENCODING,
+                encoding
+            );
+            KvEventEncoding::Json
+        }
+        Err(_) => KvEventEncoding::default(),
+    }
+}
+
 fn kv_event_create_stored_block_from_parts(
     block_hash: u64,
     token_ids: *const u32,
     num_tokens: usize,
-    _lora_id: u64,
+    lora_id: u64,
 ) -> KvCacheStoredBlockData {
-    let tokens_hash =
-        compute_block_hash_for_seq(unsafe { std::slice::from_raw_parts(token_ids, num_tokens) })[0];
+    let tokens_hash = compute_block_hash_with_lora(
+        unsafe { std::slice::from_raw_parts(token_ids, num_tokens) },
+        lora_id,
+    );
     KvCacheStoredBlockData {
         block_hash: ExternalSequenceBlockHash(block_hash),
         tokens_hash,
@@ -178,13 +223,14 @@ fn kv_event_create_stored_from_parts(
 ) -> KvCacheEvent {
     let mut blocks: Vec<KvCacheStoredBlockData> = Vec::new();
 
+    let kv_block_size = KV_BLOCK_SIZE_TOKENS.load(Ordering::Relaxed);
     let mut token_offset: usize = 0;
     for block_idx in 0..num_blocks {
         let block_hash = unsafe { *block_ids.offset(block_idx.try_into().unwrap()) };
         let tokens = unsafe { token_ids.offset(token_offset.try_into().unwrap()) };
         let num_toks = unsafe { *num_block_tokens.offset(block_idx.try_into().unwrap()) };
-        // compute hash only apply to full block (KV_BLOCK_SIZE token)
-        if num_toks != 64 {
+        // compute hash only apply to full block (kv_block_size token)
+        if num_toks != kv_block_size {
             if WARN_COUNT
                 .fetch_update(Ordering::SeqCst, Ordering::SeqCst, |c| {
                     if c < 3 {
@@ -196,7 +242,8 @@ fn kv_event_create_stored_from_parts(
                 .is_ok()
             {
                 tracing::warn!(
-                    "Block size must be 64 tokens to be published. Block size is: {}",
+                    "Block size must be {} tokens to be published. Block size is: {}",
+                    kv_block_size,
                     num_toks
                 );
             }
@@ -290,6 +337,26 @@ pub extern "C" fn triton_kv_event_publish_removed(
     }
 }
 
+/// Publish that the worker dropped all its KV blocks, e.g. when its prefix cache is reset
+///
+/// The publisher answers the resync requests of the routers that missed events of the worker
+/// from the events published through this API, so they must cover all its blocks.
+#[no_mangle]
+pub extern "C" fn triton_kv_event_publish_cleared(event_id: u64) -> TritonLlmResult {
+    let publisher = KV_PUB.get().unwrap();
+    let event = KvCacheEvent {
+        event_id,
+        data: KvCacheEventData::Cleared,
+    };
+    match publisher.publish(event) {
+        Ok(_) => TritonLlmResult::OK,
+        Err(e) => {
+            eprintln!("Error publishing cleared kv event {:?}", e);
+            TritonLlmResult::ERR
+        }
+    }
+}
+
 // #[no_mangle]
 // pub extern "C" fn triton_kv_publish_store_event(
 //     event_id: u64,
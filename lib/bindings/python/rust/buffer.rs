@@ -0,0 +1,297 @@
+// SPDX-FileCopyrightText: Copyright (c) 2024-2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+// SPDX-License-Identifier: Apache-2.0
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+// http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+//! Bounded buffers placed between the producer and the consumer of a response stream
+//!
+//! A buffer is bounded by a number of items and, optionally, by the total number of bytes of the
+//! items it holds. Every buffer records its high-water marks, which can also be aggregated over
+//! all the streams of a client or an endpoint to size the buffers of many concurrent streams.
+
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Arc;
+
+use pyo3::prelude::*;
+use tokio::sync::{mpsc, OwnedSemaphorePermit, Semaphore};
+use tokio_stream::Stream;
+
+use triton_distributed_runtime::protocols::annotated::Annotated;
+
+/// Default number of responses buffered per stream on the client side
+pub const DEFAULT_CLIENT_STREAM_BUFFER: usize = 32;
+
+/// Default number of responses buffered per stream on the endpoint side
+pub const DEFAULT_ENDPOINT_STREAM_BUFFER: usize = 128;
+
+pub fn add_to_module(m: &Bound<'_, PyModule>) -> PyResult<()> {
+    m.add_class::<StreamBufferStats>()?;
+    Ok(())
+}
+
+/// Bounds of a stream buffer
+#[derive(Debug, Clone, Copy)]
+pub struct StreamBufferConfig {
+    /// Maximum number of buffered items
+    pub capacity: usize,
+
+    /// Maximum number of buffered bytes; unbounded if `None`
+    pub max_bytes: Option<usize>,
+}
+
+impl StreamBufferConfig {
+    pub fn new(capacity: Option<usize>, max_bytes: Option<usize>, default_capacity: usize) -> Self {
+        Self {
+            capacity: capacity.unwrap_or(default_capacity).max(1),
+            max_bytes: max_bytes.map(|bytes| bytes.clamp(1, Semaphore::MAX_PERMITS)),
+        }
+    }
+}
+
+/// Approximate number of bytes an item occupies while it sits in a stream buffer
+pub trait BufferedSize {
+    fn buffered_size(&self) -> usize;
+}
+
+impl<R: BufferedSize> BufferedSize for Annotated<R> {
+    fn buffered_size(&self) -> usize {
+        self.data.as_ref().map(R::buffered_size).unwrap_or(0)
+            + self
+                .comment
+                .as_ref()
+                .map(|comment| comment.iter().map(String::len).sum())
+                .unwrap_or(0)
+    }
+}
+
+impl BufferedSize for serde_json::Value {
+    /// Size of the JSON encoding of the value, without walking it through a serializer
+    fn buffered_size(&self) -> usize {
+        match self {
+            serde_json::Value::Null => 4,
+            serde_json::Value::Bool(_) => 5,
+            serde_json::Value::Number(_) => 8,
+            serde_json::Value::String(s) => s.len() + 2,
+            serde_json::Value::Array(values) => {
+                values.iter().map(|v| v.buffered_size() + 1).sum::<usize>() + 2
+            }
+            serde_json::Value::Object(map) => {
+                map.iter()
+                    .map(|(k, v)| k.len() + v.buffered_size() + 4)
+                    .sum::<usize>()
+                    + 2
+            }
+        }
+    }
+}
+
+/// High-water marks of one or more stream buffers
+#[derive(Debug, Default)]
+pub struct HighWaterMarks {
+    items: AtomicUsize,
+    bytes: AtomicUsize,
+}
+
+impl HighWaterMarks {
+    fn observe(&self, items: usize, bytes: usize) {
+        self.items.fetch_max(items, Ordering::Relaxed);
+        self.bytes.fetch_max(bytes, Ordering::Relaxed);
+    }
+
+    pub fn snapshot(&self) -> StreamBufferStats {
+        StreamBufferStats {
+            high_water_items: self.items.load(Ordering::Relaxed),
+            high_water_bytes: self.bytes.load(Ordering::Relaxed),
+        }
+    }
+}
+
+/// Point-in-time view of the [`HighWaterMarks`] of a stream, a client or an endpoint
+#[pyclass]
+#[derive(Debug, Clone)]
+pub struct StreamBufferStats {
+    /// Largest number of items held by a buffer
+    #[pyo3(get)]
+    high_water_items: usize,
+
+    /// Largest number of bytes held by a buffer
+    #[pyo3(get)]
+    high_water_bytes: usize,
+}
+
+#[pymethods]
+impl StreamBufferStats {
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!(
+            "StreamBufferStats(high_water_items={}, high_water_bytes={})",
+            self.high_water_items, self.high_water_bytes
+        )
+    }
+}
+
+/// Occupancy of a single stream buffer
+#[derive(Debug)]
+struct BufferState {
+    items: AtomicUsize,
+    bytes: AtomicUsize,
+    marks: HighWaterMarks,
+    parent: Option<Arc<HighWaterMarks>>,
+}
+
+impl BufferState {
+    fn push(&self, size: usize) {
+        let items = self.items.fetch_add(1, Ordering::Relaxed) + 1;
+        let bytes = self.bytes.fetch_add(size, Ordering::Relaxed) + size;
+        self.marks.observe(items, bytes);
+        if let Some(parent) = &self.parent {
+            parent.observe(items, bytes);
+        }
+    }
+
+    fn pop(&self, size: usize) {
+        self.items.fetch_sub(1, Ordering::Relaxed);
+        self.bytes.fetch_sub(size, Ordering::Relaxed);
+    }
+}
+
+/// Read-only handle on the occupancy of a stream buffer
+#[derive(Debug, Clone)]
+pub struct BufferMonitor(Arc<BufferState>);
+
+impl BufferMonitor {
+    pub fn stats(&self) -> StreamBufferStats {
+        self.0.marks.snapshot()
+    }
+}
+
+struct Buffered<T> {
+    item: T,
+    size: usize,
+    _permit: Option<OwnedSemaphorePermit>,
+}
+
+/// Sending half of a stream buffer
+pub struct BufferSender<T> {
+    tx: mpsc::Sender<Buffered<T>>,
+    bytes: Option<(Arc<Semaphore>, usize)>,
+    state: Arc<BufferState>,
+}
+
+/// Receiving half of a stream buffer
+pub struct BufferReceiver<T> {
+    rx: mpsc::Receiver<Buffered<T>>,
+    state: Arc<BufferState>,
+}
+
+/// Create a stream buffer; its high-water marks are also recorded in `parent` if provided
+pub fn channel<T>(
+    config: StreamBufferConfig,
+    parent: Option<Arc<HighWaterMarks>>,
+) -> (BufferSender<T>, BufferReceiver<T>) {
+    let (tx, rx) = mpsc::channel(config.capacity.max(1));
+    let state = Arc::new(BufferState {
+        items: AtomicUsize::new(0),
+        bytes: AtomicUsize::new(0),
+        marks: HighWaterMarks::default(),
+        parent,
+    });
+    let bytes = config
+        .max_bytes
+        .map(|max_bytes| (Arc::new(Semaphore::new(max_bytes)), max_bytes));
+
+    (
+        BufferSender {
+            tx,
+            bytes,
+            state: state.clone(),
+        },
+        BufferReceiver { rx, state },
+    )
+}
+
+impl<T> Clone for BufferSender<T> {
+    fn clone(&self) -> Self {
+        BufferSender {
+            tx: self.tx.clone(),
+            bytes: self.bytes.clone(),
+            state: self.state.clone(),
+        }
+    }
+}
+
+impl<T> BufferSender<T> {
+    /// Returns true if the buffer is bounded in bytes and therefore needs item sizes
+    pub fn is_bytes_bounded(&self) -> bool {
+        self.bytes.is_some()
+    }
+
+    /// Completes once the receiver was dropped
+    pub async fn closed(&self) {
+        self.tx.closed().await
+    }
+
+    /// Wait for room for an item of `size` bytes, then buffer it
+    ///
+    /// An item larger than the byte bound waits for the buffer to be empty. The item is returned
+    /// if the receiver was dropped.
+    pub async fn send(&self, item: T, size: usize) -> Result<(), T> {
+        let permit = match &self.bytes {
+            Some((semaphore, max_bytes)) => {
+                let permits = size.clamp(1, *max_bytes).min(u32::MAX as usize) as u32;
+                match semaphore.clone().acquire_many_owned(permits).await {
+                    Ok(permit) => Some(permit),
+                    Err(_) => return Err(item),
+                }
+            }
+            None => None,
+        };
+
+        let slot = match self.tx.reserve().await {
+            Ok(slot) => slot,
+            Err(_) => return Err(item),
+        };
+
+        self.state.push(size);
+        slot.send(Buffered {
+            item,
+            size,
+            _permit: permit,
+        });
+        Ok(())
+    }
+}
+
+impl<T> BufferReceiver<T> {
+    /// Receive the next item; returns `None` once the sender was dropped and the buffer is empty
+    pub async fn recv(&mut self) -> Option<T> {
+        let buffered = self.rx.recv().await?;
+        self.state.pop(buffered.size);
+        Some(buffered.item)
+    }
+
+    /// Handle on the high-water marks of this buffer
+    pub fn monitor(&self) -> BufferMonitor {
+        BufferMonitor(self.state.clone())
+    }
+
+    pub fn into_stream(self) -> impl Stream<Item = T> + Send
+    where
+        T: Send + 'static,
+    {
+        futures::stream::unfold(self, |mut rx| async move {
+            let item = rx.recv().await?;
+            Some((item, rx))
+        })
+    }
+}
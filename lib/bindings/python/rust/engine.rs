@@ -13,32 +13,384 @@
 // See the License for the specific language governing permissions and
 // limitations under the License.
 
+use std::ffi::CStr;
+use std::pin::Pin;
+use std::sync::atomic::{AtomicU64, Ordering};
 use std::sync::Arc;
+use std::time::Duration;
 
 pub use serde::{Deserialize, Serialize};
 pub use triton_distributed_runtime::{
     error,
     pipeline::{
-        async_trait, AsyncEngine, AsyncEngineContextProvider, Data, ManyOut, ResponseStream,
-        SingleIn,
+        async_trait, AsyncEngine, AsyncEngineContext, AsyncEngineContextProvider, Data, ManyOut,
+        ResponseStream, SingleIn,
     },
     protocols::annotated::Annotated,
     Error, Result,
 };
 
+use pyo3::buffer::PyBuffer;
 use pyo3::prelude::*;
-use pyo3_async_runtimes::TaskLocals;
+use pyo3::sync::GILOnceCell;
+use pyo3::types::{PyByteArray, PyBytes, PyDict, PyMemoryView};
 use pythonize::{depythonize, pythonize};
+use serde_json::value::RawValue;
 
-use tokio::sync::mpsc;
-use tokio_stream::{wrappers::ReceiverStream, StreamExt};
+use futures::FutureExt;
+use tokio::sync::{mpsc, oneshot};
+use tokio_stream::{wrappers::ReceiverStream, Stream, StreamExt};
+
+use crate::buffer::{self, BufferedSize, HighWaterMarks, StreamBufferConfig};
 
 /// Add bingings from this crate to the provided module
 pub fn add_to_module(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<PythonAsyncEngine>()?;
+    m.add_class::<IngressBatchStats>()?;
+    m.add_class::<Context>()?;
     Ok(())
 }
 
+/// Stream of items yielded by a Python async generator
+type PyItemStream = Pin<Box<dyn Stream<Item = PyResult<PyObject>> + Send>>;
+
+/// Deferred conversion of a request into a Python object; executed while holding the GIL
+type PyRequestFn = Box<dyn FnOnce(Python<'_>) -> PyResult<PyObject> + Send>;
+
+/// Default upper bound on the number of requests started under a single GIL acquisition
+pub const DEFAULT_MAX_BATCH_SIZE: usize = 256;
+
+/// Default upper bound on the number of responses converted under a single GIL acquisition
+/// when draining a python async generator
+pub const DEFAULT_MAX_DRAIN_ITEMS: usize = 64;
+
+/// Options for the batched ingress mode of the [`PythonAsyncEngine`]
+///
+/// Requests arriving within `window` of the first request of a batch are pythonized and
+/// their generators started under a single GIL acquisition. A batch is dispatched early
+/// once `max_batch_size` requests have been collected.
+#[derive(Debug, Clone, Copy)]
+pub struct BatchConfig {
+    pub window: Duration,
+    pub max_batch_size: usize,
+}
+
+/// Counters describing how many requests were handled per GIL acquisition by the
+/// batched ingress mode.
+#[derive(Debug, Default)]
+pub struct BatchCounters {
+    batches: AtomicU64,
+    requests: AtomicU64,
+    max_batch_size: AtomicU64,
+}
+
+impl BatchCounters {
+    fn record(&self, batch_size: usize) {
+        self.batches.fetch_add(1, Ordering::Relaxed);
+        self.requests
+            .fetch_add(batch_size as u64, Ordering::Relaxed);
+        self.max_batch_size
+            .fetch_max(batch_size as u64, Ordering::Relaxed);
+    }
+
+    pub fn snapshot(&self) -> IngressBatchStats {
+        IngressBatchStats {
+            batches: self.batches.load(Ordering::Relaxed),
+            requests: self.requests.load(Ordering::Relaxed),
+            max_batch_size: self.max_batch_size.load(Ordering::Relaxed),
+        }
+    }
+}
+
+/// Point-in-time view of the [`BatchCounters`] of an endpoint
+#[pyclass]
+#[derive(Debug, Clone)]
+pub struct IngressBatchStats {
+    /// Number of GIL acquisitions used to start request generators
+    #[pyo3(get)]
+    batches: u64,
+
+    /// Total number of requests started
+    #[pyo3(get)]
+    requests: u64,
+
+    /// Largest number of requests started under a single GIL acquisition
+    #[pyo3(get)]
+    max_batch_size: u64,
+}
+
+#[pymethods]
+impl IngressBatchStats {
+    /// Average number of requests started per GIL acquisition
+    fn mean_batch_size(&self) -> f64 {
+        if self.batches == 0 {
+            0.0
+        } else {
+            self.requests as f64 / self.batches as f64
+        }
+    }
+
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!(
+            "IngressBatchStats(batches={}, requests={}, max_batch_size={}, mean_batch_size={:.2})",
+            self.batches,
+            self.requests,
+            self.max_batch_size,
+            self.mean_batch_size()
+        )
+    }
+}
+
+/// Payload exchanged with python code over the request plane
+///
+/// Python objects are converted to a [`serde_json::Value`] and serialized as usual. Objects
+/// exposing the buffer protocol (`bytes`, `bytearray` and `memoryview`) are treated as
+/// pre-serialized JSON and spliced verbatim into the outgoing message, skipping the
+/// intermediate value tree on both the python and the rust side.
+#[derive(Debug, Clone)]
+pub enum PyPayload {
+    Value(serde_json::Value),
+    Raw(Box<RawValue>),
+}
+
+impl PyPayload {
+    fn from_json_bytes(bytes: Vec<u8>) -> PyResult<Self> {
+        let json = String::from_utf8(bytes).map_err(|e| {
+            pyo3::exceptions::PyValueError::new_err(format!("raw payload is not utf-8: {}", e))
+        })?;
+        let raw = RawValue::from_string(json).map_err(|e| {
+            pyo3::exceptions::PyValueError::new_err(format!("raw payload is not valid json: {}", e))
+        })?;
+        Ok(PyPayload::Raw(raw))
+    }
+}
+
+impl<'py> FromPyObject<'py> for PyPayload {
+    fn extract_bound(ob: &Bound<'py, PyAny>) -> PyResult<Self> {
+        if let Ok(bytes) = ob.downcast::<PyBytes>() {
+            return Self::from_json_bytes(bytes.as_bytes().to_vec());
+        }
+        if ob.is_instance_of::<PyMemoryView>() || ob.is_instance_of::<PyByteArray>() {
+            let buffer = PyBuffer::<u8>::get(ob)?;
+            return Self::from_json_bytes(buffer.to_vec(ob.py())?);
+        }
+        let value = depythonize::<serde_json::Value>(ob)
+            .map_err(|e| pyo3::exceptions::PyValueError::new_err(e.to_string()))?;
+        Ok(PyPayload::Value(value))
+    }
+}
+
+impl BufferedSize for PyPayload {
+    fn buffered_size(&self) -> usize {
+        match self {
+            PyPayload::Value(value) => value.buffered_size(),
+            PyPayload::Raw(raw) => raw.get().len(),
+        }
+    }
+}
+
+impl Serialize for PyPayload {
+    fn serialize<S>(&self, serializer: S) -> std::result::Result<S::Ok, S::Error>
+    where
+        S: serde::Serializer,
+    {
+        match self {
+            PyPayload::Value(value) => value.serialize(serializer),
+            PyPayload::Raw(raw) => raw.serialize(serializer),
+        }
+    }
+}
+
+/// Context of a request, handed to python handlers which accept a `context` argument
+///
+/// Stopping or killing the request also raises `asyncio.CancelledError` inside the handler's
+/// async generator, whether or not the handler accepts the context.
+#[pyclass]
+#[derive(Clone)]
+pub struct Context {
+    inner: Arc<dyn AsyncEngineContext>,
+}
+
+#[pymethods]
+impl Context {
+    /// Unique id of the request
+    fn id(&self) -> String {
+        self.inner.id().to_string()
+    }
+
+    /// Returns true if the request was asked to stop generating
+    fn is_stopped(&self) -> bool {
+        self.inner.is_stopped()
+    }
+
+    /// Returns true if the request was killed
+    fn is_killed(&self) -> bool {
+        self.inner.is_killed()
+    }
+
+    /// Awaitable which completes once the request was asked to stop generating
+    fn stopped<'p>(&self, py: Python<'p>) -> PyResult<Bound<'p, PyAny>> {
+        let inner = self.inner.clone();
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            inner.stopped().await;
+            Ok(())
+        })
+    }
+
+    /// Ask the request to stop generating
+    fn stop_generating(&self) {
+        self.inner.stop_generating();
+    }
+
+    /// Kill the request
+    fn kill(&self) {
+        self.inner.kill();
+    }
+
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!(
+            "Context(id={}, stopped={}, killed={})",
+            self.inner.id(),
+            self.inner.is_stopped(),
+            self.inner.is_killed()
+        )
+    }
+}
+
+/// Returns true if the handler declares a `context` parameter
+fn accepts_context(py: Python<'_>, generator: &PyObject) -> bool {
+    let parameters = py
+        .import("inspect")
+        .and_then(|inspect| inspect.call_method1("signature", (generator,)))
+        .and_then(|signature| signature.getattr("parameters"));
+    match parameters {
+        Ok(parameters) => parameters.contains("context").unwrap_or(false),
+        Err(_) => false,
+    }
+}
+
+/// Python code running an async generator on the event loop, see [`start_generator`]
+///
+/// The generator is driven by a single task which forwards its items to an [`ItemSender`],
+/// only yielding to the event loop to wait for room in the buffer. Cancelling the task raises
+/// `asyncio.CancelledError` inside the generator: at its innermost await while it runs, or at
+/// its `yield` while the task waits for room. The generator is closed once it stops, including
+/// when nobody is left to read its items.
+const DRIVER: &CStr = cr#"
+import asyncio
+
+
+async def drive(gen, sender):
+    try:
+        while True:
+            try:
+                item = await gen.__anext__()
+            except StopAsyncIteration:
+                return
+            try:
+                if not (sender.try_send(item) or await sender.send(item)):
+                    return
+            except asyncio.CancelledError:
+                try:
+                    await gen.athrow(asyncio.CancelledError())
+                except (StopAsyncIteration, asyncio.CancelledError):
+                    pass
+                return
+    except (Exception, asyncio.CancelledError) as e:
+        await sender.send_error(e)
+    finally:
+        sender.close()
+        try:
+            await gen.aclose()
+        except Exception:
+            pass
+"#;
+
+/// The `drive` coroutine function of [`DRIVER`], compiled once
+static DRIVE: GILOnceCell<PyObject> = GILOnceCell::new();
+
+fn drive_fn(py: Python<'_>) -> PyResult<&Bound<'_, PyAny>> {
+    DRIVE
+        .get_or_try_init(py, || {
+            let module = PyModule::from_code(
+                py,
+                DRIVER,
+                c"triton_distributed_driver.py",
+                c"triton_distributed_driver",
+            )?;
+            Ok::<_, PyErr>(module.getattr("drive")?.unbind())
+        })
+        .map(|drive| drive.bind(py))
+}
+
+/// Sending half of the stream of items yielded by a python async generator, fed by [`DRIVER`]
+#[pyclass]
+struct ItemSender {
+    tx: Option<mpsc::Sender<PyResult<PyObject>>>,
+}
+
+impl ItemSender {
+    fn send_result<'p>(
+        &self,
+        py: Python<'p>,
+        item: PyResult<PyObject>,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        let tx = self.tx.clone();
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            Ok(match tx {
+                Some(tx) => tx.send(item).await.is_ok(),
+                None => false,
+            })
+        })
+    }
+}
+
+#[pymethods]
+impl ItemSender {
+    /// Queue `item` without waiting; returns false if the buffer is full or nobody reads it
+    fn try_send(&self, item: PyObject) -> bool {
+        self.tx
+            .as_ref()
+            .is_some_and(|tx| tx.try_send(Ok(item)).is_ok())
+    }
+
+    /// Awaitable queueing `item` once there is room; resolves to false if nobody reads it
+    fn send<'p>(&self, py: Python<'p>, item: PyObject) -> PyResult<Bound<'p, PyAny>> {
+        self.send_result(py, Ok(item))
+    }
+
+    /// Awaitable queueing the exception which stopped the generator
+    fn send_error<'p>(
+        &self,
+        py: Python<'p>,
+        error: Bound<'p, PyAny>,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        self.send_result(py, Err(PyErr::from_value(error)))
+    }
+
+    /// Drop the sender; the stream ends once its remaining items are read
+    fn close(&mut self) {
+        self.tx = None;
+    }
+}
+
+/// A python async generator adapted into a rust stream
+struct StartedGenerator {
+    stream: PyItemStream,
+    /// `concurrent.futures.Future` of the task driving the generator; cancelling it cancels the task
+    task: PyObject,
+}
+
+/// A request waiting in the batched ingress queue
+struct PendingRequest {
+    request: PyRequestFn,
+    context: Option<Context>,
+    buffer: usize,
+    tx: oneshot::Sender<PyResult<StartedGenerator>>,
+}
+
 #[derive(Debug, thiserror::Error)]
 enum ResponseProcessingError {
     #[error("python exception: {0}")]
@@ -52,8 +404,6 @@ enum ResponseProcessingError {
 }
 
 // todos:
-// - [ ] enable context cancellation
-//   - this will likely require a change to the function signature python calling arguments
 // - [ ] rename `PythonAsyncEngine` to `PythonServerStreamingEngine` to be more descriptive
 // - [ ] other `AsyncEngine` implementations will have a similar pattern, i.e. one AsyncEngine
 //       implementation per struct
@@ -71,7 +421,7 @@ enum ResponseProcessingError {
 ///     def __init__(self):
 ///         self.compute_engine = make_compute_engine()
 ///
-///     def generate(self, request):
+///     def generate(self, request, context):
 ///         async generator():
 ///            async for output in self.compute_engine.generate(request):
 ///                yield output
@@ -85,11 +435,18 @@ enum ResponseProcessingError {
 ///     service.add_engine("model_name", engine)
 ///     loop.run_until_complete(service.run())
 /// ```
+///
+/// If the generator declares a `context` parameter, it is passed the [`Context`] of the request.
 #[pyclass]
 #[derive(Clone)]
 pub struct PythonAsyncEngine {
     generator: Arc<PyObject>,
     event_loop: Arc<PyObject>,
+    batcher: Option<mpsc::Sender<PendingRequest>>,
+    max_drain_items: usize,
+    accepts_context: bool,
+    stream_buffer: StreamBufferConfig,
+    stream_marks: Option<Arc<HighWaterMarks>>,
 }
 
 #[pymethods]
@@ -106,18 +463,214 @@ impl PythonAsyncEngine {
     /// and we would not know until runtime.
     #[new]
     pub fn new(generator: PyObject, event_loop: PyObject) -> PyResult<Self> {
+        let accepts_context = Python::with_gil(|py| accepts_context(py, &generator));
         Ok(PythonAsyncEngine {
             generator: Arc::new(generator),
             event_loop: Arc::new(event_loop),
+            batcher: None,
+            max_drain_items: 1,
+            accepts_context,
+            stream_buffer: StreamBufferConfig::new(
+                None,
+                None,
+                buffer::DEFAULT_ENDPOINT_STREAM_BUFFER,
+            ),
+            stream_marks: None,
+        })
+    }
+}
+
+impl PythonAsyncEngine {
+    /// Create a new instance of the PythonAsyncEngine which batches request ingress
+    ///
+    /// Rather than paying a `spawn_blocking` + GIL acquisition per request, incoming requests
+    /// are queued and a background task starts the generators of all requests collected within
+    /// [`BatchConfig::window`] under a single GIL acquisition. The number of requests handled per
+    /// acquisition is recorded in `counters`.
+    pub fn new_batched(
+        generator: PyObject,
+        event_loop: PyObject,
+        config: BatchConfig,
+        counters: Arc<BatchCounters>,
+    ) -> PyResult<Self> {
+        let accepts_context = Python::with_gil(|py| accepts_context(py, &generator));
+        let generator = Arc::new(generator);
+        let event_loop = Arc::new(event_loop);
+        let max_batch_size = config.max_batch_size.max(1);
+
+        let (tx, rx) = mpsc::channel::<PendingRequest>(max_batch_size * 2);
+
+        pyo3_async_runtimes::tokio::get_runtime().spawn(batch_ingress(
+            generator.clone(),
+            event_loop.clone(),
+            BatchConfig {
+                window: config.window,
+                max_batch_size,
+            },
+            counters,
+            rx,
+        ));
+
+        Ok(PythonAsyncEngine {
+            generator,
+            event_loop,
+            batcher: Some(tx),
+            max_drain_items: 1,
+            accepts_context,
+            stream_buffer: StreamBufferConfig::new(
+                None,
+                None,
+                buffer::DEFAULT_ENDPOINT_STREAM_BUFFER,
+            ),
+            stream_marks: None,
         })
     }
+
+    /// Enable the response drain mode
+    ///
+    /// Each time the python async generator is polled, every item it has already buffered, up to
+    /// `max_items`, is pulled and converted under a single GIL acquisition instead of paying a
+    /// `spawn_blocking` + GIL acquisition per item.
+    pub fn with_response_drain(mut self, max_items: usize) -> Self {
+        self.max_drain_items = max_items.max(1);
+        self
+    }
+
+    /// Set the bounds of the buffer holding the responses of each stream until they are sent
+    ///
+    /// The high-water marks of every stream buffer are recorded in `marks`.
+    pub fn with_stream_buffer(
+        mut self,
+        config: StreamBufferConfig,
+        marks: Arc<HighWaterMarks>,
+    ) -> Self {
+        self.stream_buffer = config;
+        self.stream_marks = Some(marks);
+        self
+    }
+}
+
+/// Call the Python generator with the request and adapt the returned async generator into a
+/// Rust stream buffering up to `buffer` items. Must be called while holding the GIL.
+///
+/// The async generator is driven by a single task on the event loop, see [`DRIVER`].
+fn start_generator(
+    py: Python<'_>,
+    generator: &PyObject,
+    event_loop: &Arc<PyObject>,
+    py_request: PyObject,
+    context: Option<Context>,
+    buffer: usize,
+) -> PyResult<StartedGenerator> {
+    let gen = match context {
+        Some(context) => {
+            let kwargs = PyDict::new(py);
+            kwargs.set_item("context", context)?;
+            generator.call(py, (py_request,), Some(&kwargs))?
+        }
+        None => generator.call1(py, (py_request,))?,
+    };
+    let (tx, rx) = mpsc::channel(buffer.max(1));
+    let sender = ItemSender { tx: Some(tx) };
+    let drive = drive_fn(py)?.call1((gen, sender))?;
+    let task = py
+        .import("asyncio")?
+        .call_method1("run_coroutine_threadsafe", (drive, event_loop.bind(py)))?
+        .unbind();
+    Ok(StartedGenerator {
+        stream: Box::pin(ReceiverStream::new(rx)),
+        task,
+    })
+}
+
+/// Raise `asyncio.CancelledError` inside the python async generator
+///
+/// Cancelling the future returned by `run_coroutine_threadsafe` schedules the cancellation of
+/// its task on the event loop thread.
+async fn cancel_generator(task: PyObject) {
+    // see [`PythonAsyncEngine::generate`] for why the GIL is acquired on a blocking thread
+    let result = tokio::task::spawn_blocking(move || {
+        Python::with_gil(|py| task.call_method0(py, "cancel").map(|_| ()))
+    })
+    .await;
+
+    match result {
+        Ok(Ok(())) => {}
+        Ok(Err(e)) => tracing::warn!("failed to cancel python async generator: {}", e),
+        Err(e) => tracing::warn!("failed to cancel python async generator: {}", e),
+    }
+}
+
+/// Background task of the batched ingress mode
+///
+/// Waits for a request, then keeps collecting requests until either the batch window elapses or
+/// the batch is full. The whole batch is then started under a single GIL acquisition and each
+/// resulting stream is handed back to its requestor.
+async fn batch_ingress(
+    generator: Arc<PyObject>,
+    event_loop: Arc<PyObject>,
+    config: BatchConfig,
+    counters: Arc<BatchCounters>,
+    mut rx: mpsc::Receiver<PendingRequest>,
+) {
+    while let Some(first) = rx.recv().await {
+        let mut batch = Vec::with_capacity(config.max_batch_size);
+        batch.push(first);
+
+        let deadline = tokio::time::Instant::now() + config.window;
+        while batch.len() < config.max_batch_size {
+            match tokio::time::timeout_at(deadline, rx.recv()).await {
+                Ok(Some(pending)) => batch.push(pending),
+                Ok(None) | Err(_) => break,
+            }
+        }
+
+        let batch_size = batch.len();
+        counters.record(batch_size);
+        tracing::trace!(batch_size, "starting batch of python async generators");
+
+        let generator = generator.clone();
+        let event_loop = event_loop.clone();
+
+        // see [`PythonAsyncEngine::generate`] for why the GIL is acquired on a blocking thread
+        let result = tokio::task::spawn_blocking(move || {
+            Python::with_gil(|py| {
+                for pending in batch {
+                    let started = (pending.request)(py).and_then(|py_request| {
+                        start_generator(
+                            py,
+                            &generator,
+                            &event_loop,
+                            py_request,
+                            pending.context,
+                            pending.buffer,
+                        )
+                    });
+                    if let Err(started) = pending.tx.send(started) {
+                        tracing::trace!("requestor dropped before its generator was started");
+                        if let Ok(started) = started {
+                            let _ = started.task.call_method0(py, "cancel");
+                        }
+                    }
+                }
+            })
+        })
+        .await;
+
+        // dropping the pending senders on failure surfaces an error to each requestor
+        if let Err(e) = result {
+            tracing::error!("failed to start batch of python async generators: {}", e);
+        }
+    }
+
+    tracing::debug!("batched ingress task shutting down");
 }
 
 #[async_trait]
 impl<Req, Resp> AsyncEngine<SingleIn<Req>, ManyOut<Annotated<Resp>>, Error> for PythonAsyncEngine
 where
     Req: Data + Serialize,
-    Resp: Data + for<'de> Deserialize<'de>,
+    Resp: Data + BufferedSize + for<'py> FromPyObject<'py>,
 {
     async fn generate(&self, request: SingleIn<Req>) -> Result<ManyOut<Annotated<Resp>>, Error> {
         // Create a context
@@ -129,11 +682,18 @@ where
 
         // Clone the PyObject to move into the thread
 
-        // Create a channel to communicate between the Python thread and the Rust async context
-        let (tx, rx) = mpsc::channel::<Annotated<Resp>>(128);
+        // Create a buffer to communicate between the Python thread and the Rust async context
+        let (tx, rx) =
+            buffer::channel::<Annotated<Resp>>(self.stream_buffer, self.stream_marks.clone());
 
         let generator = self.generator.clone();
         let event_loop = self.event_loop.clone();
+        let max_drain_items = self.max_drain_items;
+        let py_context = if self.accepts_context {
+            Some(Context { inner: ctx.clone() })
+        } else {
+            None
+        };
 
         // Acquiring the GIL is similar to acquiring a standard lock/mutex
         // Performing this in an tokio async task could block the thread for an undefined amount of time
@@ -145,17 +705,46 @@ where
         //
         // Since we cannot predict the GIL contention, we will always use the blocking task and pay the
         // cost. The Python GIL is the gift that keeps on giving -- performance hits...
-        let stream = tokio::task::spawn_blocking(move || {
-            Python::with_gil(|py| {
-                let py_request = pythonize(py, &request)?;
-                let gen = generator.call1(py, (py_request,))?;
-                let locals = TaskLocals::new(event_loop.bind(py).clone());
-                pyo3_async_runtimes::tokio::into_stream_with_locals_v1(locals, gen.into_bound(py))
-            })
-        })
-        .await??;
-
-        let stream = Box::pin(stream);
+        //
+        // In batched mode, the cost of the blocking task and the GIL acquisition is amortized across
+        // all the requests collected by the batched ingress task.
+        let started = match &self.batcher {
+            Some(batcher) => {
+                let (stream_tx, stream_rx) = oneshot::channel();
+                let pending = PendingRequest {
+                    request: Box::new(move |py: Python<'_>| -> PyResult<PyObject> {
+                        Ok(pythonize(py, &request)?.unbind())
+                    }),
+                    context: py_context,
+                    buffer: max_drain_items,
+                    tx: stream_tx,
+                };
+                batcher
+                    .send(pending)
+                    .await
+                    .map_err(|_| error!("batched ingress task is not running"))?;
+                stream_rx
+                    .await
+                    .map_err(|_| error!("batched ingress task dropped the request"))??
+            }
+            None => {
+                tokio::task::spawn_blocking(move || {
+                    Python::with_gil(|py| {
+                        let py_request = pythonize(py, &request)?.unbind();
+                        start_generator(
+                            py,
+                            &generator,
+                            &event_loop,
+                            py_request,
+                            py_context,
+                            max_drain_items,
+                        )
+                    })
+                })
+                .await??
+            }
+        };
+        let StartedGenerator { stream, task } = started;
 
         // process the stream
         // any error thrown in the stream will be caught and complete the processing task
@@ -171,94 +760,160 @@ where
 
             let mut stream = stream;
             let mut count = 0;
+            let mut exhausted = false;
+            let mut cancel = false;
+
+            'outer: loop {
+                let item = tokio::select! {
+                    biased;
+                    _ = ctx.stopped() => {
+                        tracing::debug!(request_id, "request stopped; cancelling python async generator");
+                        cancel = true;
+                        break 'outer;
+                    }
+                    item = stream.next() => match item {
+                        Some(item) => item,
+                        None => break 'outer,
+                    },
+                };
+
+                // in drain mode, pull every item the python async generator has already buffered
+                // so that they can all be converted under a single GIL acquisition
+                let mut items = vec![item];
+                while items.len() < max_drain_items {
+                    match stream.next().now_or_never() {
+                        Some(Some(item)) => items.push(item),
+                        Some(None) => {
+                            exhausted = true;
+                            break;
+                        }
+                        None => break,
+                    }
+                }
 
-            while let Some(item) = stream.next().await {
-                count += 1;
+                count += items.len();
                 tracing::trace!(
                     request_id,
-                    "processing the {}th item from python async generator",
+                    "processing {} item(s) from python async generator; {} in total",
+                    items.len(),
                     count
                 );
 
-                let mut done = false;
-
-                let response = match process_item::<Resp>(item).await {
-                    Ok(response) => response,
-                    Err(e) => {
-                        done = true;
-
-                        let msg = match &e {
-                            ResponseProcessingError::DeserializeError(e) => {
-                                // tell the python async generator to stop generating
-                                // right now, this is impossible as we are not passing the context to the python async generator
-                                // todo: add task-local context to the python async generator
-                                // see: https://github.com/triton-inference-server/triton_distributed/issues/130
-                                ctx.stop_generating();
-                                let msg = format!("critical error: invalid response object from python async generator; application-logic-mismatch: {}", e);
-                                tracing::error!(request_id, "{}", msg);
-                                msg
-                            }
-                            ResponseProcessingError::PythonException(e) => {
-                                let msg = format!("a python exception was caught while processing the async generator: {}", e);
-                                tracing::warn!(request_id, "{}", msg);
-                                msg
-                            }
-                            ResponseProcessingError::OffloadError(e) => {
-                                let msg = format!("critical error: failed to offload the python async generator to a new thread: {}", e);
-                                tracing::error!(request_id, "{}", msg);
-                                msg
-                            }
-                        };
-
-                        Annotated::from_error(msg)
+                for response in process_items::<Resp>(items).await {
+                    let mut done = false;
+
+                    let response = match response {
+                        Ok(response) => response,
+                        Err(e) => {
+                            done = true;
+
+                            let msg = match &e {
+                                ResponseProcessingError::DeserializeError(e) => {
+                                    // tell the python async generator to stop generating
+                                    ctx.stop_generating();
+                                    cancel = true;
+                                    let msg = format!("critical error: invalid response object from python async generator; application-logic-mismatch: {}", e);
+                                    tracing::error!(request_id, "{}", msg);
+                                    msg
+                                }
+                                ResponseProcessingError::PythonException(e) => {
+                                    let msg = format!("a python exception was caught while processing the async generator: {}", e);
+                                    tracing::warn!(request_id, "{}", msg);
+                                    msg
+                                }
+                                ResponseProcessingError::OffloadError(e) => {
+                                    let msg = format!("critical error: failed to offload the python async generator to a new thread: {}", e);
+                                    tracing::error!(request_id, "{}", msg);
+                                    msg
+                                }
+                            };
+
+                            Annotated::from_error(msg)
+                        }
+                    };
+
+                    let size = if tx.is_bytes_bounded() {
+                        response.buffered_size()
+                    } else {
+                        0
+                    };
+
+                    if tx.send(response, size).await.is_err() {
+                        tracing::trace!(
+                            request_id,
+                            "error forwarding annotated response to channel; channel is closed"
+                        );
+                        // nobody is left to read the responses
+                        ctx.stop_generating();
+                        cancel = true;
+                        break 'outer;
                     }
-                };
 
-                if tx.send(response).await.is_err() {
-                    tracing::trace!(
-                        request_id,
-                        "error forwarding annotated response to channel; channel is closed"
-                    );
-                    break;
+                    if done {
+                        tracing::debug!(
+                            request_id,
+                            "early termination of python async generator stream task"
+                        );
+                        break 'outer;
+                    }
                 }
 
-                if done {
-                    tracing::debug!(
-                        request_id,
-                        "early termination of python async generator stream task"
-                    );
+                if exhausted {
                     break;
                 }
             }
 
+            if cancel {
+                cancel_generator(task).await;
+            }
+
             tracing::debug!(
                 request_id,
                 "finished processing python async generator stream"
             );
         });
 
-        let stream = ReceiverStream::new(rx);
-
-        Ok(ResponseStream::new(Box::pin(stream), context.context()))
+        Ok(ResponseStream::new(
+            Box::pin(rx.into_stream()),
+            context.context(),
+        ))
     }
 }
 
-async fn process_item<Resp>(
-    item: Result<Py<PyAny>, PyErr>,
-) -> Result<Annotated<Resp>, ResponseProcessingError>
+/// Convert a batch of items yielded by the python async generator under a single GIL acquisition.
+///
+/// Conversion stops at the first error, which is returned as the last element.
+async fn process_items<Resp>(
+    items: Vec<Result<Py<PyAny>, PyErr>>,
+) -> Vec<Result<Annotated<Resp>, ResponseProcessingError>>
 where
-    Resp: Data + for<'de> Deserialize<'de>,
+    Resp: Data + for<'py> FromPyObject<'py>,
 {
-    let item = item.map_err(|e| ResponseProcessingError::PythonException(e.to_string()))?;
-
-    let response = tokio::task::spawn_blocking(move || {
-        Python::with_gil(|py| depythonize::<Resp>(&item.into_bound(py)))
+    let responses = tokio::task::spawn_blocking(move || {
+        Python::with_gil(|py| {
+            let mut responses = Vec::with_capacity(items.len());
+            for item in items {
+                let response = item
+                    .map_err(|e| ResponseProcessingError::PythonException(e.to_string()))
+                    .and_then(|item| {
+                        Resp::extract_bound(&item.into_bound(py))
+                            .map_err(|e| ResponseProcessingError::DeserializeError(e.to_string()))
+                    })
+                    .map(Annotated::from_data);
+
+                let is_err = response.is_err();
+                responses.push(response);
+                if is_err {
+                    break;
+                }
+            }
+            responses
+        })
     })
-    .await
-    .map_err(|e| ResponseProcessingError::OffloadError(e.to_string()))?
-    .map_err(|e| ResponseProcessingError::DeserializeError(e.to_string()))?;
+    .await;
 
-    let response = Annotated::from_data(response);
-
-    Ok(response)
+    match responses {
+        Ok(responses) => responses,
+        Err(e) => vec![Err(ResponseProcessingError::OffloadError(e.to_string()))],
+    }
 }
@@ -15,29 +15,36 @@
 
 use futures::StreamExt;
 use once_cell::sync::OnceCell;
-use pyo3::exceptions::PyStopAsyncIteration;
-use pyo3::types::PyString;
+use pyo3::exceptions::{PyStopAsyncIteration, PyValueError};
+use pyo3::types::{PyBytes, PyString};
 use pyo3::IntoPyObjectExt;
 use pyo3::{exceptions::PyException, prelude::*};
 use rs::pipeline::network::Ingress;
-use std::{fmt::Display, sync::Arc};
+use serde_json::value::RawValue;
+use std::{collections::HashMap, fmt::Display, sync::Arc, time::Duration};
 use tokio::sync::Mutex;
 use tracing_subscriber::FmtSubscriber;
 
 use triton_distributed_runtime::{
     self as rs,
-    pipeline::{EngineStream, ManyOut, SingleIn},
+    pipeline::{AsyncEngineContextProvider, EngineStream, ManyOut, SingleIn},
     protocols::annotated::Annotated as RsAnnotated,
     traits::DistributedRuntimeProvider,
 };
 
 use triton_distributed_llm::{self as llm_rs};
 
+mod buffer;
 mod engine;
 mod llm;
+mod routing;
 
 type JsonServerStreamingIngress =
-    Ingress<SingleIn<serde_json::Value>, ManyOut<RsAnnotated<serde_json::Value>>>;
+    Ingress<SingleIn<serde_json::Value>, ManyOut<RsAnnotated<engine::PyPayload>>>;
+
+/// Responses are decoded lazily; the data field is kept as raw JSON until it is either
+/// handed to python as `bytes` or converted into python objects.
+type RawResponse = RsAnnotated<Box<RawValue>>;
 
 static INIT: OnceCell<()> = OnceCell::new();
 
@@ -63,10 +70,22 @@ fn _core(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<Endpoint>()?;
     m.add_class::<Client>()?;
     m.add_class::<AsyncResponseStream>()?;
+    m.add_class::<AsyncMultiResponseStream>()?;
     m.add_class::<llm::kv::KvRouter>()?;
+    m.add_class::<llm::kv::OverlapScores>()?;
+    m.add_class::<llm::kv::WorkerSnapshot>()?;
+    m.add_class::<llm::kv::AdmissionStats>()?;
+    m.add_class::<llm::kv::IndexerLag>()?;
+    m.add_class::<llm::kv::SequenceHasher>()?;
+    m.add_function(wrap_pyfunction!(llm::kv::compute_block_hashes, m)?)?;
+    m.add(
+        "OverloadedError",
+        m.py().get_type::<llm::kv::OverloadedError>(),
+    )?;
     m.add_class::<llm::kv::KvMetricsPublisher>()?;
 
     engine::add_to_module(m)?;
+    buffer::add_to_module(m)?;
 
     Ok(())
 }
@@ -110,12 +129,17 @@ struct Component {
 struct Endpoint {
     inner: rs::component::Endpoint,
     event_loop: PyObject,
+    batch_counters: Arc<engine::BatchCounters>,
+    stream_marks: Arc<buffer::HighWaterMarks>,
 }
 
 #[pyclass]
 #[derive(Clone)]
 struct Client {
-    inner: rs::component::Client<serde_json::Value, serde_json::Value>,
+    inner: rs::component::Client<engine::PyPayload, RawResponse>,
+    stream_buffer: buffer::StreamBufferConfig,
+    stream_marks: Arc<buffer::HighWaterMarks>,
+    router: routing::Router,
 }
 
 #[pymethods]
@@ -190,6 +214,8 @@ impl Component {
         Ok(Endpoint {
             inner,
             event_loop: self.event_loop.clone(),
+            batch_counters: Arc::new(engine::BatchCounters::default()),
+            stream_marks: Arc::new(buffer::HighWaterMarks::default()),
         })
     }
 
@@ -208,15 +234,54 @@ impl Component {
 
 #[pymethods]
 impl Endpoint {
+    /// Serve the endpoint with the given Python async generator.
+    ///
+    /// If `batch_window_us` is set, requests arriving within the window are started under a
+    /// single GIL acquisition, up to `max_batch_size` requests per acquisition.
+    ///
+    /// If `drain_responses` is set, all responses already buffered by the generator are
+    /// converted under a single GIL acquisition.
+    ///
+    /// The responses of each stream are buffered until they are sent, up to `stream_buffer`
+    /// responses and, if set, `stream_buffer_bytes` bytes.
+    #[pyo3(signature = (generator, batch_window_us=None, max_batch_size=None, drain_responses=false, stream_buffer=None, stream_buffer_bytes=None))]
+    #[allow(clippy::too_many_arguments)]
     fn serve_endpoint<'p>(
         &self,
         py: Python<'p>,
         generator: PyObject,
+        batch_window_us: Option<u64>,
+        max_batch_size: Option<usize>,
+        drain_responses: bool,
+        stream_buffer: Option<usize>,
+        stream_buffer_bytes: Option<usize>,
     ) -> PyResult<Bound<'p, PyAny>> {
-        let engine = Arc::new(engine::PythonAsyncEngine::new(
-            generator,
-            self.event_loop.clone(),
-        )?);
+        let engine = match batch_window_us {
+            Some(window) => engine::PythonAsyncEngine::new_batched(
+                generator,
+                self.event_loop.clone(),
+                engine::BatchConfig {
+                    window: Duration::from_micros(window),
+                    max_batch_size: max_batch_size.unwrap_or(engine::DEFAULT_MAX_BATCH_SIZE),
+                },
+                self.batch_counters.clone(),
+            )?,
+            None => engine::PythonAsyncEngine::new(generator, self.event_loop.clone())?,
+        };
+        let engine = if drain_responses {
+            engine.with_response_drain(engine::DEFAULT_MAX_DRAIN_ITEMS)
+        } else {
+            engine
+        };
+        let engine = engine.with_stream_buffer(
+            buffer::StreamBufferConfig::new(
+                stream_buffer,
+                stream_buffer_bytes,
+                buffer::DEFAULT_ENDPOINT_STREAM_BUFFER,
+            ),
+            self.stream_marks.clone(),
+        );
+        let engine = Arc::new(engine);
         let ingress = JsonServerStreamingIngress::for_engine(engine).map_err(to_pyerr)?;
         let builder = self.inner.endpoint_builder().handler(ingress);
         pyo3_async_runtimes::tokio::future_into_py(py, async move {
@@ -225,20 +290,60 @@ impl Endpoint {
         })
     }
 
-    fn client<'p>(&self, py: Python<'p>) -> PyResult<Bound<'p, PyAny>> {
+    /// Create a client; the responses of each stream are buffered until they are consumed, up to
+    /// `stream_buffer` responses and, if set, `stream_buffer_bytes` bytes.
+    ///
+    /// If `load_weight` is set, the client follows the forward pass metrics published by the
+    /// instances of the component, and the `least_inflight` and `power_of_two` strategies add
+    /// the utilization of an instance, between 0 and 1, scaled by `load_weight` to its number of
+    /// in-flight streams.
+    #[pyo3(signature = (stream_buffer=None, stream_buffer_bytes=None, load_weight=None))]
+    fn client<'p>(
+        &self,
+        py: Python<'p>,
+        stream_buffer: Option<usize>,
+        stream_buffer_bytes: Option<usize>,
+        load_weight: Option<f64>,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        if load_weight.is_some_and(|weight| !weight.is_finite() || weight < 0.0) {
+            return Err(PyValueError::new_err(
+                "load_weight must be a non-negative number",
+            ));
+        }
         let inner = self.inner.clone();
+        let stream_buffer = buffer::StreamBufferConfig::new(
+            stream_buffer,
+            stream_buffer_bytes,
+            buffer::DEFAULT_CLIENT_STREAM_BUFFER,
+        );
         pyo3_async_runtimes::tokio::future_into_py(py, async move {
             let client = inner
-                .client::<serde_json::Value, serde_json::Value>()
+                .client::<engine::PyPayload, RawResponse>()
                 .await
                 .map_err(to_pyerr)?;
-            Ok(Client { inner: client })
+            let load = load_weight.map(|_| routing::watch_load_metrics(inner.component()));
+            Ok(Client {
+                inner: client,
+                stream_buffer,
+                stream_marks: Arc::new(buffer::HighWaterMarks::default()),
+                router: routing::Router::new(load, load_weight.unwrap_or(0.0)),
+            })
         })
     }
 
     fn lease_id(&self) -> i64 {
         self.inner.drt().primary_lease().id()
     }
+
+    /// Number of requests started per GIL acquisition by the batched ingress mode
+    fn ingress_batch_stats(&self) -> engine::IngressBatchStats {
+        self.batch_counters.snapshot()
+    }
+
+    /// High-water marks across the response buffers of all the streams served by this endpoint
+    fn stream_buffer_stats(&self) -> buffer::StreamBufferStats {
+        self.stream_marks.snapshot()
+    }
 }
 
 #[pymethods]
@@ -259,6 +364,11 @@ impl Client {
         self.inner.endpoint_ids().borrow().clone()
     }
 
+    /// High-water marks across the response buffers of all the streams issued by this client
+    fn stream_buffer_stats(&self) -> buffer::StreamBufferStats {
+        self.stream_marks.snapshot()
+    }
+
     fn wait_for_endpoints<'p>(&self, py: Python<'p>) -> PyResult<Bound<'p, PyAny>> {
         let inner = self.inner.clone();
         pyo3_async_runtimes::tokio::future_into_py(py, async move {
@@ -266,127 +376,291 @@ impl Client {
         })
     }
 
-    /// Issue a request to the endpoint using the default routing strategy.
-    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING))]
+    /// Number of streams issued by this client that are still in flight, per instance
+    fn inflight(&self) -> HashMap<i64, usize> {
+        self.router.inflight().snapshot()
+    }
+
+    /// Issue a request to the endpoint, routed according to `strategy`.
+    ///
+    /// The strategy is one of `random` (the default), `round_robin`, `least_inflight`,
+    /// `power_of_two` or `direct`, which requires `endpoint_id`.
+    ///
+    /// `bytes`, `bytearray` and `memoryview` requests are sent verbatim as pre-serialized JSON.
+    /// If `raw` is set, the data of each response is returned as the `bytes` of its JSON
+    /// encoding instead of being converted into python objects.
+    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING, raw=false, strategy="random", endpoint_id=None))]
     fn generate<'p>(
         &self,
         py: Python<'p>,
         request: PyObject,
         annotated: Option<bool>,
+        raw: bool,
+        strategy: &str,
+        endpoint_id: Option<i64>,
     ) -> PyResult<Bound<'p, PyAny>> {
-        self.random(py, request, annotated)
+        let strategy = routing::RoutingStrategy::parse(strategy, endpoint_id)?;
+        self.issue(py, request, strategy, annotated, raw)
     }
 
     /// Send a request to the next endpoint in a round-robin fashion.
-    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING))]
+    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING, raw=false))]
     fn round_robin<'p>(
         &self,
         py: Python<'p>,
         request: PyObject,
         annotated: Option<bool>,
+        raw: bool,
     ) -> PyResult<Bound<'p, PyAny>> {
-        let request: serde_json::Value = pythonize::depythonize(&request.into_bound(py))?;
-        let annotated = annotated.unwrap_or(false);
-
-        let (tx, rx) = tokio::sync::mpsc::channel(32);
-        let client = self.inner.clone();
-
-        pyo3_async_runtimes::tokio::future_into_py(py, async move {
-            let stream = client.round_robin(request.into()).await.map_err(to_pyerr)?;
-            tokio::spawn(process_stream(stream, tx));
-            Ok(AsyncResponseStream {
-                rx: Arc::new(Mutex::new(rx)),
-                annotated,
-            })
-        })
+        self.issue(
+            py,
+            request,
+            routing::RoutingStrategy::RoundRobin,
+            annotated,
+            raw,
+        )
     }
 
     /// Send a request to a random endpoint.
-    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING))]
+    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING, raw=false))]
     fn random<'p>(
         &self,
         py: Python<'p>,
         request: PyObject,
         annotated: Option<bool>,
+        raw: bool,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        self.issue(
+            py,
+            request,
+            routing::RoutingStrategy::Random,
+            annotated,
+            raw,
+        )
+    }
+
+    /// Send a request to the endpoint with the fewest streams in flight from this client.
+    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING, raw=false))]
+    fn least_inflight<'p>(
+        &self,
+        py: Python<'p>,
+        request: PyObject,
+        annotated: Option<bool>,
+        raw: bool,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        self.issue(
+            py,
+            request,
+            routing::RoutingStrategy::LeastInflight,
+            annotated,
+            raw,
+        )
+    }
+
+    /// Send a request to the less loaded of two endpoints picked at random.
+    #[pyo3(signature = (request, annotated=DEFAULT_ANNOTATED_SETTING, raw=false))]
+    fn power_of_two<'p>(
+        &self,
+        py: Python<'p>,
+        request: PyObject,
+        annotated: Option<bool>,
+        raw: bool,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        self.issue(
+            py,
+            request,
+            routing::RoutingStrategy::PowerOfTwo,
+            annotated,
+            raw,
+        )
+    }
+
+    /// Directly send a request to a specific endpoint.
+    #[pyo3(signature = (request, endpoint_id, annotated=DEFAULT_ANNOTATED_SETTING, raw=false))]
+    fn direct<'p>(
+        &self,
+        py: Python<'p>,
+        request: PyObject,
+        endpoint_id: i64,
+        annotated: Option<bool>,
+        raw: bool,
     ) -> PyResult<Bound<'p, PyAny>> {
-        let request: serde_json::Value = pythonize::depythonize(&request.into_bound(py))?;
+        self.issue(
+            py,
+            request,
+            routing::RoutingStrategy::Direct(endpoint_id),
+            annotated,
+            raw,
+        )
+    }
+
+    /// Issue a batch of requests with a single call.
+    ///
+    /// Each request is routed according to `strategy`, as in [`Client::generate`], with at most
+    /// `max_inflight` requests in flight if set.
+    /// The responses of all the streams are multiplexed into a single async iterator of
+    /// `(index, response)` tuples, where `index` is the position of the request in `requests`.
+    #[pyo3(signature = (requests, strategy="random", endpoint_id=None, max_inflight=None, annotated=DEFAULT_ANNOTATED_SETTING, raw=false))]
+    #[allow(clippy::too_many_arguments)]
+    fn generate_many<'p>(
+        &self,
+        py: Python<'p>,
+        requests: &Bound<'p, PyAny>,
+        strategy: &str,
+        endpoint_id: Option<i64>,
+        max_inflight: Option<usize>,
+        annotated: Option<bool>,
+        raw: bool,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        let strategy = routing::RoutingStrategy::parse(strategy, endpoint_id)?;
+        let requests = requests
+            .try_iter()?
+            .map(|request| request?.extract::<engine::PyPayload>())
+            .collect::<PyResult<Vec<_>>>()?;
         let annotated = annotated.unwrap_or(false);
 
-        let (tx, rx) = tokio::sync::mpsc::channel(32);
+        let (tx, rx) = buffer::channel(self.stream_buffer, Some(self.stream_marks.clone()));
         let client = self.inner.clone();
+        let router = self.router.clone();
+        let limiter = max_inflight.map(|limit| Arc::new(tokio::sync::Semaphore::new(limit.max(1))));
 
         pyo3_async_runtimes::tokio::future_into_py(py, async move {
-            let stream = client.random(request.into()).await.map_err(to_pyerr)?;
-            tokio::spawn(process_stream(stream, tx));
-            Ok(AsyncResponseStream {
-                rx: Arc::new(Mutex::new(rx)),
-                annotated,
-            })
+            for (index, request) in requests.into_iter().enumerate() {
+                let client = client.clone();
+                let router = router.clone();
+                let tx = tx.clone();
+                let limiter = limiter.clone();
+                tokio::spawn(async move {
+                    let _permit = match limiter {
+                        Some(limiter) => match limiter.acquire_owned().await {
+                            Ok(permit) => Some(permit),
+                            Err(_) => return,
+                        },
+                        None => None,
+                    };
+                    match router.route(&client, strategy, request).await {
+                        Ok((stream, _guard)) => {
+                            process_stream(stream, tx, raw, move |annotated| (index, annotated))
+                                .await
+                        }
+                        Err(e) => {
+                            let error = RsAnnotated::from_error(e.to_string());
+                            if tx.send((index, error), 0).await.is_err() {
+                                tracing::trace!(index, "multiplexed stream dropped");
+                            }
+                        }
+                    }
+                });
+            }
+            Ok(AsyncMultiResponseStream::new(rx, annotated))
         })
     }
+}
 
-    /// Directly send a request to a specific endpoint.
-    #[pyo3(signature = (request, endpoint_id, annotated=DEFAULT_ANNOTATED_SETTING))]
-    fn direct<'p>(
+impl Client {
+    /// Issue a single request routed according to `strategy`; the stream counts as in flight on
+    /// the selected instance until it is fully consumed or dropped
+    fn issue<'p>(
         &self,
         py: Python<'p>,
         request: PyObject,
-        endpoint_id: i64,
+        strategy: routing::RoutingStrategy,
         annotated: Option<bool>,
+        raw: bool,
     ) -> PyResult<Bound<'p, PyAny>> {
-        let request: serde_json::Value = pythonize::depythonize(&request.into_bound(py))?;
+        let request: engine::PyPayload = request.extract(py)?;
         let annotated = annotated.unwrap_or(false);
 
-        let (tx, rx) = tokio::sync::mpsc::channel(32);
+        let (tx, rx) = buffer::channel(self.stream_buffer, Some(self.stream_marks.clone()));
         let client = self.inner.clone();
+        let router = self.router.clone();
 
         pyo3_async_runtimes::tokio::future_into_py(py, async move {
-            let stream = client
-                .direct(request.into(), endpoint_id)
+            let (stream, guard) = router
+                .route(&client, strategy, request)
                 .await
                 .map_err(to_pyerr)?;
 
-            tokio::spawn(process_stream(stream, tx));
+            tokio::spawn(async move {
+                process_stream(stream, tx, raw, |annotated| annotated).await;
+                drop(guard);
+            });
 
-            Ok(AsyncResponseStream {
-                rx: Arc::new(Mutex::new(rx)),
-                annotated,
-            })
+            Ok(AsyncResponseStream::new(rx, annotated))
         })
     }
 }
 
-async fn process_stream(
-    stream: EngineStream<serde_json::Value>,
-    tx: tokio::sync::mpsc::Sender<RsAnnotated<PyObject>>,
-) {
+/// Convert each response of the stream into python objects and forward them to `tx`, tagged by
+/// `tag`; the stream ends after the first error
+///
+/// Returns early, stopping the request, once nobody reads `tx` or the request was stopped, so
+/// that the caller can release the stream's in-flight guard without waiting for the upstream.
+async fn process_stream<T, F>(
+    stream: EngineStream<RawResponse>,
+    tx: buffer::BufferSender<T>,
+    raw: bool,
+    tag: F,
+) where
+    T: std::fmt::Debug,
+    F: Fn(RsAnnotated<PyObject>) -> T,
+{
     let mut stream = stream;
-    while let Some(response) = stream.next().await {
-        // Convert the response to a PyObject using Python's GIL
-        // TODO: Remove the clone, but still log the full JSON string on error. But how?
-        let annotated: RsAnnotated<serde_json::Value> = match serde_json::from_value(
-            response.clone(),
-        ) {
-            Ok(a) => a,
-            Err(err) => {
-                tracing::error!(%err, %response, "process_stream: Failed de-serializing JSON into RsAnnotated");
+    let context = stream.context();
+    loop {
+        let annotated = tokio::select! {
+            biased;
+            _ = tx.closed() => {
+                tracing::trace!(
+                    request_id = context.id(),
+                    "response stream dropped; stopping the request"
+                );
+                context.stop_generating();
                 break;
             }
+            _ = context.stopped() => {
+                tracing::trace!(request_id = context.id(), "request stopped");
+                break;
+            }
+            annotated = stream.next() => match annotated {
+                Some(annotated) => annotated,
+                None => break,
+            },
         };
 
+        let size = annotated
+            .data
+            .as_ref()
+            .map(|data| data.get().len())
+            .unwrap_or(0);
+
+        // Convert the response to a PyObject using Python's GIL
         let annotated: RsAnnotated<PyObject> = annotated.map_data(|data| {
-            let result = Python::with_gil(|py| match pythonize::pythonize(py, &data) {
+            if raw {
+                return Ok(Python::with_gil(|py| {
+                    PyBytes::new(py, data.get().as_bytes()).into_any().unbind()
+                }));
+            }
+            let value: serde_json::Value = match serde_json::from_str(data.get()) {
+                Ok(value) => value,
+                Err(err) => {
+                    tracing::error!(%err, data = data.get(), "process_stream: Failed de-serializing response data");
+                    return Err(err.to_string());
+                }
+            };
+            Python::with_gil(|py| match pythonize::pythonize(py, &value) {
                 Ok(pyobj) => Ok(pyobj.into()),
                 Err(e) => Err(e.to_string()),
-            });
-            result
+            })
         });
 
         let is_error = annotated.is_error();
 
-        // Send the PyObject through the channel or log an error
-        if let Err(e) = tx.send(annotated).await {
-            tracing::error!("Failed to send response: {:?}", e);
+        // Send the PyObject through the channel or stop the request if nobody reads it
+        if let Err(e) = tx.send(tag(annotated), size).await {
+            tracing::trace!("response stream dropped; stopping the request: {:?}", e);
+            context.stop_generating();
+            break;
         }
 
         if is_error {
@@ -397,12 +671,28 @@ async fn process_stream(
 
 #[pyclass]
 struct AsyncResponseStream {
-    rx: Arc<Mutex<tokio::sync::mpsc::Receiver<RsAnnotated<PyObject>>>>,
+    rx: Arc<Mutex<buffer::BufferReceiver<RsAnnotated<PyObject>>>>,
+    monitor: buffer::BufferMonitor,
     annotated: bool,
 }
 
+impl AsyncResponseStream {
+    fn new(rx: buffer::BufferReceiver<RsAnnotated<PyObject>>, annotated: bool) -> Self {
+        AsyncResponseStream {
+            monitor: rx.monitor(),
+            rx: Arc::new(Mutex::new(rx)),
+            annotated,
+        }
+    }
+}
+
 #[pymethods]
 impl AsyncResponseStream {
+    /// High-water marks of the response buffer of this stream
+    fn buffer_stats(&self) -> buffer::StreamBufferStats {
+        self.monitor.stats()
+    }
+
     /// This method is required to implement the `AsyncIterator` protocol.
     #[pyo3(name = "__aiter__")]
     fn aiter(slf: PyRef<Self>, py: Python) -> PyResult<Py<PyAny>> {
@@ -445,6 +735,78 @@ impl AsyncResponseStream {
     }
 }
 
+/// Responses of the requests of [`Client::generate_many`], tagged with the index of their request
+#[pyclass]
+struct AsyncMultiResponseStream {
+    rx: Arc<Mutex<buffer::BufferReceiver<(usize, RsAnnotated<PyObject>)>>>,
+    monitor: buffer::BufferMonitor,
+    annotated: bool,
+}
+
+impl AsyncMultiResponseStream {
+    fn new(rx: buffer::BufferReceiver<(usize, RsAnnotated<PyObject>)>, annotated: bool) -> Self {
+        AsyncMultiResponseStream {
+            monitor: rx.monitor(),
+            rx: Arc::new(Mutex::new(rx)),
+            annotated,
+        }
+    }
+}
+
+#[pymethods]
+impl AsyncMultiResponseStream {
+    /// High-water marks of the response buffer shared by the multiplexed streams
+    fn buffer_stats(&self) -> buffer::StreamBufferStats {
+        self.monitor.stats()
+    }
+
+    #[pyo3(name = "__aiter__")]
+    fn aiter(slf: PyRef<Self>, py: Python) -> PyResult<Py<PyAny>> {
+        slf.into_py_any(py)
+    }
+
+    /// Returns the next `(index, response)` tuple; an error response raises a `ValueError`
+    /// naming the index of its request, after which iteration may continue with the other
+    /// requests.
+    #[pyo3(name = "__anext__")]
+    fn next<'p>(&self, py: Python<'p>) -> PyResult<Bound<'p, PyAny>> {
+        let rx = self.rx.clone();
+        let annotated = self.annotated;
+
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            loop {
+                let value = rx.lock().await.recv().await;
+                match value {
+                    Some((index, pyobj)) => {
+                        let pyobj = match pyobj.ok() {
+                            Ok(pyobj) => pyobj,
+                            Err(e) => {
+                                return Err(PyValueError::new_err(format!(
+                                    "request {}: {}",
+                                    index, e
+                                )));
+                            }
+                        };
+
+                        if annotated {
+                            let object = Annotated { inner: pyobj };
+                            return Python::with_gil(|py| (index, object).into_py_any(py));
+                        } else {
+                            match pyobj.data {
+                                Some(data) => {
+                                    return Python::with_gil(|py| (index, data).into_py_any(py))
+                                }
+                                None => continue,
+                            }
+                        }
+                    }
+                    None => return Err(PyStopAsyncIteration::new_err("Stream exhausted")),
+                }
+            }
+        })
+    }
+}
+
 #[pyclass]
 struct Annotated {
     inner: RsAnnotated<PyObject>,
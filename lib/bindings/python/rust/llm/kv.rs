@@ -15,6 +15,576 @@
 
 use super::*;
 
+use std::sync::atomic::{AtomicBool, Ordering};
+
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::{PyBufferError, PyTimeoutError, PyValueError};
+use pyo3::types::PyString;
+
+use llm_rs::kv_router::scheduler::{
+    AdmissionConfig, AdmissionOptions, KvSchedulerError, DEFAULT_ADMISSION_QUEUE_CAPACITY,
+};
+
+pyo3::create_exception!(
+    _core,
+    OverloadedError,
+    PyException,
+    "Raised when the admission queue of a KvRouter is full; the request should be shed."
+);
+
+/// Convert an error from scheduling a request, raising [`OverloadedError`] if the admission
+/// queue is full and `TimeoutError` if no worker freed up before the deadline of the request
+fn to_schedule_pyerr(err: rs::Error) -> PyErr {
+    match err.downcast_ref::<KvSchedulerError>() {
+        Some(KvSchedulerError::Overloaded) => OverloadedError::new_err(err.to_string()),
+        Some(KvSchedulerError::DeadlineExceeded) => PyTimeoutError::new_err(err.to_string()),
+        _ => to_pyerr(err),
+    }
+}
+
+/// Convert the optional duration `name`, given in seconds from python
+fn duration_from_secs(name: &str, secs: Option<f64>) -> PyResult<Option<Duration>> {
+    secs.map(|secs| {
+        Duration::try_from_secs_f64(secs)
+            .map_err(|_| PyValueError::new_err(format!("invalid {}: {}", name, secs)))
+    })
+    .transpose()
+}
+
+/// The admission options of a request scheduled from python; `timeout` is in seconds
+fn admission_options(priority: u8, timeout: Option<f64>) -> PyResult<AdmissionOptions> {
+    let timeout = duration_from_secs("timeout", timeout)?;
+    Ok(AdmissionOptions { priority, timeout })
+}
+
+/// Token ids passed from python
+///
+/// Any object exporting a buffer of native `uint32` items, such as a NumPy `uint32` array or an
+/// `array('I')`, is copied in bulk rather than item by item. Buffers of bytes, such as `bytes` or
+/// a `memoryview` of them, hold the token ids as packed little-endian `uint32`. Anything else is
+/// extracted as a sequence of ints.
+///
+/// The token ids are always copied while the GIL is held: they are read later without it, while
+/// python code is free to write to a buffer it exported.
+pub(crate) struct TokenIds(Vec<u32>);
+
+impl<'py> FromPyObject<'py> for TokenIds {
+    fn extract_bound(obj: &Bound<'py, PyAny>) -> PyResult<Self> {
+        if let Ok(bytes) = obj.downcast::<PyBytes>() {
+            return unpack_token_ids(bytes.as_bytes()).map(TokenIds);
+        }
+        if let Ok(buffer) = PyBuffer::<u32>::get(obj) {
+            return Ok(TokenIds(buffer.to_vec(obj.py())?));
+        }
+        if let Ok(buffer) = PyBuffer::<u8>::get(obj) {
+            return unpack_token_ids(&buffer.to_vec(obj.py())?).map(TokenIds);
+        }
+        Ok(TokenIds(obj.extract()?))
+    }
+}
+
+impl AsRef<[u32]> for TokenIds {
+    fn as_ref(&self) -> &[u32] {
+        &self.0
+    }
+}
+
+fn unpack_token_ids(bytes: &[u8]) -> PyResult<Vec<u32>> {
+    if bytes.len() % 4 != 0 {
+        return Err(PyBufferError::new_err(format!(
+            "packed token ids must be a multiple of 4 bytes, got {}",
+            bytes.len()
+        )));
+    }
+    Ok(bytes
+        .chunks_exact(4)
+        .map(|chunk| u32::from_le_bytes([chunk[0], chunk[1], chunk[2], chunk[3]]))
+        .collect())
+}
+
+/// Blocks of a request already cached by each worker, as found by the KV indexer
+#[pyclass]
+#[derive(Debug, Clone)]
+pub(crate) struct OverlapScores {
+    /// Number of leading blocks of the request cached by each worker; workers without any
+    /// matched block are omitted
+    #[pyo3(get)]
+    scores: HashMap<i64, u32>,
+
+    /// Number of recent accesses of each matched block, if the indexer tracks them
+    #[pyo3(get)]
+    frequencies: Vec<usize>,
+
+    /// Number of full blocks of the request
+    #[pyo3(get)]
+    num_blocks: usize,
+}
+
+impl OverlapScores {
+    fn new(
+        scores: llm_rs::kv_router::indexer::OverlapScores,
+        num_tokens: usize,
+        kv_block_size: usize,
+    ) -> Self {
+        Self {
+            scores: scores.scores,
+            frequencies: scores.frequencies,
+            num_blocks: num_tokens / kv_block_size,
+        }
+    }
+}
+
+#[pymethods]
+impl OverlapScores {
+    /// Fraction of the blocks of the request cached by `worker_id`
+    fn hit_ratio(&self, worker_id: i64) -> f64 {
+        if self.num_blocks == 0 {
+            return 0.0;
+        }
+        self.scores.get(&worker_id).copied().unwrap_or(0) as f64 / self.num_blocks as f64
+    }
+
+    /// Worker caching the most blocks of the request, if any
+    fn best_worker(&self) -> Option<i64> {
+        self.scores
+            .iter()
+            .max_by_key(|(worker_id, score)| (**score, std::cmp::Reverse(**worker_id)))
+            .map(|(worker_id, _)| *worker_id)
+    }
+
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!(
+            "OverlapScores(scores={:?}, frequencies={:?}, num_blocks={})",
+            self.scores, self.frequencies, self.num_blocks
+        )
+    }
+}
+
+/// Statistics of the requests waiting for a worker in a [`KvRouter`]; times are in seconds
+#[pyclass]
+#[derive(Debug, Clone)]
+pub(crate) struct AdmissionStats {
+    #[pyo3(get)]
+    queue_depth: usize,
+    #[pyo3(get)]
+    scheduled: u64,
+    #[pyo3(get)]
+    rejected: u64,
+    #[pyo3(get)]
+    expired: u64,
+    #[pyo3(get)]
+    mean_wait: f64,
+    #[pyo3(get)]
+    max_wait: f64,
+}
+
+impl From<llm_rs::kv_router::scheduler::AdmissionStats> for AdmissionStats {
+    fn from(stats: llm_rs::kv_router::scheduler::AdmissionStats) -> Self {
+        Self {
+            queue_depth: stats.queue_depth,
+            scheduled: stats.scheduled,
+            rejected: stats.rejected,
+            expired: stats.expired,
+            mean_wait: stats.mean_wait.as_secs_f64(),
+            max_wait: stats.max_wait.as_secs_f64(),
+        }
+    }
+}
+
+#[pymethods]
+impl AdmissionStats {
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!("{:?}", self)
+    }
+}
+
+/// How far behind the KV events published by the workers the indexer of a [`KvRouter`] is
+#[pyclass]
+#[derive(Debug, Clone)]
+pub(crate) struct IndexerLag {
+    #[pyo3(get)]
+    events: u64,
+    #[pyo3(get)]
+    seconds: f64,
+}
+
+impl From<llm_rs::kv_router::indexer::IndexerLag> for IndexerLag {
+    fn from(lag: llm_rs::kv_router::indexer::IndexerLag) -> Self {
+        Self {
+            events: lag.events,
+            seconds: lag.delay.as_secs_f64(),
+        }
+    }
+}
+
+#[pymethods]
+impl IndexerLag {
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!("{:?}", self)
+    }
+}
+
+/// The workers a request can be scheduled on, as passed to a python cost function; each list has
+/// one entry per worker
+#[pyclass]
+#[derive(Debug, Clone)]
+pub(crate) struct WorkerSnapshot {
+    #[pyo3(get)]
+    worker_ids: Vec<i64>,
+    #[pyo3(get)]
+    overlap_blocks: Vec<u32>,
+    #[pyo3(get)]
+    new_tokens: Vec<usize>,
+    #[pyo3(get)]
+    request_active_slots: Vec<u64>,
+    #[pyo3(get)]
+    request_total_slots: Vec<u64>,
+    #[pyo3(get)]
+    kv_active_blocks: Vec<u64>,
+    #[pyo3(get)]
+    kv_total_blocks: Vec<u64>,
+    #[pyo3(get)]
+    isl_tokens: usize,
+    #[pyo3(get)]
+    kv_block_size: usize,
+    #[pyo3(get)]
+    load_avg: f64,
+    #[pyo3(get)]
+    load_std: f64,
+}
+
+impl From<&llm_rs::kv_router::scoring::WorkerSnapshot> for WorkerSnapshot {
+    fn from(snapshot: &llm_rs::kv_router::scoring::WorkerSnapshot) -> Self {
+        Self {
+            worker_ids: snapshot.worker_ids.clone(),
+            overlap_blocks: snapshot.overlap_blocks.clone(),
+            new_tokens: snapshot.new_tokens.clone(),
+            request_active_slots: snapshot.request_active_slots.clone(),
+            request_total_slots: snapshot.request_total_slots.clone(),
+            kv_active_blocks: snapshot.kv_active_blocks.clone(),
+            kv_total_blocks: snapshot.kv_total_blocks.clone(),
+            isl_tokens: snapshot.isl_tokens,
+            kv_block_size: snapshot.kv_block_size,
+            load_avg: snapshot.load_avg,
+            load_std: snapshot.load_std,
+        }
+    }
+}
+
+#[pymethods]
+impl WorkerSnapshot {
+    fn __len__(&self) -> usize {
+        self.worker_ids.len()
+    }
+
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!("{:?}", self)
+    }
+}
+
+/// How long the scheduler waits for a python cost function by default, in seconds
+const DEFAULT_POLICY_TIMEOUT: f64 = 0.1;
+
+/// How long a [`KvRouter`] waits to start by default, in seconds
+const DEFAULT_START_TIMEOUT: f64 = 60.0;
+
+/// A call of a [`PyCostFunction`], answered on `resp_tx`
+struct CostRequest {
+    snapshot: WorkerSnapshot,
+    resp_tx: std::sync::mpsc::Sender<PyResult<Vec<f64>>>,
+}
+
+/// A cost function calling back into python
+///
+/// The callback takes a [`WorkerSnapshot`] and returns one cost per worker. It runs on a thread
+/// of its own, so that waiting for the GIL does not stall the scheduler's runtime; the scheduler
+/// waits up to `timeout` for it. If it raises, times out, is still busy with a previous call, or
+/// does not return a cost for each worker, the workers are scored with the default cost function.
+#[derive(Debug)]
+struct PyCostFunction {
+    request_tx: std::sync::mpsc::SyncSender<CostRequest>,
+    /// Set from the time a call is sent to the thread until its callback returns
+    busy: Arc<AtomicBool>,
+    timeout: Duration,
+    fallback: llm_rs::kv_router::scoring::DefaultCost,
+}
+
+impl PyCostFunction {
+    fn new(callback: PyObject, timeout: Duration) -> PyResult<Self> {
+        // calls are only sent while the thread is idle, so one slot is enough
+        let (request_tx, request_rx) = std::sync::mpsc::sync_channel::<CostRequest>(1);
+        let busy = Arc::new(AtomicBool::new(false));
+        let idle = busy.clone();
+        std::thread::Builder::new()
+            .name("kv-cost-function".to_string())
+            .spawn(move || {
+                // ends once the cost function is dropped
+                for request in request_rx {
+                    let costs = Python::with_gil(|py| {
+                        callback
+                            .call1(py, (request.snapshot,))?
+                            .extract::<Vec<f64>>(py)
+                    });
+                    // cleared before answering, so that the next call finds the thread idle
+                    idle.store(false, Ordering::Release);
+                    let _ = request.resp_tx.send(costs);
+                }
+            })
+            .map_err(|e| {
+                PyException::new_err(format!("failed to start the cost function thread: {}", e))
+            })?;
+        Ok(Self {
+            request_tx,
+            busy,
+            timeout,
+            fallback: llm_rs::kv_router::scoring::DefaultCost::default(),
+        })
+    }
+
+    /// Call the python callback on its thread and wait for its costs
+    fn call(
+        &self,
+        snapshot: &llm_rs::kv_router::scoring::WorkerSnapshot,
+    ) -> Result<Vec<f64>, String> {
+        let (resp_tx, resp_rx) = std::sync::mpsc::channel();
+        let request = CostRequest {
+            snapshot: WorkerSnapshot::from(snapshot),
+            resp_tx,
+        };
+        // a call that timed out may still be running
+        if self.busy.swap(true, Ordering::AcqRel) {
+            return Err("still running a previous call".to_string());
+        }
+        if self.request_tx.try_send(request).is_err() {
+            self.busy.store(false, Ordering::Release);
+            return Err("its thread stopped".to_string());
+        }
+        let wait = || resp_rx.recv_timeout(self.timeout);
+        // let the runtime move its other tasks off this thread while it waits
+        let resp = match tokio::runtime::Handle::try_current() {
+            Ok(handle) if handle.runtime_flavor() == tokio::runtime::RuntimeFlavor::MultiThread => {
+                tokio::task::block_in_place(wait)
+            }
+            _ => wait(),
+        };
+        match resp {
+            Ok(costs) => costs.map_err(|e| e.to_string()),
+            Err(_) => Err(format!("no costs after {:?}", self.timeout)),
+        }
+    }
+}
+
+impl llm_rs::kv_router::scoring::CostFunction for PyCostFunction {
+    fn costs(&self, snapshot: &llm_rs::kv_router::scoring::WorkerSnapshot) -> Vec<f64> {
+        match self.call(snapshot) {
+            Ok(costs) if costs.len() == snapshot.len() => costs,
+            Ok(costs) => {
+                tracing::error!(
+                    "cost function returned {} costs for {} workers; using the default costs",
+                    costs.len(),
+                    snapshot.len()
+                );
+                self.fallback.costs(snapshot)
+            }
+            Err(e) => {
+                tracing::error!("cost function failed: {}; using the default costs", e);
+                self.fallback.costs(snapshot)
+            }
+        }
+    }
+}
+
+/// Take the weight `name` out of `weights`, if given
+fn take_weight(weights: &mut HashMap<String, f64>, name: &str, default: f64) -> f64 {
+    weights.remove(name).unwrap_or(default)
+}
+
+/// Build the cost function of a `KvRouter` from the name of a built-in policy and its weights,
+/// or from a python callable; `None` if both are left to their defaults
+fn cost_function(
+    policy: Option<&Bound<'_, PyAny>>,
+    weights: Option<HashMap<String, f64>>,
+    policy_timeout: f64,
+) -> PyResult<Option<Arc<dyn llm_rs::kv_router::scoring::CostFunction>>> {
+    use llm_rs::kv_router::scoring::{
+        CostWeights, DefaultCost, LeastLoadedCost, PrefixCost, QueueTimeCost,
+    };
+
+    let name = match policy {
+        None if weights.is_none() => return Ok(None),
+        None => "default".to_string(),
+        Some(policy) if policy.is_instance_of::<PyString>() => policy.extract::<String>()?,
+        Some(policy) => {
+            if !policy.is_callable() {
+                return Err(PyValueError::new_err(
+                    "policy must be the name of a built-in policy or a callable",
+                ));
+            }
+            if weights.is_some() {
+                return Err(PyValueError::new_err(
+                    "weights only apply to the built-in policies",
+                ));
+            }
+            let timeout = duration_from_secs("policy_timeout", Some(policy_timeout))?
+                .filter(|timeout| !timeout.is_zero())
+                .ok_or_else(|| PyValueError::new_err("policy_timeout must be positive"))?;
+            return Ok(Some(Arc::new(PyCostFunction::new(
+                policy.clone().unbind(),
+                timeout,
+            )?)));
+        }
+    };
+
+    let mut weights = weights.unwrap_or_default();
+    let cost_fn: Arc<dyn llm_rs::kv_router::scoring::CostFunction> = match name.as_str() {
+        "default" => {
+            let default = CostWeights::default();
+            Arc::new(DefaultCost {
+                weights: CostWeights {
+                    balance_threshold: take_weight(
+                        &mut weights,
+                        "balance_threshold",
+                        default.balance_threshold,
+                    ),
+                    balance_alpha: take_weight(
+                        &mut weights,
+                        "balance_alpha",
+                        default.balance_alpha,
+                    ),
+                    alpha: take_weight(&mut weights, "alpha", default.alpha),
+                    gamma: take_weight(&mut weights, "gamma", default.gamma),
+                },
+            })
+        }
+        "prefix" => Arc::new(PrefixCost),
+        "least_loaded" => Arc::new(LeastLoadedCost {
+            gamma: take_weight(&mut weights, "gamma", LeastLoadedCost::default().gamma),
+        }),
+        "queue_time" => Arc::new(QueueTimeCost {
+            active_request_tokens: take_weight(
+                &mut weights,
+                "active_request_tokens",
+                QueueTimeCost::default().active_request_tokens,
+            ),
+        }),
+        other => {
+            return Err(PyValueError::new_err(format!(
+                "unknown policy: {}; expected one of default, prefix, least_loaded, queue_time",
+                other
+            )))
+        }
+    };
+
+    if !weights.is_empty() {
+        let mut unknown: Vec<_> = weights.into_keys().collect();
+        unknown.sort();
+        return Err(PyValueError::new_err(format!(
+            "unknown weights for policy {:?}: {}",
+            cost_fn,
+            unknown.join(", ")
+        )));
+    }
+    Ok(Some(cost_fn))
+}
+
+fn check_kv_block_size(kv_block_size: usize) -> PyResult<()> {
+    if kv_block_size == 0 {
+        return Err(PyValueError::new_err("kv_block_size must be positive"));
+    }
+    Ok(())
+}
+
+/// Return the hashes of the full blocks of the given token ids, as matched by a [`KvRouter`]
+/// with the same `kv_block_size`; they are computed without holding the GIL.
+#[pyfunction]
+#[pyo3(signature = (token_ids, kv_block_size, lora_id=0))]
+pub(crate) fn compute_block_hashes(
+    py: Python<'_>,
+    token_ids: TokenIds,
+    kv_block_size: usize,
+    lora_id: u64,
+) -> PyResult<Vec<u64>> {
+    check_kv_block_size(kv_block_size)?;
+    Ok(py.allow_threads(|| {
+        llm_rs::kv_router::indexer::compute_block_hash_for_seq(
+            token_ids.as_ref(),
+            kv_block_size,
+            lora_id,
+        )
+        .into_iter()
+        .map(|hash| hash.0)
+        .collect()
+    }))
+}
+
+/// The block hashes of a sequence, such as a conversation, computed as its tokens are appended
+/// so that each block is only hashed once
+#[pyclass]
+#[derive(Debug, Clone)]
+pub(crate) struct SequenceHasher {
+    inner: llm_rs::kv_router::indexer::SequenceHasher,
+}
+
+#[pymethods]
+impl SequenceHasher {
+    #[new]
+    #[pyo3(signature = (kv_block_size, lora_id=0))]
+    fn new(kv_block_size: usize, lora_id: u64) -> PyResult<Self> {
+        check_kv_block_size(kv_block_size)?;
+        Ok(Self {
+            inner: llm_rs::kv_router::indexer::SequenceHasher::new(kv_block_size, lora_id),
+        })
+    }
+
+    /// Append the given token ids, returning the hashes of the blocks they complete
+    fn extend(&mut self, py: Python<'_>, token_ids: TokenIds) -> Vec<u64> {
+        let inner = &mut self.inner;
+        py.allow_threads(|| {
+            inner
+                .extend(token_ids.as_ref())
+                .iter()
+                .map(|hash| hash.0)
+                .collect()
+        })
+    }
+
+    /// The hashes of the full blocks of the sequence
+    #[getter]
+    fn block_hashes(&self) -> Vec<u64> {
+        self.inner
+            .block_hashes()
+            .iter()
+            .map(|hash| hash.0)
+            .collect()
+    }
+
+    /// The number of tokens appended to the sequence
+    #[getter]
+    fn num_tokens(&self) -> usize {
+        self.inner.num_tokens()
+    }
+
+    /// A copy of the hasher, to follow another branch of the sequence
+    fn copy(&self) -> Self {
+        self.clone()
+    }
+
+    #[pyo3(name = "__repr__")]
+    fn _repr(&self) -> String {
+        format!(
+            "SequenceHasher(kv_block_size={}, lora_id={}, num_blocks={}, num_tokens={})",
+            self.inner.kv_block_size(),
+            self.inner.lora_id(),
+            self.inner.block_hashes().len(),
+            self.inner.num_tokens()
+        )
+    }
+}
+
 #[pyclass]
 pub(crate) struct KvRouter {
     inner: Arc<llm_rs::kv_router::KvRouter>,
@@ -23,35 +593,240 @@ pub(crate) struct KvRouter {
 #[pymethods]
 impl KvRouter {
     #[new]
+    #[pyo3(signature = (
+        drt,
+        component,
+        kv_block_size=None,
+        policy=None,
+        weights=None,
+        policy_timeout=DEFAULT_POLICY_TIMEOUT,
+        queue_capacity=DEFAULT_ADMISSION_QUEUE_CAPACITY,
+        timeout=None,
+        num_shards=1,
+        expiration=None,
+        snapshot_path=None,
+        snapshot_interval=60.0,
+        start_timeout=Some(DEFAULT_START_TIMEOUT),
+    ))]
     // [FXIME] 'drt' can be obtained from 'component'
-    fn new(drt: DistributedRuntime, component: Component) -> PyResult<Self> {
+    #[allow(clippy::too_many_arguments)]
+    fn new(
+        py: Python<'_>,
+        drt: DistributedRuntime,
+        component: Component,
+        kv_block_size: Option<usize>,
+        policy: Option<Bound<'_, PyAny>>,
+        weights: Option<HashMap<String, f64>>,
+        policy_timeout: f64,
+        queue_capacity: usize,
+        timeout: Option<f64>,
+        num_shards: usize,
+        expiration: Option<f64>,
+        snapshot_path: Option<std::path::PathBuf>,
+        snapshot_interval: f64,
+        start_timeout: Option<f64>,
+    ) -> PyResult<Self> {
+        if kv_block_size == Some(0) {
+            return Err(PyValueError::new_err("kv_block_size must be positive"));
+        }
+        if num_shards == 0 {
+            return Err(PyValueError::new_err("num_shards must be positive"));
+        }
+        let snapshot = match snapshot_path {
+            Some(path) => {
+                let interval = duration_from_secs("snapshot_interval", Some(snapshot_interval))?
+                    .filter(|interval| !interval.is_zero())
+                    .ok_or_else(|| PyValueError::new_err("snapshot_interval must be positive"))?;
+                Some(llm_rs::kv_router::indexer::SnapshotConfig { path, interval })
+            }
+            None => None,
+        };
+        let indexer = llm_rs::kv_router::indexer::IndexerConfig {
+            num_shards,
+            expiration: duration_from_secs("expiration", expiration)?,
+            snapshot,
+        };
+        let cost_fn = cost_function(policy.as_ref(), weights, policy_timeout)?;
+        let admission = AdmissionConfig {
+            queue_capacity,
+            default_timeout: duration_from_secs("timeout", timeout)?,
+        };
+        let start_timeout = duration_from_secs("start_timeout", start_timeout)?;
         let runtime = pyo3_async_runtimes::tokio::get_runtime();
-        runtime.block_on(async {
-            let inner = llm_rs::kv_router::KvRouter::from_runtime(
-                drt.inner.clone(),
-                component.inner.clone(),
-            )
-            .await
-            .map_err(to_pyerr)?;
-            Ok(Self { inner })
+        let (drt, component) = (drt.inner.clone(), component.inner.clone());
+        // without a block size, the router waits for the workers to publish theirs
+        py.allow_threads(|| {
+            runtime.block_on(async {
+                let start = llm_rs::kv_router::KvRouter::from_runtime(
+                    drt,
+                    component,
+                    kv_block_size,
+                    cost_fn,
+                    admission,
+                    indexer,
+                );
+                let inner = match start_timeout {
+                    Some(start_timeout) => tokio::time::timeout(start_timeout, start)
+                        .await
+                        .map_err(|_| {
+                            PyTimeoutError::new_err(format!(
+                                "KvRouter did not start within {:?}; without a kv_block_size it \
+                                 waits for a worker to publish its KV block size",
+                                start_timeout
+                            ))
+                        })?,
+                    None => start.await,
+                }
+                .map_err(to_pyerr)?;
+                Ok(Self { inner })
+            })
         })
     }
 
+    /// Return the worker id that should handle the given token ids; see [`TokenIds`] for the
+    /// accepted types. While all the workers are busy the request is queued by `priority`,
+    /// for up to `timeout` seconds.
+    #[pyo3(signature = (token_ids, lora_id, priority=0, timeout=None))]
     fn schedule<'p>(
         &self,
         py: Python<'p>,
-        token_ids: Vec<u32>,
+        token_ids: TokenIds,
         lora_id: u64,
+        priority: u8,
+        timeout: Option<f64>,
     ) -> PyResult<Bound<'p, PyAny>> {
+        let options = admission_options(priority, timeout)?;
         let router = self.inner.clone();
         pyo3_async_runtimes::tokio::future_into_py(py, async move {
-            let worker_id = router
-                .schedule(&token_ids, lora_id)
+            let (worker_id, _) = router
+                .schedule_with_scores(token_ids.as_ref(), lora_id, options)
                 .await
-                .map_err(to_pyerr)?;
+                .map_err(to_schedule_pyerr)?;
             Ok(worker_id)
         })
     }
+
+    /// Return the blocks of the given token ids already cached by each worker, without
+    /// scheduling the request.
+    #[pyo3(signature = (token_ids, lora_id=0))]
+    fn find_matches<'p>(
+        &self,
+        py: Python<'p>,
+        token_ids: TokenIds,
+        lora_id: u64,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        let router = self.inner.clone();
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            let tokens = token_ids.as_ref();
+            let scores = router
+                .find_matches(tokens, lora_id)
+                .await
+                .map_err(to_pyerr)?;
+            Ok(OverlapScores::new(
+                scores,
+                tokens.len(),
+                router.kv_block_size(),
+            ))
+        })
+    }
+
+    /// Schedule the given token ids; returns the selected worker id along with the
+    /// [`OverlapScores`] the decision was based on.
+    #[pyo3(signature = (token_ids, lora_id, priority=0, timeout=None))]
+    fn schedule_with_scores<'p>(
+        &self,
+        py: Python<'p>,
+        token_ids: TokenIds,
+        lora_id: u64,
+        priority: u8,
+        timeout: Option<f64>,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        let options = admission_options(priority, timeout)?;
+        let router = self.inner.clone();
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            let tokens = token_ids.as_ref();
+            let (worker_id, scores) = router
+                .schedule_with_scores(tokens, lora_id, options)
+                .await
+                .map_err(to_schedule_pyerr)?;
+            Ok((
+                worker_id,
+                OverlapScores::new(scores, tokens.len(), router.kv_block_size()),
+            ))
+        })
+    }
+
+    /// Schedule a request whose block hashes were already computed, by [`compute_block_hashes`]
+    /// or a [`SequenceHasher`] with the block size of the router; `num_tokens` is the number of
+    /// input tokens of the request. Returns the selected worker id along with the
+    /// [`OverlapScores`] the decision was based on.
+    #[pyo3(signature = (block_hashes, num_tokens, priority=0, timeout=None))]
+    fn schedule_block_hashes<'p>(
+        &self,
+        py: Python<'p>,
+        block_hashes: Vec<u64>,
+        num_tokens: usize,
+        priority: u8,
+        timeout: Option<f64>,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        let options = admission_options(priority, timeout)?;
+        let router = self.inner.clone();
+        let block_hashes = block_hashes
+            .into_iter()
+            .map(llm_rs::kv_router::protocols::LocalBlockHash)
+            .collect();
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            let (worker_id, scores) = router
+                .schedule_block_hashes(block_hashes, num_tokens, options)
+                .await
+                .map_err(to_schedule_pyerr)?;
+            Ok((
+                worker_id,
+                OverlapScores::new(scores, num_tokens, router.kv_block_size()),
+            ))
+        })
+    }
+
+    /// Schedule a batch of requests; their blocks are hashed and matched without holding the
+    /// GIL, and the workers are assigned jointly. Returns the worker id of each request, or the
+    /// exception of a request that failed, like `asyncio.gather(..., return_exceptions=True)`.
+    #[pyo3(signature = (token_ids, lora_id=0, priority=0, timeout=None))]
+    fn schedule_batch<'p>(
+        &self,
+        py: Python<'p>,
+        token_ids: Vec<TokenIds>,
+        lora_id: u64,
+        priority: u8,
+        timeout: Option<f64>,
+    ) -> PyResult<Bound<'p, PyAny>> {
+        let options = admission_options(priority, timeout)?;
+        let router = self.inner.clone();
+        pyo3_async_runtimes::tokio::future_into_py(py, async move {
+            let results = router
+                .schedule_batch(&token_ids, lora_id, options)
+                .await
+                .map_err(to_schedule_pyerr)?;
+            Python::with_gil(|py| {
+                results
+                    .into_iter()
+                    .map(|result| match result {
+                        Ok(worker_id) => worker_id.into_py_any(py),
+                        Err(e) => Ok(to_schedule_pyerr(e.into()).into_value(py).into_any()),
+                    })
+                    .collect::<PyResult<Vec<PyObject>>>()
+            })
+        })
+    }
+
+    /// Return the [`AdmissionStats`] of the requests waiting for a worker
+    fn admission_stats(&self) -> AdmissionStats {
+        self.inner.admission_stats().into()
+    }
+
+    /// Return the [`IndexerLag`] of the indexer behind the KV events of the workers
+    fn indexer_lag(&self) -> IndexerLag {
+        self.inner.indexer_lag().into()
+    }
 }
 
 #[pyclass]
@@ -85,6 +860,7 @@ impl KvMetricsPublisher {
         })
     }
 
+    #[pyo3(signature = (request_active_slots, request_total_slots, kv_active_blocks, kv_total_blocks, kv_block_size=None))]
     fn publish(
         &self,
         _py: Python,
@@ -92,6 +868,7 @@ impl KvMetricsPublisher {
         request_total_slots: u64,
         kv_active_blocks: u64,
         kv_total_blocks: u64,
+        kv_block_size: Option<u64>,
     ) -> PyResult<()> {
         self.inner
             .publish(
@@ -100,6 +877,7 @@ impl KvMetricsPublisher {
                     request_total_slots,
                     kv_active_blocks,
                     kv_total_blocks,
+                    kv_block_size,
                 }
                 .into(),
             )
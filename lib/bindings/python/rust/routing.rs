@@ -0,0 +1,273 @@
+// SPDX-FileCopyrightText: Copyright (c) 2024-2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+// SPDX-License-Identifier: Apache-2.0
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+// http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+//! Client side routing strategies
+//!
+//! Every request issued by a client is addressed to an instance picked by the client itself, so
+//! that the client knows the number of streams it has in flight on each instance. The load-aware
+//! strategies pick the instance with the lowest cost, where the cost of an instance is its
+//! number of in-flight streams, optionally increased by its utilization as reported by the
+//! [`ForwardPassMetrics`] published through a `KvMetricsPublisher`.
+
+use std::collections::HashMap;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
+
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use rand::Rng;
+use serde::{Deserialize, Serialize};
+use tokio::sync::{mpsc, watch};
+
+use triton_distributed_llm::kv_router::{collect_endpoints, protocols::ForwardPassMetrics};
+use triton_distributed_runtime::{
+    self as rs, error,
+    pipeline::{Data, ManyOut},
+    Result,
+};
+
+/// Strategy used to pick the instance handling a request
+#[derive(Debug, Clone, Copy)]
+pub enum RoutingStrategy {
+    Random,
+    RoundRobin,
+    Direct(i64),
+    /// Instance with the lowest cost
+    LeastInflight,
+    /// Instance with the lowest cost out of two picked at random
+    PowerOfTwo,
+}
+
+impl RoutingStrategy {
+    pub fn parse(strategy: &str, endpoint_id: Option<i64>) -> PyResult<Self> {
+        match (strategy, endpoint_id) {
+            ("random", _) => Ok(RoutingStrategy::Random),
+            ("round_robin", _) => Ok(RoutingStrategy::RoundRobin),
+            ("least_inflight", _) => Ok(RoutingStrategy::LeastInflight),
+            ("power_of_two", _) => Ok(RoutingStrategy::PowerOfTwo),
+            ("direct", Some(endpoint_id)) => Ok(RoutingStrategy::Direct(endpoint_id)),
+            ("direct", None) => Err(PyValueError::new_err(
+                "the direct strategy requires an endpoint_id",
+            )),
+            (strategy, _) => Err(PyValueError::new_err(format!(
+                "unknown routing strategy: {}",
+                strategy
+            ))),
+        }
+    }
+}
+
+/// Number of streams in flight on each instance
+#[derive(Debug, Default)]
+pub struct InflightCounts {
+    counts: Mutex<HashMap<i64, usize>>,
+}
+
+impl InflightCounts {
+    fn get(&self, endpoint_id: i64) -> usize {
+        let counts = self.counts.lock().unwrap();
+        counts.get(&endpoint_id).copied().unwrap_or(0)
+    }
+
+    fn acquire(self: &Arc<Self>, endpoint_id: i64) -> InflightGuard {
+        let mut counts = self.counts.lock().unwrap();
+        *counts.entry(endpoint_id).or_insert(0) += 1;
+        InflightGuard {
+            counts: self.clone(),
+            endpoint_id,
+        }
+    }
+
+    pub fn snapshot(&self) -> HashMap<i64, usize> {
+        self.counts.lock().unwrap().clone()
+    }
+}
+
+/// Marks a stream as in flight on an instance until dropped
+pub struct InflightGuard {
+    counts: Arc<InflightCounts>,
+    endpoint_id: i64,
+}
+
+impl Drop for InflightGuard {
+    fn drop(&mut self) {
+        let mut counts = self.counts.counts.lock().unwrap();
+        if let Some(count) = counts.get_mut(&self.endpoint_id) {
+            *count -= 1;
+            if *count == 0 {
+                counts.remove(&self.endpoint_id);
+            }
+        }
+    }
+}
+
+/// Latest utilization of each instance, between 0 and 1
+pub type LoadMetrics = watch::Receiver<Arc<HashMap<i64, f64>>>;
+
+/// Utilization of an instance: the larger of its KV block and request slot occupancies
+fn utilization(metrics: &ForwardPassMetrics) -> f64 {
+    let ratio = |active: u64, total: u64| {
+        if total == 0 {
+            0.0
+        } else {
+            active as f64 / total as f64
+        }
+    };
+    ratio(metrics.kv_active_blocks, metrics.kv_total_blocks).max(ratio(
+        metrics.request_active_slots,
+        metrics.request_total_slots,
+    ))
+}
+
+/// Follow the [`ForwardPassMetrics`] published by the instances of `component`
+pub fn watch_load_metrics(component: &rs::component::Component) -> LoadMetrics {
+    let (ep_tx, mut ep_rx) = mpsc::channel(4);
+    let (load_tx, load_rx) = watch::channel(Arc::new(HashMap::new()));
+
+    tokio::spawn(collect_endpoints(
+        component.drt().nats_client(),
+        component.service_name(),
+        ep_tx,
+        component.drt().runtime().child_token(),
+    ));
+
+    tokio::spawn(async move {
+        while let Some(processed) = ep_rx.recv().await {
+            let load = processed
+                .endpoints
+                .iter()
+                .map(|endpoint| (endpoint.worker_id(), utilization(&endpoint.data)))
+                .collect::<HashMap<_, _>>();
+            if load_tx.send(Arc::new(load)).is_err() {
+                tracing::trace!("all clients dropped; no longer following load metrics");
+                break;
+            }
+        }
+    });
+
+    load_rx
+}
+
+/// Picks the instance handling each request issued by a client
+#[derive(Clone)]
+pub struct Router {
+    inflight: Arc<InflightCounts>,
+    counter: Arc<AtomicU64>,
+    load: Option<(LoadMetrics, f64)>,
+}
+
+impl Router {
+    /// Create a router; if `load` is provided, the utilization of an instance scaled by
+    /// `load_weight` is added to its in-flight stream count to compute its cost
+    pub fn new(load: Option<LoadMetrics>, load_weight: f64) -> Self {
+        Router {
+            inflight: Arc::new(InflightCounts::default()),
+            counter: Arc::new(AtomicU64::new(0)),
+            load: load.map(|load| (load, load_weight)),
+        }
+    }
+
+    pub fn inflight(&self) -> &InflightCounts {
+        &self.inflight
+    }
+
+    fn cost(&self, endpoint_id: i64, load: Option<&(Arc<HashMap<i64, f64>>, f64)>) -> f64 {
+        let inflight = self.inflight.get(endpoint_id) as f64;
+        match load {
+            Some((load, weight)) => {
+                inflight + weight * load.get(&endpoint_id).copied().unwrap_or(0.0)
+            }
+            None => inflight,
+        }
+    }
+
+    fn select(&self, strategy: RoutingStrategy, endpoint_ids: &[i64]) -> Option<i64> {
+        if let RoutingStrategy::Direct(endpoint_id) = strategy {
+            return Some(endpoint_id);
+        }
+
+        let count = endpoint_ids.len();
+        if count == 0 {
+            return None;
+        }
+
+        let mut rng = rand::thread_rng();
+        let load = self
+            .load
+            .as_ref()
+            .map(|(load, weight)| (load.borrow().clone(), *weight));
+
+        let index = match strategy {
+            RoutingStrategy::Random => rng.gen_range(0..count),
+            RoutingStrategy::RoundRobin => {
+                (self.counter.fetch_add(1, Ordering::Relaxed) % count as u64) as usize
+            }
+            RoutingStrategy::LeastInflight => {
+                // start from a random offset so that ties are not always broken the same way
+                let offset = rng.gen_range(0..count);
+                (0..count)
+                    .map(|i| (i + offset) % count)
+                    .min_by(|&a, &b| {
+                        self.cost(endpoint_ids[a], load.as_ref())
+                            .total_cmp(&self.cost(endpoint_ids[b], load.as_ref()))
+                    })
+                    .unwrap_or(offset)
+            }
+            RoutingStrategy::PowerOfTwo => {
+                let a = rng.gen_range(0..count);
+                if count == 1 {
+                    a
+                } else {
+                    let b = (a + rng.gen_range(1..count)) % count;
+                    if self.cost(endpoint_ids[b], load.as_ref())
+                        < self.cost(endpoint_ids[a], load.as_ref())
+                    {
+                        b
+                    } else {
+                        a
+                    }
+                }
+            }
+            RoutingStrategy::Direct(_) => unreachable!(),
+        };
+
+        Some(endpoint_ids[index])
+    }
+
+    /// Issue `request` to the instance picked by `strategy`
+    ///
+    /// The stream counts as in flight on that instance until the returned guard is dropped.
+    pub async fn route<T, U>(
+        &self,
+        client: &rs::component::Client<T, U>,
+        strategy: RoutingStrategy,
+        request: T,
+    ) -> Result<(ManyOut<U>, InflightGuard)>
+    where
+        T: Data + Serialize,
+        U: Data + for<'de> Deserialize<'de>,
+    {
+        let endpoint_id = {
+            let endpoint_ids = client.endpoint_ids().borrow();
+            self.select(strategy, &endpoint_ids)
+        };
+        let endpoint_id = endpoint_id
+            .ok_or_else(|| error!("no endpoints found for endpoint {:?}", client.etcd_path()))?;
+
+        let guard = self.inflight.acquire(endpoint_id);
+        let stream = client.direct(request.into(), endpoint_id).await?;
+        Ok((stream, guard))
+    }
+}
@@ -13,7 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import AsyncGenerator, AsyncIterator, Callable, List
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 class JsonLike:
     """
@@ -24,6 +34,9 @@ class JsonLike:
 
 RequestHandler = Callable[[JsonLike], AsyncGenerator[JsonLike, None]]
 
+# A sequence of ints, a buffer of uint32 or packed little-endian uint32 bytes
+TokenIds = Union[List[int], bytes, bytearray, memoryview]
+
 class DistributedRuntime:
     """
     The runtime object for a distributed NOVA applications
@@ -82,16 +95,50 @@ class Endpoint:
 
     ...
 
-    async def serve_endpoint(self, handler: RequestHandler) -> None:
+    async def serve_endpoint(
+        self,
+        handler: RequestHandler,
+        batch_window_us: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        drain_responses: bool = False,
+        stream_buffer: Optional[int] = None,
+        stream_buffer_bytes: Optional[int] = None,
+    ) -> None:
         """
         Serve an endpoint discoverable by all connected clients at
         `{{ namespace }}/components/{{ component_name }}/endpoints/{{ endpoint_name }}`
+
+        If `batch_window_us` is set, requests arriving within the window are
+        converted to Python objects and their generators started under a single
+        GIL acquisition, up to `max_batch_size` (default 256) requests at a time.
+
+        If `drain_responses` is set, every item already yielded by the handler's
+        async generator is converted under a single GIL acquisition rather than
+        one acquisition per item.
+
+        The responses of each stream are buffered until they are sent, up to
+        `stream_buffer` (default 128) responses and, if set, `stream_buffer_bytes`
+        bytes of payload.
         """
         ...
 
-    async def client(self) -> Client:
+    async def client(
+        self,
+        stream_buffer: Optional[int] = None,
+        stream_buffer_bytes: Optional[int] = None,
+        load_weight: Optional[float] = None,
+    ) -> Client:
         """
         Create a `Client` capable of calling served instances of this endpoint
+
+        The responses of each stream are buffered until they are consumed, up to
+        `stream_buffer` (default 32) responses and, if set, `stream_buffer_bytes`
+        bytes of payload.
+
+        If `load_weight` is set, the client follows the forward pass metrics
+        published by the instances with a `KvMetricsPublisher`; the load-aware
+        strategies then add the utilization of an instance, between 0 and 1,
+        scaled by `load_weight` to its number of in-flight streams.
         """
         ...
 
@@ -101,6 +148,90 @@ class Endpoint:
         """
         ...
 
+    def ingress_batch_stats(self) -> IngressBatchStats:
+        """
+        Return how many requests were started per GIL acquisition when the
+        endpoint is served in batched mode
+        """
+        ...
+
+    def stream_buffer_stats(self) -> StreamBufferStats:
+        """
+        Return the largest response buffer occupancy across the streams served
+        by this endpoint
+        """
+        ...
+
+class StreamBufferStats:
+    """
+    High-water marks of the response buffer of a stream, or the largest
+    across all the streams of a `Client` or an `Endpoint`
+    """
+
+    high_water_items: int
+    high_water_bytes: int
+
+class IngressBatchStats:
+    """
+    Snapshot of the batched ingress counters of an `Endpoint`
+    """
+
+    batches: int
+    requests: int
+    max_batch_size: int
+
+    def mean_batch_size(self) -> float:
+        """
+        Average number of requests started per GIL acquisition
+        """
+        ...
+
+class Context:
+    """
+    Context of a request, passed to handlers declaring a `context` parameter.
+
+    Stopping or killing the request raises `asyncio.CancelledError` inside the
+    handler's async generator.
+    """
+
+    ...
+
+    def id(self) -> str:
+        """
+        Unique id of the request
+        """
+        ...
+
+    def is_stopped(self) -> bool:
+        """
+        Whether the request was asked to stop generating
+        """
+        ...
+
+    def is_killed(self) -> bool:
+        """
+        Whether the request was killed
+        """
+        ...
+
+    async def stopped(self) -> None:
+        """
+        Wait until the request is asked to stop generating
+        """
+        ...
+
+    def stop_generating(self) -> None:
+        """
+        Ask the request to stop generating
+        """
+        ...
+
+    def kill(self) -> None:
+        """
+        Kill the request
+        """
+        ...
+
 class Client:
     """
     A client capable of calling served instances of an endpoint
@@ -108,24 +239,117 @@ class Client:
 
     ...
 
-    async def random(self, request: JsonLike) -> AsyncIterator[JsonLike]:
+    def endpoint_ids(self) -> List[int]:
+        """
+        Return the ids of the instances of the endpoint currently known
+        """
+        ...
+
+    async def wait_for_endpoints(self) -> None:
+        """
+        Wait until at least one instance of the endpoint is known
+        """
+        ...
+
+    def stream_buffer_stats(self) -> StreamBufferStats:
+        """
+        Return the largest response buffer occupancy across the streams issued
+        by this client
+        """
+        ...
+
+    def inflight(self) -> Dict[int, int]:
+        """
+        Return the number of streams issued by this client that are still in
+        flight, per instance
+        """
+        ...
+
+    async def generate(
+        self,
+        request: JsonLike,
+        annotated: bool = True,
+        raw: bool = False,
+        strategy: str = "random",
+        endpoint_id: Optional[int] = None,
+    ) -> AsyncIterator[JsonLike]:
+        """
+        Issue the request, routed according to `strategy`: one of `random`,
+        `round_robin`, `least_inflight`, `power_of_two` or `direct`, the latter
+        requiring `endpoint_id`.
+
+        `bytes`, `bytearray` and `memoryview` requests are sent verbatim as
+        pre-serialized JSON. If `raw` is set, the data of each response is
+        returned as the `bytes` of its JSON encoding.
+        """
+        ...
+
+    async def random(
+        self, request: JsonLike, annotated: bool = True, raw: bool = False
+    ) -> AsyncIterator[JsonLike]:
         """
         Pick a random instance of the endpoint and issue the request
         """
         ...
 
-    async def round_robin(self, request: JsonLike) -> AsyncIterator[JsonLike]:
+    async def round_robin(
+        self, request: JsonLike, annotated: bool = True, raw: bool = False
+    ) -> AsyncIterator[JsonLike]:
         """
         Pick the next instance of the endpoint in a round-robin fashion
         """
         ...
 
-    async def direct(self, request: JsonLike, instance: str) -> AsyncIterator[JsonLike]:
+    async def least_inflight(
+        self, request: JsonLike, annotated: bool = True, raw: bool = False
+    ) -> AsyncIterator[JsonLike]:
+        """
+        Pick the instance of the endpoint with the fewest streams in flight
+        from this client
+        """
+        ...
+
+    async def power_of_two(
+        self, request: JsonLike, annotated: bool = True, raw: bool = False
+    ) -> AsyncIterator[JsonLike]:
+        """
+        Pick two random instances of the endpoint and issue the request to the
+        less loaded one
+        """
+        ...
+
+    async def direct(
+        self,
+        request: JsonLike,
+        instance: int,
+        annotated: bool = True,
+        raw: bool = False,
+    ) -> AsyncIterator[JsonLike]:
         """
         Pick a specific instance of the endpoint
         """
         ...
 
+    async def generate_many(
+        self,
+        requests: Iterable[JsonLike],
+        strategy: str = "random",
+        endpoint_id: Optional[int] = None,
+        max_inflight: Optional[int] = None,
+        annotated: bool = True,
+        raw: bool = False,
+    ) -> AsyncIterator[Tuple[int, JsonLike]]:
+        """
+        Issue all the requests with a single call and multiplex their responses
+        into one async iterator of `(index, response)` tuples, where `index` is
+        the position of the request in `requests`.
+
+        `strategy` is one of the strategies accepted by `generate`. At most `max_inflight` requests are in flight
+        at a time if set. An error response raises a `ValueError` naming its
+        request index; iteration may continue afterwards.
+        """
+        ...
+
 class KvRouter:
     """
     A router will determine which worker should handle a given request.
@@ -133,18 +357,281 @@ class KvRouter:
 
     ...
 
-    def __init__(self, drt: DistributedRuntime, component: Component) -> None:
+    def __init__(
+        self,
+        drt: DistributedRuntime,
+        component: Component,
+        kv_block_size: Optional[int] = None,
+        policy: Union[str, Callable[[WorkerSnapshot], List[float]], None] = None,
+        weights: Optional[Dict[str, float]] = None,
+        policy_timeout: float = 0.1,
+        queue_capacity: int = 1024,
+        timeout: Optional[float] = None,
+        num_shards: int = 1,
+        expiration: Optional[float] = None,
+        snapshot_path: Optional[str] = None,
+        snapshot_interval: float = 60.0,
+        start_timeout: Optional[float] = 60.0,
+    ) -> None:
         """
         Create a `KvRouter` object that is associated with the `component`
-        """
 
-    def schedule(self, token_ids: List[int], lora_id: int) -> int:
+        Requests are hashed in blocks of `kv_block_size` tokens, by default
+        the block size published by the workers along with their metrics,
+        or 64 if they do not publish one; the router is then only created
+        once the first workers are up. Workers publishing another block size
+        are never scheduled. The constructor blocks while the router starts;
+        `TimeoutError` is raised if it has not started within `start_timeout`
+        seconds, or never with `None`.
+
+        `policy` scores the workers a request can be scheduled on, the worker
+        with the lowest finite cost is selected. It is one of the built-in
+        policies, configured by `weights`:
+        - "default": trades the tokens to prefill against the load; weights
+          `balance_threshold`, `balance_alpha`, `alpha` and `gamma`
+        - "prefix": maximizes the cached prefix
+        - "least_loaded": minimizes the load; weight `gamma` of the request
+          slots against the KV blocks
+        - "queue_time": minimizes the estimated wait, counting each active
+          request as `active_request_tokens` tokens to process
+        or a callable taking a `WorkerSnapshot` and returning one cost per
+        worker. The callable runs on a thread of its own, and the scheduler
+        waits up to `policy_timeout` seconds for it; if it raises, times out
+        or is still running a previous call, the default policy is used
+        instead.
+
+        While all the workers are busy, up to `queue_capacity` requests wait
+        for a worker, by priority; requests beyond it fail right away with
+        `OverloadedError`. `timeout` is how long, in seconds, a request waits
+        unless it sets its own; by default it waits until a worker frees up.
+
+        The blocks cached by the workers are indexed in `num_shards` radix
+        trees, each served by its own thread; the workers are spread over
+        them. With an `expiration`, in seconds, the accesses of each block in
+        that window are counted in the `frequencies` of the `OverlapScores`.
+
+        With a `snapshot_path`, the index is saved to that file every
+        `snapshot_interval` seconds, and restored from it when the router
+        starts; only the blocks of the workers still alive are restored.
+        """
+
+    def schedule(
+        self,
+        token_ids: TokenIds,
+        lora_id: int,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> int:
         """
         Return the worker id that should handle the given token ids,
         exception will be raised if there is no worker available.
+
+        While all the workers are busy the request waits for one, requests of
+        a higher `priority` (0 to 255) first. `OverloadedError` is raised if
+        too many requests are waiting, `TimeoutError` if no worker frees up
+        within `timeout` seconds.
+
+        `lora_id` salts the block hashes, so only the KV cached for the same
+        adapter is matched; 0 is the base model.
+
+        Buffers of `uint32`, such as NumPy arrays or `array('I')`, are copied
+        in bulk rather than item by item; `bytes` hold packed little-endian
+        `uint32`.
+        """
+        ...
+
+    async def find_matches(
+        self, token_ids: TokenIds, lora_id: int = 0
+    ) -> OverlapScores:
+        """
+        Return the blocks of the given token ids already cached by each worker,
+        without scheduling the request. The lookup counts as an access of the
+        matched blocks, so prefer `schedule_with_scores` when also scheduling.
+        """
+        ...
+
+    async def schedule_with_scores(
+        self,
+        token_ids: TokenIds,
+        lora_id: int,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, OverlapScores]:
+        """
+        Same as `schedule`, also returning the overlap scores the decision was
+        based on
+        """
+        ...
+
+    async def schedule_batch(
+        self,
+        token_ids: List[TokenIds],
+        lora_id: int = 0,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> List[Union[int, Exception]]:
+        """
+        Return the worker id that should handle each of the given token id
+        lists. The requests are matched against the indexer in a single pass
+        and assigned jointly, so a burst of similar requests is spread across
+        workers.
+
+        A request that cannot be scheduled, such as one timing out, is
+        returned as its exception, as `schedule` would raise it, like
+        `asyncio.gather(..., return_exceptions=True)`; the other requests
+        keep their workers.
+        """
+        ...
+
+    async def schedule_block_hashes(
+        self,
+        block_hashes: List[int],
+        num_tokens: int,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, OverlapScores]:
+        """
+        Same as `schedule_with_scores`, for a request whose block hashes were
+        already computed by `compute_block_hashes` or a `SequenceHasher` with
+        the block size of the router, and the adapter serving the request.
+        `num_tokens` is the number of input tokens of the request.
+        """
+        ...
+
+    def admission_stats(self) -> AdmissionStats:
+        """
+        Return the statistics of the requests waiting for a worker
+        """
+        ...
+
+    def indexer_lag(self) -> IndexerLag:
+        """
+        Return how far behind the KV events published by the workers the
+        router's indexer is
+        """
+        ...
+
+def compute_block_hashes(
+    token_ids: TokenIds, kv_block_size: int, lora_id: int = 0
+) -> List[int]:
+    """
+    Return the hashes of the full blocks of `kv_block_size` tokens of the
+    given token ids, as matched by a `KvRouter` with the same block size;
+    they are computed without holding the GIL.
+    """
+    ...
+
+class SequenceHasher:
+    """
+    The block hashes of a sequence, such as a conversation, computed as its
+    tokens are appended: each turn only hashes the blocks it completes.
+    """
+
+    # hashes of the full blocks of the sequence
+    block_hashes: List[int]
+    # number of tokens appended to the sequence
+    num_tokens: int
+
+    def __init__(self, kv_block_size: int, lora_id: int = 0) -> None: ...
+    def extend(self, token_ids: TokenIds) -> List[int]:
+        """
+        Append the given token ids, returning the hashes of the blocks they
+        complete
         """
         ...
 
+    def copy(self) -> SequenceHasher:
+        """
+        A copy of the hasher, to follow another branch of the sequence
+        """
+        ...
+
+class OverloadedError(Exception):
+    """
+    Raised when too many requests are waiting for a worker of a `KvRouter`;
+    the request should be shed rather than retried right away.
+    """
+
+    ...
+
+class AdmissionStats:
+    """
+    Statistics of the requests waiting for a worker of a `KvRouter`
+    """
+
+    # number of requests waiting for a worker
+    queue_depth: int
+    # number of requests scheduled on a worker
+    scheduled: int
+    # number of requests rejected with `OverloadedError`
+    rejected: int
+    # number of requests that timed out waiting for a worker
+    expired: int
+    # mean time, in seconds, the scheduled requests waited for a worker
+    mean_wait: float
+    # longest time, in seconds, a scheduled request waited for a worker
+    max_wait: float
+
+class IndexerLag:
+    """
+    How far behind the KV events published by the workers the indexer of a
+    `KvRouter` is
+    """
+
+    # number of events received and not applied yet
+    events: int
+    # how long, in seconds, the last events applied waited, while events are
+    # pending; 0 once the indexer caught up
+    seconds: float
+
+class OverlapScores:
+    """
+    Blocks of a request already cached by each worker
+    """
+
+    # number of leading blocks of the request cached by each worker
+    scores: Dict[int, int]
+    # number of recent accesses of each matched block
+    frequencies: List[int]
+    # number of full blocks of the request
+    num_blocks: int
+
+    def hit_ratio(self, worker_id: int) -> float:
+        """
+        Fraction of the blocks of the request cached by `worker_id`
+        """
+        ...
+
+    def best_worker(self) -> Optional[int]:
+        """
+        Worker caching the most blocks of the request, if any
+        """
+        ...
+
+class WorkerSnapshot:
+    """
+    The workers a request can be scheduled on, as passed to a `KvRouter`
+    policy; each list has one entry per worker
+    """
+
+    worker_ids: List[int]
+    # number of leading blocks of the request cached by each worker
+    overlap_blocks: List[int]
+    # number of tokens of the request each worker would have to prefill
+    new_tokens: List[int]
+    request_active_slots: List[int]
+    request_total_slots: List[int]
+    kv_active_blocks: List[int]
+    kv_total_blocks: List[int]
+    # number of input tokens of the request
+    isl_tokens: int
+    kv_block_size: int
+    # mean and standard deviation of the active KV blocks of all the workers
+    load_avg: float
+    load_std: float
+
+    def __len__(self) -> int: ...
+
 class KvMetricsPublisher:
     """
     A metrics publisher will provide KV metrics to the router.
@@ -166,8 +653,12 @@ class KvMetricsPublisher:
     def publish(self, request_active_slots: int,
         request_total_slots: int,
         kv_active_blocks: int,
-        kv_total_blocks: int) -> None:
+        kv_total_blocks: int,
+        kv_block_size: Optional[int] = None) -> None:
         """
         Update the KV metrics being reported.
+
+        `kv_block_size` is the number of tokens per KV block of the worker;
+        once published, it is kept by the following updates.
         """
         ...
@@ -15,3 +15,6 @@
 
 from triton_distributed._core import KvMetricsPublisher as KvMetricsPublisher
 from triton_distributed._core import KvRouter as KvRouter
+from triton_distributed._core import OverloadedError as OverloadedError
+from triton_distributed._core import SequenceHasher as SequenceHasher
+from triton_distributed._core import compute_block_hashes as compute_block_hashes
@@ -16,7 +16,7 @@
 
 import asyncio
 from functools import wraps
-from typing import Any, AsyncGenerator, Callable, Type
+from typing import Any, AsyncGenerator, Callable, Optional, Type
 
 from pydantic import BaseModel, ValidationError
 
@@ -86,3 +86,61 @@ def triton_endpoint(
         return wrapper
 
     return decorator
+
+
+def triton_msgspec_endpoint(
+    request_type: Type, response_type: Optional[Type] = None, encode: bool = False
+) -> Callable:
+    """
+    Variant of `triton_endpoint` for `msgspec.Struct` (or any msgspec supported) types.
+
+    Requests are decoded with a `msgspec.json.Decoder` compiled once for
+    `request_type`; JSON requests may arrive as `str` or `bytes`, structured
+    requests (e.g. sent by clients as raw bytes) as `dict`.
+
+    If `encode` is set, items yielded as instances of `response_type` are
+    encoded with a cached `msgspec.json.Encoder` and forwarded as raw JSON bytes.
+    `str` and `bytes` items are always forwarded unchanged.
+    """
+    # msgspec is an optional dependency; only required when this decorator is used
+    import msgspec
+
+    decoder = msgspec.json.Decoder(request_type)
+    encoder = msgspec.json.Encoder() if encode else None
+    if encode and response_type is None:
+        raise ValueError("response_type is required when encode=True")
+
+    def decode(request: Any) -> Any:
+        try:
+            if isinstance(request, (str, bytes, bytearray, memoryview)):
+                return decoder.decode(request)
+            elif isinstance(request, dict):
+                return msgspec.convert(request, request_type)
+        except msgspec.DecodeError as e:
+            # also covers msgspec.ValidationError, a subclass raised on schema mismatch
+            raise ValueError(f"Invalid request: {e}")
+        raise ValueError(f"Invalid request: {request}")
+
+    def decorator(
+        func: Callable[..., AsyncGenerator[Any, None]]
+    ) -> Callable[..., AsyncGenerator[Any, None]]:
+        @wraps(func)
+        async def wrapper(*args, **kwargs) -> AsyncGenerator[Any, None]:
+            if len(args) not in [1, 2]:
+                raise ValueError(f"Invalid request arguments: {args}")
+            args_list = list(args)
+            args_list[-1] = decode(args[-1])
+
+            if encoder is None:
+                async for item in func(*args_list, **kwargs):
+                    yield item
+            else:
+                async for item in func(*args_list, **kwargs):
+                    if isinstance(item, response_type):
+                        yield encoder.encode(item)
+                    else:
+                        yield item
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,89 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import asyncio
+import time
+
+import msgspec
+from pydantic import BaseModel
+
+from triton_distributed.runtime import triton_endpoint, triton_msgspec_endpoint
+
+# Micro-benchmark: request decoding overhead of `triton_endpoint` (pydantic)
+# versus `triton_msgspec_endpoint` (msgspec) for a KV router style request.
+#
+# No runtime is started; the decorated handlers are driven directly with the
+# JSON payload a client would send, which isolates the per-request decoding
+# cost from the network.
+
+
+class PydanticTokens(BaseModel):
+    tokens: list[int]
+
+
+class MsgspecTokens(msgspec.Struct):
+    tokens: list[int]
+
+
+class Handler:
+    @triton_endpoint(PydanticTokens, str)
+    async def pydantic_generate(self, request):
+        yield str(len(request.tokens))
+
+    @triton_msgspec_endpoint(MsgspecTokens, str)
+    async def msgspec_generate(self, request):
+        yield str(len(request.tokens))
+
+
+async def run(generate, payload, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        async for _ in generate(payload):
+            pass
+    return time.perf_counter() - start
+
+
+async def main(num_tokens: int, iterations: int):
+    handler = Handler()
+    payload = PydanticTokens(tokens=list(range(num_tokens))).model_dump_json()
+
+    cases = [
+        ("pydantic/str", handler.pydantic_generate, payload),
+        ("msgspec/str", handler.msgspec_generate, payload),
+        ("msgspec/bytes", handler.msgspec_generate, payload.encode()),
+    ]
+
+    print(f"{num_tokens} tokens, {iterations} requests")
+    baseline = None
+    for name, generate, request in cases:
+        # warm up
+        await run(generate, request, min(iterations, 100))
+        elapsed = await run(generate, request, iterations)
+        per_request_us = elapsed / iterations * 1e6
+        baseline = baseline or per_request_us
+        print(
+            f"{name:>16}: {per_request_us:8.2f} us/request "
+            f"({baseline / per_request_us:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-tokens", type=int, default=4096)
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.num_tokens, args.iterations))
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import socket
+import threading
+import uuid
+from typing import Any, Coroutine, Set, TypeVar
+from urllib.parse import urlparse
+
+import pytest
+
+T = TypeVar("T")
+
+
+def _reachable(url: str) -> bool:
+    address = urlparse(url)
+    try:
+        with socket.create_connection((address.hostname, address.port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+class RuntimeHarness:
+    """
+    A `DistributedRuntime` and the event loop it is bound to, running on a
+    background thread
+
+    Only one runtime can be created per process, so it is shared by all the
+    tests; each test issues its coroutines to the loop with `run`.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.runtime = self.run(self._create_runtime())
+
+    async def _create_runtime(self):
+        from triton_distributed.runtime import DistributedRuntime
+
+        return DistributedRuntime(asyncio.get_running_loop())
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: float = 30) -> T:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def close(self):
+        self.runtime.shutdown()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+@pytest.fixture(scope="session")
+def runtime_harness():
+    etcd = os.environ.get("ETCD_ENDPOINTS", "http://localhost:2379").split(",")[0]
+    nats = os.environ.get("NATS_SERVER", "nats://localhost:4222")
+    if not (_reachable(etcd) and _reachable(nats)):
+        pytest.skip("etcd and NATS are required to run the runtime")
+    harness = RuntimeHarness()
+    yield harness
+    harness.close()
+
+
+@pytest.fixture
+def namespace(runtime_harness):
+    """A namespace of the shared runtime not used by any other test"""
+    return runtime_harness.runtime.namespace(f"test-{uuid.uuid4().hex[:12]}")
+
+
+@pytest.fixture
+def serve(namespace):
+    """
+    Serve a handler on the `generate` endpoint of a new component, see
+    `Endpoint.serve_endpoint` for the keyword arguments; returns the endpoint
+    and a client which found it
+    """
+    # keep the serving tasks alive until the test is done
+    tasks: Set[asyncio.Task] = set()
+
+    async def serve(handler, component_name="backend", **kwargs):
+        component = namespace.component(component_name)
+        await component.create_service()
+        endpoint = component.endpoint("generate")
+        tasks.add(asyncio.create_task(endpoint.serve_endpoint(handler, **kwargs)))
+        client = await endpoint.client()
+        await client.wait_for_endpoints()
+        return endpoint, client
+
+    yield serve
+    tasks.clear()
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.pre_merge
+
+
+async def echo(request):
+    for char in request:
+        yield char
+
+
+async def collect(client, request):
+    return [item async for item in await client.generate(request, annotated=False)]
+
+
+def test_batched_ingress(runtime_harness, serve):
+    requests = [f"request-{i}" for i in range(8)]
+
+    async def run():
+        endpoint, client = await serve(echo, batch_window_us=50_000, max_batch_size=4)
+        responses = await asyncio.gather(*[collect(client, r) for r in requests])
+        return endpoint.ingress_batch_stats(), responses
+
+    stats, responses = runtime_harness.run(run())
+
+    assert responses == [list(r) for r in requests]
+    assert stats.requests == len(requests)
+    # a batch never exceeds max_batch_size, so at least two were needed
+    assert 2 <= stats.batches <= len(requests)
+    assert 1 <= stats.max_batch_size <= 4
+    assert stats.mean_batch_size() == pytest.approx(stats.requests / stats.batches)
+
+
+def test_unbatched_ingress_has_no_batches(runtime_harness, serve):
+    async def run():
+        endpoint, client = await serve(echo)
+        responses = await collect(client, "hello")
+        return endpoint.ingress_batch_stats(), responses
+
+    stats, responses = runtime_harness.run(run())
+
+    assert responses == list("hello")
+    assert stats.batches == 0
+    assert stats.requests == 0
+    assert stats.mean_batch_size() == 0.0
@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import itertools
+
+import pytest
+
+pytestmark = pytest.mark.pre_merge
+
+
+class EndlessHandler:
+    """
+    Yields increasing numbers until cancelled, recording how its async
+    generator ended
+    """
+
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.cancelled = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def generate(self, request, context):
+        try:
+            for i in itertools.count():
+                if i == self.stop_after:
+                    context.stop_generating()
+                yield i
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        finally:
+            self.closed.set()
+
+
+def test_stop_generating_cancels_generator(runtime_harness, serve):
+    async def run():
+        handler = EndlessHandler(stop_after=2)
+        _, client = await serve(handler.generate)
+        responses = [i async for i in await client.generate("go", annotated=False)]
+        await asyncio.wait_for(handler.cancelled.wait(), 10)
+        await asyncio.wait_for(handler.closed.wait(), 10)
+        return responses
+
+    responses = runtime_harness.run(run())
+
+    # the stream ends once the request is stopped, without an error
+    assert responses[:3] == [0, 1, 2]
+
+
+def test_dropped_stream_closes_generator(runtime_harness, serve):
+    async def run():
+        handler = EndlessHandler()
+        _, client = await serve(handler.generate)
+        stream = await client.generate("go", annotated=False)
+        received = []
+        async for i in stream:
+            received.append(i)
+            if len(received) == 2:
+                break
+        del stream
+        await asyncio.wait_for(handler.closed.wait(), 10)
+        return received
+
+    assert runtime_harness.run(run()) == [0, 1]
@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from collections import defaultdict
+
+import pytest
+
+pytestmark = pytest.mark.pre_merge
+
+
+class EchoHandler:
+    """Echoes the characters of each request, tracking how many run at once"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    async def generate(self, request):
+        if request == "fail":
+            raise ValueError("failing on purpose")
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            for char in request:
+                await asyncio.sleep(0.01)
+                yield char
+        finally:
+            self.active -= 1
+
+
+async def collect(stream):
+    """Group the responses by request index; returns them and the errors raised"""
+    responses = defaultdict(list)
+    errors = []
+    while True:
+        try:
+            index, item = await stream.__anext__()
+        except StopAsyncIteration:
+            break
+        except ValueError as e:
+            errors.append(str(e))
+            continue
+        responses[index].append(item)
+    return dict(responses), errors
+
+
+def test_generate_many_multiplexes_responses(runtime_harness, serve):
+    requests = ["abc", "de", "fghi", ""]
+
+    async def run():
+        handler = EchoHandler()
+        _, client = await serve(handler.generate)
+        return await collect(await client.generate_many(requests, annotated=False))
+
+    responses, errors = runtime_harness.run(run())
+
+    assert errors == []
+    assert responses == {i: list(r) for i, r in enumerate(requests) if r}
+
+
+def test_generate_many_max_inflight(runtime_harness, serve):
+    requests = ["abc"] * 6
+
+    async def run():
+        handler = EchoHandler()
+        _, client = await serve(handler.generate)
+        stream = await client.generate_many(requests, max_inflight=2, annotated=False)
+        return await collect(stream), handler.max_active
+
+    (responses, errors), max_active = runtime_harness.run(run())
+
+    assert errors == []
+    assert responses == {i: list("abc") for i in range(len(requests))}
+    assert 1 <= max_active <= 2
+
+
+def test_generate_many_error_names_request(runtime_harness, serve):
+    requests = ["ab", "fail", "cd"]
+
+    async def run():
+        handler = EchoHandler()
+        _, client = await serve(handler.generate)
+        return await collect(await client.generate_many(requests, annotated=False))
+
+    responses, errors = runtime_harness.run(run())
+
+    # iteration continues with the other requests after the error
+    assert responses == {0: ["a", "b"], 2: ["c", "d"]}
+    assert len(errors) == 1
+    assert errors[0].startswith("request 1:")
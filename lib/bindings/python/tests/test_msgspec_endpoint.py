@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+msgspec = pytest.importorskip("msgspec")
+
+from triton_distributed.runtime import triton_msgspec_endpoint  # noqa: E402
+
+pytestmark = pytest.mark.pre_merge
+
+
+class Tokens(msgspec.Struct):
+    tokens: list[int]
+
+
+@triton_msgspec_endpoint(Tokens, Tokens, encode=True)
+async def generate(request):
+    yield Tokens(tokens=request.tokens[::-1])
+
+
+async def collect(request):
+    return [item async for item in generate(request)]
+
+
+@pytest.mark.parametrize(
+    "request_",
+    ['{"tokens": [1, 2, 3]}', b'{"tokens": [1, 2, 3]}', {"tokens": [1, 2, 3]}],
+)
+async def test_decodes_requests(request_):
+    assert await collect(request_) == [b'{"tokens":[3,2,1]}']
+
+
+@pytest.mark.parametrize(
+    "request_",
+    [
+        # malformed json raises msgspec.DecodeError
+        '{"tokens": [1, 2',
+        b"not json",
+        # a schema mismatch raises msgspec.ValidationError
+        '{"tokens": "abc"}',
+        {"tokens": ["a"]},
+    ],
+)
+async def test_invalid_requests_raise_value_error(request_):
+    with pytest.raises(ValueError, match="Invalid request"):
+        await collect(request_)
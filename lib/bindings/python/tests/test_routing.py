@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import itertools
+
+import pytest
+
+pytestmark = pytest.mark.pre_merge
+
+
+async def endless(request):
+    for i in itertools.count():
+        yield i
+        await asyncio.sleep(0.01)
+
+
+async def wait_for_inflight(client, expected, timeout=10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while client.inflight() != expected:
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError(f"in-flight counts {client.inflight()} != {expected}")
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize("strategy", ["least_inflight", "power_of_two"])
+def test_inflight_released_after_early_drop(runtime_harness, serve, strategy):
+    async def run():
+        _, client = await serve(endless)
+        (instance,) = client.endpoint_ids()
+
+        stream = await client.generate("go", annotated=False, strategy=strategy)
+        received = []
+        async for i in stream:
+            received.append(i)
+            if len(received) == 2:
+                break
+        inflight = client.inflight()
+
+        # the generator never ends, so only the dropped stream releases the count
+        del stream
+        await wait_for_inflight(client, {})
+        return instance, inflight
+
+    instance, inflight = runtime_harness.run(run())
+
+    assert inflight == {instance: 1}
+
+
+def test_inflight_released_after_completion(runtime_harness, serve):
+    async def bounded(request):
+        for i in range(3):
+            yield i
+
+    async def run():
+        _, client = await serve(bounded)
+        items = [i async for i in await client.generate("go", annotated=False)]
+        await wait_for_inflight(client, {})
+        return items
+
+    assert runtime_harness.run(run()) == [0, 1, 2]
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.pre_merge
+
+NUM_ITEMS = 32
+
+# serialized as the 18 bytes of a JSON string
+ITEM = "x" * 16
+
+
+async def burst(request):
+    for _ in range(NUM_ITEMS):
+        yield ITEM
+
+
+def test_stream_buffer_bounds(runtime_harness, serve):
+    async def run():
+        endpoint, _ = await serve(burst, stream_buffer=4)
+        client = await endpoint.client(stream_buffer=2, stream_buffer_bytes=64)
+        await client.wait_for_endpoints()
+
+        stream = await client.generate("go", annotated=False)
+        # let the producer fill every buffer before reading
+        await asyncio.sleep(0.5)
+        items = [item async for item in stream]
+        return (
+            items,
+            stream.buffer_stats(),
+            client.stream_buffer_stats(),
+            endpoint.stream_buffer_stats(),
+        )
+
+    items, stream_stats, client_stats, endpoint_stats = runtime_harness.run(run())
+
+    assert items == [ITEM] * NUM_ITEMS
+    assert 1 <= stream_stats.high_water_items <= 2
+    assert 0 < stream_stats.high_water_bytes <= 64
+    # the client only issued this stream
+    assert client_stats.high_water_items == stream_stats.high_water_items
+    assert client_stats.high_water_bytes == stream_stats.high_water_bytes
+    assert 1 <= endpoint_stats.high_water_items <= 4
+
+
+def test_stream_buffer_stats_start_empty(runtime_harness, serve):
+    async def run():
+        endpoint, client = await serve(burst)
+        return client.stream_buffer_stats(), endpoint.stream_buffer_stats()
+
+    client_stats, endpoint_stats = runtime_harness.run(run())
+
+    assert client_stats.high_water_items == 0
+    assert client_stats.high_water_bytes == 0
+    assert endpoint_stats.high_water_items == 0
+    assert endpoint_stats.high_water_bytes == 0
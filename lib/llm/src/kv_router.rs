@@ -15,7 +15,7 @@
 
 use anyhow::Result;
 use futures::stream::StreamExt;
-use std::{sync::Arc, time::Duration};
+use std::{collections::HashSet, path::Path, sync::Arc, time::Duration};
 use tokio_util::sync::CancellationToken;
 use tracing;
 use triton_distributed_runtime::{component::Component, DistributedRuntime};
@@ -23,18 +23,33 @@ use triton_distributed_runtime::{component::Component, DistributedRuntime};
 pub mod indexer;
 pub mod protocols;
 pub mod publisher;
+pub mod resync;
 pub mod scheduler;
 pub mod scoring;
 
 use crate::kv_router::{
-    indexer::{KvIndexer, KvIndexerInterface, RouterEvent},
-    scheduler::{Endpoint, KvScheduler, Service},
-    scoring::ProcessedEndpoints,
+    indexer::{
+        compute_block_hash_for_seq, decode_snapshot, encode_snapshot, IndexerConfig, IndexerLag,
+        KvIndexerInterface, OverlapScores, RouterEvent, SnapshotConfig, MAX_EVENT_BATCH,
+    },
+    protocols::{KvResyncRequest, LocalBlockHash},
+    resync::EventGapTracker,
+    scheduler::{
+        AdmissionConfig, AdmissionOptions, AdmissionStats, Endpoint, KvScheduler, KvSchedulerError,
+        Service,
+    },
+    scoring::{CostFunction, ProcessedEndpoints},
 };
 
 // this should be discovered from the backend
 pub const KV_EVENT_SUBJECT: &str = "kv_events";
 
+/// The subject the [`KvResyncRequest`]s are sent to by the routers receiving the KV events
+/// published on `kv_subject`
+pub fn kv_resync_subject(kv_subject: &str) -> String {
+    format!("{}.resync", kv_subject)
+}
+
 pub struct KvRouter {
     // properties of request plane
     // maybe rolled up into the generic object or not
@@ -45,26 +60,49 @@ pub struct KvRouter {
     #[allow(dead_code)]
     scheduler: KvScheduler,
 
-    indexer: KvIndexer,
+    indexer: Arc<dyn KvIndexerInterface + Send + Sync>,
 }
 
 impl KvRouter {
+    /// Create a router for the workers of `backend`
+    ///
+    /// Unless `kv_block_size` is given, the KV block size published by the workers is used.
+    /// The workers are scored with `cost_fn`, [`DefaultCost`](scoring::DefaultCost) by default.
+    /// The requests waiting for a worker are queued as set by `admission`, and the blocks cached
+    /// by the workers are indexed as set by `indexer`.
     pub async fn from_runtime(
         runtime: DistributedRuntime,
         backend: Component,
+        kv_block_size: Option<usize>,
+        cost_fn: Option<Arc<dyn CostFunction>>,
+        admission: AdmissionConfig,
+        indexer: IndexerConfig,
     ) -> Result<Arc<Self>> {
         let nats_client = runtime.nats_client();
         let service_name = backend.service_name();
         let kv_subject = backend.event_subject(KV_EVENT_SUBJECT);
         tracing::info!("Component Service Name {}", service_name);
         tracing::info!("KV Subject {}", kv_subject);
-        Self::new(nats_client, service_name, kv_subject).await
+        Self::new(
+            nats_client,
+            service_name,
+            kv_subject,
+            kv_block_size,
+            cost_fn,
+            admission,
+            indexer,
+        )
+        .await
     }
 
     pub async fn new(
         nats_client: triton_distributed_runtime::transports::nats::Client,
         service_name: String,
         kv_subject: String,
+        kv_block_size: Option<usize>,
+        cost_fn: Option<Arc<dyn CostFunction>>,
+        admission: AdmissionConfig,
+        indexer: IndexerConfig,
     ) -> Result<Arc<Self>> {
         let cancellation_token = CancellationToken::new();
         let (ep_tx, ep_rx) = tokio::sync::mpsc::channel(128);
@@ -76,29 +114,75 @@ impl KvRouter {
             cancellation_token.clone(),
         ));
 
-        let indexer = KvIndexer::new(cancellation_token.clone());
-        let scheduler = KvScheduler::start(ep_rx).await?;
+        // the scheduler negotiates the block size with the workers, the indexer hashes with it
+        let scheduler = KvScheduler::start(ep_rx, kv_block_size, cost_fn, admission).await?;
+        tracing::info!("KV indexer: {:?}", indexer);
+        let snapshot = indexer.snapshot.clone();
+        let indexer: Arc<dyn KvIndexerInterface + Send + Sync> =
+            Arc::from(indexer.start(cancellation_token.clone(), scheduler.kv_block_size()));
+
+        // restored before subscribing, so that the live events are applied on top
+        if let Some(snapshot) = snapshot {
+            restore_snapshot(
+                &nats_client,
+                &service_name,
+                indexer.as_ref(),
+                &snapshot.path,
+            )
+            .await;
+            tokio::spawn(save_snapshots(
+                indexer.clone(),
+                snapshot,
+                cancellation_token.clone(),
+            ));
+        }
 
         tracing::debug!("subscribing to kv events: {}", kv_subject);
-        let mut kv_events_rx = nats_client.client().subscribe(kv_subject).await?;
+        let resync_subject = kv_resync_subject(&kv_subject);
+        // the messages already received are decoded together and sent to the indexer as one
+        // batch, which it applies in a single pass
+        let mut kv_events_rx = nats_client
+            .client()
+            .subscribe(kv_subject)
+            .await?
+            .ready_chunks(MAX_EVENT_BATCH);
         let kv_events_tx = indexer.event_sender();
+        let client = nats_client.client().clone();
 
         tokio::spawn(async move {
-            while let Some(event) = kv_events_rx.next().await {
-                let event: RouterEvent = match serde_json::from_slice(&event.payload) {
-                    Ok(event) => {
-                        tracing::debug!("received kv event: {:?}", event);
-                        event
+            let mut tracker = EventGapTracker::default();
+            while let Some(messages) = kv_events_rx.next().await {
+                let mut events = Vec::with_capacity(messages.len());
+                for message in messages {
+                    match RouterEvent::decode_batch(&message.payload) {
+                        Ok(batch) => {
+                            tracing::debug!("received kv events: {:?}", batch);
+                            events.extend(batch);
+                        }
+                        Err(e) => {
+                            tracing::warn!("Failed to deserialize RouterEvent: {:?}", e);
+                            // Choosing warn and continue to process other events from other workers
+                            // A bad event likely signals a problem with a worker, but potentially other workers are still healthy
+                        }
                     }
-                    Err(e) => {
-                        tracing::warn!("Failed to deserialize RouterEvent: {:?}", e);
-                        // Choosing warn and continue to process other events from other workers
-                        // A bad event likely signals a problem with a worker, but potentially other workers are still healthy
-                        continue;
+                }
+                if events.is_empty() {
+                    continue;
+                }
+                // the answers are published along with the next events of the workers
+                for worker_id in tracker.track(&events) {
+                    let request = serde_json::to_vec(&KvResyncRequest { worker_id }).unwrap();
+                    if let Err(e) = client.publish(resync_subject.clone(), request.into()).await {
+                        tracing::warn!(
+                            "failed to request a resync of worker {}: {:?}",
+                            worker_id,
+                            e
+                        );
                     }
-                };
-                if let Err(e) = kv_events_tx.send(event).await {
+                }
+                if let Err(e) = kv_events_tx.send(events).await {
                     tracing::trace!("failed to send kv event to indexer; shutting down: {:?}", e);
+                    break;
                 }
             }
         });
@@ -119,22 +203,123 @@ impl KvRouter {
         &self.service_name
     }
 
-    // [TODO] indexer needs to take 'lora_id' as parameter
-    pub async fn schedule(&self, token_ids: &Vec<u32>, _lora_id: u64) -> Result<i64> {
+    /// The number of tokens per KV block of the workers
+    pub fn kv_block_size(&self) -> usize {
+        self.indexer.kv_block_size()
+    }
+
+    /// How far behind the KV events published by the workers the indexer is
+    pub fn indexer_lag(&self) -> IndexerLag {
+        self.indexer.lag()
+    }
+
+    /// Statistics of the requests waiting for a worker
+    pub fn admission_stats(&self) -> AdmissionStats {
+        self.scheduler.admission_stats()
+    }
+
+    pub async fn schedule(&self, token_ids: &[u32], lora_id: u64) -> Result<i64> {
+        let (worker_id, _) = self
+            .schedule_with_scores(token_ids, lora_id, AdmissionOptions::default())
+            .await?;
+        Ok(worker_id)
+    }
+
+    /// Find the blocks of `token_ids` already cached by each worker, without scheduling
+    pub async fn find_matches(&self, token_ids: &[u32], lora_id: u64) -> Result<OverlapScores> {
+        let overlap_scores = self
+            .indexer
+            .find_matches_for_request(token_ids, lora_id)
+            .await?;
+        Ok(overlap_scores)
+    }
+
+    /// Schedule a request, also returning the overlap scores the decision was based on
+    ///
+    /// While all the workers are busy, the request waits in the admission queue of the scheduler
+    /// as set by `options`. Fails with [`KvSchedulerError::Overloaded`](scheduler::KvSchedulerError)
+    /// if the queue is full, or [`KvSchedulerError::DeadlineExceeded`](scheduler::KvSchedulerError)
+    /// if no worker frees up in time.
+    pub async fn schedule_with_scores(
+        &self,
+        token_ids: &[u32],
+        lora_id: u64,
+        options: AdmissionOptions,
+    ) -> Result<(i64, OverlapScores)> {
         // Extracting part of the code in KvRouter::generate() for only
         // the decision making part, routing is done by the caller
         let isl_tokens = token_ids.len();
         let overlap_scores = self
             .indexer
-            .find_matches_for_request(token_ids.as_slice())
+            .find_matches_for_request(token_ids, lora_id)
             .await?;
         tracing::debug!("KV router overlap_scores: {:?}", overlap_scores);
-        let worker_id = self.scheduler.schedule(overlap_scores, isl_tokens).await?;
-        Ok(worker_id)
+        let worker_id = self
+            .scheduler
+            .schedule(overlap_scores.clone(), isl_tokens, options)
+            .await?;
+        Ok((worker_id, overlap_scores))
+    }
+
+    /// Schedule a request whose block hashes were already computed, such as by a
+    /// [`SequenceHasher`](indexer::SequenceHasher) following a conversation
+    ///
+    /// The hashes must be those of [`compute_block_hash_for_seq`] with the block size of the
+    /// router; `isl_tokens` is the number of input tokens of the request. Otherwise the same as
+    /// [`KvRouter::schedule_with_scores`].
+    pub async fn schedule_block_hashes(
+        &self,
+        block_hashes: Vec<LocalBlockHash>,
+        isl_tokens: usize,
+        options: AdmissionOptions,
+    ) -> Result<(i64, OverlapScores)> {
+        let overlap_scores = self.indexer.find_matches(block_hashes).await?;
+        tracing::debug!("KV router overlap_scores: {:?}", overlap_scores);
+        let worker_id = self
+            .scheduler
+            .schedule(overlap_scores.clone(), isl_tokens, options)
+            .await?;
+        Ok((worker_id, overlap_scores))
+    }
+
+    /// Schedule several requests at once
+    ///
+    /// The overlap scores of all the requests are found in a single pass of the indexer, then
+    /// the workers are assigned jointly, so that similar requests arriving in a burst are spread
+    /// across workers rather than all sent to the one that looked best for each of them.
+    /// Returns the worker id of each request, in order, or the error it failed with on its own;
+    /// the other requests keep their workers. All the requests are admitted with the same
+    /// `options`.
+    pub async fn schedule_batch<T: AsRef<[u32]>>(
+        &self,
+        token_ids: &[T],
+        lora_id: u64,
+        options: AdmissionOptions,
+    ) -> Result<Vec<Result<i64, KvSchedulerError>>> {
+        if token_ids.is_empty() {
+            return Ok(Vec::new());
+        }
+
+        let kv_block_size = self.indexer.kv_block_size();
+        let sequences = token_ids
+            .iter()
+            .map(|tokens| compute_block_hash_for_seq(tokens.as_ref(), kv_block_size, lora_id))
+            .collect();
+        let overlap_scores = self.indexer.find_matches_batch(sequences).await?;
+        tracing::debug!("KV router batch overlap_scores: {:?}", overlap_scores);
+
+        let requests = overlap_scores
+            .into_iter()
+            .zip(token_ids.iter().map(|tokens| tokens.as_ref().len()))
+            .collect();
+        let results = self.scheduler.schedule_batch(requests, options).await?;
+        Ok(results)
     }
 }
 
-async fn collect_endpoints(
+/// Periodically collect the [`ForwardPassMetrics`](protocols::ForwardPassMetrics) published by
+/// the endpoints of `service_name` and forward them to `ep_tx` until `cancel` is triggered
+pub async fn collect_endpoints(
     nats_client: triton_distributed_runtime::transports::nats::Client,
     service_name: String,
     ep_tx: tokio::sync::mpsc::Sender<ProcessedEndpoints>,
@@ -151,49 +336,14 @@ async fn collect_endpoints(
             }
         }
 
-        let values = match nats_client
-            .get_endpoints(&service_name, Duration::from_secs(1))
-            .await
-        {
-            Ok(v) => v,
+        let endpoints = match get_endpoints(&nats_client, &service_name).await {
+            Ok(endpoints) => endpoints,
             Err(e) => {
                 tracing::warn!("Failed to retrieve endpoints for {}: {:?}", service_name, e);
                 continue;
             }
         };
 
-        tracing::debug!("values: {:?}", values);
-        let services: Vec<Service> = values
-            .into_iter()
-            .filter(|v| !v.is_empty())
-            .filter_map(|v| match serde_json::from_slice::<Service>(&v) {
-                Ok(service) => Some(service),
-                Err(e) => {
-                    tracing::warn!("For value: {:?} \nFailed to parse service: {:?}", v, e);
-                    None
-                }
-            })
-            .collect();
-        tracing::debug!("services: {:?}", services);
-
-        let endpoints: Vec<Endpoint> = services
-            .into_iter()
-            .flat_map(|s| s.endpoints)
-            .filter(|s| s.data.is_some())
-            .map(|s| Endpoint {
-                name: s.name,
-                subject: s.subject,
-                data: s.data.unwrap(),
-            })
-            .collect();
-        tracing::debug!("endpoints: {:?}", endpoints);
-
-        tracing::trace!(
-            "found {} endpoints for service: {}",
-            endpoints.len(),
-            service_name
-        );
-
         let processed = ProcessedEndpoints::new(endpoints);
 
         // process endpoints into
@@ -203,3 +353,161 @@ async fn collect_endpoints(
         }
     }
 }
+
+/// Get the endpoints of `service_name` along with the metrics they publish
+pub async fn get_endpoints(
+    nats_client: &triton_distributed_runtime::transports::nats::Client,
+    service_name: &str,
+) -> Result<Vec<Endpoint>> {
+    let values = nats_client
+        .get_endpoints(service_name, Duration::from_secs(1))
+        .await?;
+
+    tracing::debug!("values: {:?}", values);
+    let services: Vec<Service> = values
+        .into_iter()
+        .filter(|v| !v.is_empty())
+        .filter_map(|v| match serde_json::from_slice::<Service>(&v) {
+            Ok(service) => Some(service),
+            Err(e) => {
+                tracing::warn!("For value: {:?} \nFailed to parse service: {:?}", v, e);
+                None
+            }
+        })
+        .collect();
+    tracing::debug!("services: {:?}", services);
+
+    let endpoints: Vec<Endpoint> = services
+        .into_iter()
+        .flat_map(|s| s.endpoints)
+        .filter(|s| s.data.is_some())
+        .map(|s| Endpoint {
+            name: s.name,
+            subject: s.subject,
+            data: s.data.unwrap(),
+        })
+        .collect();
+    tracing::debug!("endpoints: {:?}", endpoints);
+
+    tracing::trace!(
+        "found {} endpoints for service: {}",
+        endpoints.len(),
+        service_name
+    );
+    Ok(endpoints)
+}
+
+/// Restore `indexer` from the snapshot at `path`, if there is one
+///
+/// Only the blocks of the workers of `service_name` still alive are restored; the events they
+/// publish from then on are applied on top. The router starts with an empty index if the
+/// snapshot cannot be restored.
+async fn restore_snapshot(
+    nats_client: &triton_distributed_runtime::transports::nats::Client,
+    service_name: &str,
+    indexer: &(dyn KvIndexerInterface + Send + Sync),
+    path: &Path,
+) {
+    let data = match tokio::fs::read(path).await {
+        Ok(data) => data,
+        Err(e) if e.kind() == std::io::ErrorKind::NotFound => {
+            tracing::info!("no KV indexer snapshot at {}", path.display());
+            return;
+        }
+        Err(e) => {
+            tracing::warn!(
+                "failed to read KV indexer snapshot {}: {}",
+                path.display(),
+                e
+            );
+            return;
+        }
+    };
+    let (kv_block_size, events) = match decode_snapshot(&data) {
+        Ok(snapshot) => snapshot,
+        Err(e) => {
+            tracing::warn!("invalid KV indexer snapshot {}: {}", path.display(), e);
+            return;
+        }
+    };
+    if kv_block_size != indexer.kv_block_size() {
+        tracing::warn!(
+            "KV indexer snapshot {} was taken with a block size of {}, not {}; ignoring it",
+            path.display(),
+            kv_block_size,
+            indexer.kv_block_size()
+        );
+        return;
+    }
+
+    let workers: HashSet<i64> = match get_endpoints(nats_client, service_name).await {
+        Ok(endpoints) => endpoints.iter().map(Endpoint::worker_id).collect(),
+        Err(e) => {
+            tracing::warn!(
+                "failed to list the workers to restore the KV indexer: {:?}",
+                e
+            );
+            return;
+        }
+    };
+    let num_events = events.len();
+    let events: Vec<_> = events
+        .into_iter()
+        .filter(|event| workers.contains(&event.worker_id()))
+        .collect();
+    tracing::info!(
+        "restoring {} of the {} events of the KV indexer snapshot {}, for {} live workers",
+        events.len(),
+        num_events,
+        path.display(),
+        workers.len()
+    );
+    if let Err(e) = indexer.event_sender().send(events).await {
+        tracing::warn!("failed to restore the KV indexer snapshot: {:?}", e);
+    }
+}
+
+/// Periodically save a snapshot of `indexer` until `cancel` is triggered
+async fn save_snapshots(
+    indexer: Arc<dyn KvIndexerInterface + Send + Sync>,
+    config: SnapshotConfig,
+    cancel: CancellationToken,
+) {
+    loop {
+        tokio::select! {
+            _ = cancel.cancelled() => {
+                break;
+            }
+            _ = tokio::time::sleep(config.interval) => {}
+        }
+
+        let events = match indexer.snapshot().await {
+            Ok(events) => events,
+            Err(e) => {
+                tracing::warn!("failed to take a KV indexer snapshot: {:?}", e);
+                continue;
+            }
+        };
+        let data = encode_snapshot(&events, indexer.kv_block_size());
+
+        // written aside then renamed, so that the previous snapshot is only replaced by a whole one
+        let tmp_path = config.path.with_extension("tmp");
+        let written = async {
+            tokio::fs::write(&tmp_path, &data).await?;
+            tokio::fs::rename(&tmp_path, &config.path).await
+        };
+        match written.await {
+            Ok(()) => tracing::debug!(
+                "saved KV indexer snapshot of {} events to {} ({} bytes)",
+                events.len(),
+                config.path.display(),
+                data.len()
+            ),
+            Err(e) => tracing::warn!(
+                "failed to save KV indexer snapshot to {}: {}",
+                config.path.display(),
+                e
+            ),
+        }
+    }
+}
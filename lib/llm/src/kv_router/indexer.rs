@@ -24,6 +24,7 @@
 //!
 //! - **Radix Tree Structure**:
 //!   - The `RadixTree` struct represents the main data structure, with nodes (`RadixBlock`) containing children and associated worker IDs.
+//!   - The nodes are kept in an arena and refer to each other by index, their workers being a bitset of the workers of the tree.
 //!   - It allows efficient storage and retrieval of data blocks based on their hashes.
 //!
 //! - **Event Handling**:
@@ -43,16 +44,20 @@
 //!
 //! This module provides a scalable and efficient way to manage and retrieve data blocks for LLM inference, leveraging a global KV cache to optimize performance.
 
-use bytes::Bytes;
 // use prometheus::{IntCounter, IntGauge};
 use async_trait::async_trait;
 use serde::{Deserialize, Serialize};
 use std::{
+    borrow::Cow,
     cell::RefCell,
     collections::{HashMap, HashSet, VecDeque},
     iter,
-    rc::Rc,
-    sync::OnceLock,
+    mem::{size_of, size_of_val},
+    path::PathBuf,
+    sync::{
+        atomic::{AtomicU64, Ordering},
+        Arc, Mutex, OnceLock,
+    },
     thread::JoinHandle,
     time::{Duration, Instant},
 };
@@ -63,6 +68,9 @@ use xxhash_rust::xxh3;
 
 pub const XXH3_SEED: u64 = 1337;
 
+/// The maximum number of events an indexer applies to its radix tree in one pass.
+pub const MAX_EVENT_BATCH: usize = 512;
+
 use crate::kv_router::protocols::*;
 
 /// Errors that can occur in the KV Router.
@@ -81,9 +89,6 @@ pub enum KvRouterError {
 /// Identifier of a LLM worker which emits events to the router.
 pub type WorkerId = i64;
 
-/// A shared reference to a [`RadixBlock`].
-type SharedRadixBlock = Rc<RefCell<RadixBlock>>;
-
 /// Compute the hash of a local block.
 ///
 /// ### Arguments
@@ -97,39 +102,151 @@ pub fn compute_block_hash(data: &[u8]) -> LocalBlockHash {
     LocalBlockHash(xxh3::xxh3_64_with_seed(data, XXH3_SEED))
 }
 
-// /// Updated version of the `compute_block_hash` function that included the lora_id
-// pub fn compute_block_hash_v2(token_id: &[u32], lora_id: u64) {
-//     let mut bytes = Vec::new();
-//     for token in token_id {
-//         bytes.extend_from_slice(&token.to_le_bytes());
-//     }
-//     bytes.extend_from_slice(&lora_id.to_le_bytes());
-//     let hash = xxh3::xxh3_64_with_seed(&bytes, XXH3_SEED);
-// }
+/// Compute the hash of a block of tokens, salted with the LoRA adapter the block was computed with.
+///
+/// Blocks of the base model (`lora_id` of 0) hash to the same value as [`compute_block_hash`] of
+/// their little-endian bytes, so the hashes of workers not serving adapters are unchanged.
+///
+/// ### Arguments
+///
+/// * `tokens` - The token ids of the block.
+/// * `lora_id` - The id of the LoRA adapter, or 0 for the base model.
+///
+/// ### Returns
+///
+/// A `LocalBlockHash` representing the computed hash.
+pub fn compute_block_hash_with_lora(tokens: &[u32], lora_id: u64) -> LocalBlockHash {
+    let bytes = token_bytes(tokens);
+    if lora_id == 0 {
+        return compute_block_hash(&bytes);
+    }
+    let mut hasher = xxh3::Xxh3::with_seed(XXH3_SEED);
+    hasher.update(&bytes);
+    hasher.update(&lora_id.to_le_bytes());
+    LocalBlockHash(hasher.digest())
+}
+
+/// The bytes of `tokens` as little-endian `u32`s, borrowed in place on little-endian targets.
+fn token_bytes(tokens: &[u32]) -> Cow<'_, [u8]> {
+    if cfg!(target_endian = "little") {
+        // SAFETY: the bytes of a `u32` slice are initialized and any value is a valid `u8`, the
+        // length covers the tokens exactly and `u8` has no alignment requirement
+        Cow::Borrowed(unsafe {
+            std::slice::from_raw_parts(tokens.as_ptr().cast::<u8>(), size_of_val(tokens))
+        })
+    } else {
+        Cow::Owned(
+            tokens
+                .iter()
+                .flat_map(|token| token.to_le_bytes())
+                .collect(),
+        )
+    }
+}
 
 /// Compute the hash for a sequence of tokens.
 ///
 /// ### Arguments
 ///
 /// * `tokens` - A vector of `u32` tokens.
+/// * `kv_block_size` - The number of tokens per block.
+/// * `lora_id` - The id of the LoRA adapter serving the sequence, or 0 for the base model.
 ///
 /// ### Returns
 ///
 /// A vector of `LocalBlockHash` representing the computed hashes for each chunk of tokens.
-pub fn compute_block_hash_for_seq(tokens: &[u32]) -> Vec<LocalBlockHash> {
+pub fn compute_block_hash_for_seq(
+    tokens: &[u32],
+    kv_block_size: usize,
+    lora_id: u64,
+) -> Vec<LocalBlockHash> {
     tokens
-        .chunks_exact(KV_BLOCK_SIZE) // Split into chunks of KV_BLOCK_SIZE elements
-        .map(|chunk| {
-            let bytes: Vec<u8> = chunk
-                .iter()
-                .flat_map(|&num| num.to_le_bytes()) // Convert each i32 to its little-endian bytes
-                .collect();
-
-            compute_block_hash(&Bytes::from(bytes)) // Convert the byte Vec to Bytes
-        })
+        .chunks_exact(kv_block_size) // Split into chunks of kv_block_size elements
+        .map(|chunk| compute_block_hash_with_lora(chunk, lora_id))
         .collect()
 }
 
+/// Computes the block hashes of a sequence as its tokens are appended, such as the turns of a
+/// chat, hashing each block once.
+///
+/// The hashes are those of [`compute_block_hash_for_seq`] for all the tokens appended so far;
+/// the tokens past the last full block are kept until the block fills up.
+#[derive(Debug, Clone)]
+pub struct SequenceHasher {
+    kv_block_size: usize,
+    lora_id: u64,
+    block_hashes: Vec<LocalBlockHash>,
+    /// The tokens of the partial block at the end of the sequence
+    partial: Vec<u32>,
+}
+
+impl SequenceHasher {
+    /// Create a new `SequenceHasher` for an empty sequence.
+    ///
+    /// ### Arguments
+    ///
+    /// * `kv_block_size` - The number of tokens per block, which must be positive.
+    /// * `lora_id` - The id of the LoRA adapter serving the sequence, or 0 for the base model.
+    pub fn new(kv_block_size: usize, lora_id: u64) -> Self {
+        assert!(kv_block_size > 0, "kv_block_size must be positive");
+        Self {
+            kv_block_size,
+            lora_id,
+            block_hashes: Vec::new(),
+            partial: Vec::with_capacity(kv_block_size),
+        }
+    }
+
+    /// Append tokens to the sequence.
+    ///
+    /// ### Arguments
+    ///
+    /// * `tokens` - The tokens to append.
+    ///
+    /// ### Returns
+    ///
+    /// The hashes of the blocks completed by the tokens.
+    pub fn extend(&mut self, mut tokens: &[u32]) -> &[LocalBlockHash] {
+        let completed = self.block_hashes.len();
+        if !self.partial.is_empty() {
+            let missing = (self.kv_block_size - self.partial.len()).min(tokens.len());
+            self.partial.extend_from_slice(&tokens[..missing]);
+            tokens = &tokens[missing..];
+            if self.partial.len() < self.kv_block_size {
+                return &[];
+            }
+            self.block_hashes
+                .push(compute_block_hash_with_lora(&self.partial, self.lora_id));
+            self.partial.clear();
+        }
+        let chunks = tokens.chunks_exact(self.kv_block_size);
+        self.partial.extend_from_slice(chunks.remainder());
+        self.block_hashes
+            .extend(chunks.map(|chunk| compute_block_hash_with_lora(chunk, self.lora_id)));
+        &self.block_hashes[completed..]
+    }
+
+    /// The hashes of the full blocks of the sequence.
+    pub fn block_hashes(&self) -> &[LocalBlockHash] {
+        &self.block_hashes
+    }
+
+    /// The number of tokens appended to the sequence.
+    pub fn num_tokens(&self) -> usize {
+        self.block_hashes.len() * self.kv_block_size + self.partial.len()
+    }
+
+    /// The number of tokens per block.
+    pub fn kv_block_size(&self) -> usize {
+        self.kv_block_size
+    }
+
+    /// The id of the LoRA adapter the blocks are hashed with.
+    pub fn lora_id(&self) -> u64 {
+        self.lora_id
+    }
+}
+
 /// A [`KvCacheEvent`] on a specific LLM worker denoted by [`WorkerId`].
 #[derive(Debug, Clone, Serialize, Deserialize)]
 pub struct RouterEvent {
@@ -153,37 +270,589 @@ impl RouterEvent {
     pub fn new(worker_id: WorkerId, event: KvCacheEvent) -> Self {
         Self { worker_id, event }
     }
+
+    /// The ID of the worker emitting the event.
+    pub fn worker_id(&self) -> WorkerId {
+        self.worker_id
+    }
+
+    /// The cache event of the worker.
+    pub fn event(&self) -> &KvCacheEvent {
+        &self.event
+    }
+
+    /// Decode the events of a message published on the KV event subject.
+    ///
+    /// The message is either a single JSON `RouterEvent`, a JSON array of them, or the events of
+    /// a worker in the binary format of [`encode_kv_events`].
+    ///
+    /// ### Arguments
+    ///
+    /// * `payload` - The payload of the message.
+    ///
+    /// ### Returns
+    ///
+    /// The `RouterEvent`s of the message, in order.
+    pub fn decode_batch(payload: &[u8]) -> Result<Vec<RouterEvent>, KvEventsDecodeError> {
+        match payload.first() {
+            Some(&KV_EVENTS_BINARY_TAG) => {
+                let (worker_id, events) = decode_kv_events(payload)?;
+                Ok(events
+                    .into_iter()
+                    .map(|event| RouterEvent::new(worker_id, event))
+                    .collect())
+            }
+            Some(b'[') => Ok(serde_json::from_slice(payload)?),
+            _ => Ok(vec![serde_json::from_slice(payload)?]),
+        }
+    }
 }
 
-/// A block in the Radix Tree.
-struct RadixBlock {
-    /// A map of child blocks, keyed by their local block hash.
-    children: HashMap<LocalBlockHash, SharedRadixBlock>,
-    /// A set of worker IDs associated with this block.
-    workers: HashSet<WorkerId>,
-    /// A buffer of times that this block was last traversed
-    recent_uses: VecDeque<Instant>,
+/// [`RouterEvent`]s received together, applied to the radix tree in a single pass.
+#[derive(Debug)]
+pub struct RouterEventBatch {
+    /// The events, in order.
+    events: Vec<RouterEvent>,
+    /// When the events were received by the router.
+    received_at: Instant,
+}
+
+impl From<Vec<RouterEvent>> for RouterEventBatch {
+    fn from(events: Vec<RouterEvent>) -> Self {
+        Self {
+            events,
+            received_at: Instant::now(),
+        }
+    }
+}
+
+/// How far behind the events it was sent an indexer is.
+#[derive(Debug, Clone, Copy, Default, Serialize, Deserialize)]
+pub struct IndexerLag {
+    /// The number of events sent to the indexer and not applied yet.
+    pub events: u64,
+    /// How long the last events applied waited to be applied, while events are pending.
+    pub delay: Duration,
+}
+
+/// Counters behind [`IndexerLag`], shared by the senders and the indexer tasks.
+#[derive(Debug, Default)]
+struct EventLag {
+    pending: AtomicU64,
+    delay_us: AtomicU64,
+}
+
+impl EventLag {
+    fn sent(&self, count: usize) {
+        self.pending.fetch_add(count as u64, Ordering::Relaxed);
+    }
+
+    fn applied(&self, count: usize, received_at: Instant) {
+        self.delay_us
+            .store(received_at.elapsed().as_micros() as u64, Ordering::Relaxed);
+        self.pending.fetch_sub(count as u64, Ordering::Relaxed);
+    }
+
+    fn lag(&self) -> IndexerLag {
+        let events = self.pending.load(Ordering::Relaxed);
+        let delay = match events {
+            0 => Duration::ZERO,
+            _ => Duration::from_micros(self.delay_us.load(Ordering::Relaxed)),
+        };
+        IndexerLag { events, delay }
+    }
+}
+
+/// The shard of an indexer applying the events of each worker.
+#[derive(Debug)]
+struct ShardAssignments {
+    worker_assignments: HashMap<WorkerId, usize>,
+    worker_counts: Vec<usize>,
+}
+
+impl ShardAssignments {
+    fn new(num_shards: usize) -> Self {
+        Self {
+            worker_assignments: HashMap::new(),
+            worker_counts: vec![0; num_shards],
+        }
+    }
+
+    /// The shard of `worker`; new workers are assigned to the shard with the fewest workers.
+    fn shard(&mut self, worker: WorkerId) -> usize {
+        if let Some(&shard) = self.worker_assignments.get(&worker) {
+            return shard;
+        }
+        let shard = self
+            .worker_counts
+            .iter()
+            .enumerate()
+            .min_by_key(|&(_, count)| count)
+            .unwrap()
+            .0;
+        self.worker_assignments.insert(worker, shard);
+        self.worker_counts[shard] += 1;
+        shard
+    }
+
+    /// Forget `worker`, returning the shard it was assigned to.
+    fn remove(&mut self, worker: WorkerId) -> Option<usize> {
+        let shard = self.worker_assignments.remove(&worker)?;
+        self.worker_counts[shard] -= 1;
+        Some(shard)
+    }
+}
+
+/// Sends [`RouterEvent`]s to a [`KvIndexerInterface`], accounting for them in its
+/// [`IndexerLag`].
+#[derive(Clone)]
+pub struct RouterEventSender {
+    /// A sender per shard of the indexer.
+    shards: Vec<mpsc::Sender<RouterEventBatch>>,
+    /// The shard of each worker, when there are several.
+    assignments: Arc<Mutex<ShardAssignments>>,
+    lag: Arc<EventLag>,
 }
 
-impl RadixBlock {
-    /// Create a new `RadixBlock`.
+impl RouterEventSender {
+    fn new(shards: Vec<mpsc::Sender<RouterEventBatch>>, lag: Arc<EventLag>) -> Self {
+        let assignments = ShardAssignments::new(shards.len());
+        Self {
+            shards,
+            assignments: Arc::new(Mutex::new(assignments)),
+            lag,
+        }
+    }
+
+    /// Send events received together; they are applied in a single pass by each shard.
+    ///
+    /// ### Arguments
+    ///
+    /// * `events` - The `RouterEvent`s to apply, in order.
+    pub async fn send(&self, events: Vec<RouterEvent>) -> Result<(), KvRouterError> {
+        if let [shard] = self.shards.as_slice() {
+            return send_event_batch(shard, &self.lag, events.into()).await;
+        }
+
+        let received_at = Instant::now();
+        let mut batches = vec![Vec::new(); self.shards.len()];
+        {
+            let mut assignments = self.assignments.lock().unwrap();
+            for event in events {
+                batches[assignments.shard(event.worker_id)].push(event);
+            }
+        }
+        for (shard, events) in self.shards.iter().zip(batches) {
+            if !events.is_empty() {
+                let batch = RouterEventBatch {
+                    events,
+                    received_at,
+                };
+                send_event_batch(shard, &self.lag, batch).await?;
+            }
+        }
+        Ok(())
+    }
+
+    /// Forget `worker`, returning the shard it was assigned to.
+    fn remove_worker(&self, worker: WorkerId) -> Option<usize> {
+        self.assignments.lock().unwrap().remove(worker)
+    }
+
+    fn lag(&self) -> IndexerLag {
+        self.lag.lag()
+    }
+}
+
+/// Where and how often the KV store of an indexer is saved, see [`KvIndexerInterface::snapshot`].
+#[derive(Debug, Clone, PartialEq, Eq, Serialize, Deserialize)]
+pub struct SnapshotConfig {
+    /// The file the snapshots are written to, and restored from at startup.
+    pub path: PathBuf,
+    /// How often a snapshot is taken.
+    pub interval: Duration,
+}
+
+/// How a router indexes the KV blocks cached by its workers.
+#[derive(Debug, Clone, PartialEq, Eq, Serialize, Deserialize)]
+pub struct IndexerConfig {
+    /// The number of radix trees the workers are spread over, each served by its own thread; a
+    /// [`KvIndexerSharded`] is used if there are more than one.
+    pub num_shards: usize,
+    /// How long the accesses of a block count towards its frequency in the [`OverlapScores`];
+    /// the frequencies are not tracked if not set.
+    pub expiration: Option<Duration>,
+    /// Where and how often the KV store is saved, to be restored when the router restarts; it is
+    /// not saved if not set.
+    pub snapshot: Option<SnapshotConfig>,
+}
+
+impl Default for IndexerConfig {
+    fn default() -> Self {
+        Self {
+            num_shards: 1,
+            expiration: None,
+            snapshot: None,
+        }
+    }
+}
+
+impl IndexerConfig {
+    /// Start the indexer.
+    ///
+    /// ### Arguments
+    ///
+    /// * `token` - A `CancellationToken` for managing shutdown.
+    /// * `kv_block_size` - The number of tokens per block of the workers.
     ///
     /// ### Returns
     ///
-    /// A new `RadixBlock`.
-    pub fn new() -> Self {
+    /// The `KvIndexer`, or the `KvIndexerSharded` if there are several shards.
+    pub fn start(
+        &self,
+        token: CancellationToken,
+        kv_block_size: usize,
+    ) -> Box<dyn KvIndexerInterface + Send + Sync> {
+        if self.num_shards > 1 {
+            Box::new(KvIndexerSharded::new_with_frequency(
+                token,
+                self.num_shards,
+                self.expiration,
+                kv_block_size,
+            ))
+        } else {
+            Box::new(KvIndexer::new_with_frequency(
+                token,
+                self.expiration,
+                kv_block_size,
+            ))
+        }
+    }
+}
+
+async fn send_event_batch(
+    tx: &mpsc::Sender<RouterEventBatch>,
+    lag: &EventLag,
+    batch: RouterEventBatch,
+) -> Result<(), KvRouterError> {
+    let count = batch.events.len();
+    lag.sent(count);
+    if tx.send(batch).await.is_err() {
+        lag.pending.fetch_sub(count as u64, Ordering::Relaxed);
+        return Err(KvRouterError::IndexerOffline);
+    }
+    Ok(())
+}
+
+/// Apply `first` and the batches already queued behind it to `trie`, up to [`MAX_EVENT_BATCH`]
+/// events.
+fn apply_event_batches(
+    trie: &mut RadixTree,
+    event_rx: &mut mpsc::Receiver<RouterEventBatch>,
+    lag: &EventLag,
+    first: RouterEventBatch,
+) {
+    let received_at = first.received_at;
+    let mut count = first.events.len();
+    let mut events = first.events;
+    while count < MAX_EVENT_BATCH {
+        match event_rx.try_recv() {
+            Ok(batch) => {
+                count += batch.events.len();
+                events.extend(batch.events);
+            }
+            Err(_) => break,
+        }
+    }
+    trie.apply_events(events);
+    lag.applied(count, received_at);
+}
+
+/// The index of a [`RadixBlock`] in the arena of its [`RadixTree`].
+type BlockId = u32;
+
+/// The root block of every [`RadixTree`], which no worker holds.
+const ROOT: BlockId = 0;
+
+/// The number of children of a block above which they are hashed rather than scanned.
+const MAX_LISTED_CHILDREN: usize = 8;
+
+/// The children of a [`RadixBlock`], keyed by their local block hash.
+///
+/// Most blocks are in the middle of a sequence and have a single child, kept inline; the blocks
+/// sequences branch from list their children, and hash them past [`MAX_LISTED_CHILDREN`].
+#[derive(Debug, Default)]
+enum Children {
+    #[default]
+    None,
+    One(LocalBlockHash, BlockId),
+    Listed(Vec<(LocalBlockHash, BlockId)>),
+    Hashed(Box<HashMap<LocalBlockHash, BlockId>>),
+}
+
+impl Children {
+    fn get(&self, tokens_hash: &LocalBlockHash) -> Option<BlockId> {
+        match self {
+            Children::None => None,
+            Children::One(hash, block) => (hash == tokens_hash).then_some(*block),
+            Children::Listed(children) => children
+                .iter()
+                .find(|(hash, _)| hash == tokens_hash)
+                .map(|&(_, block)| block),
+            Children::Hashed(children) => children.get(tokens_hash).copied(),
+        }
+    }
+
+    /// Add a child, which must not be there already.
+    fn insert(&mut self, tokens_hash: LocalBlockHash, block: BlockId) {
+        match self {
+            Children::None => *self = Children::One(tokens_hash, block),
+            Children::One(hash, child) => {
+                *self = Children::Listed(vec![(*hash, *child), (tokens_hash, block)])
+            }
+            Children::Listed(children) if children.len() < MAX_LISTED_CHILDREN => {
+                children.push((tokens_hash, block))
+            }
+            Children::Listed(children) => {
+                let mut hashed: HashMap<_, _> = children.drain(..).collect();
+                hashed.insert(tokens_hash, block);
+                *self = Children::Hashed(Box::new(hashed));
+            }
+            Children::Hashed(children) => {
+                children.insert(tokens_hash, block);
+            }
+        }
+    }
+
+    fn len(&self) -> usize {
+        match self {
+            Children::None => 0,
+            Children::One(..) => 1,
+            Children::Listed(children) => children.len(),
+            Children::Hashed(children) => children.len(),
+        }
+    }
+
+    fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    fn iter(&self) -> impl Iterator<Item = (LocalBlockHash, BlockId)> + '_ {
+        let (one, listed, hashed) = match self {
+            Children::None => (None, &[][..], None),
+            Children::One(hash, block) => (Some((*hash, *block)), &[][..], None),
+            Children::Listed(children) => (None, children.as_slice(), None),
+            Children::Hashed(children) => (None, &[][..], Some(children.iter())),
+        };
+        one.into_iter().chain(listed.iter().copied()).chain(
+            hashed
+                .into_iter()
+                .flatten()
+                .map(|(&hash, &block)| (hash, block)),
+        )
+    }
+
+    /// The bytes allocated for the children, besides the block.
+    fn heap_size(&self) -> usize {
+        match self {
+            Children::None | Children::One(..) => 0,
+            Children::Listed(children) => {
+                children.capacity() * size_of::<(LocalBlockHash, BlockId)>()
+            }
+            Children::Hashed(children) => {
+                size_of::<HashMap<LocalBlockHash, BlockId>>() + hash_table_size(children)
+            }
+        }
+    }
+}
+
+/// The workers holding a [`RadixBlock`], as a bitset of their slots in the [`RadixTree`].
+///
+/// The first 64 slots are kept inline, the following ones are allocated when used.
+#[derive(Debug, Default)]
+struct WorkerSet {
+    low: u64,
+    high: Option<Box<[u64]>>,
+}
+
+impl WorkerSet {
+    fn insert(&mut self, slot: usize) {
+        if slot < 64 {
+            self.low |= 1 << slot;
+            return;
+        }
+        let word = slot / 64 - 1;
+        let high = self.high.get_or_insert_with(Default::default);
+        if high.len() <= word {
+            let mut grown = vec![0; word + 1];
+            grown[..high.len()].copy_from_slice(high);
+            *high = grown.into_boxed_slice();
+        }
+        high[word] |= 1 << (slot % 64);
+    }
+
+    fn remove(&mut self, slot: usize) {
+        if slot < 64 {
+            self.low &= !(1 << slot);
+        } else if let Some(bits) = self
+            .high
+            .as_mut()
+            .and_then(|high| high.get_mut(slot / 64 - 1))
+        {
+            *bits &= !(1 << (slot % 64));
+        }
+    }
+
+    fn words(&self) -> impl Iterator<Item = u64> + '_ {
+        iter::once(self.low).chain(self.high.iter().flat_map(|high| high.iter().copied()))
+    }
+
+    fn len(&self) -> usize {
+        self.words().map(|bits| bits.count_ones() as usize).sum()
+    }
+
+    fn is_empty(&self) -> bool {
+        self.words().all(|bits| bits == 0)
+    }
+
+    /// The slots of the workers, in increasing order.
+    fn slots(&self) -> impl Iterator<Item = usize> + '_ {
+        self.words().enumerate().flat_map(|(word, mut bits)| {
+            iter::from_fn(move || {
+                if bits == 0 {
+                    return None;
+                }
+                let bit = bits.trailing_zeros() as usize;
+                bits &= bits - 1;
+                Some(word * 64 + bit)
+            })
+        })
+    }
+
+    /// The bytes allocated for the workers past the first 64 slots.
+    fn heap_size(&self) -> usize {
+        self.high
+            .as_ref()
+            .map_or(0, |high| high.len() * size_of::<u64>())
+    }
+}
+
+/// A block in the Radix Tree.
+#[derive(Debug, Default)]
+struct RadixBlock {
+    /// The child blocks, keyed by their local block hash.
+    children: Children,
+    /// The slots of the workers holding this block.
+    workers: WorkerSet,
+    /// The parents and lookup table entries referring to this block; it is freed when none are
+    /// left.
+    refs: u32,
+}
+
+/// The blocks of a [`RadixTree`], each freed once nothing refers to it.
+#[derive(Debug)]
+struct BlockArena {
+    /// The blocks, [`ROOT`] first; the freed ones are reused.
+    blocks: Vec<RadixBlock>,
+    free: Vec<BlockId>,
+    /// A buffer of times that each block was last traversed, when tracking the frequencies.
+    recent_uses: RefCell<HashMap<BlockId, VecDeque<Instant>>>,
+}
+
+impl BlockArena {
+    fn new() -> Self {
+        // the root is referred to by the tree itself
+        let root = RadixBlock {
+            refs: 1,
+            ..Default::default()
+        };
         Self {
-            children: HashMap::new(),
-            workers: HashSet::new(),
-            recent_uses: VecDeque::new(),
+            blocks: vec![root],
+            free: Vec::new(),
+            recent_uses: RefCell::default(),
+        }
+    }
+
+    fn get(&self, block: BlockId) -> &RadixBlock {
+        &self.blocks[block as usize]
+    }
+
+    fn get_mut(&mut self, block: BlockId) -> &mut RadixBlock {
+        &mut self.blocks[block as usize]
+    }
+
+    /// The number of blocks, besides the root.
+    fn len(&self) -> usize {
+        self.blocks.len() - self.free.len() - 1
+    }
+
+    /// Allocate an empty block with a single reference.
+    fn alloc(&mut self) -> BlockId {
+        let block = RadixBlock {
+            refs: 1,
+            ..Default::default()
+        };
+        match self.free.pop() {
+            Some(id) => {
+                self.blocks[id as usize] = block;
+                id
+            }
+            None => {
+                self.blocks.push(block);
+                BlockId::try_from(self.blocks.len() - 1).expect("too many blocks in radix tree")
+            }
+        }
+    }
+
+    fn retain(&mut self, block: BlockId) {
+        self.get_mut(block).refs += 1;
+    }
+
+    /// Drop a reference to `block`; the last one frees it, releasing its children.
+    fn release(&mut self, block: BlockId) {
+        let mut released = vec![block];
+        while let Some(id) = released.pop() {
+            let block = self.get_mut(id);
+            block.refs -= 1;
+            if block.refs == 0 {
+                let children = std::mem::take(&mut block.children);
+                block.workers = WorkerSet::default();
+                released.extend(children.iter().map(|(_, child)| child));
+                self.recent_uses.get_mut().remove(&id);
+                self.free.push(id);
+            }
         }
     }
 }
 
+/// The approximate number of bytes allocated for the table of a `HashMap`.
+fn hash_table_size<K, V>(map: &HashMap<K, V>) -> usize {
+    // the table is at most 7/8 full, with a control byte per bucket
+    map.capacity() * 8 / 7 * (size_of::<(K, V)>() + 1)
+}
+
+/// The memory used by a [`RadixTree`], see [`RadixTree::memory_usage`].
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq, Serialize, Deserialize)]
+pub struct RadixTreeMemory {
+    /// The number of blocks in the tree.
+    pub blocks: usize,
+    /// The estimated number of bytes allocated for the tree, lookup tables included.
+    pub bytes: usize,
+}
+
+impl RadixTreeMemory {
+    /// The average number of bytes per block.
+    pub fn bytes_per_block(&self) -> f64 {
+        if self.blocks == 0 {
+            return 0.0;
+        }
+        self.bytes as f64 / self.blocks as f64
+    }
+}
+
 pub struct RadixTree {
-    /// This is the root of the radix/prefix tree
-    /// This will only contain root blocks
-    root: SharedRadixBlock,
+    /// The blocks of the radix/prefix tree, from its root
+    arena: BlockArena,
 
     /// This is a global lookup table for all blocks which will let you jump into
     /// the radix tree at any point
@@ -193,7 +862,11 @@ pub struct RadixTree {
     /// Transitioning to a radix tree only would require a change in the messaging structure
     /// as the entire prefix would need to be sent. Alternatively, we could use block_depth
     /// integers to indicate how many blocks to skip and use a radix/prefix tree at each level.
-    lookup: HashMap<WorkerId, HashMap<ExternalSequenceBlockHash, SharedRadixBlock>>,
+    lookup: HashMap<WorkerId, HashMap<ExternalSequenceBlockHash, BlockId>>,
+    /// The slot of each worker in the [`WorkerSet`]s of the blocks
+    worker_slots: HashMap<WorkerId, usize>,
+    /// The worker in each slot; the slots of the removed workers are reused
+    slot_workers: Vec<Option<WorkerId>>,
     /// The time buffer the radix tree should check when considering frequence of block accesses
     expiration_duration: Option<Duration>,
 }
@@ -212,8 +885,10 @@ impl RadixTree {
     /// A new `RadixTree`.
     pub fn new_with_frequency(expiration_duration: Option<Duration>) -> Self {
         Self {
-            root: Rc::new(RefCell::new(RadixBlock::new())),
+            arena: BlockArena::new(),
             lookup: HashMap::new(),
+            worker_slots: HashMap::new(),
+            slot_workers: Vec::new(),
             expiration_duration,
         }
     }
@@ -234,41 +909,48 @@ impl RadixTree {
     /// An `OverlapScores` representing the match scores.
     pub fn find_matches(&self, sequence: Vec<LocalBlockHash>, early_exit: bool) -> OverlapScores {
         let mut scores = OverlapScores::new();
-        let mut current = self.root.clone();
+        // the matched blocks of each worker slot
+        let mut matches = vec![0u32; self.slot_workers.len()];
+        let mut recent_uses = self
+            .expiration_duration
+            .map(|expiration_duration| (expiration_duration, self.arena.recent_uses.borrow_mut()));
+        let mut current = ROOT;
         let now = Instant::now();
         for block_hash in sequence {
-            let next_block = {
-                let current_borrow = current.borrow();
-                current_borrow.children.get(&block_hash).cloned()
+            let Some(block) = self.arena.get(current).children.get(&block_hash) else {
+                break;
             };
+            let workers = &self.arena.get(block).workers;
+            for slot in workers.slots() {
+                matches[slot] += 1;
+            }
 
-            if let Some(block) = next_block {
-                scores.update_scores(&block.borrow().workers);
-
-                if let Some(expiration_duration) = self.expiration_duration {
-                    let mut block_mut = block.borrow_mut();
-
-                    while let Some(access_time) = block_mut.recent_uses.front() {
-                        if now.duration_since(*access_time) > expiration_duration {
-                            block_mut.recent_uses.pop_front();
-                        } else {
-                            break;
-                        }
+            if let Some((expiration_duration, recent_uses)) = recent_uses.as_mut() {
+                let recent_uses = recent_uses.entry(block).or_default();
+                while let Some(access_time) = recent_uses.front() {
+                    if now.duration_since(*access_time) > *expiration_duration {
+                        recent_uses.pop_front();
+                    } else {
+                        break;
                     }
-                    scores.add_frequency(block_mut.recent_uses.len());
-                    block_mut.recent_uses.push_back(now);
-                }
-
-                if early_exit && block.borrow().workers.len() == 1 {
-                    break;
                 }
+                scores.add_frequency(recent_uses.len());
+                recent_uses.push_back(now);
+            }
 
-                current = block;
-            } else {
+            if early_exit && workers.len() == 1 {
                 break;
             }
+
+            current = block;
         }
 
+        scores.scores = matches
+            .into_iter()
+            .enumerate()
+            .filter(|&(_, score)| score > 0)
+            .filter_map(|(slot, score)| Some((self.slot_workers[slot]?, score)))
+            .collect();
         scores
     }
 
@@ -278,24 +960,87 @@ impl RadixTree {
     ///
     /// * `event` - The `RouterEvent` to apply.
     pub fn apply_event(&mut self, event: RouterEvent) {
-        let (worker_id, event) = (event.worker_id, event.event);
+        let slot = self.worker_slot(event.worker_id);
+        let worker_lookup = self.lookup.entry(event.worker_id).or_default();
+        Self::apply_cache_event(
+            &mut self.arena,
+            worker_lookup,
+            slot,
+            event.worker_id,
+            event.event,
+        );
+    }
+
+    /// Apply several [`RouterEvent`]s to the radix tree, in order.
+    ///
+    /// The lookup table of a worker is resolved once for each run of consecutive events of that
+    /// worker, which is how the events of a forward pass arrive.
+    ///
+    /// ### Arguments
+    ///
+    /// * `events` - The `RouterEvent`s to apply.
+    pub fn apply_events(&mut self, events: impl IntoIterator<Item = RouterEvent>) {
+        let mut events = events.into_iter().peekable();
+        while let Some(event) = events.next() {
+            let worker_id = event.worker_id;
+            let slot = self.worker_slot(worker_id);
+            let worker_lookup = self.lookup.entry(worker_id).or_default();
+            Self::apply_cache_event(&mut self.arena, worker_lookup, slot, worker_id, event.event);
+            while let Some(event) = events.next_if(|event| event.worker_id == worker_id) {
+                Self::apply_cache_event(
+                    &mut self.arena,
+                    worker_lookup,
+                    slot,
+                    worker_id,
+                    event.event,
+                );
+            }
+        }
+    }
+
+    /// The slot of `worker_id` in the [`WorkerSet`]s, assigned on its first event.
+    fn worker_slot(&mut self, worker_id: WorkerId) -> usize {
+        if let Some(&slot) = self.worker_slots.get(&worker_id) {
+            return slot;
+        }
+        let slot = match self.slot_workers.iter().position(Option::is_none) {
+            Some(slot) => {
+                self.slot_workers[slot] = Some(worker_id);
+                slot
+            }
+            None => {
+                self.slot_workers.push(Some(worker_id));
+                self.slot_workers.len() - 1
+            }
+        };
+        self.worker_slots.insert(worker_id, slot);
+        slot
+    }
+
+    /// Apply a [`KvCacheEvent`] of `worker_id`, whose blocks are looked up in `worker_lookup`
+    /// and marked with `slot`.
+    fn apply_cache_event(
+        arena: &mut BlockArena,
+        worker_lookup: &mut HashMap<ExternalSequenceBlockHash, BlockId>,
+        slot: usize,
+        worker_id: WorkerId,
+        event: KvCacheEvent,
+    ) {
         let (id, op) = (event.event_id, event.data);
         log::debug!(id, "Store operation: {:?}", op);
 
-        let worker_lookup = self.lookup.entry(worker_id).or_default();
-
         match op {
             KvCacheEventData::Stored(op) => {
                 // find the parent block - if the parent exists it must be on our worker, if not,
                 // we check the radix tree's root to find it.
                 // this is the single most expensive lookup
                 let current = match op.parent_hash {
-                    Some(parent) => worker_lookup.get(&parent),
-                    None => Some(&self.root),
+                    Some(parent) => worker_lookup.get(&parent).copied(),
+                    None => Some(ROOT),
                 };
 
                 let mut current = match current {
-                    Some(current) => current.clone(),
+                    Some(current) => current,
                     None => {
                         log::warn!(
                             worker_id = worker_id.to_string(),
@@ -308,33 +1053,41 @@ impl RadixTree {
                 };
 
                 for block_id in op.blocks {
-                    let mut inner = current.borrow_mut();
-                    let block = match inner.children.get(&block_id.tokens_hash) {
-                        Some(block) => block.clone(),
+                    let block = match arena.get(current).children.get(&block_id.tokens_hash) {
+                        Some(block) => block,
                         None => {
                             // create new block - automatically added to the lookup table
-                            let new_block = worker_lookup
-                                .get(&block_id.block_hash)
-                                .cloned()
-                                .unwrap_or_else(|| Rc::new(RefCell::new(RadixBlock::new())));
+                            let new_block = match worker_lookup.get(&block_id.block_hash) {
+                                Some(&block) => {
+                                    arena.retain(block);
+                                    block
+                                }
+                                None => arena.alloc(),
+                            };
 
                             // insert into radix tree
-                            inner
+                            arena
+                                .get_mut(current)
                                 .children
-                                .insert(block_id.tokens_hash, new_block.clone());
+                                .insert(block_id.tokens_hash, new_block);
 
                             new_block
                         }
                     };
 
                     // add our worker_id to the block
-                    block.borrow_mut().workers.insert(worker_id);
+                    arena.get_mut(block).workers.insert(slot);
 
                     // add the block to the worker_id lookup table
-                    worker_lookup.insert(block_id.block_hash, block.clone());
-
-                    // drop inner so we can shift current to this block
-                    drop(inner);
+                    match worker_lookup.insert(block_id.block_hash, block) {
+                        Some(previous) if previous == block => {}
+                        previous => {
+                            arena.retain(block);
+                            if let Some(previous) = previous {
+                                arena.release(previous);
+                            }
+                        }
+                    }
 
                     current = block;
                 }
@@ -348,8 +1101,9 @@ impl RadixTree {
                     // a small optimization would be to get the next block from the reduced set of children
                     // in order to apply this optimization, we would need to know the list of blocks is always sorted
                     // by parent -> child relationship
-                    let entry = match worker_lookup.get(&block) {
-                        Some(entry) => entry.clone(),
+                    // the block is removed from the lookup table
+                    let entry = match worker_lookup.remove(&block) {
+                        Some(entry) => entry,
                         None => {
                             log::warn!(
                                 worker_id = worker_id.to_string(),
@@ -360,26 +1114,223 @@ impl RadixTree {
                         }
                     };
 
-                    let mut guard = entry.borrow_mut();
-                    guard.workers.remove(&worker_id);
+                    let guard = arena.get_mut(entry);
+                    guard.workers.remove(slot);
                     if guard.workers.is_empty() {
                         // if no worker are using this block, that is true for all children
-                        guard.children.clear();
+                        let children = std::mem::take(&mut guard.children);
+                        for (_, child) in children.iter() {
+                            arena.release(child);
+                        }
                     }
-                    // remove the block from the lookup table
-                    worker_lookup.remove(&block);
+                    arena.release(entry);
+                }
+            }
+            KvCacheEventData::Cleared => {
+                for (_, block) in worker_lookup.drain() {
+                    arena.get_mut(block).workers.remove(slot);
+                    arena.release(block);
                 }
             }
         }
     }
 
     pub fn remove_worker(&mut self, worker: WorkerId) {
-        if let Some((_, blocks)) = self.lookup.remove_entry(&worker) {
-            blocks.iter().for_each(|(_, block)| {
-                block.borrow_mut().workers.remove(&worker);
-            });
+        if let Some(slot) = self.worker_slots.remove(&worker) {
+            // a block the worker stored under several hashes may be left out of its lookup
+            // table, clear the slot everywhere before it is reused
+            for block in &mut self.arena.blocks {
+                block.workers.remove(slot);
+            }
+            self.slot_workers[slot] = None;
+        }
+        if let Some(blocks) = self.lookup.remove(&worker) {
+            for (_, block) in blocks {
+                self.arena.release(block);
+            }
         }
     }
+
+    /// Estimate the memory used by the radix tree.
+    ///
+    /// ### Returns
+    ///
+    /// The number of blocks in the tree and the bytes allocated for them.
+    pub fn memory_usage(&self) -> RadixTreeMemory {
+        let arena = &self.arena;
+        let recent_uses = arena.recent_uses.borrow();
+        let bytes = size_of::<Self>()
+            + arena.blocks.capacity() * size_of::<RadixBlock>()
+            + arena
+                .blocks
+                .iter()
+                .map(|block| block.children.heap_size() + block.workers.heap_size())
+                .sum::<usize>()
+            + arena.free.capacity() * size_of::<BlockId>()
+            + hash_table_size(&*recent_uses)
+            + recent_uses
+                .values()
+                .map(|uses| uses.capacity() * size_of::<Instant>())
+                .sum::<usize>()
+            + hash_table_size(&self.lookup)
+            + self.lookup.values().map(hash_table_size).sum::<usize>()
+            + hash_table_size(&self.worker_slots)
+            + self.slot_workers.capacity() * size_of::<Option<WorkerId>>();
+        RadixTreeMemory {
+            blocks: arena.len(),
+            bytes,
+        }
+    }
+
+    /// Take a snapshot of the radix tree, as the stored events rebuilding it.
+    ///
+    /// The blocks of each worker are listed from the root down, the blocks along a path being
+    /// stored by the same event. The blocks a worker holds without their parent, which it can
+    /// not match anyway, are left out, as are the access frequencies.
+    ///
+    /// ### Returns
+    ///
+    /// The `RouterEvent`s rebuilding the tree, grouped by worker.
+    pub fn snapshot(&self) -> Vec<RouterEvent> {
+        // the hash of each block for each of the workers holding it
+        let mut block_hashes: HashMap<BlockId, Vec<_>> = HashMap::new();
+        for (&worker_id, blocks) in &self.lookup {
+            for (&block_hash, &block) in blocks {
+                block_hashes
+                    .entry(block)
+                    .or_default()
+                    .push((worker_id, block_hash));
+            }
+        }
+
+        let mut events: HashMap<WorkerId, Vec<KvCacheEvent>> = HashMap::new();
+        let mut visited = HashSet::new();
+        let mut stack = vec![(ROOT, None)];
+        while let Some((block, parent)) = stack.pop() {
+            for (tokens_hash, child) in self.arena.get(block).children.iter() {
+                // a block reached through several parents is listed under the first one
+                if !visited.insert(child) {
+                    continue;
+                }
+                for &(worker_id, block_hash) in block_hashes.get(&child).into_iter().flatten() {
+                    let parent_hash = match parent {
+                        None => None,
+                        Some(parent) => match block_hashes.get(&parent).and_then(|hashes| {
+                            hashes.iter().find(|(worker, _)| *worker == worker_id)
+                        }) {
+                            Some(&(_, parent_hash)) => Some(parent_hash),
+                            None => continue,
+                        },
+                    };
+                    let stored = KvCacheStoredBlockData {
+                        block_hash,
+                        tokens_hash,
+                    };
+                    let worker_events = events.entry(worker_id).or_default();
+                    // extend the last event of the worker if it stored the parent
+                    if let Some(KvCacheEvent {
+                        data: KvCacheEventData::Stored(last),
+                        ..
+                    }) = worker_events.last_mut()
+                    {
+                        if parent_hash.is_some()
+                            && last.blocks.last().map(|last| last.block_hash) == parent_hash
+                        {
+                            last.blocks.push(stored);
+                            continue;
+                        }
+                    }
+                    worker_events.push(KvCacheEvent {
+                        event_id: worker_events.len() as u64,
+                        data: KvCacheEventData::Stored(KvCacheStoreData {
+                            parent_hash,
+                            blocks: vec![stored],
+                        }),
+                    });
+                }
+                stack.push((child, Some(child)));
+            }
+        }
+
+        events
+            .into_iter()
+            .flat_map(|(worker_id, events)| {
+                events
+                    .into_iter()
+                    .map(move |event| RouterEvent::new(worker_id, event))
+            })
+            .collect()
+    }
+}
+
+/// The first bytes of a snapshot file of an indexer.
+const SNAPSHOT_MAGIC: &[u8; 8] = b"KVINDEX1";
+
+/// Encode a snapshot of an indexer, as taken by [`KvIndexerInterface::snapshot`].
+///
+/// The snapshot is [`SNAPSHOT_MAGIC`] and the block size, followed by the events of each worker
+/// in the binary format of [`encode_kv_events`], each prefixed by its length as a little-endian
+/// `u64`.
+///
+/// ### Arguments
+///
+/// * `events` - The `RouterEvent`s of the snapshot, grouped by worker.
+/// * `kv_block_size` - The number of tokens per block the events were hashed with.
+///
+/// ### Returns
+///
+/// The encoded snapshot.
+pub fn encode_snapshot(events: &[RouterEvent], kv_block_size: usize) -> Vec<u8> {
+    let mut buf = Vec::new();
+    buf.extend_from_slice(SNAPSHOT_MAGIC);
+    buf.extend_from_slice(&(kv_block_size as u64).to_le_bytes());
+    for worker_events in events.chunk_by(|a, b| a.worker_id == b.worker_id) {
+        let events: Vec<_> = worker_events
+            .iter()
+            .map(|event| event.event.clone())
+            .collect();
+        let section = encode_kv_events(worker_events[0].worker_id, &events);
+        buf.extend_from_slice(&(section.len() as u64).to_le_bytes());
+        buf.extend_from_slice(&section);
+    }
+    buf
+}
+
+/// Decode a snapshot encoded with [`encode_snapshot`].
+///
+/// ### Arguments
+///
+/// * `data` - The encoded snapshot.
+///
+/// ### Returns
+///
+/// The number of tokens per block of the snapshot and its `RouterEvent`s.
+pub fn decode_snapshot(data: &[u8]) -> Result<(usize, Vec<RouterEvent>), KvEventsDecodeError> {
+    let data = data
+        .strip_prefix(SNAPSHOT_MAGIC)
+        .ok_or(KvEventsDecodeError::NotASnapshot)?;
+    let (kv_block_size, mut data) = data
+        .split_first_chunk::<8>()
+        .ok_or(KvEventsDecodeError::Truncated)?;
+    let mut events = Vec::new();
+    while let Some((len, rest)) = data.split_first_chunk::<8>() {
+        let len = u64::from_le_bytes(*len) as usize;
+        if rest.len() < len {
+            return Err(KvEventsDecodeError::Truncated);
+        }
+        let (section, rest) = rest.split_at(len);
+        let (worker_id, worker_events) = decode_kv_events(section)?;
+        events.extend(
+            worker_events
+                .into_iter()
+                .map(|event| RouterEvent::new(worker_id, event)),
+        );
+        data = rest;
+    }
+    if !data.is_empty() {
+        return Err(KvEventsDecodeError::Truncated);
+    }
+    Ok((u64::from_le_bytes(*kv_block_size) as usize, events))
 }
 
 /// Scores representing the overlap of workers.
@@ -443,6 +1394,14 @@ pub struct MatchRequest {
     resp: oneshot::Sender<OverlapScores>,
 }
 
+/// A request to find matches for several sequences in a single pass over the Radix Tree.
+pub struct BatchMatchRequest {
+    /// The sequences of `LocalBlockHash` to match.
+    sequences: Vec<Vec<LocalBlockHash>>,
+    /// A channel sender to send the `OverlapScores` of each sequence, in order.
+    resp: oneshot::Sender<Vec<OverlapScores>>,
+}
+
 #[async_trait]
 pub trait KvIndexerInterface {
     /// Find matches for a given sequence of `LocalBlockHash`es.
@@ -464,6 +1423,7 @@ pub trait KvIndexerInterface {
     /// ### Arguments
     ///
     /// * `tokens` - A vector of `u32` tokens.
+    /// * `lora_id` - The id of the LoRA adapter serving the request, or 0 for the base model.
     ///
     /// ### Returns
     ///
@@ -471,8 +1431,23 @@ pub trait KvIndexerInterface {
     async fn find_matches_for_request(
         &self,
         tokens: &[u32],
+        lora_id: u64,
     ) -> Result<OverlapScores, KvRouterError>;
 
+    /// Find matches for several sequences of `LocalBlockHash`es.
+    ///
+    /// ### Arguments
+    ///
+    /// * `sequences` - The sequences to match.
+    ///
+    /// ### Returns
+    ///
+    /// The `OverlapScores` of each sequence, in order.
+    async fn find_matches_batch(
+        &self,
+        sequences: Vec<Vec<LocalBlockHash>>,
+    ) -> Result<Vec<OverlapScores>, KvRouterError>;
+
     /// Apply a `RouterEvent` to the KV store.
     ///
     /// ### Arguments
@@ -487,6 +1462,27 @@ pub trait KvIndexerInterface {
     /// * `worker` - The worker to remove from the trie.
     async fn remove_worker(&mut self, worker: WorkerId);
 
+    /// The number of tokens per block used to hash requests.
+    fn kv_block_size(&self) -> usize;
+
+    /// Take a snapshot of the KV store.
+    ///
+    /// ### Returns
+    ///
+    /// The `RouterEvent`s rebuilding the KV store, grouped by worker; see
+    /// [`RadixTree::snapshot`].
+    async fn snapshot(&self) -> Result<Vec<RouterEvent>, KvRouterError>;
+
+    /// Get a sender for `RouterEvent`s.
+    ///
+    /// ### Returns
+    ///
+    /// A `RouterEventSender` for batches of `RouterEvent`s.
+    fn event_sender(&self) -> RouterEventSender;
+
+    /// How far behind the events it was sent the indexer is.
+    fn lag(&self) -> IndexerLag;
+
     /// Shutdown the KV Indexer.
     fn shutdown(&mut self);
 }
@@ -496,13 +1492,19 @@ pub struct KvIndexer {
     /// A `CancellationToken` for managing shutdown.
     cancel: CancellationToken,
     /// A sender for `RouterEvent`s.
-    event_tx: mpsc::Sender<RouterEvent>,
+    events: RouterEventSender,
     /// A sender for `MatchRequest`s.
     match_tx: mpsc::Sender<MatchRequest>,
+    /// A sender for `BatchMatchRequest`s.
+    batch_match_tx: mpsc::Sender<BatchMatchRequest>,
     /// A sender for remove worker requests.
     remove_worker_tx: mpsc::Sender<WorkerId>,
+    /// A sender for snapshot requests.
+    snapshot_tx: mpsc::Sender<oneshot::Sender<Vec<RouterEvent>>>,
     /// A handle to the background task managing the KV store.
     task: OnceLock<std::thread::JoinHandle<()>>,
+    /// The number of tokens per block.
+    kv_block_size: usize,
 }
 
 impl KvIndexer {
@@ -512,6 +1514,7 @@ impl KvIndexer {
     ///
     /// * `token` - A `CancellationToken` for managing shutdown.
     /// * `expiration_duration` - The amount of time that block usage should be buffered.
+    /// * `kv_block_size` - The number of tokens per block of the workers.
     ///
     /// ### Returns
     ///
@@ -519,10 +1522,16 @@ impl KvIndexer {
     pub fn new_with_frequency(
         token: CancellationToken,
         expiration_duration: Option<Duration>,
+        kv_block_size: usize,
     ) -> Self {
-        let (event_tx, event_rx) = mpsc::channel::<RouterEvent>(2048);
+        let (event_tx, event_rx) = mpsc::channel::<RouterEventBatch>(2048);
+        let lag = Arc::new(EventLag::default());
+        let task_lag = lag.clone();
+        let events = RouterEventSender::new(vec![event_tx], lag);
         let (match_tx, match_rx) = mpsc::channel::<MatchRequest>(128);
+        let (batch_match_tx, batch_match_rx) = mpsc::channel::<BatchMatchRequest>(16);
         let (remove_worker_tx, remove_worker_rx) = mpsc::channel::<WorkerId>(16);
+        let (snapshot_tx, snapshot_rx) = mpsc::channel::<oneshot::Sender<Vec<RouterEvent>>>(4);
         let cancel_clone = token.clone();
         let task = std::thread::spawn(move || {
             // create a new tokio runtime which will only perform work on a single thread
@@ -538,8 +1547,10 @@ impl KvIndexer {
                 tokio::task::spawn_local(async move {
                     let cancel = cancel_clone;
                     let mut match_rx = match_rx;
+                    let mut batch_match_rx = batch_match_rx;
                     let mut event_rx = event_rx;
                     let mut remove_worker_rx = remove_worker_rx;
+                    let mut snapshot_rx = snapshot_rx;
                     let mut trie = RadixTree::new_with_frequency(expiration_duration);
                     loop {
                         tokio::select! {
@@ -549,18 +1560,31 @@ impl KvIndexer {
                                 trie.remove_worker(worker);
                             }
 
-                            Some(req) = match_rx.recv() => {
-                                let matches = trie.find_matches(req.sequence, req.early_exit);
+                            Some(req) = match_rx.recv() => {
+                                let matches = trie.find_matches(req.sequence, req.early_exit);
+                                let _ = req.resp.send(matches);
+                            }
+
+                            Some(req) = batch_match_rx.recv() => {
+                                let matches = req
+                                    .sequences
+                                    .into_iter()
+                                    .map(|sequence| trie.find_matches(sequence, false))
+                                    .collect();
                                 let _ = req.resp.send(matches);
                             }
 
+                            Some(resp) = snapshot_rx.recv() => {
+                                let _ = resp.send(trie.snapshot());
+                            }
+
                             _ = cancel.cancelled() => {
                                 log::debug!("KvCacheIndexer progress loop shutting down");
                                 return;
                             }
 
-                            Some(event) = event_rx.recv() => {
-                                trie.apply_event(event);
+                            Some(batch) = event_rx.recv() => {
+                                apply_event_batches(&mut trie, &mut event_rx, &task_lag, batch);
                             }
                         }
                     }
@@ -577,24 +1601,18 @@ impl KvIndexer {
 
         Self {
             cancel: token,
-            event_tx,
+            events,
             match_tx,
+            batch_match_tx,
             remove_worker_tx,
+            snapshot_tx,
             task: once,
+            kv_block_size,
         }
     }
 
-    pub fn new(token: CancellationToken) -> Self {
-        Self::new_with_frequency(token, None)
-    }
-
-    /// Get a sender for `RouterEvent`s.
-    ///
-    /// ### Returns
-    ///
-    /// A `mpsc::Sender` for `RouterEvent`s.
-    pub fn event_sender(&self) -> mpsc::Sender<RouterEvent> {
-        self.event_tx.clone()
+    pub fn new(token: CancellationToken, kv_block_size: usize) -> Self {
+        Self::new_with_frequency(token, None, kv_block_size)
     }
 }
 
@@ -627,25 +1645,73 @@ impl KvIndexerInterface for KvIndexer {
     async fn find_matches_for_request(
         &self,
         tokens: &[u32],
+        lora_id: u64,
     ) -> Result<OverlapScores, KvRouterError> {
         log::debug!(
-            "Finding matches for request tokens: {:?} / len: {}",
+            "Finding matches for request tokens: {:?} / len: {} / lora_id: {}",
             tokens,
-            tokens.len()
+            tokens.len(),
+            lora_id
         );
-        let sequence = compute_block_hash_for_seq(tokens);
+        let sequence = compute_block_hash_for_seq(tokens, self.kv_block_size, lora_id);
         log::debug!("Computed sequence: {:?}", sequence);
         self.find_matches(sequence).await
     }
 
+    async fn find_matches_batch(
+        &self,
+        sequences: Vec<Vec<LocalBlockHash>>,
+    ) -> Result<Vec<OverlapScores>, KvRouterError> {
+        let (resp_tx, resp_rx) = oneshot::channel();
+        let req = BatchMatchRequest {
+            sequences,
+            resp: resp_tx,
+        };
+
+        if let Err(e) = self.batch_match_tx.send(req).await {
+            log::error!(
+                "Failed to send batch match request: {:?}; the indexer maybe offline",
+                e
+            );
+            return Err(KvRouterError::IndexerOffline);
+        }
+
+        resp_rx
+            .await
+            .map_err(|_| KvRouterError::IndexerDroppedRequest)
+    }
+
     async fn apply_event(&mut self, event: RouterEvent) {
-        self.event_tx.send(event).await.unwrap();
+        self.events.send(vec![event]).await.unwrap();
     }
 
     async fn remove_worker(&mut self, worker: WorkerId) {
         self.remove_worker_tx.send(worker).await.unwrap();
     }
 
+    async fn snapshot(&self) -> Result<Vec<RouterEvent>, KvRouterError> {
+        let (resp_tx, resp_rx) = oneshot::channel();
+        self.snapshot_tx
+            .send(resp_tx)
+            .await
+            .map_err(|_| KvRouterError::IndexerOffline)?;
+        resp_rx
+            .await
+            .map_err(|_| KvRouterError::IndexerDroppedRequest)
+    }
+
+    fn kv_block_size(&self) -> usize {
+        self.kv_block_size
+    }
+
+    fn event_sender(&self) -> RouterEventSender {
+        self.events.clone()
+    }
+
+    fn lag(&self) -> IndexerLag {
+        self.events.lag()
+    }
+
     fn shutdown(&mut self) {
         self.cancel.cancel();
         if let Some(task) = self.task.take() {
@@ -665,13 +1731,15 @@ pub struct ShardedMatchRequest {
 pub struct KvIndexerSharded {
     /// A `CancellationToken` for managing shutdown.
     cancel: CancellationToken,
-    worker_assignments: HashMap<WorkerId, usize>,
-    worker_counts: Vec<usize>,
+    num_shards: usize,
 
-    event_tx: Vec<mpsc::Sender<RouterEvent>>,
+    /// A sender for `RouterEvent`s, to the shard of their worker.
+    events: RouterEventSender,
     request_broadcast_tx: broadcast::Sender<ShardedMatchRequest>,
     remove_worker_tx: Vec<mpsc::Sender<WorkerId>>,
+    snapshot_tx: Vec<mpsc::Sender<oneshot::Sender<Vec<RouterEvent>>>>,
     tasks: Vec<JoinHandle<()>>,
+    kv_block_size: usize,
 }
 
 impl KvIndexerSharded {
@@ -682,6 +1750,7 @@ impl KvIndexerSharded {
     /// * `token` - A `CancellationToken` for managing shutdown.
     /// * `shards` - A list of kvindexer shards.
     /// * `expiration_duration` - The amount of time that block usage should be buffered.
+    /// * `kv_block_size` - The number of tokens per block of the workers.
     ///
     /// ### Returns
     ///
@@ -690,25 +1759,29 @@ impl KvIndexerSharded {
         token: CancellationToken,
         num_shards: usize,
         expiration_duration: Option<Duration>,
+        kv_block_size: usize,
     ) -> Self {
-        let worker_assignments: HashMap<WorkerId, usize> = HashMap::new();
-        let worker_counts: Vec<usize> = vec![0; num_shards];
-
         let mut event_tx = Vec::new();
+        let lag = Arc::new(EventLag::default());
         let mut remove_worker_tx = Vec::new();
+        let mut snapshot_tx = Vec::new();
         let mut tasks = Vec::new();
 
         let (request_broadcast_tx, _) = broadcast::channel::<ShardedMatchRequest>(1048576);
 
         for _ in 0..num_shards {
-            let (shard_event_tx, mut shard_event_rx) = mpsc::channel::<RouterEvent>(2048);
+            let (shard_event_tx, mut shard_event_rx) = mpsc::channel::<RouterEventBatch>(2048);
+            let shard_lag = lag.clone();
             let (shard_remove_worker_tx, mut shard_remove_worker_rx) =
                 mpsc::channel::<WorkerId>(16);
+            let (shard_snapshot_tx, mut shard_snapshot_rx) =
+                mpsc::channel::<oneshot::Sender<Vec<RouterEvent>>>(4);
             let mut shard_broadcast_rx = request_broadcast_tx.subscribe();
             let cancel = token.clone();
 
             event_tx.push(shard_event_tx);
             remove_worker_tx.push(shard_remove_worker_tx);
+            snapshot_tx.push(shard_snapshot_tx);
 
             let runtime = tokio::runtime::Builder::new_multi_thread()
                 .worker_threads(1)
@@ -737,13 +1810,22 @@ impl KvIndexerSharded {
                                     }
                                 }
 
+                                Some(resp) = shard_snapshot_rx.recv() => {
+                                    let _ = resp.send(trie.snapshot());
+                                }
+
                                 _ = cancel.cancelled() => {
                                     log::debug!("KvCacheIndexer progress loop shutting down");
                                     return;
                                 }
 
-                                Some(event) = shard_event_rx.recv() => {
-                                    trie.apply_event(event);
+                                Some(batch) = shard_event_rx.recv() => {
+                                    apply_event_batches(
+                                        &mut trie,
+                                        &mut shard_event_rx,
+                                        &shard_lag,
+                                        batch,
+                                    );
                                 }
                             }
                         }
@@ -758,17 +1840,18 @@ impl KvIndexerSharded {
 
         Self {
             cancel: token,
-            worker_assignments,
-            worker_counts,
-            event_tx,
+            num_shards,
+            events: RouterEventSender::new(event_tx, lag),
             request_broadcast_tx,
             remove_worker_tx,
+            snapshot_tx,
             tasks,
+            kv_block_size,
         }
     }
 
-    pub fn new(token: CancellationToken, num_shards: usize) -> Self {
-        Self::new_with_frequency(token, num_shards, None)
+    pub fn new(token: CancellationToken, num_shards: usize, kv_block_size: usize) -> Self {
+        Self::new_with_frequency(token, num_shards, None, kv_block_size)
     }
 }
 
@@ -779,7 +1862,7 @@ impl KvIndexerInterface for KvIndexerSharded {
         sequence: Vec<LocalBlockHash>,
     ) -> Result<OverlapScores, KvRouterError> {
         'match_loop: loop {
-            let (match_tx, mut match_rx) = mpsc::channel(self.event_tx.len());
+            let (match_tx, mut match_rx) = mpsc::channel(self.num_shards);
             self.request_broadcast_tx
                 .send(ShardedMatchRequest {
                     sequence: sequence.clone(),
@@ -790,7 +1873,7 @@ impl KvIndexerInterface for KvIndexerSharded {
 
             let mut scores = OverlapScores::new();
 
-            for response_num in 0..self.event_tx.len() {
+            for response_num in 0..self.num_shards {
                 match match_rx.recv().await {
                     Some(response) => {
                         scores.scores.extend(response.scores);
@@ -826,42 +1909,64 @@ impl KvIndexerInterface for KvIndexerSharded {
     async fn find_matches_for_request(
         &self,
         tokens: &[u32],
+        lora_id: u64,
     ) -> Result<OverlapScores, KvRouterError> {
-        let sequence = compute_block_hash_for_seq(tokens);
+        let sequence = compute_block_hash_for_seq(tokens, self.kv_block_size, lora_id);
         self.find_matches(sequence).await
     }
 
-    async fn apply_event(&mut self, event: RouterEvent) {
-        #[allow(clippy::map_entry)]
-        if !self.worker_assignments.contains_key(&event.worker_id) {
-            // Get the shard with the smallest amount of workers.
-            let selected_shard = self
-                .worker_counts
-                .iter()
-                .enumerate()
-                .min_by_key(|&(_, value)| value)
-                .unwrap()
-                .0;
-
-            self.worker_assignments
-                .insert(event.worker_id, selected_shard);
-            self.worker_counts[selected_shard] += 1;
+    async fn find_matches_batch(
+        &self,
+        sequences: Vec<Vec<LocalBlockHash>>,
+    ) -> Result<Vec<OverlapScores>, KvRouterError> {
+        // every shard has to be queried for each sequence anyway
+        let mut scores = Vec::with_capacity(sequences.len());
+        for sequence in sequences {
+            scores.push(self.find_matches(sequence).await?);
         }
+        Ok(scores)
+    }
 
-        self.event_tx[self.worker_assignments[&event.worker_id]]
-            .send(event)
-            .await
-            .unwrap();
+    async fn apply_event(&mut self, event: RouterEvent) {
+        self.events.send(vec![event]).await.unwrap();
     }
 
     async fn remove_worker(&mut self, worker: WorkerId) {
-        if let Some((_, shard)) = self.worker_assignments.remove_entry(&worker) {
-            self.worker_counts[shard] -= 1;
+        if let Some(shard) = self.events.remove_worker(worker) {
             self.remove_worker_tx[shard].send(worker).await.unwrap();
         }
     }
 
-    /// Shutdown the KV Indexer.
+    async fn snapshot(&self) -> Result<Vec<RouterEvent>, KvRouterError> {
+        // the workers of each shard are disjoint
+        let mut events = Vec::new();
+        for snapshot_tx in &self.snapshot_tx {
+            let (resp_tx, resp_rx) = oneshot::channel();
+            snapshot_tx
+                .send(resp_tx)
+                .await
+                .map_err(|_| KvRouterError::IndexerOffline)?;
+            events.extend(
+                resp_rx
+                    .await
+                    .map_err(|_| KvRouterError::IndexerDroppedRequest)?,
+            );
+        }
+        Ok(events)
+    }
+
+    fn kv_block_size(&self) -> usize {
+        self.kv_block_size
+    }
+
+    fn event_sender(&self) -> RouterEventSender {
+        self.events.clone()
+    }
+
+    fn lag(&self) -> IndexerLag {
+        self.events.lag()
+    }
+
     fn shutdown(&mut self) {
         self.cancel.cancel();
         while !self.tasks.is_empty() {
@@ -945,26 +2050,30 @@ mod tests {
 
         assert_eq!(trie.lookup.len(), 1);
         assert_eq!(trie.lookup.get(&worker_1).unwrap().len(), 3);
-        assert_eq!(trie.root.borrow().workers.len(), 0);
-        assert_eq!(trie.root.borrow().children.len(), 1);
+        assert_eq!(trie.arena.get(ROOT).workers.len(), 0);
+        assert_eq!(trie.arena.get(ROOT).children.len(), 1);
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .workers
                 .len(),
             1
         );
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .children
                 .len(),
             1
@@ -982,26 +2091,30 @@ mod tests {
         assert_eq!(trie.lookup.len(), 2);
         assert_eq!(trie.lookup.get(&worker_1).unwrap().len(), 3);
         assert_eq!(trie.lookup.get(&worker_2).unwrap().len(), 3);
-        assert_eq!(trie.root.borrow().workers.len(), 0);
-        assert_eq!(trie.root.borrow().children.len(), 1);
+        assert_eq!(trie.arena.get(ROOT).workers.len(), 0);
+        assert_eq!(trie.arena.get(ROOT).children.len(), 1);
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .workers
                 .len(),
             2
         );
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .children
                 .len(),
             2
@@ -1011,26 +2124,30 @@ mod tests {
         assert_eq!(trie.lookup.len(), 2);
         assert_eq!(trie.lookup.get(&worker_1).unwrap().len(), 3);
         assert_eq!(trie.lookup.get(&worker_2).unwrap().len(), 2);
-        assert_eq!(trie.root.borrow().workers.len(), 0);
-        assert_eq!(trie.root.borrow().children.len(), 1);
+        assert_eq!(trie.arena.get(ROOT).workers.len(), 0);
+        assert_eq!(trie.arena.get(ROOT).children.len(), 1);
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .workers
                 .len(),
             2
         );
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .children
                 .len(),
             2
@@ -1041,26 +2158,30 @@ mod tests {
         assert_eq!(trie.lookup.len(), 2);
         assert_eq!(trie.lookup.get(&worker_1).unwrap().len(), 3);
         assert_eq!(trie.lookup.get(&worker_2).unwrap().len(), 1);
-        assert_eq!(trie.root.borrow().workers.len(), 0);
-        assert_eq!(trie.root.borrow().children.len(), 1);
+        assert_eq!(trie.arena.get(ROOT).workers.len(), 0);
+        assert_eq!(trie.arena.get(ROOT).children.len(), 1);
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .workers
                 .len(),
             2
         );
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .children
                 .len(),
             2
@@ -1083,48 +2204,44 @@ mod tests {
         assert_eq!(trie.lookup.len(), 2);
         assert_eq!(trie.lookup.get(&worker_1).unwrap().len(), 3);
         assert_eq!(trie.lookup.get(&worker_2).unwrap().len(), 4);
-        assert_eq!(trie.root.borrow().workers.len(), 0);
-        assert_eq!(trie.root.borrow().children.len(), 1);
+        assert_eq!(trie.arena.get(ROOT).workers.len(), 0);
+        assert_eq!(trie.arena.get(ROOT).children.len(), 1);
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .workers
                 .len(),
             2
         );
         assert_eq!(
-            trie.root
-                .borrow()
-                .children
-                .get(&LocalBlockHash(1))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(
+                    trie.arena
+                        .get(ROOT)
+                        .children
+                        .get(&LocalBlockHash(1))
+                        .unwrap()
+                )
                 .children
                 .len(),
             2
         );
         assert_eq!(
-            trie.lookup
-                .get(&worker_1)
-                .unwrap()
-                .get(&ExternalSequenceBlockHash(200))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(trie.lookup[&worker_1][&ExternalSequenceBlockHash(200)])
                 .workers
                 .len(),
             2
         );
         assert_eq!(
-            trie.lookup
-                .get(&worker_2)
-                .unwrap()
-                .get(&ExternalSequenceBlockHash(200))
-                .unwrap()
-                .borrow()
+            trie.arena
+                .get(trie.lookup[&worker_2][&ExternalSequenceBlockHash(200)])
                 .workers
                 .len(),
             2
@@ -1180,33 +2297,225 @@ mod tests {
         assert!(result.len() == 2 && result[&worker_0] == 2 && result[&worker_1] == 1);
     }
 
+    #[test]
+    fn test_apply_events() {
+        let events = vec![
+            create_store_event(0, 0, vec![1, 2, 3], None),
+            create_store_event(0, 1, vec![4], Some(ExternalSequenceBlockHash(300))),
+            create_store_event(1, 0, vec![1, 2], None),
+            create_remove_event(0, 2, vec![4]),
+            create_store_event(1, 1, vec![3], Some(ExternalSequenceBlockHash(200))),
+            create_remove_event(1, 2, vec![3]),
+        ];
+
+        let mut expected = RadixTree::new();
+        for event in events.clone() {
+            expected.apply_event(event);
+        }
+        let mut trie = RadixTree::new();
+        trie.apply_events(events);
+
+        for sequence in [vec![1, 2, 3, 4], vec![1, 2, 3], vec![1, 2]] {
+            let sequence: Vec<_> = sequence.into_iter().map(LocalBlockHash).collect();
+            assert_eq!(
+                trie.find_matches(sequence.clone(), false).scores,
+                expected.find_matches(sequence, false).scores
+            );
+        }
+        let scores = trie
+            .find_matches(
+                vec![LocalBlockHash(1), LocalBlockHash(2), LocalBlockHash(3)],
+                false,
+            )
+            .scores;
+        assert_eq!(scores[&0], 3);
+        assert_eq!(scores[&1], 2);
+    }
+
+    #[test]
+    fn test_decode_batch() {
+        let events = vec![
+            create_store_event(3, 0, vec![1, 2], None),
+            create_remove_event(3, 1, vec![2]),
+        ];
+        let expected = serde_json::to_string(&events).unwrap();
+
+        let single = serde_json::to_vec(&events[0]).unwrap();
+        let decoded = RouterEvent::decode_batch(&single).unwrap();
+        assert_eq!(
+            serde_json::to_string(&decoded).unwrap(),
+            serde_json::to_string(&events[..1]).unwrap()
+        );
+
+        let decoded = RouterEvent::decode_batch(expected.as_bytes()).unwrap();
+        assert_eq!(serde_json::to_string(&decoded).unwrap(), expected);
+
+        let binary = encode_kv_events(
+            3,
+            &events
+                .iter()
+                .map(|event| event.event.clone())
+                .collect::<Vec<_>>(),
+        );
+        let decoded = RouterEvent::decode_batch(&binary).unwrap();
+        assert_eq!(serde_json::to_string(&decoded).unwrap(), expected);
+
+        assert!(RouterEvent::decode_batch(b"not an event").is_err());
+    }
+
+    #[test]
+    fn test_snapshot() {
+        let mut trie = RadixTree::new();
+        trie.apply_events(vec![
+            create_store_event(0, 0, vec![1, 2, 3], None),
+            create_store_event(0, 1, vec![4], Some(ExternalSequenceBlockHash(200))),
+            create_store_event(1, 0, vec![1, 2], None),
+            create_store_event(1, 1, vec![5], Some(ExternalSequenceBlockHash(200))),
+            // worker 2 no longer holds the parent of block 6, which is left out
+            create_store_event(2, 0, vec![1, 2], None),
+            create_store_event(2, 1, vec![6], Some(ExternalSequenceBlockHash(200))),
+            create_remove_event(2, 2, vec![2]),
+        ]);
+
+        let mut restored = RadixTree::new();
+        restored.apply_events(trie.snapshot());
+
+        for sequence in [vec![1, 2, 3], vec![1, 4], vec![1, 2, 4], vec![1, 2, 5]] {
+            let sequence: Vec<_> = sequence.into_iter().map(LocalBlockHash).collect();
+            assert_eq!(
+                restored.find_matches(sequence.clone(), false).scores,
+                trie.find_matches(sequence, false).scores
+            );
+        }
+        assert_eq!(restored.lookup[&0].len(), 4);
+        assert_eq!(restored.lookup[&1].len(), 3);
+        assert_eq!(trie.lookup[&2].len(), 2);
+        assert_eq!(restored.lookup[&2].len(), 1);
+
+        // the restored blocks keep their hashes, so the workers can remove them
+        restored.apply_event(create_remove_event(0, 2, vec![2]));
+        let scores = restored
+            .find_matches(vec![LocalBlockHash(1), LocalBlockHash(2)], false)
+            .scores;
+        assert_eq!(scores[&0], 1);
+        assert_eq!(scores[&1], 2);
+    }
+
+    #[test]
+    fn test_encode_snapshot() {
+        let events = vec![
+            create_store_event(0, 0, vec![1, 2, 3], None),
+            create_store_event(0, 1, vec![4], Some(ExternalSequenceBlockHash(200))),
+            create_store_event(7, 0, vec![1], None),
+        ];
+        let data = encode_snapshot(&events, 16);
+
+        let (kv_block_size, decoded) = decode_snapshot(&data).unwrap();
+        assert_eq!(kv_block_size, 16);
+        assert_eq!(
+            serde_json::to_string(&decoded).unwrap(),
+            serde_json::to_string(&events).unwrap()
+        );
+
+        let (_, decoded) = decode_snapshot(&encode_snapshot(&[], 16)).unwrap();
+        assert!(decoded.is_empty());
+        assert!(matches!(
+            decode_snapshot(&data[..data.len() - 1]),
+            Err(KvEventsDecodeError::Truncated)
+        ));
+        assert!(matches!(
+            decode_snapshot(b"not a snapshot"),
+            Err(KvEventsDecodeError::NotASnapshot)
+        ));
+    }
+
     #[test]
     fn test_compute_block_hash_for_seq() {
         // create a sequence of 64 elements
         let sequence = (0..KV_BLOCK_SIZE).map(|i| i as u32).collect::<Vec<u32>>();
-        let hashes = compute_block_hash_for_seq(&sequence);
+        let hashes = compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 0);
         assert_eq!(hashes.len(), 1);
 
         // create a sequence of 65 elements
         let sequence = (0..(KV_BLOCK_SIZE + 1))
             .map(|i| i as u32)
             .collect::<Vec<u32>>();
-        let hashes = compute_block_hash_for_seq(&sequence);
+        let hashes = compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 0);
         assert_eq!(hashes.len(), 1);
 
         // create a sequence of 129 elements
         let sequence = (0..(2 * KV_BLOCK_SIZE + 1))
             .map(|i| i as u32)
             .collect::<Vec<u32>>();
-        let hashes = compute_block_hash_for_seq(&sequence);
+        let hashes = compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 0);
         assert_eq!(hashes.len(), 2);
+
+        // the same sequence in blocks of 16 tokens
+        let hashes = compute_block_hash_for_seq(&sequence, 16, 0);
+        assert_eq!(hashes.len(), (2 * KV_BLOCK_SIZE + 1) / 16);
+        assert_eq!(hashes[0], compute_block_hash_with_lora(&sequence[..16], 0));
+    }
+
+    #[test]
+    fn test_compute_block_hash_with_lora() {
+        let sequence = (0..KV_BLOCK_SIZE).map(|i| i as u32).collect::<Vec<u32>>();
+        let bytes: Vec<u8> = sequence.iter().flat_map(|t| t.to_le_bytes()).collect();
+
+        // the base model hashes are unchanged by the lora salting
+        let base = compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 0);
+        assert_eq!(base[0], compute_block_hash(&bytes));
+
+        // the same tokens served by different adapters must not match
+        let lora_1 = compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 1);
+        let lora_2 = compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 2);
+        assert_ne!(base[0], lora_1[0]);
+        assert_ne!(lora_1[0], lora_2[0]);
+        assert_eq!(
+            lora_1,
+            compute_block_hash_for_seq(&sequence, KV_BLOCK_SIZE, 1)
+        );
+
+        // the adapter id is hashed after the tokens, as the workers publishing events do
+        let salted: Vec<u8> = bytes.iter().copied().chain(1u64.to_le_bytes()).collect();
+        assert_eq!(lora_1[0], compute_block_hash(&salted));
+    }
+
+    #[rstest]
+    #[case(0)]
+    #[case(3)]
+    fn test_sequence_hasher(#[case] lora_id: u64) {
+        let kv_block_size = 4;
+        let sequence = (0..23).collect::<Vec<u32>>();
+        let expected = compute_block_hash_for_seq(&sequence, kv_block_size, lora_id);
+        assert_eq!(expected.len(), 5);
+
+        let mut hasher = SequenceHasher::new(kv_block_size, lora_id);
+        assert_eq!(hasher.extend(&sequence[..2]), &[]);
+        assert_eq!(hasher.extend(&sequence[2..3]), &[]);
+        assert_eq!(hasher.extend(&sequence[3..10]), &expected[..2]);
+        assert_eq!(hasher.extend(&[]), &[]);
+        assert_eq!(hasher.extend(&sequence[10..12]), &expected[2..3]);
+        assert_eq!(hasher.extend(&sequence[12..23]), &expected[3..]);
+        assert_eq!(hasher.block_hashes(), expected.as_slice());
+        assert_eq!(hasher.num_tokens(), 23);
+
+        // another turn of the conversation only hashes its own blocks
+        let mut sequence = sequence;
+        sequence.extend(23..30);
+        let expected = compute_block_hash_for_seq(&sequence, kv_block_size, lora_id);
+        assert_eq!(hasher.extend(&sequence[23..]), &expected[5..]);
+        assert_eq!(hasher.block_hashes(), expected.as_slice());
     }
 
     fn make_indexer(token: &CancellationToken, num_shards: usize) -> Box<dyn KvIndexerInterface> {
         if num_shards == 1 {
-            Box::new(KvIndexer::new(token.clone()))
+            Box::new(KvIndexer::new(token.clone(), KV_BLOCK_SIZE))
         } else {
-            Box::new(KvIndexerSharded::new(token.clone(), num_shards))
+            Box::new(KvIndexerSharded::new(
+                token.clone(),
+                num_shards,
+                KV_BLOCK_SIZE,
+            ))
         }
     }
 
@@ -1260,11 +2569,51 @@ mod tests {
         let kv_indexer = make_indexer(&token, num_shards);
 
         let tokens = vec![1, 2, 3, 4];
-        let scores = kv_indexer.find_matches_for_request(&tokens).await;
+        let scores = kv_indexer.find_matches_for_request(&tokens, 0).await;
 
         assert!(scores.unwrap().scores.is_empty());
     }
 
+    #[rstest]
+    #[case(1)]
+    #[case(2)]
+    #[case(3)]
+    #[case(4)]
+    #[case(5)]
+    #[case(6)]
+    #[case(7)]
+    #[case(8)]
+    #[tokio::test]
+    async fn test_find_matches_batch(#[case] num_shards: usize) {
+        let token = CancellationToken::new();
+        let mut kv_indexer = make_indexer(&token, num_shards);
+
+        kv_indexer
+            .apply_event(create_store_event(0, 0, vec![1, 2, 3], None))
+            .await;
+        kv_indexer
+            .apply_event(create_store_event(1, 0, vec![1, 4], None))
+            .await;
+
+        time::sleep(Duration::from_millis(5)).await;
+
+        let scores = kv_indexer
+            .find_matches_batch(vec![
+                vec![LocalBlockHash(1), LocalBlockHash(2), LocalBlockHash(3)],
+                vec![LocalBlockHash(1), LocalBlockHash(4)],
+                vec![LocalBlockHash(5)],
+            ])
+            .await
+            .unwrap();
+
+        assert_eq!(scores.len(), 3);
+        assert_eq!(scores[0].scores.get(&0), Some(&3));
+        assert_eq!(scores[0].scores.get(&1), Some(&1));
+        assert_eq!(scores[1].scores.get(&0), Some(&1));
+        assert_eq!(scores[1].scores.get(&1), Some(&2));
+        assert!(scores[2].scores.is_empty());
+    }
+
     #[rstest]
     #[case(1)]
     #[case(2)]
@@ -1287,6 +2636,100 @@ mod tests {
         // No assertion here, just ensuring it runs without panic
     }
 
+    #[rstest]
+    #[case(1)]
+    #[case(3)]
+    #[tokio::test]
+    async fn test_lag(#[case] num_shards: usize) {
+        let token = CancellationToken::new();
+        let mut kv_indexer = make_indexer(&token, num_shards);
+
+        for worker_id in 0..4 {
+            let event = create_store_event(worker_id, 1, vec![1, 2, 3], None);
+            kv_indexer.apply_event(event).await;
+        }
+
+        time::sleep(Duration::from_millis(100)).await;
+        let scores = kv_indexer
+            .find_matches(vec![LocalBlockHash(1)])
+            .await
+            .unwrap();
+        assert_eq!(scores.scores.len(), 4);
+
+        let lag = kv_indexer.lag();
+        assert_eq!(lag.events, 0);
+        assert_eq!(lag.delay, Duration::ZERO);
+
+        kv_indexer.shutdown();
+    }
+
+    #[rstest]
+    #[case(1)]
+    #[case(3)]
+    #[tokio::test]
+    async fn test_event_sender(#[case] num_shards: usize) {
+        let token = CancellationToken::new();
+        let config = IndexerConfig {
+            num_shards,
+            ..Default::default()
+        };
+        let mut kv_indexer = config.start(token, KV_BLOCK_SIZE);
+
+        let sender = kv_indexer.event_sender();
+        sender
+            .send(vec![
+                create_store_event(0, 0, vec![1, 2], None),
+                create_store_event(1, 0, vec![1], None),
+            ])
+            .await
+            .unwrap();
+
+        time::sleep(Duration::from_millis(100)).await;
+        let scores = kv_indexer
+            .find_matches(vec![LocalBlockHash(1), LocalBlockHash(2)])
+            .await
+            .unwrap();
+        assert_eq!(scores.scores[&0], 2);
+        assert_eq!(scores.scores[&1], 1);
+        assert_eq!(kv_indexer.lag().events, 0);
+
+        kv_indexer.shutdown();
+    }
+
+    #[rstest]
+    #[case(1)]
+    #[case(3)]
+    #[tokio::test]
+    async fn test_indexer_snapshot(#[case] num_shards: usize) {
+        let token = CancellationToken::new();
+        let mut kv_indexer = make_indexer(&token, num_shards);
+
+        for worker_id in 0..4 {
+            let event = create_store_event(worker_id, 0, vec![1, 2, 3], None);
+            kv_indexer.apply_event(event).await;
+        }
+        time::sleep(Duration::from_millis(100)).await;
+
+        let events = kv_indexer.snapshot().await.unwrap();
+        let (_, events) = decode_snapshot(&encode_snapshot(&events, KV_BLOCK_SIZE)).unwrap();
+        let mut trie = RadixTree::new();
+        trie.apply_events(events);
+        let scores = trie
+            .find_matches(
+                vec![LocalBlockHash(1), LocalBlockHash(2), LocalBlockHash(3)],
+                false,
+            )
+            .scores;
+        assert_eq!(
+            scores,
+            (0..4)
+                .map(|worker_id| (worker_id, 3))
+                .collect::<HashMap<_, _>>()
+        );
+
+        kv_indexer.shutdown();
+    }
+
     #[rstest]
     #[case(1)]
     #[case(2)]
@@ -1320,10 +2763,17 @@ mod tests {
         let duration = Some(Duration::from_millis(50));
 
         if num_shards == 1 {
-            kv_indexer = Box::new(KvIndexer::new_with_frequency(token, duration));
+            kv_indexer = Box::new(KvIndexer::new_with_frequency(
+                token,
+                duration,
+                KV_BLOCK_SIZE,
+            ));
         } else {
             kv_indexer = Box::new(KvIndexerSharded::new_with_frequency(
-                token, num_shards, duration,
+                token,
+                num_shards,
+                duration,
+                KV_BLOCK_SIZE,
             ));
         }
 
@@ -1397,11 +2847,100 @@ mod tests {
     #[test]
     fn test_radix_tree_default() {
         let radix_tree: RadixTree = Default::default();
-        assert!(radix_tree.root.borrow().children.is_empty());
-        assert!(radix_tree.root.borrow().workers.is_empty());
+        assert!(radix_tree.arena.get(ROOT).children.is_empty());
+        assert!(radix_tree.arena.get(ROOT).workers.is_empty());
         assert!(radix_tree.lookup.is_empty());
     }
 
+    #[test]
+    fn test_radix_tree_children() {
+        let mut trie = RadixTree::new();
+
+        // the children of the root go from inline to listed to hashed
+        for i in 1..=20 {
+            trie.apply_event(create_store_event(0, i, vec![i], None));
+            assert_eq!(trie.arena.get(ROOT).children.len(), i as usize);
+        }
+        assert!(matches!(trie.arena.get(ROOT).children, Children::Hashed(_)));
+        trie.apply_event(create_store_event(
+            0,
+            21,
+            vec![21, 22],
+            Some(ExternalSequenceBlockHash(100)),
+        ));
+
+        for i in 1..=20 {
+            let scores = trie.find_matches(vec![LocalBlockHash(i)], false).scores;
+            assert_eq!(scores.len(), 1);
+            assert_eq!(scores[&0], 1);
+        }
+        let scores = trie
+            .find_matches(
+                vec![LocalBlockHash(1), LocalBlockHash(21), LocalBlockHash(22)],
+                false,
+            )
+            .scores;
+        assert_eq!(scores[&0], 3);
+    }
+
+    #[test]
+    fn test_radix_tree_many_workers() {
+        let mut trie = RadixTree::new();
+        let workers: Vec<WorkerId> = (0..150).map(|i| i * 1000).collect();
+
+        for &worker in &workers {
+            trie.apply_event(create_store_event(worker, 0, vec![1, 2], None));
+        }
+        trie.apply_event(create_store_event(
+            workers[140],
+            1,
+            vec![3],
+            Some(ExternalSequenceBlockHash(200)),
+        ));
+        let sequence = vec![LocalBlockHash(1), LocalBlockHash(2), LocalBlockHash(3)];
+        let scores = trie.find_matches(sequence.clone(), false).scores;
+        assert_eq!(scores.len(), workers.len());
+        assert!(workers[..140].iter().all(|worker| scores[worker] == 2));
+        assert_eq!(scores[&workers[140]], 3);
+
+        // a new worker does not inherit the blocks of the removed worker whose slot it takes
+        trie.remove_worker(workers[140]);
+        trie.apply_event(create_store_event(7, 0, vec![1], None));
+        let scores = trie.find_matches(sequence.clone(), true).scores;
+        assert!(!scores.contains_key(&workers[140]));
+        assert_eq!(scores[&7], 1);
+        assert_eq!(scores[&workers[141]], 2);
+    }
+
+    #[test]
+    fn test_radix_tree_memory() {
+        let mut trie = RadixTree::new();
+        assert_eq!(trie.memory_usage().blocks, 0);
+
+        trie.apply_event(create_store_event(0, 0, vec![1, 2, 3], None));
+        let memory = trie.memory_usage();
+        assert_eq!(memory.blocks, 3);
+        assert!(memory.bytes_per_block() > 0.0);
+
+        // the emptied block stays in the tree, its children are freed
+        trie.apply_event(create_remove_event(0, 1, vec![1]));
+        trie.apply_event(create_remove_event(0, 2, vec![2, 3]));
+        assert_eq!(trie.memory_usage().blocks, 1);
+
+        // the freed blocks are reused
+        trie.apply_event(create_store_event(1, 0, vec![1, 2, 3], None));
+        assert_eq!(trie.memory_usage().blocks, 3);
+        assert_eq!(trie.arena.blocks.len(), 4);
+        let scores = trie
+            .find_matches(
+                vec![LocalBlockHash(1), LocalBlockHash(2), LocalBlockHash(3)],
+                false,
+            )
+            .scores;
+        assert_eq!(scores.len(), 1);
+        assert_eq!(scores[&1], 3);
+    }
+
     #[test]
     fn test_overlap_scores_default() {
         let overlap_scores: OverlapScores = Default::default();
@@ -15,9 +15,8 @@
 
 use serde::{Deserialize, Serialize};
 
-// Currently hard-coding the block size to be 64 tokens, and
-// assuming the LLM framework aligns with this size.
-// The KV publisher and subscriber conveys hash values of the tokens,
+// Default number of tokens per KV block, used when the workers of a component do not publish
+// their block size. The KV publisher and subscriber conveys hash values of the tokens,
 // for performance reason, therefore the block size needs to be consistent
 // so that the computed hash value is the same on both sizes.
 pub const KV_BLOCK_SIZE: usize = 64;
@@ -28,6 +27,9 @@ pub struct ForwardPassMetrics {
     pub request_total_slots: u64,
     pub kv_active_blocks: u64,
     pub kv_total_blocks: u64,
+    /// Number of tokens per KV block of the worker, if published
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    pub kv_block_size: Option<u64>,
 }
 
 /// A [`BlockHash`] is a hash computed from the tokens_ids, extra_token_ids and the optional
@@ -62,7 +64,7 @@ pub struct KvCacheEvent {
 
 /// Represents the data associated with a cache event.
 ///
-/// Data is either stored or removed.
+/// Data is either stored or removed, or all the blocks of the worker are cleared.
 #[derive(Serialize, Deserialize, Debug, Clone)]
 #[serde(rename_all = "snake_case")]
 pub enum KvCacheEventData {
@@ -70,6 +72,9 @@ pub enum KvCacheEventData {
     Stored(KvCacheStoreData),
     /// Data for a removed cache event.
     Removed(KvCacheRemoveData),
+    /// All the blocks of the worker were dropped; also starts the answer to a
+    /// [`KvResyncRequest`].
+    Cleared,
 }
 
 /// Represents the data associated with a stored cache event.
@@ -97,6 +102,18 @@ pub struct KvCacheRemoveData {
     pub block_hashes: Vec<ExternalSequenceBlockHash>,
 }
 
+/// Asks a worker to republish all the blocks it holds, sent by a router that missed some of its
+/// events.
+///
+/// The worker answers on its KV events subject with a [`KvCacheEventData::Cleared`] event
+/// followed by the stored events rebuilding its blocks, all with the id of the last event it
+/// published before them; the events it publishes afterwards apply on top.
+#[derive(Serialize, Deserialize, Debug, Clone, PartialEq, Eq)]
+pub struct KvResyncRequest {
+    /// The ID of the worker to resync.
+    pub worker_id: i64,
+}
+
 impl Serialize for LocalBlockHash {
     fn serialize<S>(&self, serializer: S) -> Result<S::Ok, S::Error>
     where
@@ -135,6 +152,143 @@ impl<'de> Deserialize<'de> for ExternalSequenceBlockHash {
     }
 }
 
+/// First byte of the compact binary encoding of KV events; JSON payloads start with `{` or `[`
+pub const KV_EVENTS_BINARY_TAG: u8 = 0xB1;
+
+const STORED_EVENT: u8 = 0;
+const REMOVED_EVENT: u8 = 1;
+const CLEARED_EVENT: u8 = 2;
+
+/// Errors decoding KV events.
+#[derive(Debug, thiserror::Error)]
+pub enum KvEventsDecodeError {
+    #[error("truncated KV events payload")]
+    Truncated,
+
+    #[error("unknown KV event kind: {0}")]
+    UnknownEventKind(u8),
+
+    #[error("not a KV indexer snapshot")]
+    NotASnapshot,
+
+    #[error("invalid KV events payload: {0}")]
+    Json(#[from] serde_json::Error),
+}
+
+/// Encode the events of a worker in the compact binary format.
+///
+/// The payload is [`KV_EVENTS_BINARY_TAG`], the worker id and the number of events, followed by
+/// each event: its id, its kind, then the optional parent hash and the stored blocks, or the
+/// removed blocks, or nothing for a cleared event. Integers are little-endian; lengths are `u32`.
+pub fn encode_kv_events(worker_id: i64, events: &[KvCacheEvent]) -> Vec<u8> {
+    let mut buf = Vec::with_capacity(13 + events.len() * 32);
+    buf.push(KV_EVENTS_BINARY_TAG);
+    buf.extend_from_slice(&worker_id.to_le_bytes());
+    buf.extend_from_slice(&(events.len() as u32).to_le_bytes());
+    for event in events {
+        buf.extend_from_slice(&event.event_id.to_le_bytes());
+        match &event.data {
+            KvCacheEventData::Stored(store) => {
+                buf.push(STORED_EVENT);
+                match store.parent_hash {
+                    Some(parent_hash) => {
+                        buf.push(1);
+                        buf.extend_from_slice(&parent_hash.0.to_le_bytes());
+                    }
+                    None => buf.push(0),
+                }
+                buf.extend_from_slice(&(store.blocks.len() as u32).to_le_bytes());
+                for block in &store.blocks {
+                    buf.extend_from_slice(&block.block_hash.0.to_le_bytes());
+                    buf.extend_from_slice(&block.tokens_hash.0.to_le_bytes());
+                }
+            }
+            KvCacheEventData::Removed(remove) => {
+                buf.push(REMOVED_EVENT);
+                buf.extend_from_slice(&(remove.block_hashes.len() as u32).to_le_bytes());
+                for block_hash in &remove.block_hashes {
+                    buf.extend_from_slice(&block_hash.0.to_le_bytes());
+                }
+            }
+            KvCacheEventData::Cleared => buf.push(CLEARED_EVENT),
+        }
+    }
+    buf
+}
+
+/// Decode events encoded with [`encode_kv_events`], returning the worker id and the events.
+pub fn decode_kv_events(payload: &[u8]) -> Result<(i64, Vec<KvCacheEvent>), KvEventsDecodeError> {
+    let mut reader = Reader(payload);
+    if reader.u8()? != KV_EVENTS_BINARY_TAG {
+        return Err(KvEventsDecodeError::UnknownEventKind(payload[0]));
+    }
+    let worker_id = reader.u64()? as i64;
+    let count = reader.len()?;
+    // every event takes at least 9 bytes, do not trust the count to preallocate
+    let mut events = Vec::with_capacity(count.min(reader.0.len() / 9));
+    for _ in 0..count {
+        let event_id = reader.u64()?;
+        let data = match reader.u8()? {
+            STORED_EVENT => {
+                let parent_hash = match reader.u8()? {
+                    0 => None,
+                    _ => Some(ExternalSequenceBlockHash(reader.u64()?)),
+                };
+                let len = reader.len()?;
+                let mut blocks = Vec::with_capacity(len.min(reader.0.len() / 16));
+                for _ in 0..len {
+                    blocks.push(KvCacheStoredBlockData {
+                        block_hash: ExternalSequenceBlockHash(reader.u64()?),
+                        tokens_hash: LocalBlockHash(reader.u64()?),
+                    });
+                }
+                KvCacheEventData::Stored(KvCacheStoreData {
+                    parent_hash,
+                    blocks,
+                })
+            }
+            REMOVED_EVENT => {
+                let len = reader.len()?;
+                let mut block_hashes = Vec::with_capacity(len.min(reader.0.len() / 8));
+                for _ in 0..len {
+                    block_hashes.push(ExternalSequenceBlockHash(reader.u64()?));
+                }
+                KvCacheEventData::Removed(KvCacheRemoveData { block_hashes })
+            }
+            CLEARED_EVENT => KvCacheEventData::Cleared,
+            kind => return Err(KvEventsDecodeError::UnknownEventKind(kind)),
+        };
+        events.push(KvCacheEvent { event_id, data });
+    }
+    Ok((worker_id, events))
+}
+
+/// Reads the little-endian integers of a binary payload
+struct Reader<'a>(&'a [u8]);
+
+impl Reader<'_> {
+    fn take<const N: usize>(&mut self) -> Result<[u8; N], KvEventsDecodeError> {
+        let (bytes, rest) = self
+            .0
+            .split_first_chunk::<N>()
+            .ok_or(KvEventsDecodeError::Truncated)?;
+        self.0 = rest;
+        Ok(*bytes)
+    }
+
+    fn u8(&mut self) -> Result<u8, KvEventsDecodeError> {
+        Ok(self.take::<1>()?[0])
+    }
+
+    fn u64(&mut self) -> Result<u64, KvEventsDecodeError> {
+        Ok(u64::from_le_bytes(self.take()?))
+    }
+
+    fn len(&mut self) -> Result<usize, KvEventsDecodeError> {
+        Ok(u32::from_le_bytes(self.take()?) as usize)
+    }
+}
+
 #[cfg(test)]
 mod tests {
     use super::*;
@@ -196,6 +350,23 @@ mod tests {
         assert!(!deserialized.shutdown);
     }
 
+    #[test]
+    fn test_forward_pass_metrics_block_size() {
+        // metrics of workers that do not publish their block size
+        let serialized = r#"{"request_active_slots":1,"request_total_slots":2,"kv_active_blocks":3,"kv_total_blocks":4}"#;
+        let deserialized: ForwardPassMetrics = serde_json::from_str(serialized).unwrap();
+        assert_eq!(deserialized.kv_block_size, None);
+        assert_eq!(serde_json::to_string(&deserialized).unwrap(), serialized);
+
+        let metrics = ForwardPassMetrics {
+            kv_block_size: Some(16),
+            ..deserialized
+        };
+        let serialized = serde_json::to_string(&metrics).unwrap();
+        let deserialized: ForwardPassMetrics = serde_json::from_str(&serialized).unwrap();
+        assert_eq!(deserialized.kv_block_size, Some(16));
+    }
+
     #[test]
     fn test_kv_cache_remove_data_serialization() {
         let remove_data = KvCacheRemoveData {
@@ -209,4 +380,60 @@ mod tests {
         assert_eq!(deserialized.block_hashes[0].0, 4);
         assert_eq!(deserialized.block_hashes[1].0, 5);
     }
+
+    #[test]
+    fn test_kv_events_binary_roundtrip() {
+        let events = vec![
+            KvCacheEvent {
+                event_id: 7,
+                data: KvCacheEventData::Stored(KvCacheStoreData {
+                    parent_hash: Some(ExternalSequenceBlockHash(1)),
+                    blocks: vec![
+                        KvCacheStoredBlockData {
+                            block_hash: ExternalSequenceBlockHash(2),
+                            tokens_hash: LocalBlockHash(3),
+                        },
+                        KvCacheStoredBlockData {
+                            block_hash: ExternalSequenceBlockHash(u64::MAX),
+                            tokens_hash: LocalBlockHash(5),
+                        },
+                    ],
+                }),
+            },
+            KvCacheEvent {
+                event_id: 8,
+                data: KvCacheEventData::Stored(KvCacheStoreData {
+                    parent_hash: None,
+                    blocks: vec![],
+                }),
+            },
+            KvCacheEvent {
+                event_id: 9,
+                data: KvCacheEventData::Removed(KvCacheRemoveData {
+                    block_hashes: vec![ExternalSequenceBlockHash(2)],
+                }),
+            },
+            KvCacheEvent {
+                event_id: 10,
+                data: KvCacheEventData::Cleared,
+            },
+        ];
+
+        let encoded = encode_kv_events(-3, &events);
+        assert_eq!(encoded[0], KV_EVENTS_BINARY_TAG);
+        let (worker_id, decoded) = decode_kv_events(&encoded).unwrap();
+        assert_eq!(worker_id, -3);
+        // compare through the JSON encoding, the events do not implement PartialEq
+        assert_eq!(
+            serde_json::to_string(&decoded).unwrap(),
+            serde_json::to_string(&events).unwrap()
+        );
+
+        for len in 0..encoded.len() {
+            assert!(matches!(
+                decode_kv_events(&encoded[..len]),
+                Err(KvEventsDecodeError::Truncated)
+            ));
+        }
+    }
 }
@@ -13,10 +13,19 @@
 // See the License for the specific language governing permissions and
 // limitations under the License.
 
-use crate::kv_router::{indexer::RouterEvent, protocols::*, KV_EVENT_SUBJECT};
+use crate::kv_router::{
+    indexer::{RouterEvent, MAX_EVENT_BATCH},
+    kv_resync_subject,
+    protocols::*,
+    resync::PublishedBlocks,
+    KV_EVENT_SUBJECT,
+};
 use async_trait::async_trait;
-use futures::stream;
-use std::sync::Arc;
+use futures::{stream, StreamExt};
+use std::{
+    sync::Arc,
+    time::{Duration, Instant},
+};
 use tokio::sync::mpsc;
 use tracing as log;
 use triton_distributed_runtime::{
@@ -26,19 +35,45 @@ use triton_distributed_runtime::{
         SingleIn,
     },
     protocols::annotated::Annotated,
+    transports::nats::Client as NatsClient,
     DistributedRuntime, Error, Result,
 };
 
+/// The [`KvResyncRequest`]s received within this interval of the previous one are ignored
+const MIN_RESYNC_INTERVAL: Duration = Duration::from_secs(1);
+
+/// How a [`KvEventPublisher`] encodes the events it publishes
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq)]
+pub enum KvEventEncoding {
+    /// One JSON [`RouterEvent`] per message, understood by every router
+    #[default]
+    Json,
+    /// The events pending when a message is published, in the binary format of
+    /// [`encode_kv_events`]
+    Binary,
+}
+
+/// Publishes the KV events of a worker, and answers the [`KvResyncRequest`]s of the routers
+/// that missed some of them with the blocks it published.
 pub struct KvEventPublisher {
     tx: mpsc::UnboundedSender<KvCacheEvent>,
 }
 
 impl KvEventPublisher {
     pub fn new(drt: DistributedRuntime, backend: Component, worker_id: i64) -> Result<Self> {
+        Self::new_with_encoding(drt, backend, worker_id, KvEventEncoding::default())
+    }
+
+    pub fn new_with_encoding(
+        drt: DistributedRuntime,
+        backend: Component,
+        worker_id: i64,
+        encoding: KvEventEncoding,
+    ) -> Result<Self> {
         let (tx, rx) = mpsc::unbounded_channel::<KvCacheEvent>();
         let p = KvEventPublisher { tx };
 
-        start_publish_task(drt, backend, worker_id, rx);
+        start_publish_task(drt, backend, worker_id, encoding, rx);
         Ok(p)
     }
 
@@ -52,22 +87,105 @@ fn start_publish_task(
     drt: DistributedRuntime,
     backend: Component,
     worker_id: i64,
+    encoding: KvEventEncoding,
     mut rx: mpsc::UnboundedReceiver<KvCacheEvent>,
 ) {
-    let client = drt.nats_client().client().clone();
+    let nats_client = drt.nats_client();
     let kv_subject = backend.event_subject(KV_EVENT_SUBJECT);
-    log::info!("Publishing KV Events to subject: {}", kv_subject);
+    log::info!(
+        "Publishing KV Events to subject: {} ({:?})",
+        kv_subject,
+        encoding
+    );
 
     _ = drt.runtime().secondary().spawn(async move {
-        while let Some(event) = rx.recv().await {
-            let router_event = RouterEvent::new(worker_id, event);
-            let data = serde_json::to_string(&router_event).unwrap();
+        let resync_subject = kv_resync_subject(&kv_subject);
+        let client = nats_client.client();
+        let mut resync_rx = match client.subscribe(resync_subject.clone()).await {
+            Ok(subscriber) => Some(subscriber),
+            Err(e) => {
+                log::warn!("Failed to subscribe to {}: {:?}", resync_subject, e);
+                None
+            }
+        };
+
+        let mut published = PublishedBlocks::default();
+        let mut last_resync: Option<Instant> = None;
+        let mut events = Vec::with_capacity(MAX_EVENT_BATCH);
+        loop {
+            tokio::select! {
+                received = rx.recv_many(&mut events, MAX_EVENT_BATCH) => {
+                    if received == 0 {
+                        break;
+                    }
+                    for event in &events {
+                        published.apply(event);
+                    }
+                    publish_events(&nats_client, &kv_subject, worker_id, encoding, &mut events)
+                        .await;
+                }
+                Some(message) = async { resync_rx.as_mut()?.next().await } => {
+                    match serde_json::from_slice::<KvResyncRequest>(&message.payload) {
+                        Ok(request) if request.worker_id == worker_id => {
+                            // the routers requesting together all receive the same answer
+                            if last_resync.is_some_and(|at| at.elapsed() < MIN_RESYNC_INTERVAL) {
+                                continue;
+                            }
+                            last_resync = Some(Instant::now());
+                            // published in order with the events, which apply on top
+                            let mut resync = published.resync_events();
+                            log::info!("Resyncing {} KV events", resync.len());
+                            while !resync.is_empty() {
+                                let len = resync.len().min(MAX_EVENT_BATCH);
+                                let mut batch: Vec<_> = resync.drain(..len).collect();
+                                publish_events(
+                                    &nats_client,
+                                    &kv_subject,
+                                    worker_id,
+                                    encoding,
+                                    &mut batch,
+                                )
+                                .await;
+                            }
+                        }
+                        Ok(_) => {}
+                        Err(e) => log::warn!("Failed to deserialize KvResyncRequest: {:?}", e),
+                    }
+                }
+            }
+        }
+    });
+}
+
+/// Publish `events`, leaving it empty
+async fn publish_events(
+    nats_client: &NatsClient,
+    kv_subject: &str,
+    worker_id: i64,
+    encoding: KvEventEncoding,
+    events: &mut Vec<KvCacheEvent>,
+) {
+    let client = nats_client.client();
+    match encoding {
+        KvEventEncoding::Json => {
+            for event in events.drain(..) {
+                let router_event = RouterEvent::new(worker_id, event);
+                let data = serde_json::to_string(&router_event).unwrap();
+                client
+                    .publish(kv_subject.to_string(), data.into())
+                    .await
+                    .unwrap();
+            }
+        }
+        KvEventEncoding::Binary => {
+            let data = encode_kv_events(worker_id, events);
+            events.clear();
             client
                 .publish(kv_subject.to_string(), data.into())
                 .await
                 .unwrap();
         }
-    });
+    }
 }
 
 pub struct KvMetricsPublisher {
@@ -81,10 +199,21 @@ impl KvMetricsPublisher {
         Ok(KvMetricsPublisher { tx, rx })
     }
 
+    /// Publish the metrics of the worker
+    ///
+    /// The KV block size only needs to be given once, it is kept by the following metrics that
+    /// do not set it.
     pub fn publish(
         &self,
         metrics: Arc<ForwardPassMetrics>,
     ) -> Result<(), tokio::sync::watch::error::SendError<Arc<ForwardPassMetrics>>> {
+        let mut metrics = metrics;
+        if metrics.kv_block_size.is_none() {
+            let kv_block_size = self.rx.borrow().kv_block_size;
+            if kv_block_size.is_some() {
+                Arc::make_mut(&mut metrics).kv_block_size = kv_block_size;
+            }
+        }
         log::debug!("Publish metrics: {:?}", metrics);
         self.tx.send(metrics)
     }
@@ -0,0 +1,301 @@
+// SPDX-FileCopyrightText: Copyright (c) 2024-2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+// SPDX-License-Identifier: Apache-2.0
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+// http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+//! Resynchronization of the KV blocks indexed by a router with the ones held by a worker.
+//!
+//! The events of a worker are numbered consecutively, so a router notices the ones it missed:
+//! a dropped message, or the events published before it started. It then sends a
+//! [`KvResyncRequest`], and the publisher of the worker answers from the blocks it published,
+//! see [`KvResyncRequest`] for the format of the answer.
+
+use std::{
+    collections::{hash_map::Entry, HashMap},
+    time::{Duration, Instant},
+};
+
+use crate::kv_router::{indexer::RouterEvent, protocols::*};
+
+/// How long a router waits for the answer to a [`KvResyncRequest`] before sending it again
+pub const RESYNC_RETRY_INTERVAL: Duration = Duration::from_secs(5);
+
+/// The blocks a worker published and has not removed, kept by its publisher to answer the
+/// [`KvResyncRequest`]s
+#[derive(Debug, Default)]
+pub(crate) struct PublishedBlocks {
+    /// The parent and the tokens hash of each block
+    blocks: HashMap<ExternalSequenceBlockHash, (Option<ExternalSequenceBlockHash>, LocalBlockHash)>,
+    last_event_id: Option<u64>,
+}
+
+impl PublishedBlocks {
+    /// Account for an event published by the worker
+    pub fn apply(&mut self, event: &KvCacheEvent) {
+        self.last_event_id = Some(event.event_id);
+        match &event.data {
+            KvCacheEventData::Stored(store) => {
+                let mut parent_hash = store.parent_hash;
+                for block in &store.blocks {
+                    self.blocks
+                        .insert(block.block_hash, (parent_hash, block.tokens_hash));
+                    parent_hash = Some(block.block_hash);
+                }
+            }
+            KvCacheEventData::Removed(remove) => {
+                for block_hash in &remove.block_hashes {
+                    self.blocks.remove(block_hash);
+                }
+            }
+            KvCacheEventData::Cleared => self.blocks.clear(),
+        }
+    }
+
+    /// The events answering a [`KvResyncRequest`]: a cleared event, then the stored events
+    /// rebuilding the blocks from the root down, one per path
+    ///
+    /// The blocks whose parent was removed are left out, a router can not match them.
+    pub fn resync_events(&self) -> Vec<KvCacheEvent> {
+        let mut children: HashMap<_, Vec<_>> = HashMap::new();
+        for (&block_hash, &(parent_hash, _)) in &self.blocks {
+            children.entry(parent_hash).or_default().push(block_hash);
+        }
+
+        let event_id = self.last_event_id.unwrap_or(0);
+        let mut events = vec![KvCacheEvent {
+            event_id,
+            data: KvCacheEventData::Cleared,
+        }];
+        // every block has a single parent, so each is reached once from the root
+        let mut stack: Vec<_> = children
+            .get(&None)
+            .into_iter()
+            .flatten()
+            .map(|&block_hash| (None, block_hash))
+            .collect();
+        while let Some((parent_hash, mut block_hash)) = stack.pop() {
+            let mut blocks = Vec::new();
+            loop {
+                blocks.push(KvCacheStoredBlockData {
+                    block_hash,
+                    tokens_hash: self.blocks[&block_hash].1,
+                });
+                // the path goes on with the first child, the others start their own
+                let Some((&first, others)) = children
+                    .get(&Some(block_hash))
+                    .and_then(|children| children.split_first())
+                else {
+                    break;
+                };
+                stack.extend(others.iter().map(|&child| (Some(block_hash), child)));
+                block_hash = first;
+            }
+            events.push(KvCacheEvent {
+                event_id,
+                data: KvCacheEventData::Stored(KvCacheStoreData {
+                    parent_hash,
+                    blocks,
+                }),
+            });
+        }
+        events
+    }
+}
+
+/// The id of the last event received from a worker
+#[derive(Debug)]
+struct WorkerSequence {
+    last_event_id: u64,
+    resync_requested_at: Option<Instant>,
+}
+
+/// Finds the workers a router missed events of, to send them a [`KvResyncRequest`]
+#[derive(Debug, Default)]
+pub(crate) struct EventGapTracker {
+    workers: HashMap<i64, WorkerSequence>,
+}
+
+impl EventGapTracker {
+    /// Track the events received, returning the workers to send a [`KvResyncRequest`] to
+    ///
+    /// A worker is resynced when one of its events is skipped, or when the first event received
+    /// from it is not its first one; the request is sent again if the worker has not answered
+    /// within [`RESYNC_RETRY_INTERVAL`].
+    pub fn track(&mut self, events: &[RouterEvent]) -> Vec<i64> {
+        let now = Instant::now();
+        let mut resync = Vec::new();
+        for event in events {
+            let worker_id = event.worker_id();
+            let KvCacheEvent { event_id, data } = event.event();
+            let cleared = matches!(data, KvCacheEventData::Cleared);
+            let missed = match self.workers.entry(worker_id) {
+                Entry::Vacant(entry) => {
+                    entry.insert(WorkerSequence {
+                        last_event_id: *event_id,
+                        resync_requested_at: None,
+                    });
+                    *event_id != 0 && !cleared
+                }
+                Entry::Occupied(mut entry) => {
+                    let sequence = entry.get_mut();
+                    let missed = !cleared && event_id.saturating_sub(sequence.last_event_id) > 1;
+                    if cleared {
+                        // the worker answered, or dropped all its blocks anyway
+                        sequence.last_event_id = *event_id;
+                        sequence.resync_requested_at = None;
+                    } else {
+                        sequence.last_event_id = sequence.last_event_id.max(*event_id);
+                    }
+                    missed
+                }
+            };
+            if !missed {
+                continue;
+            }
+
+            let sequence = self.workers.get_mut(&worker_id).unwrap();
+            let pending = sequence
+                .resync_requested_at
+                .is_some_and(|at| now.duration_since(at) < RESYNC_RETRY_INTERVAL);
+            if !pending {
+                tracing::warn!(
+                    "missed KV events of worker {} before event {}; requesting a resync",
+                    worker_id,
+                    event_id
+                );
+                sequence.resync_requested_at = Some(now);
+                resync.push(worker_id);
+            }
+        }
+        resync
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::kv_router::indexer::RadixTree;
+
+    fn stored(event_id: u64, parent: Option<u64>, hashes: &[u64]) -> KvCacheEvent {
+        KvCacheEvent {
+            event_id,
+            data: KvCacheEventData::Stored(KvCacheStoreData {
+                parent_hash: parent.map(ExternalSequenceBlockHash),
+                blocks: hashes
+                    .iter()
+                    .map(|&hash| KvCacheStoredBlockData {
+                        block_hash: ExternalSequenceBlockHash(hash * 100),
+                        tokens_hash: LocalBlockHash(hash),
+                    })
+                    .collect(),
+            }),
+        }
+    }
+
+    fn removed(event_id: u64, hashes: &[u64]) -> KvCacheEvent {
+        KvCacheEvent {
+            event_id,
+            data: KvCacheEventData::Removed(KvCacheRemoveData {
+                block_hashes: hashes
+                    .iter()
+                    .map(|&hash| ExternalSequenceBlockHash(hash * 100))
+                    .collect(),
+            }),
+        }
+    }
+
+    fn router_events(worker_id: i64, events: Vec<KvCacheEvent>) -> Vec<RouterEvent> {
+        events
+            .into_iter()
+            .map(|event| RouterEvent::new(worker_id, event))
+            .collect()
+    }
+
+    #[test]
+    fn test_resync_events() {
+        let events = vec![
+            stored(0, None, &[1, 2, 3]),
+            stored(1, Some(200), &[4, 5]),
+            stored(2, None, &[6]),
+            removed(3, &[6]),
+            stored(4, Some(300), &[7]),
+            // block 9 loses its parent
+            stored(5, None, &[8, 9]),
+            removed(6, &[8]),
+        ];
+        let mut published = PublishedBlocks::default();
+        for event in &events {
+            published.apply(event);
+        }
+
+        let resync = published.resync_events();
+        assert!(resync.iter().all(|event| event.event_id == 6));
+        assert!(matches!(resync[0].data, KvCacheEventData::Cleared));
+        // one event per path from the root
+        assert_eq!(resync.len(), 3);
+
+        // a router with a stale view of the worker ends up with the blocks of the worker
+        let mut expected = RadixTree::new();
+        expected.apply_events(router_events(0, events));
+        let mut trie = RadixTree::new();
+        trie.apply_events(router_events(0, vec![stored(0, None, &[1, 6, 10])]));
+        trie.apply_events(router_events(0, resync));
+
+        for sequence in [
+            vec![1, 2, 3, 7],
+            vec![1, 2, 4, 5],
+            vec![6],
+            vec![8, 9],
+            vec![1, 6, 10],
+        ] {
+            let sequence: Vec<_> = sequence.into_iter().map(LocalBlockHash).collect();
+            assert_eq!(
+                trie.find_matches(sequence.clone(), false).scores,
+                expected.find_matches(sequence, false).scores
+            );
+        }
+    }
+
+    #[test]
+    fn test_event_gap_tracker() {
+        let mut tracker = EventGapTracker::default();
+
+        // a worker seen from its first event, and one seen after it started
+        let events = [
+            router_events(0, vec![stored(0, None, &[1]), stored(1, None, &[2])]),
+            router_events(1, vec![stored(5, None, &[1])]),
+        ]
+        .concat();
+        assert_eq!(tracker.track(&events), vec![1]);
+
+        // a skipped event, the resync already requested is not sent again
+        let events = [
+            router_events(0, vec![stored(3, None, &[3])]),
+            router_events(1, vec![stored(7, None, &[2])]),
+        ]
+        .concat();
+        assert_eq!(tracker.track(&events), vec![0]);
+
+        // the answer resets the sequence of the worker
+        let resync = PublishedBlocks::default().resync_events();
+        let events = [
+            router_events(1, resync),
+            router_events(1, vec![stored(1, None, &[3])]),
+        ]
+        .concat();
+        assert!(tracker.track(&events).is_empty());
+        assert!(tracker
+            .track(&router_events(1, vec![stored(3, None, &[4])]))
+            .contains(&1));
+    }
+}
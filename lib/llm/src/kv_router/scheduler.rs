@@ -14,12 +14,21 @@
 // limitations under the License.
 
 use serde::{Deserialize, Serialize};
-use std::borrow::BorrowMut;
-use std::cmp::min;
+use std::{
+    borrow::BorrowMut,
+    collections::{BTreeMap, HashMap, HashSet, VecDeque},
+    sync::{
+        atomic::{AtomicU64, AtomicUsize, Ordering},
+        Arc,
+    },
+    time::{Duration, Instant},
+};
 
 use crate::kv_router::indexer::OverlapScores;
 pub use crate::kv_router::protocols::{ForwardPassMetrics, KV_BLOCK_SIZE};
-use crate::kv_router::scoring::ProcessedEndpoints;
+use crate::kv_router::scoring::{
+    select_lowest_cost, CostFunction, DefaultCost, ProcessedEndpoints, WorkerSnapshot,
+};
 
 #[allow(dead_code)]
 #[derive(Debug, thiserror::Error)]
@@ -32,6 +41,12 @@ pub enum KvSchedulerError {
 
     #[error("endpoint subscriber shutdown")]
     SubscriberShutdown,
+
+    #[error("admission queue full")]
+    Overloaded,
+
+    #[error("deadline exceeded while waiting for a worker")]
+    DeadlineExceeded,
 }
 
 #[derive(Debug, Clone, Serialize, Deserialize)]
@@ -72,28 +87,336 @@ pub struct Service {
     pub endpoints: Vec<FlexibleEndpoint>,
 }
 
+/// How long a scheduled request is added to the load of its worker, unless the worker confirms it
+/// earlier; covers the delay of the metrics collection
+pub const PENDING_LOAD_TTL: Duration = Duration::from_secs(3);
+
+/// A request scheduled on a worker
+#[derive(Debug, Clone, Copy)]
+struct Reservation {
+    blocks: u64,
+    scheduled_at: Instant,
+}
+
+/// The requests scheduled on each worker that its published metrics may not account for yet
+///
+/// A request is reserved on its worker when scheduled, and added to the metrics of the worker
+/// each time they are refreshed, until the worker confirms it by reporting more active requests
+/// than in its previous metrics, or until it expires. Without it, each refresh of the metrics
+/// would forget the requests scheduled since the metrics were sampled, and a burst of requests
+/// between two refreshes would pile onto the same worker.
+#[derive(Debug)]
+pub struct PendingLoad {
+    ttl: Duration,
+    /// Unconfirmed requests of each worker, oldest first
+    reservations: HashMap<i64, VecDeque<Reservation>>,
+    /// Number of active requests reported by each worker in its previous metrics
+    reported_slots: HashMap<i64, u64>,
+}
+
+impl PendingLoad {
+    pub fn new(ttl: Duration) -> Self {
+        Self {
+            ttl,
+            reservations: HashMap::new(),
+            reported_slots: HashMap::new(),
+        }
+    }
+
+    /// Reserve a request adding `blocks` KV blocks on `worker_id`
+    pub fn reserve(&mut self, worker_id: i64, blocks: u64) {
+        self.reservations
+            .entry(worker_id)
+            .or_default()
+            .push_back(Reservation {
+                blocks,
+                scheduled_at: Instant::now(),
+            });
+    }
+
+    /// Number of unconfirmed requests of `worker_id` and the KV blocks they add
+    pub fn pending(&self, worker_id: i64) -> (u64, u64) {
+        self.reservations.get(&worker_id).map_or((0, 0), |queue| {
+            (
+                queue.len() as u64,
+                queue.iter().map(|reservation| reservation.blocks).sum(),
+            )
+        })
+    }
+
+    /// Account for freshly collected metrics
+    ///
+    /// The reservations confirmed by the new metrics, or expired, are released; the remaining
+    /// ones are added to the metrics of their worker.
+    pub fn apply(&mut self, workers: &mut ProcessedEndpoints) {
+        let now = Instant::now();
+
+        let mut reported_slots = HashMap::with_capacity(workers.endpoints.len());
+        for endpoint in &workers.endpoints {
+            reported_slots
+                .entry(endpoint.worker_id())
+                .or_insert(endpoint.data.request_active_slots);
+        }
+
+        // workers gone from the metrics have no load to account for anymore
+        self.reservations
+            .retain(|worker_id, _| reported_slots.contains_key(worker_id));
+        for (worker_id, queue) in self.reservations.iter_mut() {
+            // requests both started and completed between two samples go unnoticed, and are
+            // left to expire
+            let started = match self.reported_slots.get(worker_id) {
+                Some(previous) => reported_slots[worker_id].saturating_sub(*previous),
+                None => 0,
+            };
+            let confirmed = (started as usize).min(queue.len());
+            queue.drain(..confirmed);
+            while queue
+                .front()
+                .is_some_and(|reservation| now.duration_since(reservation.scheduled_at) > self.ttl)
+            {
+                queue.pop_front();
+            }
+        }
+        self.reservations.retain(|_, queue| !queue.is_empty());
+        self.reported_slots = reported_slots;
+
+        for index in 0..workers.endpoints.len() {
+            let (requests, blocks) = self.pending(workers.endpoints[index].worker_id());
+            workers.charge(index, requests, blocks);
+        }
+        workers.update_load_stats();
+    }
+}
+
+/// Default capacity of the admission queue of a [`KvScheduler`]
+pub const DEFAULT_ADMISSION_QUEUE_CAPACITY: usize = 1024;
+
+/// Configuration of the admission queue of a [`KvScheduler`]
+#[derive(Debug, Clone, Copy, PartialEq, Serialize, Deserialize)]
+pub struct AdmissionConfig {
+    /// Number of requests waiting for a worker above which new requests are rejected with
+    /// [`KvSchedulerError::Overloaded`]
+    pub queue_capacity: usize,
+    /// How long a request may wait for a worker when it does not set its own timeout
+    pub default_timeout: Option<Duration>,
+}
+
+impl Default for AdmissionConfig {
+    fn default() -> Self {
+        Self {
+            queue_capacity: DEFAULT_ADMISSION_QUEUE_CAPACITY,
+            default_timeout: None,
+        }
+    }
+}
+
+/// How a request is admitted by a [`KvScheduler`] while all the workers are busy
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq)]
+pub struct AdmissionOptions {
+    /// Requests of a higher priority are scheduled first; requests of the same priority are
+    /// scheduled in order of arrival
+    pub priority: u8,
+    /// How long the request may wait for a worker before failing with
+    /// [`KvSchedulerError::DeadlineExceeded`]; the default timeout of the scheduler if not set
+    pub timeout: Option<Duration>,
+}
+
+/// Statistics of the admission queue of a [`KvScheduler`]
+#[derive(Debug, Clone, Default, Serialize, Deserialize)]
+pub struct AdmissionStats {
+    /// Number of requests waiting for a worker
+    pub queue_depth: usize,
+    /// Number of requests scheduled on a worker
+    pub scheduled: u64,
+    /// Number of requests rejected because the queue was full
+    pub rejected: u64,
+    /// Number of requests whose deadline passed while waiting for a worker
+    pub expired: u64,
+    /// Mean time the scheduled requests waited for a worker
+    pub mean_wait: Duration,
+    /// Longest time a scheduled request waited for a worker
+    pub max_wait: Duration,
+}
+
+/// Counters behind [`AdmissionStats`], updated by the scheduler task
+#[derive(Debug, Default)]
+struct AdmissionCounters {
+    queue_depth: AtomicUsize,
+    scheduled: AtomicU64,
+    rejected: AtomicU64,
+    expired: AtomicU64,
+    total_wait_us: AtomicU64,
+    max_wait_us: AtomicU64,
+}
+
+impl AdmissionCounters {
+    fn record_wait(&self, wait: Duration) {
+        let wait_us = wait.as_micros() as u64;
+        self.scheduled.fetch_add(1, Ordering::Relaxed);
+        self.total_wait_us.fetch_add(wait_us, Ordering::Relaxed);
+        self.max_wait_us.fetch_max(wait_us, Ordering::Relaxed);
+    }
+
+    fn stats(&self) -> AdmissionStats {
+        let scheduled = self.scheduled.load(Ordering::Relaxed);
+        let total_wait_us = self.total_wait_us.load(Ordering::Relaxed);
+        AdmissionStats {
+            queue_depth: self.queue_depth.load(Ordering::Relaxed),
+            scheduled,
+            rejected: self.rejected.load(Ordering::Relaxed),
+            expired: self.expired.load(Ordering::Relaxed),
+            mean_wait: Duration::from_micros(total_wait_us.checked_div(scheduled).unwrap_or(0)),
+            max_wait: Duration::from_micros(self.max_wait_us.load(Ordering::Relaxed)),
+        }
+    }
+}
+
 pub struct SchedulingRequest {
     isl_tokens: usize,
     overlap: OverlapScores,
-    resp_tx: tokio::sync::oneshot::Sender<i64>,
+    priority: u8,
+    enqueued_at: Instant,
+    deadline: Option<Instant>,
+    resp_tx: tokio::sync::oneshot::Sender<Result<i64, KvSchedulerError>>,
 }
 
 impl SchedulingRequest {
-    pub fn respond(self, worker_id: i64) {
-        if self.resp_tx.send(worker_id).is_err() {
+    pub fn respond(self, result: Result<i64, KvSchedulerError>) {
+        if self.resp_tx.send(result).is_err() {
             tracing::trace!("failed to send response to requestor");
         }
     }
+
+    fn is_expired(&self, now: Instant) -> bool {
+        self.deadline.is_some_and(|deadline| deadline <= now)
+    }
+}
+
+/// The requests waiting for a worker, by priority
+///
+/// The requests are admitted as they arrive, up to the capacity of the queue, so that a request
+/// that cannot be scheduled yet never keeps the scheduler from rejecting the requests above
+/// capacity or failing the requests past their deadline.
+struct AdmissionQueue {
+    capacity: usize,
+    len: usize,
+    queues: BTreeMap<u8, VecDeque<SchedulingRequest>>,
+    counters: Arc<AdmissionCounters>,
+}
+
+impl AdmissionQueue {
+    fn new(capacity: usize, counters: Arc<AdmissionCounters>) -> Self {
+        Self {
+            capacity,
+            len: 0,
+            queues: BTreeMap::new(),
+            counters,
+        }
+    }
+
+    /// Queue `request`, or reject it if the queue is full
+    fn admit(&mut self, request: SchedulingRequest) {
+        if self.len >= self.capacity {
+            self.counters.rejected.fetch_add(1, Ordering::Relaxed);
+            request.respond(Err(KvSchedulerError::Overloaded));
+            return;
+        }
+        self.queues
+            .entry(request.priority)
+            .or_default()
+            .push_back(request);
+        self.set_len(self.len + 1);
+    }
+
+    /// Take the request of the highest priority that arrived first
+    fn pop(&mut self) -> Option<SchedulingRequest> {
+        let mut entry = self.queues.last_entry()?;
+        let request = entry.get_mut().pop_front();
+        if entry.get().is_empty() {
+            entry.remove();
+        }
+        if request.is_some() {
+            self.set_len(self.len - 1);
+        }
+        request
+    }
+
+    /// Put back a request taken with [`AdmissionQueue::pop`] that could not be scheduled
+    fn push_front(&mut self, request: SchedulingRequest) {
+        self.queues
+            .entry(request.priority)
+            .or_default()
+            .push_front(request);
+        self.set_len(self.len + 1);
+    }
+
+    /// Fail the requests past their deadline
+    fn expire(&mut self, now: Instant) {
+        let mut expired = Vec::new();
+        for queue in self.queues.values_mut() {
+            if !queue.iter().any(|request| request.is_expired(now)) {
+                continue;
+            }
+            let (past, kept): (VecDeque<_>, VecDeque<_>) = std::mem::take(queue)
+                .into_iter()
+                .partition(|request| request.is_expired(now));
+            *queue = kept;
+            expired.extend(past);
+        }
+        if expired.is_empty() {
+            return;
+        }
+        self.queues.retain(|_, queue| !queue.is_empty());
+        self.set_len(self.len - expired.len());
+        self.counters
+            .expired
+            .fetch_add(expired.len() as u64, Ordering::Relaxed);
+        for request in expired {
+            request.respond(Err(KvSchedulerError::DeadlineExceeded));
+        }
+    }
+
+    /// The earliest deadline of the queued requests
+    fn next_deadline(&self) -> Option<Instant> {
+        self.queues
+            .values()
+            .flatten()
+            .filter_map(|request| request.deadline)
+            .min()
+    }
+
+    fn set_len(&mut self, len: usize) {
+        self.len = len;
+        self.counters.queue_depth.store(len, Ordering::Relaxed);
+    }
 }
 
 pub struct KvScheduler {
-    request_tx: tokio::sync::mpsc::Sender<SchedulingRequest>,
+    /// Requests are sent in batches; the requests of a batch are scheduled in order against the
+    /// same view of the endpoints, so each assignment accounts for the previous ones
+    request_tx: tokio::sync::mpsc::Sender<Vec<SchedulingRequest>>,
+
+    /// The number of tokens per KV block of the workers
+    kv_block_size: usize,
+
+    admission: AdmissionConfig,
+    counters: Arc<AdmissionCounters>,
 }
 
 impl KvScheduler {
+    /// Start scheduling against the endpoints received from `endpoints_rx`
+    ///
+    /// Waits for the first endpoints; unless `kv_block_size` is given, waits for the first workers
+    /// to come up and uses the block size they publish, or [`KV_BLOCK_SIZE`] if they do not
+    /// publish one. Workers publishing another block size are never scheduled.
     pub async fn start(
         endpoints_rx: tokio::sync::mpsc::Receiver<ProcessedEndpoints>,
+        kv_block_size: Option<usize>,
+        cost_fn: Option<Arc<dyn CostFunction>>,
+        admission: AdmissionConfig,
     ) -> Result<Self, KvSchedulerError> {
+        let cost_fn = cost_fn.unwrap_or_else(|| Arc::new(DefaultCost::default()));
+        tracing::info!("KV scheduler cost function: {:?}", cost_fn);
         let mut endpoints_rx = endpoints_rx;
 
         tracing::trace!("awaiting the start of the background endpoint subscriber");
@@ -104,75 +427,138 @@ impl KvScheduler {
             }
         };
 
+        // an empty set of endpoints says nothing about the block size of the workers to come
+        if kv_block_size.is_none() && endpoints.endpoints.is_empty() {
+            tracing::info!("waiting for the workers to publish their KV block size");
+            while endpoints.endpoints.is_empty() {
+                endpoints = match endpoints_rx.recv().await {
+                    Some(endpoints) => endpoints,
+                    None => {
+                        return Err(KvSchedulerError::SubscriberShutdown);
+                    }
+                };
+            }
+        }
+
+        let published_block_size = endpoints.kv_block_size();
+        if let (Some(configured), Some(published)) = (kv_block_size, published_block_size) {
+            if configured != published {
+                tracing::warn!(
+                    "configured KV block size {} differs from the one published by the workers: {}",
+                    configured,
+                    published
+                );
+            }
+        }
+        let kv_block_size = kv_block_size
+            .or(published_block_size)
+            .unwrap_or(KV_BLOCK_SIZE);
+        tracing::info!("KV block size: {}", kv_block_size);
+        let mut rejected = HashSet::new();
+        reject_mismatched_workers(&mut endpoints, kv_block_size, &mut rejected);
+
+        let counters = Arc::new(AdmissionCounters::default());
+
         // Channel to accept new scheduling requests
-        let (request_tx, request_rx) = tokio::sync::mpsc::channel::<SchedulingRequest>(16);
+        let (request_tx, request_rx) = tokio::sync::mpsc::channel::<Vec<SchedulingRequest>>(128);
         tracing::debug!("scheduler starting");
         // Background task to handle scheduling requests
+        let mut queue = AdmissionQueue::new(admission.queue_capacity, counters.clone());
         tokio::spawn(async move {
-            let mut request: SchedulingRequest;
             let mut request_rx = request_rx;
+            let mut pending = PendingLoad::new(PENDING_LOAD_TTL);
             tracing::debug!("scheduler background task started");
 
-            'outer: loop {
-                request = tokio::select! {
-                    biased;
-
-                    new_request = request_rx.recv() => {
-                        match new_request {
-                            Some(new_request) => {
-                                tracing::trace!("received request to be scheduled");
-                                new_request
-                            },
-                            None => {
-                                tracing::trace!("scheduler shutdown");
-                                break 'outer;
-                            }
+            loop {
+                // schedule the queued requests until the workers are all busy
+                while let Some(request) = queue.pop() {
+                    match select_worker(
+                        endpoints.borrow_mut(),
+                        &request,
+                        kv_block_size,
+                        cost_fn.as_ref(),
+                        &mut pending,
+                    ) {
+                        Ok(worker_id) => {
+                            queue.counters.record_wait(request.enqueued_at.elapsed());
+                            request.respond(Ok(worker_id));
+                        }
+                        Err(KvSchedulerError::AllWorkersBusy) => {
+                            tracing::trace!("all workers busy; waiting for more capacity");
+                            queue.push_front(request);
+                            break;
+                        }
+                        Err(e) => {
+                            tracing::debug!("error scheduling request: {:?}", e);
+                            request.respond(Err(e));
                         }
                     }
+                }
 
+                let next_deadline = queue.next_deadline();
+                tokio::select! {
+                    biased;
+
+                    // checked first, so that a steady flow of requests does not keep the
+                    // metrics from being refreshed
                     new_endpoints = endpoints_rx.recv() => {
                         match new_endpoints {
-                            Some(new_endpoints) => {
+                            Some(mut new_endpoints) => {
                                 tracing::trace!("updated endpoints");
+                                reject_mismatched_workers(
+                                    &mut new_endpoints,
+                                    kv_block_size,
+                                    &mut rejected,
+                                );
+                                pending.apply(&mut new_endpoints);
                                 endpoints = new_endpoints;
-                                continue 'outer;
                             }
                             None => {
                                 tracing::trace!("endpoint subscriber shutdown");
-                                break 'outer;
+                                break;
                             }
                         }
                     }
-                };
-                tracing::debug!("selected");
-                loop {
-                    match select_worker(endpoints.borrow_mut(), &request) {
-                        Ok(worker_id) => {
-                            request.respond(worker_id);
-                            continue 'outer;
-                        }
-                        Err(KvSchedulerError::AllWorkersBusy) => {
-                            tracing::trace!("all workers busy; waiting for more capacity");
-                            endpoints = match endpoints_rx.recv().await {
-                                Some(endpoints) => endpoints,
-                                None => {
-                                    tracing::trace!("endpoint subscriber shutdown");
-                                    break 'outer;
+
+                    new_requests = request_rx.recv() => {
+                        match new_requests {
+                            Some(new_requests) => {
+                                tracing::trace!("received requests to be scheduled");
+                                for request in new_requests {
+                                    queue.admit(request);
                                 }
-                            };
-                        }
-                        Err(e) => {
-                            tracing::error!("error scheduling request: {:?}", e);
-                            break 'outer;
+                            },
+                            None => {
+                                tracing::trace!("scheduler shutdown");
+                                break;
+                            }
                         }
                     }
+
+                    _ = sleep_until_deadline(next_deadline) => {}
                 }
+                queue.expire(Instant::now());
             }
 
             tracing::trace!("background endpoint subscriber shutting down");
         });
 
-        Ok(KvScheduler { request_tx })
+        Ok(KvScheduler {
+            request_tx,
+            kv_block_size,
+            admission,
+            counters,
+        })
+    }
+
+    /// The number of tokens per KV block the overlap scores are counted in
+    pub fn kv_block_size(&self) -> usize {
+        self.kv_block_size
+    }
+
+    /// Statistics of the requests waiting for a worker
+    pub fn admission_stats(&self) -> AdmissionStats {
+        self.counters.stats()
     }
 
     #[allow(dead_code)]
@@ -180,94 +566,142 @@ impl KvScheduler {
         &self,
         overlap: OverlapScores,
         isl_tokens: usize,
+        options: AdmissionOptions,
     ) -> Result<i64, KvSchedulerError> {
-        let (resp_tx, resp_rx) = tokio::sync::oneshot::channel();
-        let request = SchedulingRequest {
-            isl_tokens,
-            overlap,
-            resp_tx,
-        };
+        let mut results = self
+            .schedule_batch(vec![(overlap, isl_tokens)], options)
+            .await?;
+        results.pop().ok_or(KvSchedulerError::SubscriberShutdown)?
+    }
+
+    /// Schedule several requests jointly
+    ///
+    /// Each request is given as its overlap scores and its number of input tokens. The workers
+    /// are selected in order, each selection accounting for the load added by the previous ones,
+    /// so a burst of similar requests is spread instead of being sent to the same worker.
+    /// Returns the result of each request, in order: the requests that cannot be scheduled fail
+    /// on their own, without discarding the workers assigned to the others. Fails as a whole
+    /// only if the scheduler is shut down.
+    pub async fn schedule_batch(
+        &self,
+        requests: Vec<(OverlapScores, usize)>,
+        options: AdmissionOptions,
+    ) -> Result<Vec<Result<i64, KvSchedulerError>>, KvSchedulerError> {
+        let enqueued_at = Instant::now();
+        let deadline = options
+            .timeout
+            .or(self.admission.default_timeout)
+            .map(|timeout| enqueued_at + timeout);
+
+        let (requests, responses): (Vec<_>, Vec<_>) = requests
+            .into_iter()
+            .map(|(overlap, isl_tokens)| {
+                let (resp_tx, resp_rx) = tokio::sync::oneshot::channel();
+                let request = SchedulingRequest {
+                    isl_tokens,
+                    overlap,
+                    priority: options.priority,
+                    enqueued_at,
+                    deadline,
+                    resp_tx,
+                };
+                (request, resp_rx)
+            })
+            .unzip();
+
         tracing::debug!("before sending request");
         self.request_tx
-            .send(request)
+            .send(requests)
             .await
             .map_err(|_| KvSchedulerError::SubscriberShutdown)?;
         tracing::debug!("after sending request");
 
-        let res = resp_rx
-            .await
-            .map_err(|_| KvSchedulerError::SubscriberShutdown)?;
+        let mut results = Vec::with_capacity(responses.len());
+        for resp_rx in responses {
+            results.push(
+                resp_rx
+                    .await
+                    .map_err(|_| KvSchedulerError::SubscriberShutdown)?,
+            );
+        }
         tracing::debug!("after receiving response");
-        Ok(res)
+        Ok(results)
+    }
+}
+
+/// Sleep until `deadline`, forever if there is none
+async fn sleep_until_deadline(deadline: Option<Instant>) {
+    match deadline {
+        Some(deadline) => tokio::time::sleep_until(deadline.into()).await,
+        None => std::future::pending().await,
     }
 }
 
+/// Drop the workers of `endpoints` publishing a block size other than `kv_block_size`
+///
+/// `rejected` holds the workers dropped from the previous endpoints, so that each mismatched
+/// worker is only reported once.
+fn reject_mismatched_workers(
+    endpoints: &mut ProcessedEndpoints,
+    kv_block_size: usize,
+    rejected: &mut HashSet<i64>,
+) {
+    let dropped: HashSet<i64> = endpoints
+        .retain_kv_block_size(kv_block_size)
+        .into_iter()
+        .collect();
+    for worker_id in dropped.difference(rejected) {
+        tracing::warn!(
+            "worker {} publishes a KV block size other than {}; it will not be scheduled",
+            worker_id,
+            kv_block_size
+        );
+    }
+    *rejected = dropped;
+}
+
 pub fn select_worker(
     workers: &mut ProcessedEndpoints,
     request: &SchedulingRequest,
+    kv_block_size: usize,
+    cost_fn: &dyn CostFunction,
+    pending: &mut PendingLoad,
 ) -> Result<i64, KvSchedulerError> {
-    // balance mode prioritizes balancing load across workers
-    let balance_threshold: f64 = 0.1;
-    let balance_mode = workers.load_std > balance_threshold * workers.load_avg;
-
-    // Determine alpha based on mode
-    let alpha = if balance_mode { 0.7 } else { 0.3 };
-    let gamma = 0.1; // example tuning param
-
-    // Compute each worker's score
-    let mut best_index = None;
-    let mut best_cost = f64::INFINITY;
-
     if workers.endpoints.is_empty() {
         return Err(KvSchedulerError::NoEndpoints);
     }
 
-    for (i, w) in workers.endpoints.iter().enumerate() {
-        // Exclude workers that are at capacity
-        if w.data.request_active_slots >= w.data.request_total_slots
-            || w.data.kv_active_blocks >= w.data.kv_total_blocks
-        {
-            continue;
-        }
-
-        let kv_load_ratio = w.data.kv_active_blocks as f64 / w.data.kv_total_blocks as f64;
-        let load_deviation = kv_load_ratio - workers.load_avg;
-
-        // [FIXME] multiple endpoints of the same worker cause out of bound error
-        let worker_id = workers.worker_ids[i];
-        let overlap_score = request.overlap.scores.get(&worker_id).map_or(0, |x| *x);
-        let overlap_score = overlap_score as usize * KV_BLOCK_SIZE;
-
-        let new_tokens = request.isl_tokens.saturating_sub(overlap_score);
-        let normalized_new_tokens = new_tokens as f64 / request.isl_tokens as f64;
-
-        let request_load_ratio =
-            w.data.request_active_slots as f64 / w.data.request_total_slots as f64;
-
-        // cost = alpha * load_deviation + (1 - alpha)*normalized_new_tokens + gamma * request_load_ratio
-        let cost = alpha * load_deviation
-            + (1.0 - alpha) * normalized_new_tokens
-            + gamma * request_load_ratio;
-
-        tracing::debug!("worker: {}; load_deviation: {}; normalized new blocks: {}; request_load_ratio: {} cost: {}",
-                worker_id,
-                load_deviation,
-                normalized_new_tokens,
-                request_load_ratio,
-                cost
-            );
-
-        if cost < best_cost {
-            best_cost = cost;
-            best_index = Some(i);
-        }
+    let (snapshot, indices) =
+        WorkerSnapshot::new(workers, &request.overlap, request.isl_tokens, kv_block_size);
+    if snapshot.is_empty() {
+        tracing::debug!("all workers busy");
+        return Err(KvSchedulerError::AllWorkersBusy);
     }
 
+    // Compute each worker's score
+    let costs = cost_fn.costs(&snapshot);
+    if costs.len() != snapshot.len() {
+        tracing::warn!(
+            "cost function {:?} returned {} costs for {} workers",
+            cost_fn,
+            costs.len(),
+            snapshot.len()
+        );
+    }
+    let best = select_lowest_cost(&costs[..costs.len().min(snapshot.len())]);
+    let best_cost = best.map_or(f64::INFINITY, |i| costs[i]);
+    let best_new_tokens = best.map_or(0, |i| snapshot.new_tokens[i]);
+    let best_index = best.map(|i| indices[i]);
+
+    // Charge the selected worker with the blocks the request adds, so that the next requests
+    // scheduled against this view of the workers account for it, and reserve them until the
+    // worker confirms the request in its metrics
     if let Some(best_index) = best_index {
-        let total_blocks = min(request.isl_tokens / KV_BLOCK_SIZE, 1);
+        let new_blocks = best_new_tokens.div_ceil(kv_block_size).max(1) as u64;
 
-        workers.endpoints[best_index].data.request_active_slots += 1;
-        workers.endpoints[best_index].data.kv_active_blocks += total_blocks as u64;
+        workers.charge(best_index, 1, new_blocks);
+        workers.update_load_stats();
+        pending.reserve(workers.endpoints[best_index].worker_id(), new_blocks);
     }
 
     match best_index {
@@ -285,3 +719,228 @@ pub fn select_worker(
         }
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn make_endpoints(request_active_slots: &[u64]) -> ProcessedEndpoints {
+        ProcessedEndpoints::new(
+            request_active_slots
+                .iter()
+                .enumerate()
+                .map(|(i, &request_active_slots)| Endpoint {
+                    name: format!("worker-{}", i),
+                    subject: format!("triton.vllm.generate-{:x}", i),
+                    data: ForwardPassMetrics {
+                        request_active_slots,
+                        request_total_slots: 8,
+                        kv_active_blocks: 10,
+                        kv_total_blocks: 100,
+                        kv_block_size: None,
+                    },
+                })
+                .collect(),
+        )
+    }
+
+    #[test]
+    fn test_pending_load_until_confirmed() {
+        let mut pending = PendingLoad::new(Duration::from_secs(60));
+        pending.apply(&mut make_endpoints(&[0, 0]));
+
+        pending.reserve(0, 2);
+        pending.reserve(0, 3);
+        pending.reserve(1, 4);
+
+        // the metrics do not reflect the requests yet
+        let mut endpoints = make_endpoints(&[0, 0]);
+        pending.apply(&mut endpoints);
+        assert_eq!(endpoints.endpoints[0].data.request_active_slots, 2);
+        assert_eq!(endpoints.endpoints[0].data.kv_active_blocks, 15);
+        assert_eq!(endpoints.endpoints[1].data.request_active_slots, 1);
+        assert_eq!(endpoints.endpoints[1].data.kv_active_blocks, 14);
+        assert_eq!(endpoints.load_avg, 14.5);
+
+        // worker 0 started one of them, worker 1 its only one
+        let mut endpoints = make_endpoints(&[1, 1]);
+        pending.apply(&mut endpoints);
+        assert_eq!(pending.pending(0), (1, 3));
+        assert_eq!(pending.pending(1), (0, 0));
+        assert_eq!(endpoints.endpoints[0].data.request_active_slots, 2);
+        assert_eq!(endpoints.endpoints[1].data.request_active_slots, 1);
+
+        // worker 1 is gone
+        pending.reserve(1, 4);
+        pending.apply(&mut make_endpoints(&[1]));
+        assert_eq!(pending.pending(1), (0, 0));
+    }
+
+    #[test]
+    fn test_pending_load_expires() {
+        let mut pending = PendingLoad::new(Duration::ZERO);
+        pending.reserve(0, 2);
+        std::thread::sleep(Duration::from_millis(1));
+
+        let mut endpoints = make_endpoints(&[0]);
+        pending.apply(&mut endpoints);
+        assert_eq!(pending.pending(0), (0, 0));
+        assert_eq!(endpoints.endpoints[0].data.request_active_slots, 0);
+    }
+
+    #[test]
+    fn test_select_worker_spreads_burst() {
+        let mut endpoints = make_endpoints(&[0, 0]);
+        let mut pending = PendingLoad::new(PENDING_LOAD_TTL);
+        let cost_fn = crate::kv_router::scoring::LeastLoadedCost::default();
+
+        let mut selected = Vec::new();
+        for _ in 0..4 {
+            let (resp_tx, _resp_rx) = tokio::sync::oneshot::channel();
+            let request = SchedulingRequest {
+                isl_tokens: 256,
+                overlap: OverlapScores::new(),
+                priority: 0,
+                enqueued_at: Instant::now(),
+                deadline: None,
+                resp_tx,
+            };
+            selected
+                .push(select_worker(&mut endpoints, &request, 64, &cost_fn, &mut pending).unwrap());
+        }
+        selected.sort();
+        assert_eq!(selected, vec![0, 0, 1, 1]);
+
+        // the next metrics do not reflect the burst yet
+        let mut endpoints = make_endpoints(&[0, 0]);
+        pending.apply(&mut endpoints);
+        assert_eq!(endpoints.endpoints[0].data.request_active_slots, 2);
+        assert_eq!(endpoints.endpoints[1].data.request_active_slots, 2);
+    }
+
+    #[test]
+    fn test_select_worker_charges_new_blocks() {
+        let mut endpoints = make_endpoints(&[0]);
+        let mut pending = PendingLoad::new(PENDING_LOAD_TTL);
+        let cost_fn = crate::kv_router::scoring::LeastLoadedCost::default();
+        let mut overlap = OverlapScores::new();
+        overlap.scores.insert(0, 2);
+
+        // (isl_tokens, kv_active_blocks after scheduling the request)
+        // - 200 tokens, 128 of them cached: the 72 others take 2 new blocks
+        // - fully cached: still charged a block, so that the request counts as load
+        for (isl_tokens, kv_active_blocks) in [(200, 12), (128, 13)] {
+            let (resp_tx, _resp_rx) = tokio::sync::oneshot::channel();
+            let request = SchedulingRequest {
+                isl_tokens,
+                overlap: overlap.clone(),
+                priority: 0,
+                enqueued_at: Instant::now(),
+                deadline: None,
+                resp_tx,
+            };
+            let worker_id =
+                select_worker(&mut endpoints, &request, 64, &cost_fn, &mut pending).unwrap();
+            assert_eq!(worker_id, 0);
+            assert_eq!(
+                endpoints.endpoints[0].data.kv_active_blocks,
+                kv_active_blocks
+            );
+        }
+    }
+
+    fn make_request(
+        priority: u8,
+        deadline: Option<Instant>,
+    ) -> (
+        SchedulingRequest,
+        tokio::sync::oneshot::Receiver<Result<i64, KvSchedulerError>>,
+    ) {
+        let (resp_tx, resp_rx) = tokio::sync::oneshot::channel();
+        let request = SchedulingRequest {
+            isl_tokens: priority as usize,
+            overlap: OverlapScores::new(),
+            priority,
+            enqueued_at: Instant::now(),
+            deadline,
+            resp_tx,
+        };
+        (request, resp_rx)
+    }
+
+    #[test]
+    fn test_admission_queue_priority() {
+        let counters = Arc::new(AdmissionCounters::default());
+        let mut queue = AdmissionQueue::new(8, counters.clone());
+        for priority in [0, 2, 1, 2] {
+            queue.admit(make_request(priority, None).0);
+        }
+        assert_eq!(counters.stats().queue_depth, 4);
+
+        // highest priority first, in order of arrival
+        let first = queue.pop().unwrap();
+        assert_eq!(first.priority, 2);
+        queue.push_front(first);
+        let order: Vec<u8> = std::iter::from_fn(|| queue.pop())
+            .map(|request| request.priority)
+            .collect();
+        assert_eq!(order, vec![2, 2, 1, 0]);
+        assert_eq!(counters.stats().queue_depth, 0);
+    }
+
+    #[test]
+    fn test_admission_queue_overloaded() {
+        let counters = Arc::new(AdmissionCounters::default());
+        let mut queue = AdmissionQueue::new(1, counters.clone());
+        let (request, _resp_rx) = make_request(0, None);
+        queue.admit(request);
+        let (request, mut resp_rx) = make_request(1, None);
+        queue.admit(request);
+
+        assert!(matches!(
+            resp_rx.try_recv().unwrap(),
+            Err(KvSchedulerError::Overloaded)
+        ));
+        let stats = counters.stats();
+        assert_eq!(stats.queue_depth, 1);
+        assert_eq!(stats.rejected, 1);
+    }
+
+    #[test]
+    fn test_admission_queue_expire() {
+        let counters = Arc::new(AdmissionCounters::default());
+        let mut queue = AdmissionQueue::new(8, counters.clone());
+        let now = Instant::now();
+        let later = now + Duration::from_secs(60);
+
+        let (request, mut expired_rx) = make_request(0, Some(now));
+        queue.admit(request);
+        let (request, mut kept_rx) = make_request(0, Some(later));
+        queue.admit(request);
+        let (request, _resp_rx) = make_request(1, None);
+        queue.admit(request);
+        assert_eq!(queue.next_deadline(), Some(now));
+
+        queue.expire(now);
+        assert!(matches!(
+            expired_rx.try_recv().unwrap(),
+            Err(KvSchedulerError::DeadlineExceeded)
+        ));
+        assert!(kept_rx.try_recv().is_err());
+        assert_eq!(queue.next_deadline(), Some(later));
+        let stats = counters.stats();
+        assert_eq!(stats.queue_depth, 2);
+        assert_eq!(stats.expired, 1);
+    }
+
+    #[test]
+    fn test_admission_stats_wait() {
+        let counters = AdmissionCounters::default();
+        counters.record_wait(Duration::from_millis(10));
+        counters.record_wait(Duration::from_millis(30));
+        let stats = counters.stats();
+        assert_eq!(stats.scheduled, 2);
+        assert_eq!(stats.mean_wait, Duration::from_millis(20));
+        assert_eq!(stats.max_wait, Duration::from_millis(30));
+    }
+}
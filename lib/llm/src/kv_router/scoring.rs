@@ -16,9 +16,9 @@
 //! Scoring functions for the KV router.
 
 use serde::{Deserialize, Serialize};
-use std::collections::HashSet;
+use std::collections::{HashMap, HashSet};
 
-use crate::kv_router::scheduler::Endpoint;
+use crate::kv_router::{indexer::OverlapScores, scheduler::Endpoint};
 
 #[derive(Debug, Default, Serialize, Deserialize)]
 pub struct ProcessedEndpoints {
@@ -30,8 +30,24 @@ pub struct ProcessedEndpoints {
 
 impl ProcessedEndpoints {
     pub fn new(endpoints: Vec<Endpoint>) -> Self {
+        let worker_ids: HashSet<i64> = endpoints.iter().map(|x| x.worker_id()).collect();
+        let worker_ids: Vec<i64> = worker_ids.into_iter().collect();
+
+        let mut processed = ProcessedEndpoints {
+            endpoints,
+            worker_ids,
+            load_avg: 0.0,
+            load_std: 0.0,
+        };
+        processed.update_load_stats();
+        processed
+    }
+
+    /// Recompute the load statistics from the metrics of the endpoints
+    pub fn update_load_stats(&mut self) {
         // compute some basic statistics
-        let load_values: Vec<f64> = endpoints
+        let load_values: Vec<f64> = self
+            .endpoints
             .iter()
             .map(|x| x.data.kv_active_blocks as f64)
             .collect();
@@ -41,16 +57,399 @@ impl ProcessedEndpoints {
             .map(|&x| (x - load_avg).powi(2))
             .sum::<f64>()
             / load_values.len() as f64;
-        let load_std = variance.sqrt();
+        self.load_avg = load_avg;
+        self.load_std = variance.sqrt();
+    }
 
-        let worker_ids: HashSet<i64> = endpoints.iter().map(|x| x.worker_id()).collect();
-        let worker_ids: Vec<i64> = worker_ids.into_iter().collect();
+    /// Charge the `index`-th endpoint with `requests` requests adding `blocks` KV blocks
+    pub fn charge(&mut self, index: usize, requests: u64, blocks: u64) {
+        let data = &mut self.endpoints[index].data;
+        data.request_active_slots += requests;
+        data.kv_active_blocks += blocks;
+    }
 
-        ProcessedEndpoints {
-            endpoints,
-            worker_ids,
-            load_avg,
-            load_std,
+    /// The KV block size published by the endpoints, if any
+    ///
+    /// The workers of a component must share a block size; if they disagree, the most common
+    /// one is returned.
+    pub fn kv_block_size(&self) -> Option<usize> {
+        let mut counts: HashMap<u64, usize> = HashMap::new();
+        for endpoint in &self.endpoints {
+            if let Some(kv_block_size) = endpoint.data.kv_block_size {
+                *counts.entry(kv_block_size).or_default() += 1;
+            }
+        }
+        if counts.len() > 1 {
+            tracing::warn!("workers publish different KV block sizes: {:?}", counts);
+        }
+        counts
+            .into_iter()
+            .max_by_key(|(kv_block_size, count)| (*count, *kv_block_size))
+            .map(|(kv_block_size, _)| kv_block_size as usize)
+    }
+
+    /// Drop the endpoints publishing a KV block size other than `kv_block_size`
+    ///
+    /// The blocks of these workers are hashed over a different number of tokens, so their
+    /// overlap scores would be meaningless. Endpoints not publishing a block size are kept.
+    /// Returns the ids of the dropped workers.
+    pub fn retain_kv_block_size(&mut self, kv_block_size: usize) -> Vec<i64> {
+        let (kept, dropped): (Vec<_>, Vec<_>) = std::mem::take(&mut self.endpoints)
+            .into_iter()
+            .partition(|endpoint| match endpoint.data.kv_block_size {
+                Some(published) => published as usize == kv_block_size,
+                None => true,
+            });
+        if dropped.is_empty() {
+            self.endpoints = kept;
+            return Vec::new();
+        }
+        *self = ProcessedEndpoints::new(kept);
+        dropped
+            .iter()
+            .map(|endpoint| endpoint.worker_id())
+            .collect()
+    }
+}
+
+/// The workers a request can be scheduled on, one entry per worker in each vector
+///
+/// Workers at capacity are left out of the snapshot.
+#[derive(Debug, Clone, Default, Serialize, Deserialize)]
+pub struct WorkerSnapshot {
+    pub worker_ids: Vec<i64>,
+    /// Number of leading blocks of the request cached by each worker
+    pub overlap_blocks: Vec<u32>,
+    /// Number of tokens of the request each worker would have to prefill
+    pub new_tokens: Vec<usize>,
+    pub request_active_slots: Vec<u64>,
+    pub request_total_slots: Vec<u64>,
+    pub kv_active_blocks: Vec<u64>,
+    pub kv_total_blocks: Vec<u64>,
+    /// Number of input tokens of the request
+    pub isl_tokens: usize,
+    pub kv_block_size: usize,
+    /// Mean of the active KV blocks over all the workers, including the ones at capacity
+    pub load_avg: f64,
+    /// Standard deviation of the active KV blocks over all the workers
+    pub load_std: f64,
+}
+
+impl WorkerSnapshot {
+    /// Snapshot the workers of `workers` that can take a request of `isl_tokens` tokens, of which
+    /// `overlap` are cached; also returns the index in `workers.endpoints` of each entry
+    pub fn new(
+        workers: &ProcessedEndpoints,
+        overlap: &OverlapScores,
+        isl_tokens: usize,
+        kv_block_size: usize,
+    ) -> (Self, Vec<usize>) {
+        let mut snapshot = WorkerSnapshot {
+            isl_tokens,
+            kv_block_size,
+            load_avg: workers.load_avg,
+            load_std: workers.load_std,
+            ..Default::default()
+        };
+        let mut indices = Vec::with_capacity(workers.endpoints.len());
+
+        for (i, w) in workers.endpoints.iter().enumerate() {
+            // Exclude workers that are at capacity
+            if w.data.request_active_slots >= w.data.request_total_slots
+                || w.data.kv_active_blocks >= w.data.kv_total_blocks
+            {
+                continue;
+            }
+
+            let worker_id = w.worker_id();
+            let overlap_blocks = overlap.scores.get(&worker_id).copied().unwrap_or(0);
+            let overlap_tokens = overlap_blocks as usize * kv_block_size;
+
+            snapshot.worker_ids.push(worker_id);
+            snapshot.overlap_blocks.push(overlap_blocks);
+            snapshot
+                .new_tokens
+                .push(isl_tokens.saturating_sub(overlap_tokens));
+            snapshot
+                .request_active_slots
+                .push(w.data.request_active_slots);
+            snapshot
+                .request_total_slots
+                .push(w.data.request_total_slots);
+            snapshot.kv_active_blocks.push(w.data.kv_active_blocks);
+            snapshot.kv_total_blocks.push(w.data.kv_total_blocks);
+            indices.push(i);
+        }
+
+        (snapshot, indices)
+    }
+
+    pub fn len(&self) -> usize {
+        self.worker_ids.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.worker_ids.is_empty()
+    }
+
+    /// Fraction of the tokens of the request the `i`-th worker would have to prefill
+    pub fn normalized_new_tokens(&self, i: usize) -> f64 {
+        if self.isl_tokens == 0 {
+            return 0.0;
+        }
+        self.new_tokens[i] as f64 / self.isl_tokens as f64
+    }
+
+    /// Fraction of the KV blocks of the `i`-th worker in use
+    pub fn kv_load_ratio(&self, i: usize) -> f64 {
+        self.kv_active_blocks[i] as f64 / self.kv_total_blocks[i] as f64
+    }
+
+    /// Fraction of the request slots of the `i`-th worker in use
+    pub fn request_load_ratio(&self, i: usize) -> f64 {
+        self.request_active_slots[i] as f64 / self.request_total_slots[i] as f64
+    }
+}
+
+/// A policy scoring the workers a request can be scheduled on
+///
+/// The worker with the lowest finite cost is selected; a worker with a non-finite cost is never
+/// selected.
+pub trait CostFunction: Send + Sync + std::fmt::Debug {
+    /// Cost of scheduling the request on each of the workers of `snapshot`, in order
+    fn costs(&self, snapshot: &WorkerSnapshot) -> Vec<f64>;
+}
+
+/// Weights of [`DefaultCost`]
+#[derive(Debug, Clone, Copy, PartialEq, Serialize, Deserialize)]
+pub struct CostWeights {
+    /// Relative standard deviation of the load above which the load is balanced
+    pub balance_threshold: f64,
+    /// Weight of the load deviation when balancing load
+    pub balance_alpha: f64,
+    /// Weight of the load deviation otherwise; the tokens to prefill weigh `1 - alpha`
+    pub alpha: f64,
+    /// Weight of the request slots in use
+    pub gamma: f64,
+}
+
+impl Default for CostWeights {
+    fn default() -> Self {
+        Self {
+            balance_threshold: 0.1,
+            balance_alpha: 0.7,
+            alpha: 0.3,
+            gamma: 0.1,
+        }
+    }
+}
+
+/// Trade the tokens to prefill against the load of the workers, favoring the load when it is
+/// unbalanced
+///
+/// `cost = alpha * load_deviation + (1 - alpha) * normalized_new_tokens + gamma * request_load_ratio`
+#[derive(Debug, Clone, Default)]
+pub struct DefaultCost {
+    pub weights: CostWeights,
+}
+
+impl CostFunction for DefaultCost {
+    fn costs(&self, snapshot: &WorkerSnapshot) -> Vec<f64> {
+        let weights = &self.weights;
+        // balance mode prioritizes balancing load across workers
+        let balance_mode = snapshot.load_std > weights.balance_threshold * snapshot.load_avg;
+        let alpha = if balance_mode {
+            weights.balance_alpha
+        } else {
+            weights.alpha
+        };
+
+        (0..snapshot.len())
+            .map(|i| {
+                let load_deviation = snapshot.kv_load_ratio(i) - snapshot.load_avg;
+                let normalized_new_tokens = snapshot.normalized_new_tokens(i);
+                let request_load_ratio = snapshot.request_load_ratio(i);
+                let cost = alpha * load_deviation
+                    + (1.0 - alpha) * normalized_new_tokens
+                    + weights.gamma * request_load_ratio;
+
+                tracing::debug!("worker: {}; load_deviation: {}; normalized new blocks: {}; request_load_ratio: {} cost: {}",
+                    snapshot.worker_ids[i],
+                    load_deviation,
+                    normalized_new_tokens,
+                    request_load_ratio,
+                    cost
+                );
+                cost
+            })
+            .collect()
+    }
+}
+
+/// Maximize the cached prefix, regardless of the load
+#[derive(Debug, Clone, Default)]
+pub struct PrefixCost;
+
+impl CostFunction for PrefixCost {
+    fn costs(&self, snapshot: &WorkerSnapshot) -> Vec<f64> {
+        (0..snapshot.len())
+            .map(|i| snapshot.normalized_new_tokens(i))
+            .collect()
+    }
+}
+
+/// Select the least loaded worker, regardless of the cached prefix
+#[derive(Debug, Clone)]
+pub struct LeastLoadedCost {
+    /// Weight of the request slots in use, the KV blocks in use weigh 1
+    pub gamma: f64,
+}
+
+impl Default for LeastLoadedCost {
+    fn default() -> Self {
+        Self { gamma: 1.0 }
+    }
+}
+
+impl CostFunction for LeastLoadedCost {
+    fn costs(&self, snapshot: &WorkerSnapshot) -> Vec<f64> {
+        (0..snapshot.len())
+            .map(|i| snapshot.kv_load_ratio(i) + self.gamma * snapshot.request_load_ratio(i))
+            .collect()
+    }
+}
+
+/// Estimate the time before the request completes its prefill, in tokens
+///
+/// Each active request of a worker is counted as `active_request_tokens` tokens of work ahead of
+/// the request, which then prefills its tokens not cached by the worker.
+#[derive(Debug, Clone)]
+pub struct QueueTimeCost {
+    pub active_request_tokens: f64,
+}
+
+impl Default for QueueTimeCost {
+    fn default() -> Self {
+        Self {
+            active_request_tokens: 256.0,
         }
     }
 }
+
+impl CostFunction for QueueTimeCost {
+    fn costs(&self, snapshot: &WorkerSnapshot) -> Vec<f64> {
+        (0..snapshot.len())
+            .map(|i| {
+                snapshot.request_active_slots[i] as f64 * self.active_request_tokens
+                    + snapshot.new_tokens[i] as f64
+            })
+            .collect()
+    }
+}
+
+/// Index of the lowest finite cost, the first one on ties
+pub fn select_lowest_cost(costs: &[f64]) -> Option<usize> {
+    costs
+        .iter()
+        .enumerate()
+        .filter(|(_, cost)| cost.is_finite())
+        .fold(None, |best: Option<(usize, f64)>, (i, &cost)| match best {
+            Some((_, best_cost)) if best_cost <= cost => best,
+            _ => Some((i, cost)),
+        })
+        .map(|(i, _)| i)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::kv_router::protocols::ForwardPassMetrics;
+
+    fn make_endpoint(worker_id: i64, request_active_slots: u64, kv_active_blocks: u64) -> Endpoint {
+        Endpoint {
+            name: format!("worker-{}", worker_id),
+            subject: format!("triton.vllm.generate-{:x}", worker_id),
+            data: ForwardPassMetrics {
+                request_active_slots,
+                request_total_slots: 4,
+                kv_active_blocks,
+                kv_total_blocks: 100,
+                kv_block_size: None,
+            },
+        }
+    }
+
+    fn make_snapshot() -> (WorkerSnapshot, Vec<usize>) {
+        let workers = ProcessedEndpoints::new(vec![
+            make_endpoint(1, 0, 90),
+            make_endpoint(2, 4, 0),
+            make_endpoint(3, 2, 10),
+        ]);
+        let mut overlap = OverlapScores::new();
+        overlap.scores.insert(1, 2);
+        overlap.scores.insert(2, 4);
+        WorkerSnapshot::new(&workers, &overlap, 256, 64)
+    }
+
+    #[test]
+    fn test_worker_snapshot() {
+        let (snapshot, indices) = make_snapshot();
+
+        // worker 2 has no request slot left
+        assert_eq!(snapshot.worker_ids, vec![1, 3]);
+        assert_eq!(indices, vec![0, 2]);
+        assert_eq!(snapshot.overlap_blocks, vec![2, 0]);
+        assert_eq!(snapshot.new_tokens, vec![128, 256]);
+        assert_eq!(snapshot.normalized_new_tokens(0), 0.5);
+        assert_eq!(snapshot.kv_load_ratio(0), 0.9);
+        assert_eq!(snapshot.request_load_ratio(1), 0.5);
+    }
+
+    #[test]
+    fn test_builtin_costs() {
+        let (snapshot, _) = make_snapshot();
+
+        let costs = PrefixCost.costs(&snapshot);
+        assert_eq!(select_lowest_cost(&costs), Some(0));
+
+        let costs = LeastLoadedCost::default().costs(&snapshot);
+        assert_eq!(select_lowest_cost(&costs), Some(1));
+
+        // 0 active requests and 128 tokens to prefill, against 2 * 256 + 256
+        let costs = QueueTimeCost::default().costs(&snapshot);
+        assert_eq!(costs, vec![128.0, 768.0]);
+
+        let costs = DefaultCost::default().costs(&snapshot);
+        assert_eq!(costs.len(), snapshot.len());
+    }
+
+    #[test]
+    fn test_select_lowest_cost() {
+        assert_eq!(select_lowest_cost(&[]), None);
+        assert_eq!(select_lowest_cost(&[f64::INFINITY, f64::NAN]), None);
+        assert_eq!(select_lowest_cost(&[2.0, 1.0, 1.0]), Some(1));
+        assert_eq!(select_lowest_cost(&[f64::NAN, 3.0, f64::INFINITY]), Some(1));
+    }
+
+    #[test]
+    fn test_retain_kv_block_size() {
+        let mut endpoints = vec![
+            make_endpoint(1, 0, 10),
+            make_endpoint(2, 0, 20),
+            make_endpoint(3, 0, 30),
+        ];
+        endpoints[0].data.kv_block_size = Some(64);
+        endpoints[1].data.kv_block_size = Some(16);
+        let mut workers = ProcessedEndpoints::new(endpoints);
+
+        // worker 3 does not publish a block size, so it is trusted to match
+        assert_eq!(workers.retain_kv_block_size(64), vec![2]);
+        let mut worker_ids = workers.worker_ids.clone();
+        worker_ids.sort();
+        assert_eq!(worker_ids, vec![1, 3]);
+        assert_eq!(workers.load_avg, 20.0);
+
+        assert!(workers.retain_kv_block_size(64).is_empty());
+        assert_eq!(workers.endpoints.len(), 2);
+    }
+}
@@ -0,0 +1,202 @@
+// SPDX-FileCopyrightText: Copyright (c) 2024-2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+// SPDX-License-Identifier: Apache-2.0
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+// http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+//! Lookup throughput of the KV indexer against the number of shards, and the memory and speed of
+//! its radix tree on a million blocks.
+//!
+//! Run with:
+//!
+//! ```text
+//! cargo test --release --test kv_indexer -- --ignored --nocapture
+//! ```
+
+use std::{
+    sync::Arc,
+    time::{Duration, Instant},
+};
+
+use tokio_util::sync::CancellationToken;
+use triton_distributed_llm::kv_router::{
+    indexer::{IndexerConfig, KvIndexerInterface, RadixTree, RouterEvent},
+    protocols::{
+        ExternalSequenceBlockHash, KvCacheEvent, KvCacheEventData, KvCacheStoreData,
+        KvCacheStoredBlockData, LocalBlockHash, KV_BLOCK_SIZE,
+    },
+};
+
+const NUM_WORKERS: i64 = 32;
+/// Number of distinct system prompts shared by the requests
+const NUM_PREFIXES: u64 = 16;
+const PREFIX_BLOCKS: u64 = 32;
+const SUFFIX_BLOCKS: u64 = 8;
+const REQUESTS_PER_WORKER: u64 = 64;
+const NUM_LOOKUPS: u64 = 20_000;
+const CONCURRENCY: u64 = 64;
+
+/// The blocks of a synthetic request: one of the shared prefixes followed by its own suffix
+fn request_blocks(request: u64) -> Vec<u64> {
+    let prefix = request % NUM_PREFIXES;
+    (0..PREFIX_BLOCKS)
+        .map(|block| (prefix << 32) | block)
+        .chain((0..SUFFIX_BLOCKS).map(|block| (1 << 63) | (request << 16) | block))
+        .collect()
+}
+
+fn store_event(worker_id: i64, event_id: u64, blocks: &[u64]) -> RouterEvent {
+    RouterEvent::new(
+        worker_id,
+        KvCacheEvent {
+            event_id,
+            data: KvCacheEventData::Stored(KvCacheStoreData {
+                parent_hash: None,
+                blocks: blocks
+                    .iter()
+                    .map(|&block| KvCacheStoredBlockData {
+                        block_hash: ExternalSequenceBlockHash(block),
+                        tokens_hash: LocalBlockHash(block),
+                    })
+                    .collect(),
+            }),
+        },
+    )
+}
+
+/// Index the requests cached by the workers, then return the lookups per second
+async fn lookup_throughput(num_shards: usize) -> f64 {
+    let token = CancellationToken::new();
+    let config = IndexerConfig {
+        num_shards,
+        ..Default::default()
+    };
+    let mut indexer = config.start(token.clone(), KV_BLOCK_SIZE);
+
+    let sender = indexer.event_sender();
+    for worker_id in 0..NUM_WORKERS {
+        let events = (0..REQUESTS_PER_WORKER)
+            .map(|i| {
+                let request = worker_id as u64 * REQUESTS_PER_WORKER + i;
+                store_event(worker_id, i, &request_blocks(request))
+            })
+            .collect();
+        sender.send(events).await.unwrap();
+    }
+    while indexer.lag().events > 0 {
+        tokio::time::sleep(Duration::from_millis(10)).await;
+    }
+
+    let indexer: Arc<dyn KvIndexerInterface + Send + Sync> = Arc::from(indexer);
+    let start = Instant::now();
+    let tasks: Vec<_> = (0..CONCURRENCY)
+        .map(|task| {
+            let indexer = indexer.clone();
+            tokio::spawn(async move {
+                for lookup in (task..NUM_LOOKUPS).step_by(CONCURRENCY as usize) {
+                    // half of the lookups hit a cached request, the others only their prefix
+                    let request = lookup * 7919 % (NUM_WORKERS as u64 * REQUESTS_PER_WORKER * 2);
+                    let sequence = request_blocks(request)
+                        .into_iter()
+                        .map(LocalBlockHash)
+                        .collect();
+                    let scores = indexer.find_matches(sequence).await.unwrap();
+                    assert!(!scores.scores.is_empty());
+                }
+            })
+        })
+        .collect();
+    for task in tasks {
+        task.await.unwrap();
+    }
+    let elapsed = start.elapsed();
+
+    token.cancel();
+    NUM_LOOKUPS as f64 / elapsed.as_secs_f64()
+}
+
+#[tokio::test(flavor = "multi_thread", worker_threads = 8)]
+#[ignore]
+async fn bench_lookup_throughput_by_shards() {
+    println!(
+        "{} workers, {} cached requests, {} shared prefixes of {} blocks",
+        NUM_WORKERS,
+        NUM_WORKERS as u64 * REQUESTS_PER_WORKER,
+        NUM_PREFIXES,
+        PREFIX_BLOCKS
+    );
+    for num_shards in [1, 2, 4, 8] {
+        let throughput = lookup_throughput(num_shards).await;
+        println!("shards: {:>2}  lookups/s: {:>10.0}", num_shards, throughput);
+    }
+}
+
+/// Workers of the synthetic million-block trace
+const TRACE_WORKERS: i64 = 128;
+/// Requests cached by each worker of the trace; their suffixes add up to about a million blocks
+const TRACE_REQUESTS_PER_WORKER: u64 = 1024;
+
+#[test]
+#[ignore]
+fn bench_radix_tree_million_blocks() {
+    let events: Vec<_> = (0..TRACE_WORKERS)
+        .flat_map(|worker_id| {
+            (0..TRACE_REQUESTS_PER_WORKER).map(move |i| {
+                let request = worker_id as u64 * TRACE_REQUESTS_PER_WORKER + i;
+                store_event(worker_id, i, &request_blocks(request))
+            })
+        })
+        .collect();
+    let num_events = events.len();
+
+    let mut trie = RadixTree::new();
+    let start = Instant::now();
+    trie.apply_events(events);
+    let apply_elapsed = start.elapsed();
+
+    let memory = trie.memory_usage();
+    println!(
+        "{} workers, {} blocks stored, {} blocks in tree",
+        TRACE_WORKERS,
+        num_events as u64 * (PREFIX_BLOCKS + SUFFIX_BLOCKS),
+        memory.blocks
+    );
+    println!(
+        "applied {} events in {:?}, {:.0} events/s",
+        num_events,
+        apply_elapsed,
+        num_events as f64 / apply_elapsed.as_secs_f64()
+    );
+    println!(
+        "memory: {:.1} MiB, {:.1} bytes per block",
+        memory.bytes as f64 / (1024.0 * 1024.0),
+        memory.bytes_per_block()
+    );
+
+    let num_requests = TRACE_WORKERS as u64 * TRACE_REQUESTS_PER_WORKER;
+    let start = Instant::now();
+    for lookup in 0..NUM_LOOKUPS {
+        // half of the lookups hit a cached request, the others only their prefix
+        let request = lookup * 7919 % (num_requests * 2);
+        let sequence = request_blocks(request)
+            .into_iter()
+            .map(LocalBlockHash)
+            .collect();
+        let scores = trie.find_matches(sequence, false);
+        assert!(!scores.scores.is_empty());
+    }
+    let elapsed = start.elapsed();
+    println!(
+        "find_matches: {:.0} lookups/s",
+        NUM_LOOKUPS as f64 / elapsed.as_secs_f64()
+    );
+}
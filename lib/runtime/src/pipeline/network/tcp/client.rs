@@ -26,6 +26,7 @@ use tokio_util::codec::{FramedRead, FramedWrite};
 
 use super::{CallHomeHandshake, ControlMessage, TcpStreamConnectionInfo};
 use crate::engine::AsyncEngineContext;
+use crate::pipeline::error::TwoPartCodecError;
 use crate::pipeline::network::{
     codec::{TwoPartCodec, TwoPartMessage},
     tcp::StreamType,
@@ -33,6 +34,9 @@ use crate::pipeline::network::{
 };
 use crate::{error, ErrorContext, Result}; // Import SinkExt to use the `send` method
 
+/// Maximum number of queued response messages written to the network with a single flush
+const MAX_COALESCED_MESSAGES: usize = 64;
+
 #[allow(dead_code)]
 pub struct TcpClient {
     worker_id: String,
@@ -262,6 +266,35 @@ async fn handle_reader(
     framed_reader
 }
 
+/// Write `msg` along with every message already queued in `bytes_rx` and flush once.
+///
+/// When the network is slower than the producer, responses queue up in the channel; coalescing
+/// them avoids paying a flush (and typically a TCP segment) per message.
+async fn write_coalesced(
+    framed_writer: &mut FramedWrite<tokio::io::WriteHalf<tokio::net::TcpStream>, TwoPartCodec>,
+    bytes_rx: &mut tokio::sync::mpsc::Receiver<TwoPartMessage>,
+    msg: TwoPartMessage,
+) -> Result<(), TwoPartCodecError> {
+    framed_writer.feed(msg).await?;
+
+    let mut coalesced = 1;
+    while coalesced < MAX_COALESCED_MESSAGES {
+        match bytes_rx.try_recv() {
+            Ok(msg) => {
+                framed_writer.feed(msg).await?;
+                coalesced += 1;
+            }
+            Err(_) => break,
+        }
+    }
+
+    if coalesced > 1 {
+        tracing::trace!("coalesced {} messages into a single flush", coalesced);
+    }
+
+    framed_writer.flush().await
+}
+
 async fn handle_writer(
     mut framed_writer: FramedWrite<tokio::io::WriteHalf<tokio::net::TcpStream>, TwoPartCodec>,
     mut bytes_rx: tokio::sync::mpsc::Receiver<TwoPartMessage>,
@@ -288,7 +321,7 @@ async fn handle_writer(
             }
         };
 
-        if let Err(e) = framed_writer.send(msg).await {
+        if let Err(e) = write_coalesced(&mut framed_writer, &mut bytes_rx, msg).await {
             tracing::trace!(
                 "failed to send message to network; possible disconnect: {:?}",
                 e